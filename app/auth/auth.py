@@ -10,9 +10,11 @@ from datetime import datetime, timedelta, timezone
 
 import redis
 from fastapi import Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from passlib.context import CryptContext
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 
 from app.core.config import settings
@@ -70,6 +72,31 @@ def create_access_token(data: dict):
 def get_user(db: Session, username: str):
     return db.query(User).filter(User.username == username).first()
 
+
+# ---- 异步版本：路由中使用，db 可以是 AsyncSession，也可以是同步 Session（在线程池中执行） ----
+
+async def get_user_async(db, username: str):
+    if isinstance(db, Session):
+        return await run_in_threadpool(get_user, db, username)
+    result = await db.execute(select(User).where(User.username == username))
+    return result.scalars().first()
+
+
+async def create_user_async(db, user_data: UserCreate):
+    """创建新用户；bcrypt 哈希是 CPU 密集操作，放到线程池中执行，不阻塞事件循环"""
+    if isinstance(db, Session):
+        return await run_in_threadpool(create_user, db, user_data)
+    hashed_password = await run_in_threadpool(pwd_context.hash, user_data.password)
+    db_user = User(username=user_data.username, password_hash=hashed_password, email=user_data.email)
+    db.add(db_user)
+    await db.commit()
+    await db.refresh(db_user)
+    return db_user
+
+
+async def verify_password_async(plain_password, hashed_password) -> bool:
+    return await run_in_threadpool(verify_password, plain_password, hashed_password)
+
 # 访客提问限制（基于 Redis）
 def check_visitor_limit(user_id: str):
     current_day = datetime.now().strftime('%Y-%m-%d')
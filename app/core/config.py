@@ -18,11 +18,159 @@ class Settings:
     broker_url: str = os.getenv("broker_url", "redis://localhost:6379/0")
     backend_url: str = os.getenv("backend_url", "redis://localhost:6379/0")
     
+    # 缓存使用的 Redis（默认与 Celery 结果后端相同）
+    cache_url: str = os.getenv("cache_url", backend_url)
+    
+    # 答案缓存：进程内 LRU（条数 / 秒）+ Redis 共享缓存（秒 / 最大条数）
+    answer_cache_enabled: bool = os.getenv("answer_cache_enabled", "true").lower() in ("1", "true", "yes")
+    answer_cache_local_size: int = int(os.getenv("answer_cache_local_size", "1024"))
+    answer_cache_local_ttl: float = float(os.getenv("answer_cache_local_ttl", "300"))
+    answer_cache_redis_ttl: int = int(os.getenv("answer_cache_redis_ttl", "86400"))
+    answer_cache_redis_max_entries: int = int(os.getenv("answer_cache_redis_max_entries", "100000"))
+    
+    # 语义缓存：相似度阈值（余弦）、容量、淘汰策略（lru / lfu）、持久化目录和间隔（秒）
+    semantic_cache_enabled: bool = os.getenv("semantic_cache_enabled", "false").lower() in ("1", "true", "yes")
+    semantic_cache_threshold: float = float(os.getenv("semantic_cache_threshold", "0.95"))
+    semantic_cache_capacity: int = int(os.getenv("semantic_cache_capacity", "10000"))
+    semantic_cache_policy: str = os.getenv("semantic_cache_policy", "lru")
+    semantic_cache_dir: str = os.getenv("semantic_cache_dir", "./data/semantic_cache")
+    semantic_cache_persist_interval: float = float(os.getenv("semantic_cache_persist_interval", "300"))
+    # 段落检索：索引目录、类型（flat / ivf / hnsw）、返回段落数、IVF/HNSW 参数、是否 mmap 加载
+    retrieval_enabled: bool = os.getenv("retrieval_enabled", "true").lower() in ("1", "true", "yes")
+    retrieval_index_dir: str = os.getenv("retrieval_index_dir", "./data/index")
+    retrieval_index_type: str = os.getenv("retrieval_index_type", "flat")
+    retrieval_top_k: int = int(os.getenv("retrieval_top_k", "3"))
+    retrieval_nlist: int = int(os.getenv("retrieval_nlist", "1024"))
+    retrieval_nprobe: int = int(os.getenv("retrieval_nprobe", "16"))
+    retrieval_hnsw_m: int = int(os.getenv("retrieval_hnsw_m", "32"))
+    retrieval_ef_search: int = int(os.getenv("retrieval_ef_search", "64"))
+    retrieval_mmap: bool = os.getenv("retrieval_mmap", "true").lower() in ("1", "true", "yes")
+    # 混合检索：向量和 BM25 各取 retrieval_candidates 个候选，RRF（常数 retrieval_rrf_k）融合
+    retrieval_hybrid: bool = os.getenv("retrieval_hybrid", "true").lower() in ("1", "true", "yes")
+    retrieval_candidates: int = int(os.getenv("retrieval_candidates", "20"))
+    retrieval_rrf_k: int = int(os.getenv("retrieval_rrf_k", "60"))
+    # 文档导入：段落字符数、相邻段落重叠字符数、每批向量化段落数、每写入多少段落保存一次索引
+    ingest_chunk_size: int = int(os.getenv("ingest_chunk_size", "300"))
+    ingest_chunk_overlap: int = int(os.getenv("ingest_chunk_overlap", "50"))
+    ingest_batch_size: int = int(os.getenv("ingest_batch_size", "64"))
+    ingest_save_every: int = int(os.getenv("ingest_save_every", "20000"))
+    # 文本向量化的最大 token 数
+    embedding_max_len: int = int(os.getenv("embedding_max_len", "128"))
+    
+    # 结果推送（/qa/ask/stream、/qa/ask/ws）：最长等待秒数、SSE 心跳间隔秒数
+    result_stream_timeout: float = float(os.getenv("result_stream_timeout", "300"))
+    result_stream_heartbeat: float = float(os.getenv("result_stream_heartbeat", "15"))
+    # API 进程异步查询任务结果的 Redis 连接池大小
+    result_redis_pool_size: int = int(os.getenv("result_redis_pool_size", "20"))
+
+    # 进程内快速路径：队列深度不超过阈值、本地线程池有空闲时在 API 进程内直接推理
+    fast_path_enabled: bool = os.getenv("fast_path_enabled", "false").lower() in ("1", "true", "yes")
+    fast_path_workers: int = int(os.getenv("fast_path_workers", "2"))
+    fast_path_max_queue_depth: int = int(os.getenv("fast_path_max_queue_depth", "0"))
+    fast_path_max_question_chars: int = int(os.getenv("fast_path_max_question_chars", "200"))
+    fast_path_max_context_chars: int = int(os.getenv("fast_path_max_context_chars", "2000"))
+    # 队列深度的缓存毫秒数（避免每个请求都查一次 broker）
+    fast_path_depth_cache_ms: float = float(os.getenv("fast_path_depth_cache_ms", "500"))
+
     # 模型配置
     local_model: str = os.getenv("local_model", "./models/bert-base-chinese")
     
+    # 多模型：默认模型名（对应 local_model），额外模型 name=path[@backend]，逗号分隔
+    default_model: str = os.getenv("default_model", "default")
+    qa_models: str = os.getenv("qa_models", "")
+    # 已加载模型的内存预算（MB），超出时按 LRU 卸载空闲模型，0 表示不限制
+    model_memory_budget_mb: int = int(os.getenv("model_memory_budget_mb", "4096"))
+    # 检查运行时模型配置（manage_models.py 发布）变化的间隔秒数
+    model_registry_refresh_seconds: int = int(os.getenv("model_registry_refresh_seconds", "30"))
+
+    # 独立模型服务（python serve_models.py）的 Unix socket 路径，为空表示每个进程自己加载模型
+    model_server_socket: str = os.getenv("model_server_socket", "")
+    model_server_timeout: float = float(os.getenv("model_server_timeout", "30"))
+    # 模型服务不可用时是否回退到进程内推理，回退后 model_server_retry_seconds 秒内不再尝试连接
+    model_server_fallback: bool = os.getenv("model_server_fallback", "true").lower() in ("1", "true", "yes")
+    model_server_retry_seconds: float = float(os.getenv("model_server_retry_seconds", "10"))
+    # 模型服务端合并批处理：一批最多合并的请求数、最长等待毫秒数
+    model_server_max_batch_size: int = int(os.getenv("model_server_max_batch_size", "32"))
+    model_server_max_wait_ms: float = float(os.getenv("model_server_max_wait_ms", "5"))
+
+    # 推理后端：eager / torchscript / compile / onnx / int8（导出文件与 local_model 同目录）
+    inference_backend: str = os.getenv("inference_backend", "eager")
+    # 推理线程数，0 表示使用默认值
+    inference_num_threads: int = int(os.getenv("inference_num_threads", "0"))
+    # Celery 父进程在 fork 前加载并预热模型，prefork 子进程写时复制共享权重
+    worker_preload_model: bool = os.getenv("worker_preload_model", "false").lower() in ("1", "true", "yes")
+    # 子进程回收：模型加载并执行 warmup 个任务后记录基线 RSS，增长超过 growth_mb 才回收；
+    # max_rss_mb 为 RSS 绝对上限（0 关闭）；max_tasks_per_child 为每个子进程最多执行的任务数（默认 100，0 不限制）
+    worker_recycle_growth_mb: int = int(os.getenv("worker_recycle_growth_mb", "512"))
+    worker_recycle_max_rss_mb: int = int(os.getenv("worker_recycle_max_rss_mb", "0"))
+    worker_recycle_warmup_tasks: int = int(os.getenv("worker_recycle_warmup_tasks", "5"))
+    worker_max_tasks_per_child: int = int(os.getenv("worker_max_tasks_per_child", "100"))
+    
+    # 动态微批处理配置（需要 worker 使用 threads/gevent 等并发池才能合并请求）
+    batch_enabled: bool = os.getenv("batch_enabled", "false").lower() in ("1", "true", "yes")
+    batch_max_size: int = int(os.getenv("batch_max_size", "16"))
+    batch_max_wait_ms: float = float(os.getenv("batch_max_wait_ms", "5"))
+    
+    # 相同问题合并：同一问题正在推理时后续提交复用同一个任务；ttl 为进行中标记的过期秒数（应大于排队 + 推理耗时）
+    single_flight_enabled: bool = os.getenv("single_flight_enabled", "true").lower() in ("1", "true", "yes")
+    single_flight_ttl: int = int(os.getenv("single_flight_ttl", "120"))
+    
+    # 分级队列的消费权重：同时消费多个级别队列的 worker 按此比例取任务（user 登录用户 / batch 批量提问 / guest 访客）
+    queue_weights: str = os.getenv("queue_weights", "user=6,batch=3,guest=1")
+    
+    # 批量提问 /qa/ask/batch：每个 Celery 任务处理的问题数、单次最多提交的问题数、批次结果保留秒数
+    ask_batch_chunk_size: int = int(os.getenv("ask_batch_chunk_size", "32"))
+    ask_batch_max_questions: int = int(os.getenv("ask_batch_max_questions", "500"))
+    ask_batch_ttl_seconds: int = int(os.getenv("ask_batch_ttl_seconds", "86400"))
+    
+    # 滑动窗口阅读器配置（doc_stride 为相邻窗口起点间隔的 token 数）
+    reader_max_seq_len: int = int(os.getenv("reader_max_seq_len", "384"))
+    reader_doc_stride: int = int(os.getenv("reader_doc_stride", "128"))
+    reader_max_question_len: int = int(os.getenv("reader_max_question_len", "64"))
+    reader_max_answer_len: int = int(os.getenv("reader_max_answer_len", "30"))
+    reader_max_windows_per_forward: int = int(os.getenv("reader_max_windows_per_forward", "32"))
+    # 上下文分词结果的 LRU 缓存条数（按内容哈希），0 表示关闭
+    tokenization_cache_size: int = int(os.getenv("tokenization_cache_size", "1024"))
+    
     # 数据库配置（带默认值）
     database_url: str = os.getenv("database_url", "sqlite:///./test.db")
+    # API 路由使用异步数据库引擎（依赖 greenlet 以及 aiosqlite / asyncpg，见 Pipfile）；
+    # async_database_url 为空时由 database_url 推导（sqlite -> sqlite+aiosqlite，postgresql -> postgresql+asyncpg）
+    database_async: bool = os.getenv("database_async", "false").lower() in ("1", "true", "yes")
+    async_database_url: str = os.getenv("async_database_url", "")
+    # 连接池（同步 / 异步引擎共用，SQLite 内存库不使用）：常驻连接数、额外连接数、取连接超时秒数、
+    # 连接最长使用秒数（超过后重建，-1 不限制）、取出连接前先 ping 检测断开的连接
+    db_pool_size: int = int(os.getenv("db_pool_size", "5"))
+    db_max_overflow: int = int(os.getenv("db_max_overflow", "10"))
+    db_pool_timeout: float = float(os.getenv("db_pool_timeout", "30"))
+    db_pool_recycle: int = int(os.getenv("db_pool_recycle", "1800"))
+    db_pool_pre_ping: bool = os.getenv("db_pool_pre_ping", "true").lower() in ("1", "true", "yes")
+    # SQLite 生产模式：WAL + synchronous=NORMAL + mmap（mmap_size 字节），busy_timeout 为写锁等待毫秒数
+    sqlite_production_mode: bool = os.getenv("sqlite_production_mode", "false").lower() in ("1", "true", "yes")
+    sqlite_mmap_size: int = int(os.getenv("sqlite_mmap_size", str(256 * 1024 * 1024)))
+    sqlite_busy_timeout_ms: int = int(os.getenv("sqlite_busy_timeout_ms", "5000"))
+    # 问答记录异步批量写库：攒够 batch_size 条或每 interval_ms 毫秒写一次；缓冲区最多 buffer_size 条，
+    # 缓冲区满或写库失败的记录追加到 spill_file，之后补写；question_write_behind=false 时每个任务同步写库
+    question_write_behind: bool = os.getenv("question_write_behind", "true").lower() in ("1", "true", "yes")
+    question_flush_batch_size: int = int(os.getenv("question_flush_batch_size", "200"))
+    question_flush_interval_ms: float = float(os.getenv("question_flush_interval_ms", "1000"))
+    question_buffer_size: int = int(os.getenv("question_buffer_size", "10000"))
+    question_spill_file: str = os.getenv("question_spill_file", "./data/questions_spill.jsonl")
+    # 问答历史 /qa/history：默认每页条数、每页最多条数
+    history_page_size: int = int(os.getenv("history_page_size", "20"))
+    history_max_page_size: int = int(os.getenv("history_max_page_size", "100"))
+    # 全文检索 /qa/search：可以检索所有用户记录的用户名（客服 / 运维工具使用），逗号分隔；每次最多返回条数
+    search_admin_users: str = os.getenv("search_admin_users", "")
+    search_max_results: int = int(os.getenv("search_max_results", "100"))
+    # 冷数据归档：created_at 早于 archive_retention_days 天的问答记录按日期分区写入 archive_dir 下的 Parquet 文件
+    # （压缩算法 archive_compression），每批 archive_batch_size 条写入并从 questions 表删除；retention_days=0 关闭归档。
+    # Celery beat 每天 archive_schedule_hour:archive_schedule_minute（Asia/Shanghai）执行一次
+    archive_dir: str = os.getenv("archive_dir", "./data/archive")
+    archive_retention_days: int = int(os.getenv("archive_retention_days", "90"))
+    archive_batch_size: int = int(os.getenv("archive_batch_size", "5000"))
+    archive_compression: str = os.getenv("archive_compression", "zstd")
+    archive_schedule_hour: int = int(os.getenv("archive_schedule_hour", "3"))
+    archive_schedule_minute: int = int(os.getenv("archive_schedule_minute", "30"))
     
     # JWT 配置
     SECRET_KEY: str = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
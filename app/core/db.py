@@ -5,7 +5,7 @@
 @Desc    :   None
 '''
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
@@ -26,8 +26,58 @@ if not DATABASE_URL:
 
 logger.info(f"Database URL: {DATABASE_URL}")
 
+
+def _is_sqlite(url: str) -> bool:
+    return url.startswith("sqlite")
+
+
+def _is_sqlite_memory(url: str) -> bool:
+    return _is_sqlite(url) and (url.split("://", 1)[-1] in ("", "/", "/:memory:") or "mode=memory" in url)
+
+
+def engine_options(url: str) -> dict:
+    """
+    连接池参数（同步 / 异步引擎共用）
+
+    SQLite 内存库使用单连接池，不支持 pool_size 等参数；其他数据库使用 Settings 中的连接池配置。
+    """
+    options = {}
+    if _is_sqlite(url) and "aiosqlite" not in url:
+        options["connect_args"] = {"check_same_thread": False}
+    if _is_sqlite_memory(url):
+        return options
+    options.update(
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout,
+        pool_recycle=settings.db_pool_recycle,
+        pool_pre_ping=settings.db_pool_pre_ping,
+    )
+    return options
+
+
+def apply_sqlite_pragmas(sync_engine):
+    """
+    SQLite 生产模式：每个新连接开启 WAL、synchronous=NORMAL 和 mmap
+
+    WAL 下读写互不阻塞；synchronous=NORMAL 在 WAL 下只在检查点时 fsync，掉电最多丢失最近的事务、不会损坏数据库。
+    """
+    @event.listens_for(sync_engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.execute(f"PRAGMA mmap_size={settings.sqlite_mmap_size}")
+            cursor.execute(f"PRAGMA busy_timeout={settings.sqlite_busy_timeout_ms}")
+        finally:
+            cursor.close()
+
+
 # 创建数据库引擎
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+engine = create_engine(DATABASE_URL, **engine_options(DATABASE_URL))
+if _is_sqlite(DATABASE_URL) and settings.sqlite_production_mode and not _is_sqlite_memory(DATABASE_URL):
+    apply_sqlite_pragmas(engine)
 
 # 创建 Session 类
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -40,8 +90,11 @@ def init_db():
     # 导入所有模型以确保它们被注册到 Base.metadata
     from app.models import User, Question  # noqa: F401
     
-    # 创建所有表
+    from app.core.migrations import run_migrations
+
+    # 创建所有表，并给已有的表补上新增的列和索引
     Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
     logger.info("Database initialized and tables created.")
 
 # 获取数据库会话的函数
@@ -52,6 +105,57 @@ def get_db():
     finally:
         db.close()  # 结束会话时关闭连接
 
+
+# ---- 异步引擎（API 路由使用，database_async=true 时启用） ----
+
+def async_database_url(url: str) -> str:
+    """同步连接串 -> 异步驱动连接串：SQLite 使用 aiosqlite，PostgreSQL 使用 asyncpg"""
+    if settings.async_database_url:
+        return settings.async_database_url
+    if url.startswith("sqlite:"):
+        return "sqlite+aiosqlite:" + url[len("sqlite:"):]
+    for prefix in ("postgresql://", "postgres://", "postgresql+psycopg2://"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg://" + url[len(prefix):]
+    return url
+
+
+_async_engine = None
+_async_session_factory = None
+
+
+def get_async_engine():
+    """延迟创建异步引擎（需要 sqlalchemy[asyncio] 和 aiosqlite / asyncpg，只在启用异步路径时导入）"""
+    global _async_engine, _async_session_factory
+    if _async_engine is None:
+        from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+        url = async_database_url(DATABASE_URL)
+        _async_engine = create_async_engine(url, **engine_options(url))
+        if _is_sqlite(url) and settings.sqlite_production_mode and not _is_sqlite_memory(url):
+            apply_sqlite_pragmas(_async_engine.sync_engine)
+        _async_session_factory = async_sessionmaker(_async_engine, expire_on_commit=False)
+        logger.info(f"Async database engine created: {_async_engine.url.render_as_string(hide_password=True)}")
+    return _async_engine
+
+
+async def get_async_db():
+    """异步数据库会话（FastAPI 依赖）"""
+    get_async_engine()
+    async with _async_session_factory() as session:
+        yield session
+
+
+async def dispose_async_engine():
+    global _async_engine, _async_session_factory
+    if _async_engine is not None:
+        await _async_engine.dispose()
+        _async_engine = _async_session_factory = None
+
+
+# API 路由使用的会话依赖：database_async=true 时为 AsyncSession，否则为同步 Session（在线程池中使用）
+get_db_session = get_async_db if settings.database_async else get_db
+
 # def get_session():
 #     with Session(engine) as session:
 #         yield session
\ No newline at end of file
@@ -0,0 +1,166 @@
+# -*- encoding: utf-8 -*-
+'''
+@Time    :   2025/10/25 18:20:41
+@Author  :   47bwy
+@Desc    :   已有数据库的结构迁移（项目没有引入 Alembic，启动时由 init_db 调用，可重复执行）
+
+create_all 只会创建缺失的表，不会给已有的表加列和索引，这里补上：
+- questions.created_at / questions.latency_ms：缺失时 ALTER TABLE 添加，
+  已有记录的 created_at 回填为迁移时间（之前的记录没有时间信息，同一时间内按 id 排序）
+- ix_questions_user_created_id：历史记录分页使用的 (user_id, created_at, id) 复合索引
+- questions.search_text 及全文索引（SQLite FTS5 表 + 同步触发器 / PostgreSQL tsvector 生成列 + GIN 索引），
+  全文索引只在首次创建时整体构建一次，之后由触发器 / 生成列增量维护
+
+启动时只执行 DDL 和不需要 Python 计算的回填。已有记录的 search_text 需要在 Python 中切词，
+百万级的表会拖慢每个 API 进程的启动，因此不在启动时回填：启动时发现还有未回填的记录只记录警告，
+由 backfill_search.py 一次性分批回填（回填时触发器 / 生成列同步更新全文索引，可以在服务运行时执行）。
+'''
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+
+from app.core.logger import get_logger
+
+logger = get_logger(__name__)
+
+# 每次回填的行数，避免大表一条 UPDATE 长时间持有写锁
+BACKFILL_BATCH_SIZE = 10000
+
+
+def _add_missing_columns(engine: Engine, table, names) -> list:
+    existing = {column["name"] for column in inspect(engine).get_columns(table.name)}
+    added = []
+    with engine.begin() as conn:
+        for name in names:
+            if name in existing:
+                continue
+            # 已有表加列时不能带 NOT NULL（SQLite 不允许没有默认值的 NOT NULL 列），新建的表按模型定义
+            column_type = table.c[name].type.compile(dialect=engine.dialect)
+            conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {name} {column_type}"))
+            added.append(name)
+    return added
+
+
+def _backfill_created_at(engine: Engine) -> int:
+    """分批把 created_at 为空的记录设为当前时间"""
+    total = 0
+    while True:
+        with engine.begin() as conn:
+            updated = conn.execute(
+                text(
+                    "UPDATE questions SET created_at = CURRENT_TIMESTAMP WHERE id IN "
+                    "(SELECT id FROM questions WHERE created_at IS NULL LIMIT :limit)"
+                ),
+                {"limit": BACKFILL_BATCH_SIZE},
+            ).rowcount
+        total += updated
+        if updated < BACKFILL_BATCH_SIZE:
+            return total
+
+
+def backfill_search_text(engine: Engine, batch_size: int = BACKFILL_BATCH_SIZE) -> int:
+    """分批为 search_text 为空的记录生成切词文本（切词在 Python 中完成，不能用一条 SQL 回填），返回回填的条数"""
+    from app.services.search import search_document
+
+    total = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                text("SELECT id, question, answer FROM questions WHERE search_text IS NULL LIMIT :limit"),
+                {"limit": batch_size},
+            ).all()
+            if rows:
+                conn.execute(
+                    text("UPDATE questions SET search_text = :search_text WHERE id = :id"),
+                    [{"id": row.id, "search_text": search_document(row.question, row.answer)} for row in rows],
+                )
+        total += len(rows)
+        if len(rows) < batch_size:
+            return total
+
+
+def _search_text_pending(engine: Engine) -> bool:
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT 1 FROM questions WHERE search_text IS NULL LIMIT 1")).first() is not None
+
+
+# 外部内容 FTS5 表：只存倒排索引，原文在 questions 中；触发器随 questions 的增删改同步索引
+SQLITE_FTS_TRIGGERS = (
+    """
+        CREATE TRIGGER IF NOT EXISTS questions_fts_ai AFTER INSERT ON questions BEGIN
+            INSERT INTO questions_fts(rowid, search_text) VALUES (new.id, new.search_text);
+        END""",
+    """
+        CREATE TRIGGER IF NOT EXISTS questions_fts_ad AFTER DELETE ON questions BEGIN
+            INSERT INTO questions_fts(questions_fts, rowid, search_text) VALUES ('delete', old.id, old.search_text);
+        END""",
+    """
+        CREATE TRIGGER IF NOT EXISTS questions_fts_au AFTER UPDATE OF search_text ON questions BEGIN
+            INSERT INTO questions_fts(questions_fts, rowid, search_text) VALUES ('delete', old.id, old.search_text);
+            INSERT INTO questions_fts(rowid, search_text) VALUES (new.id, new.search_text);
+        END""",
+)
+
+
+def _create_sqlite_fts(engine: Engine):
+    with engine.begin() as conn:
+        if conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'questions_fts'")).first():
+            return
+        try:
+            conn.execute(text(
+                "CREATE VIRTUAL TABLE questions_fts USING fts5("
+                "search_text, content='questions', content_rowid='id', tokenize='unicode61')"
+            ))
+        except OperationalError as e:
+            logger.warning(f"SQLite FTS5 unavailable, full-text search disabled: {e}")
+            return
+        for ddl in SQLITE_FTS_TRIGGERS:
+            conn.execute(text(ddl))
+        # 首次创建时从 questions 构建一次索引
+        conn.execute(text("INSERT INTO questions_fts(questions_fts) VALUES ('rebuild')"))
+    logger.info("Created SQLite FTS5 index questions_fts")
+
+
+def _create_postgres_search(engine: Engine):
+    with engine.begin() as conn:
+        conn.execute(text(
+            "ALTER TABLE questions ADD COLUMN IF NOT EXISTS search_vector tsvector "
+            "GENERATED ALWAYS AS (to_tsvector('simple', coalesce(search_text, ''))) STORED"
+        ))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_questions_search_vector ON questions USING GIN (search_vector)"))
+
+
+def migrate_question_search(engine: Engine):
+    if _search_text_pending(engine):
+        logger.warning(
+            "Some existing questions have no search_text and are missing from full-text search, "
+            "run `python backfill_search.py` to index them"
+        )
+    if engine.dialect.name == "sqlite":
+        _create_sqlite_fts(engine)
+    elif engine.dialect.name == "postgresql":
+        _create_postgres_search(engine)
+    else:
+        logger.warning(f"Full-text search is not supported on {engine.dialect.name}")
+
+
+def migrate_questions(engine: Engine):
+    from app.models.question import Question
+
+    table = Question.__table__
+    if not inspect(engine).has_table(table.name):
+        return
+    added = _add_missing_columns(engine, table, ("created_at", "latency_ms", "search_text"))
+    if added:
+        logger.info(f"Added columns to {table.name}: {', '.join(added)}")
+    backfilled = _backfill_created_at(engine)
+    if backfilled:
+        logger.info(f"Backfilled created_at for {backfilled} existing questions")
+    for index in table.indexes:
+        index.create(bind=engine, checkfirst=True)
+    migrate_question_search(engine)
+
+
+def run_migrations(engine: Engine):
+    migrate_questions(engine)
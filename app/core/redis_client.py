@@ -0,0 +1,35 @@
+# -*- encoding: utf-8 -*-
+'''
+@Time    :   2025/10/27 09:41:18
+@Author  :   47bwy
+@Desc    :   进程级复用的同步 Redis 客户端（指标、结果推送等短小调用）
+
+每次调用都 Redis.from_url 会为每个任务 / 请求新建连接池和 TCP 连接。这里按 (url, 超时) 缓存客户端，
+同一进程内复用连接池；prefork 的子进程第一次使用时重新创建，不与父进程共享连接。
+'''
+
+import os
+import threading
+
+import redis
+
+_clients = {}
+_pid = None
+_lock = threading.Lock()
+
+
+def get_redis(url: str, socket_connect_timeout: float = 0.5, socket_timeout: float = 0.5) -> redis.Redis:
+    """返回当前进程中 url 对应的 Redis 客户端（懒创建，fork 后重新创建）"""
+    global _pid
+    key = (url, socket_connect_timeout, socket_timeout)
+    with _lock:
+        if _pid != os.getpid():
+            _clients.clear()
+            _pid = os.getpid()
+        client = _clients.get(key)
+        if client is None:
+            client = redis.Redis.from_url(
+                url, socket_connect_timeout=socket_connect_timeout, socket_timeout=socket_timeout
+            )
+            _clients[key] = client
+        return client
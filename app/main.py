@@ -5,19 +5,36 @@
 @Desc    :   FastAPI 的应用入口，定义 app = FastAPI() 并挂载路由。
 '''
 
+from contextlib import asynccontextmanager
+
 from fastapi import Depends, FastAPI, Request
 from fastapi.templating import Jinja2Templates
 
 from app.core.logger import get_logger, setup_logging
-from app.core.db import init_db
+from app.core.db import dispose_async_engine, init_db
 from app.routers import auth, qa
 from app.routers.auth import get_current_user
+from app.services.persistence import close_question_writer
+from app.services.result_stream import close_result_hub
+from app.services.task_results import close_task_result_store
 
 setup_logging()
 logger = get_logger(__name__)
 logger.info("🚀 项目启动！")
 
-app = FastAPI(title="AI QA System")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # 关闭结果推送的 Redis 订阅连接和结果查询连接池
+    await close_result_hub()
+    await close_task_result_store()
+    # 快速路径在 API 进程内产生的问答记录写完再退出
+    close_question_writer()
+    await dispose_async_engine()
+
+
+app = FastAPI(title="AI QA System", lifespan=lifespan)
 
 init_db()
 
@@ -27,6 +44,7 @@ templates = Jinja2Templates(directory="app/templates")
 app.include_router(qa.router, prefix="/qa", tags=["qa"])
 app.include_router(auth.router, prefix="/auth", tags=["auth"])
 
+
 @app.get("/")
 async def home(request: Request, user: str = Depends(get_current_user)):
     return templates.TemplateResponse("index.html", {"request": request, "user": user})
@@ -5,19 +5,42 @@
 @Desc    :   问题模型
 '''
 
-from sqlalchemy import Column, ForeignKey, Integer, String
-from sqlalchemy.orm import relationship
+from datetime import datetime, timezone
+
+from sqlalchemy import Column, DateTime, Float, ForeignKey, Index, Integer, String, Text
+from sqlalchemy.orm import deferred, relationship
 
 from app.core.db import Base
 
 
+def utcnow() -> datetime:
+    """不带时区的 UTC 时间（SQLite 不保存时区）"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _search_text(context) -> str:
+    """插入时由问题和答案生成全文检索列（逐行计算，批量 insert 同样适用）"""
+    # 在函数内导入：app.services.search 依赖模型模块
+    from app.services.search import search_document
+
+    params = context.get_current_parameters()
+    return search_document(params.get("question"), params.get("answer"))
+
+
 class Question(Base):
     __tablename__ = "questions"
+    # 历史记录按 (user_id, created_at, id) 倒序分页，游标条件和排序都走这个索引
+    __table_args__ = (Index("ix_questions_user_created_id", "user_id", "created_at", "id"),)
 
     id = Column(Integer, primary_key=True, index=True)
     question = Column(String)
     answer = Column(String)
     user_id = Column(String, ForeignKey("users.username"))
+    created_at = Column(DateTime, default=utcnow, nullable=False)
+    latency_ms = Column(Float, nullable=True)
+    # 全文检索使用的切词文本（SQLite FTS5 / PostgreSQL tsvector 建在这一列上，见 app/services/search.py），
+    # 延迟加载：读取记录时不取这一列
+    search_text = deferred(Column(Text, default=_search_text))
     
     # 定义与 User 的关系（可选，如果需要通过 question.user 访问用户信息）
-    # user = relationship("User", back_populates="questions")
\ No newline at end of file
+    # user = relationship("User", back_populates="questions")
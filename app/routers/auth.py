@@ -22,9 +22,9 @@ router = APIRouter()
 
 # 注册用户
 @router.post("/register")
-def register_user(
+async def register_user(
     user_data: UserCreate,  # 使用 Pydantic 模型，自动进行类型和格式校验
-    db: Session = Depends(db.get_db)
+    db: Session = Depends(db.get_db_session)
 ):
     """
     注册新用户
@@ -36,7 +36,7 @@ def register_user(
     - confirm_password: 与 password 匹配
     """
     # 检查用户名是否已存在（业务逻辑校验，需要查询数据库）
-    db_user = auth.get_user(db, username=user_data.username)
+    db_user = await auth.get_user_async(db, username=user_data.username)
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
     
@@ -46,16 +46,16 @@ def register_user(
     #     raise HTTPException(status_code=400, detail="Email already registered")
     
     # 创建新用户
-    new_user = auth.create_user(db=db, user_data=user_data)
+    new_user = await auth.create_user_async(db, user_data)
     
     return {"message": "User registered successfully", "username": new_user.username}
 
 
 # 登录用户
 @router.post("/login")
-def login_user(
+async def login_user(
     user_data: UserLogin,  # 使用 Pydantic 模型，自动进行类型和格式校验
-    db: Session = Depends(db.get_db)
+    db: Session = Depends(db.get_db_session)
 ):
     """
     用户登录
@@ -64,8 +64,8 @@ def login_user(
     - username: 至少1个字符
     - password: 至少1个字符
     """
-    db_user = auth.get_user(db, username=user_data.username)
-    if not db_user or not auth.verify_password(user_data.password, db_user.password_hash):
+    db_user = await auth.get_user_async(db, username=user_data.username)
+    if not db_user or not await auth.verify_password_async(user_data.password, db_user.password_hash):
         raise HTTPException(status_code=400, detail="Invalid credentials")
 
     # 生成 JWT token
@@ -5,13 +5,40 @@
 @Desc    :   /ask 接口。
 '''
 
-from fastapi import APIRouter, Depends, HTTPException, Request
+import asyncio
+import json
+import time
+import uuid
+from typing import Optional
+
+import redis
+from celery import group
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from fastapi.templating import Jinja2Templates
 
 from app.auth.auth import check_visitor_limit, get_current_user
+from app.core.config import settings
+from app.core.db import get_db_session
 from app.core.logger import get_logger
-from app.schemas.question import QuestionRequest
-from worker.tasks import answer_question_task, celery_app
+from app.core.redis_client import get_redis
+from app.schemas.question import QuestionBatchRequest, QuestionRequest, TaskResultsRequest
+from app.services.answer_cache import get_answer_cache
+from app.services.archive import ArchiveUnavailableError
+from app.services.batch_jobs import create_batch, get_batch, iter_chunks
+from app.services.fast_path import get_fast_path, latency_stats
+from app.services.history import InvalidCursorError, get_history_async
+from app.services.llm_services import NO_ANSWER, get_batch_stats, save_questions
+from app.services.model_registry import UnknownModelError, get_registry
+from app.services.persistence import question_record
+from app.services.result_stream import get_result_hub
+from app.services.search import SearchUnavailableError, search_questions_async
+from app.services.single_flight import get_single_flight
+from app.services.task_results import FINAL_STATUSES, get_task_result_store, pending_ids
+from app.services.tiers import queue_stats, tier_for_user, tier_queue
+from worker.pool import get_recycle_stats
+from worker.tasks import answer_batch_task, answer_question_task, celery_app
 
 logger = get_logger(__name__)
 
@@ -50,19 +77,75 @@ async def ask_question(
                 detail="Daily question limit reached for guest user, please login for more access."
             )
     
+    model = question_data.model
+    if model is not None:
+        # 未知的模型名会先从 Redis 刷新模型配置（同步调用，可能热切换加载模型），放到线程池中执行
+        try:
+            await run_in_threadpool(get_registry().resolve, model)
+        except UnknownModelError:
+            raise HTTPException(status_code=400, detail=f"Unknown model: {model}")
+
+    # 命中答案缓存时直接返回，不再提交任务；缓存读写是同步 Redis 调用（可能顺带刷新模型指纹），放到线程池中执行
+    cache = get_answer_cache()
+    if cache is not None:
+        answer = await run_in_threadpool(cache.get, question_data.question, context=question_data.context, model=model)
+        if answer is not None:
+            logger.info(f"答案缓存命中，用户: {user}")
+            await run_in_threadpool(save_questions, [question_record(question_data.question, answer, user)])
+            return {"status": "success", "answer": answer, "cached": True}
+
+    # 按用户级别进入不同队列，访客问题激增时不影响登录用户
+    queue = tier_queue(tier_for_user(user))
+
+    # 所属队列空闲时在 API 进程内直接回答，省去 broker 往返和结果轮询
+    fast_path = get_fast_path()
+    if fast_path is not None:
+        answer = await fast_path.try_answer(question_data.question, user, question_data.context, model, queue=queue)
+        if answer is not None:
+            logger.info(f"快速路径直接回答，用户: {user}")
+            if cache is not None and answer != NO_ANSWER:
+                await run_in_threadpool(cache.set, question_data.question, answer, context=question_data.context, model=model)
+            return {"status": "success", "answer": answer, "inline": True}
+
+    task_id = str(uuid.uuid4())
+
+    # 相同问题正在推理时直接复用那个任务，不再重复入队（claim 是同步 Redis 调用，在线程池中执行）
+    flight, flight_key = get_single_flight(), None
+    if flight is not None:
+        key = flight.key(question_data.question, question_data.context, model, queue)
+        try:
+            owner = await run_in_threadpool(flight.claim, key, task_id, user)
+        except redis.RedisError as e:
+            logger.warning(f"Single-flight claim failed, submitting without coalescing: {e}")
+        else:
+            if owner is not None:
+                logger.info(f"相同问题正在处理，复用任务 {owner}，用户: {user}")
+                return {"task_id": owner, "coalesced": True}
+            flight_key = key
+
     try:
         # 提交 celery 异步任务
-        logger.info(f"提交 Celery 任务，问题: {question_data.question}, 用户: {user}")
-        task = answer_question_task.delay(question_data.question, user)
+        logger.info(f"提交 Celery 任务，问题: {question_data.question}, 用户: {user}, 队列: {queue}")
+        task = answer_question_task.apply_async(
+            (question_data.question, user, question_data.context, model),
+            {"submitted_at": time.time(), "flight_key": flight_key},
+            queue=queue,
+            task_id=task_id,
+        )
         logger.info(f"任务已提交，task_id: {task.id}")
         return {"task_id": task.id}
     except Exception as e:
         logger.error(f"提交 Celery 任务失败: {e}", exc_info=True)
+        if flight_key is not None:
+            try:
+                await run_in_threadpool(flight.abandon, flight_key, task_id)
+            except redis.RedisError:
+                pass
         raise HTTPException(status_code=500, detail=f"Failed to submit task: {str(e)}")
 
 
-@router.get("/ask/result/{task_id}")
-async def get_ask_result(task_id: str):
+def _task_result(task_id: str) -> dict:
+    """同步查询（结果后端不是 Redis 或异步查询失败时使用，在线程池中调用）"""
     task = celery_app.AsyncResult(task_id)
     if task.state == "PENDING":
         return {"status": "pending"}
@@ -71,4 +154,388 @@ async def get_ask_result(task_id: str):
     elif task.state == "FAILURE":
         return {"status": "failure", "error": str(task.info)}
     else:
-        return {"status": task.state.lower()}
\ No newline at end of file
+        return {"status": task.state.lower()}
+
+
+async def _lookup_results(task_ids) -> dict:
+    """查询多个任务的当前结果：异步 Redis 一次 MGET，不阻塞事件循环"""
+    store = get_task_result_store()
+    if store is not None:
+        try:
+            return await store.get_many(task_ids)
+        except redis.RedisError as e:
+            logger.warning(f"Async result lookup failed, falling back to AsyncResult: {e}")
+    return {task_id: await run_in_threadpool(_task_result, task_id) for task_id in dict.fromkeys(task_ids)}
+
+
+def _pushed_result(future) -> dict:
+    message = dict(future.result())
+    message.pop("task_id", None)
+    return message
+
+
+async def _wait_for_results(task_ids, timeout: float) -> dict:
+    """
+    长轮询：查询一次结果，未完成的任务通过结果推送等待，全部完成或超时后返回
+
+    先订阅再查询，任务在订阅之前完成也不会错过；超时仍未收到推送的任务最后再补查一次。
+    """
+    if timeout <= 0:
+        return await _lookup_results(task_ids)
+    hub = get_result_hub()
+    futures = {task_id: hub.subscribe(task_id) for task_id in dict.fromkeys(task_ids)}
+    try:
+        await hub.wait_ready()
+        results = await _lookup_results(list(futures))
+        waiting = pending_ids(results)
+        if waiting:
+            await asyncio.wait([futures[task_id] for task_id in waiting], timeout=timeout)
+            for task_id in waiting:
+                if futures[task_id].done() and not futures[task_id].cancelled():
+                    results[task_id] = _pushed_result(futures[task_id])
+            missing = [task_id for task_id in waiting if not futures[task_id].done()]
+            if missing:
+                results.update(await _lookup_results(missing))
+        return results
+    finally:
+        for task_id, future in futures.items():
+            hub.unsubscribe(task_id, future)
+
+
+@router.get("/ask/result/{task_id}")
+async def get_ask_result(
+    task_id: str,
+    timeout: float = Query(0, ge=0, le=60, description="长轮询秒数：任务完成或超时才返回，0 表示立即返回"),
+):
+    return (await _wait_for_results([task_id], timeout))[task_id]
+
+
+@router.post("/ask/results")
+async def get_ask_results(request: TaskResultsRequest):
+    """批量查询任务结果（一次 MGET），可选长轮询"""
+    return {"results": await _wait_for_results(request.task_ids, request.timeout)}
+
+
+async def _result_events(task_id: str, timeout: float, heartbeat: float):
+    """
+    等待任务结果：完成时产出结果字典，每 heartbeat 秒没有结果时产出 None（心跳），超时产出 pending 状态
+
+    先订阅再查一次结果后端，任务在订阅之前完成也不会错过；
+    订阅连接断开期间每次心跳都补查一次结果后端。
+    """
+    hub = get_result_hub()
+    future = hub.subscribe(task_id)
+    try:
+        await hub.wait_ready()
+        current = (await _lookup_results([task_id]))[task_id]
+        if current["status"] in FINAL_STATUSES:
+            yield current
+            return
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                yield {"status": "pending", "timeout": True}
+                return
+            try:
+                await asyncio.wait_for(asyncio.shield(future), min(heartbeat, remaining))
+            except asyncio.TimeoutError:
+                if not hub.subscribed:
+                    current = (await _lookup_results([task_id]))[task_id]
+                    if current["status"] in FINAL_STATUSES:
+                        yield current
+                        return
+                yield None
+                continue
+            yield _pushed_result(future)
+            return
+    finally:
+        hub.unsubscribe(task_id, future)
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@router.get("/ask/stream/{task_id}")
+async def stream_ask_result(task_id: str, request: Request):
+    """
+    Server-Sent Events：任务完成时推送一次 result 事件后结束
+
+    等待期间每 result_stream_heartbeat 秒发送注释行保持连接，
+    超过 result_stream_timeout 仍未完成时发送 timeout 事件，客户端可以重新连接继续等待。
+    """
+    async def events():
+        async for item in _result_events(task_id, settings.result_stream_timeout, settings.result_stream_heartbeat):
+            if item is None:
+                if await request.is_disconnected():
+                    return
+                yield ": keep-alive\n\n"
+            elif item.get("timeout"):
+                yield _sse("timeout", item)
+            else:
+                yield _sse("result", item)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.websocket("/ask/ws/{task_id}")
+async def websocket_ask_result(websocket: WebSocket, task_id: str):
+    """WebSocket：任务完成时发送一条与 /ask/result 格式相同的 JSON 后关闭"""
+    await websocket.accept()
+    try:
+        async for item in _result_events(task_id, settings.result_stream_timeout, settings.result_stream_heartbeat):
+            if item is not None:
+                await websocket.send_json(item)
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+
+
+@router.post("/ask/batch")
+async def ask_batch(request: QuestionBatchRequest, user: str = Depends(get_current_user)):
+    """
+    批量提问：问题按 ask_batch_chunk_size 切块，每块一个 Celery 任务（一次批量推理），整批作为一个 group 提交
+
+    返回 batch_id，之后通过 /ask/batch/{batch_id} 查询逐条结果，或通过 /ask/batch/{batch_id}/stream 接收进度。
+    """
+    if user == "guest":
+        raise HTTPException(status_code=403, detail="Batch questions require login.")
+    if len(request.questions) > settings.ask_batch_max_questions:
+        raise HTTPException(
+            status_code=400, detail=f"Too many questions, at most {settings.ask_batch_max_questions} per batch"
+        )
+    for model in {q.model for q in request.questions if q.model is not None}:
+        try:
+            await run_in_threadpool(get_registry().resolve, model)
+        except UnknownModelError:
+            raise HTTPException(status_code=400, detail=f"Unknown model: {model}")
+
+    items = [q.model_dump(exclude_none=True) for q in request.questions]
+    chunks = list(iter_chunks(items, settings.ask_batch_chunk_size))
+    batch_id = uuid.uuid4().hex
+    logger.info(f"收到批量提问，用户: {user}, 问题数: {len(items)}, 分块数: {len(chunks)}")
+    try:
+        # 先登记批次再提交任务，worker 写入结果时批次一定存在
+        await run_in_threadpool(create_batch, batch_id, user, len(items), len(chunks))
+        # 批量任务走 qa_batch_queue（见 celery_config.task_routes），不占用交互式提问的队列
+        submitted_at = time.time()
+        job = group(
+            answer_batch_task.s(chunk, user, batch_id, offset, submitted_at=submitted_at) for offset, chunk in chunks
+        )
+        await run_in_threadpool(job.apply_async)
+    except Exception as e:
+        logger.error(f"提交批量任务失败: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Failed to submit batch: {str(e)}")
+    return {"batch_id": batch_id, "total": len(items), "chunks": len(chunks)}
+
+
+async def _user_batch(batch_id: str, user: str, with_results: bool = True) -> dict:
+    """读取批次（同步 Redis，在线程池中调用），批次不存在或不属于当前用户时返回 404"""
+    try:
+        batch = await run_in_threadpool(get_batch, batch_id, with_results)
+    except redis.RedisError as e:
+        logger.warning(f"Failed to read batch {batch_id}: {e}")
+        raise HTTPException(status_code=503, detail="Batch store unavailable")
+    if batch is None or batch.pop("user") != user:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return batch
+
+
+@router.get("/ask/batch/{batch_id}")
+async def get_batch_result(batch_id: str, user: str = Depends(get_current_user)):
+    """批次进度与逐条结果（与提交顺序一致）"""
+    return await _user_batch(batch_id, user)
+
+
+def _progress(batch: dict) -> dict:
+    return {key: batch[key] for key in ("status", "total", "done", "failed")}
+
+
+@router.get("/ask/batch/{batch_id}/stream")
+async def stream_batch_result(batch_id: str, request: Request, user: str = Depends(get_current_user)):
+    """
+    Server-Sent Events：每完成一块推送一次 progress 事件，全部完成后推送带逐条结果的 done 事件并结束
+
+    worker 每完成一块发布一条以 batch_id 为 task_id 的结果消息；收到消息（或心跳超时）后重新读取批次进度，
+    订阅连接断开期间也能在心跳时补上进度。
+    """
+    batch = await _user_batch(batch_id, user, with_results=False)
+
+    async def batch_events():
+        hub = get_result_hub()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.result_stream_timeout
+        current, last = batch, None
+        while True:
+            # 结果消息送达后订阅即被移除，每轮重新订阅
+            future = hub.subscribe(batch_id)
+            try:
+                await hub.wait_ready()
+                if current is None:
+                    current = await _user_batch(batch_id, user, with_results=False)
+                progress = _progress(current)
+                if progress != last:
+                    yield _sse("progress", progress)
+                    last = progress
+                if current["status"] != "pending":
+                    yield _sse("done", await _user_batch(batch_id, user))
+                    return
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    yield _sse("timeout", progress)
+                    return
+                try:
+                    await asyncio.wait_for(asyncio.shield(future), min(settings.result_stream_heartbeat, remaining))
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        return
+                    yield ": keep-alive\n\n"
+                current = None
+            finally:
+                hub.unsubscribe(batch_id, future)
+
+    async def events():
+        try:
+            async for event in batch_events():
+                yield event
+        except HTTPException as e:
+            # 响应已经开始，批次过期或 Redis 不可用时以 error 事件结束
+            yield _sse("error", {"error": e.detail})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/history")
+async def get_question_history(
+    limit: Optional[int] = Query(None, ge=1),
+    cursor: Optional[str] = Query(None, description="上一页返回的 next_cursor，不填表示第一页"),
+    include_archive: bool = Query(False, description="热表中的记录读完后继续读取已归档的记录"),
+    user: str = Depends(get_current_user),
+    db=Depends(get_db_session),
+):
+    """
+    当前用户的问答历史，按时间倒序、游标分页
+
+    返回 items 和 next_cursor，next_cursor 为 null 表示没有更多记录。
+    """
+    if user == "guest":
+        raise HTTPException(status_code=403, detail="Question history requires login.")
+    limit = min(limit or settings.history_page_size, settings.history_max_page_size)
+    try:
+        return await get_history_async(db, user, limit, cursor, include_archive)
+    except InvalidCursorError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    except ArchiveUnavailableError as e:
+        logger.error(f"读取归档失败: {e}")
+        raise HTTPException(status_code=503, detail="Archive unavailable")
+
+
+@router.get("/search")
+async def search_question_history(
+    q: str = Query(..., min_length=1, max_length=200, description="检索词，所有词都要出现在问题或答案中"),
+    limit: int = Query(20, ge=1),
+    all_users: bool = Query(False, description="检索所有用户的记录（仅 search_admin_users 中的用户）"),
+    include_archive: bool = Query(False, description="热表结果不足 limit 条时继续扫描已归档的记录"),
+    user: str = Depends(get_current_user),
+    db=Depends(get_db_session),
+):
+    """全文检索问答记录，按相关度排序（SQLite FTS5 / PostgreSQL tsvector，见 app/services/search.py）"""
+    if user == "guest":
+        raise HTTPException(status_code=403, detail="Search requires login.")
+    if all_users and user not in {name.strip() for name in settings.search_admin_users.split(",") if name.strip()}:
+        raise HTTPException(status_code=403, detail="Searching all users is not allowed.")
+    limit = min(limit, settings.search_max_results)
+    try:
+        results = await search_questions_async(db, q, limit, None if all_users else user, include_archive)
+    except SearchUnavailableError as e:
+        logger.error(f"全文检索失败: {e}")
+        raise HTTPException(status_code=503, detail="Full-text search unavailable")
+    except ArchiveUnavailableError as e:
+        logger.error(f"读取归档失败: {e}")
+        raise HTTPException(status_code=503, detail="Archive unavailable")
+    return {"query": q, "results": results}
+
+
+@router.get("/cache/stats")
+async def get_cache_stats():
+    """答案缓存命中/未命中统计（当前 API 进程）"""
+    cache = get_answer_cache()
+    if cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **cache.stats()}
+
+
+@router.get("/batch/stats")
+async def get_micro_batch_stats(model: Optional[str] = None):
+    """动态微批处理统计（当前 API 进程，快速路径的请求）：每个模型的批大小分布、排队等待和前向耗时分位数"""
+    return {"enabled": settings.batch_enabled, "models": get_batch_stats(model)}
+
+
+@router.get("/singleflight/stats")
+async def get_single_flight_stats():
+    """相同问题合并统计（当前 API 进程）：新提交的任务数、挂到进行中任务上的提交数"""
+    flight = get_single_flight()
+    if flight is None:
+        return {"enabled": False}
+    return {"enabled": True, **flight.stats()}
+
+
+@router.get("/fastpath/stats")
+async def get_fast_path_stats():
+    """快速路径统计（当前 API 进程）以及两条路径的端到端耗时分位数（所有进程）"""
+    fast_path = get_fast_path()
+    try:
+        latency = await run_in_threadpool(latency_stats)
+    except redis.RedisError as e:
+        logger.warning(f"Failed to read latency stats: {e}")
+        latency = None
+    return {
+        "enabled": fast_path is not None,
+        **(fast_path.stats() if fast_path is not None else {}),
+        "latency_ms": latency,
+    }
+
+
+@router.get("/queues/stats")
+async def get_queue_stats():
+    """分级队列统计（所有进程）：每个级别的队列积压、消费权重、排队耗时分位数"""
+    try:
+        return await run_in_threadpool(queue_stats)
+    except redis.RedisError as e:
+        logger.warning(f"Failed to read queue stats: {e}")
+        raise HTTPException(status_code=503, detail="Queue stats unavailable")
+
+
+@router.get("/stream/stats")
+async def get_stream_stats():
+    """结果推送统计（当前 API 进程）：等待中的连接数、收到的消息数、送达次数，以及异步结果查询次数"""
+    store = get_task_result_store()
+    return {**get_result_hub().stats(), "result_lookups": store.stats() if store is not None else None}
+
+
+@router.get("/models")
+async def list_models():
+    """可用模型及当前 API 进程中的模型注册表状态（先从 Redis 刷新运行时覆盖的模型配置，在线程池中执行）"""
+    registry = get_registry()
+    await run_in_threadpool(registry.maybe_refresh)
+    return registry.stats()
+
+
+@router.get("/worker/stats")
+async def get_worker_stats():
+    """worker 子进程按原因统计的回收次数（memory_growth / rss_limit）"""
+    try:
+        return {"recycles": await run_in_threadpool(get_recycle_stats, get_redis(settings.cache_url))}
+    except redis.RedisError as e:
+        logger.warning(f"Failed to read worker stats: {e}")
+        return {"recycles": None}
@@ -5,9 +5,26 @@
 @Desc    :   None
 '''
 
+from typing import List, Optional
+
 from pydantic import BaseModel, Field
 
 
 # 定义请求体模型
 class QuestionRequest(BaseModel):
-    question: str = Field(..., min_length=1, max_length=2000, description="问题内容，1-2000个字符")
\ No newline at end of file
+    question: str = Field(..., min_length=1, max_length=2000, description="问题内容，1-2000个字符")
+    context: Optional[str] = Field(None, max_length=100000, description="可选的上下文文本，不填时由服务端提供")
+    model: Optional[str] = Field(
+        None, max_length=64, pattern=r"^[\w.\-]+$", description="可选的模型名，不填时使用默认模型"
+    )
+
+
+# 批量提问（单次最多提交的问题数由 ask_batch_max_questions 配置，在接口中校验）
+class QuestionBatchRequest(BaseModel):
+    questions: List[QuestionRequest] = Field(..., min_length=1, description="问题列表，按块提交为 Celery 任务")
+
+
+# 批量查询任务结果
+class TaskResultsRequest(BaseModel):
+    task_ids: List[str] = Field(..., min_length=1, max_length=100, description="任务 ID 列表，最多 100 个")
+    timeout: float = Field(0, ge=0, le=60, description="长轮询秒数：等到全部任务完成或超时再返回，0 表示立即返回")
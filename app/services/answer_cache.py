@@ -0,0 +1,242 @@
+# -*- encoding: utf-8 -*-
+'''
+@Time    :   2025/10/19 14:18:09
+@Author  :   47bwy
+@Desc    :   答案缓存：进程内 LRU + Redis 共享两级缓存
+'''
+
+import hashlib
+import re
+import threading
+import time
+import unicodedata
+from typing import Optional
+
+import redis
+
+from app.core.cache import LRUCache, content_hash
+from app.core.config import settings
+from app.core.logger import get_logger
+from app.services.model_registry import FINGERPRINT_REFRESH_SECONDS, model_version
+
+logger = get_logger(__name__)
+
+KEY_PREFIX = "qa:answer"
+
+_TRAILING_PUNCTUATION = "?？!！.。~～ "
+
+
+def normalize_question(question: str) -> str:
+    """问题归一化：全角转半角、小写、合并空白、去掉结尾标点"""
+    text = unicodedata.normalize("NFKC", question).lower()
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.rstrip(_TRAILING_PUNCTUATION)
+
+
+def registry_model_version(model: Optional[str] = None) -> str:
+    """模型注册表中模型的当前版本指纹（默认的指纹函数）"""
+    return model_version(model)
+
+
+def passage_index_version() -> str:
+    """段落检索索引的当前版本（默认的索引版本函数）；未启用检索时为空"""
+    if not settings.retrieval_enabled:
+        return ""
+    from app.services.retrieval import index_version
+
+    return index_version(settings.retrieval_index_dir)
+
+
+class AnswerCache:
+    """
+    两级答案缓存
+
+    key = 模型版本指纹 + hash(归一化问题, 上下文哈希)，每个命名模型有各自的指纹；
+    没有上下文的问题由检索提供上下文，用段落索引版本代替上下文哈希，导入新文档后旧答案不再命中
+    - 第一级：进程内 LRUCache，容量和 TTL 可配
+    - 第二级：Redis，所有 API/worker 进程共享；每条带 TTL，并用有序集合记录写入时间，
+      超过 redis_max_entries 时淘汰最早写入的条目
+    Redis 不可用时只使用进程内缓存，不影响主流程。
+    """
+
+    def __init__(
+        self,
+        redis_client=None,
+        local_size: int = 1024,
+        local_ttl: float = 300,
+        redis_ttl: int = 86400,
+        redis_max_entries: int = 100000,
+        fingerprint_func=registry_model_version,
+        index_version_func=passage_index_version,
+    ):
+        self.redis = redis_client
+        self.local = LRUCache(maxsize=local_size, ttl=local_ttl)
+        self.redis_ttl = redis_ttl
+        self.redis_max_entries = redis_max_entries
+        self._fingerprint_func = fingerprint_func
+        self._index_version_func = index_version_func
+        # (段落索引版本, 上次检查时间)
+        self._index_version = None
+        # 模型名（None 为默认模型） -> (指纹, 上次检查时间)
+        self._fingerprints = {}
+        self._lock = threading.Lock()
+
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.redis_errors = 0
+        self.invalidations = 0
+
+    # ---- 指纹与 key ----
+
+    def fingerprint(self, model: Optional[str] = None) -> str:
+        """模型当前指纹；发现模型变化时清空进程内缓存并清理 Redis 中旧版本的条目"""
+        now = time.monotonic()
+        cached = self._fingerprints.get(model)
+        if cached is not None and now - cached[1] < FINGERPRINT_REFRESH_SECONDS:
+            return cached[0]
+        with self._lock:
+            current = self._fingerprint_func(model) if model is not None else self._fingerprint_func()
+            self._fingerprints[model] = (current, now)
+        previous = cached[0] if cached is not None else None
+        if previous is not None and previous != current:
+            logger.info(f"Model {model or 'default'} fingerprint changed {previous} -> {current}, invalidating answer cache")
+            self.invalidations += 1
+            self.local.clear()
+            self._purge_redis(previous)
+        return current
+
+    def make_key(self, question: str, context: Optional[str] = None, model: Optional[str] = None) -> str:
+        return self._make_key(question, context, self.fingerprint(model))
+
+    def index_version(self) -> str:
+        """段落索引版本，最多每 FINGERPRINT_REFRESH_SECONDS 秒检查一次"""
+        now = time.monotonic()
+        cached = self._index_version
+        if cached is not None and now - cached[1] < FINGERPRINT_REFRESH_SECONDS:
+            return cached[0]
+        version = self._index_version_func()
+        self._index_version = (version, now)
+        return version
+
+    def _make_key(self, question: str, context: Optional[str], fingerprint: str) -> str:
+        source = content_hash(context) if context else f"retrieval:{self.index_version()}"
+        digest = hashlib.sha1("\0".join([normalize_question(question), source]).encode("utf-8")).hexdigest()
+        return f"{KEY_PREFIX}:{fingerprint}:{digest}"
+
+    def _index_key(self, fingerprint: str) -> str:
+        return f"{KEY_PREFIX}:index:{fingerprint}"
+
+    # ---- 读写 ----
+
+    def get(self, question: str, context: Optional[str] = None, model: Optional[str] = None) -> Optional[str]:
+        key = self.make_key(question, context, model)
+        answer = self.local.get(key)
+        if answer is not None:
+            self.local_hits += 1
+            return answer
+
+        if self.redis is not None:
+            try:
+                answer = self.redis.get(key)
+            except redis.RedisError as e:
+                self.redis_errors += 1
+                logger.warning(f"Answer cache redis get failed: {e}")
+                answer = None
+            if answer is not None:
+                self.redis_hits += 1
+                self.local.set(key, answer)
+                return answer
+
+        self.misses += 1
+        return None
+
+    def set(self, question: str, answer: str, context: Optional[str] = None, model: Optional[str] = None):
+        fingerprint = self.fingerprint(model)
+        key = self._make_key(question, context, fingerprint)
+        self.local.set(key, answer)
+        self.writes += 1
+        if self.redis is None:
+            return
+        index_key = self._index_key(fingerprint)
+        try:
+            pipe = self.redis.pipeline()
+            pipe.set(key, answer, ex=self.redis_ttl)
+            pipe.zadd(index_key, {key: time.time()})
+            pipe.expire(index_key, self.redis_ttl)
+            pipe.zcard(index_key)
+            size = pipe.execute()[-1]
+            if size > self.redis_max_entries:
+                self._evict_redis(index_key, size - self.redis_max_entries)
+        except redis.RedisError as e:
+            self.redis_errors += 1
+            logger.warning(f"Answer cache redis set failed: {e}")
+
+    def _evict_redis(self, index_key: str, count: int):
+        """淘汰最早写入的 count 条"""
+        oldest = [member for member, _ in self.redis.zpopmin(index_key, count)]
+        if oldest:
+            self.redis.delete(*oldest)
+
+    def _purge_redis(self, fingerprint: str):
+        """删除旧模型指纹下的全部条目"""
+        if self.redis is None:
+            return
+        index_key = self._index_key(fingerprint)
+        try:
+            while True:
+                batch = [member for member, _ in self.redis.zpopmin(index_key, 1000)]
+                if not batch:
+                    break
+                self.redis.delete(*batch)
+        except redis.RedisError as e:
+            self.redis_errors += 1
+            logger.warning(f"Answer cache redis purge failed: {e}")
+
+    def clear(self, model: Optional[str] = None):
+        self.local.clear()
+        self._purge_redis(self.fingerprint(model))
+
+    def stats(self) -> dict:
+        lookups = self.local_hits + self.redis_hits + self.misses
+        return {
+            "fingerprint": self._fingerprints.get(None, (None,))[0],
+            "fingerprints": {name or "default": fp for name, (fp, _) in self._fingerprints.items()},
+            "lookups": lookups,
+            "local_hits": self.local_hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.local_hits + self.redis_hits) / lookups, 4) if lookups else 0.0,
+            "writes": self.writes,
+            "redis_errors": self.redis_errors,
+            "invalidations": self.invalidations,
+            "local": self.local.stats(),
+        }
+
+
+_answer_cache = None
+_answer_cache_lock = threading.Lock()
+
+
+def get_answer_cache() -> Optional[AnswerCache]:
+    """进程级单例；answer_cache_enabled=false 时返回 None"""
+    global _answer_cache
+    if not settings.answer_cache_enabled:
+        return None
+    if _answer_cache is None:
+        with _answer_cache_lock:
+            if _answer_cache is None:
+                _answer_cache = AnswerCache(
+                    redis_client=redis.Redis.from_url(
+                        settings.cache_url,
+                        decode_responses=True,
+                        socket_connect_timeout=0.5,
+                        socket_timeout=0.5,
+                    ),
+                    local_size=settings.answer_cache_local_size,
+                    local_ttl=settings.answer_cache_local_ttl,
+                    redis_ttl=settings.answer_cache_redis_ttl,
+                    redis_max_entries=settings.answer_cache_redis_max_entries,
+                )
+    return _answer_cache
@@ -0,0 +1,241 @@
+# -*- encoding: utf-8 -*-
+'''
+@Time    :   2025/10/26 10:02:17
+@Author  :   47bwy
+@Desc    :   问答记录冷数据归档：按日期分区的压缩 Parquet 文件
+
+questions 表只增不减，插入、索引维护和备份的成本随时间增长。归档任务（worker/archive.py，Celery beat 定时执行）
+把 created_at 早于保留期的记录按批读出，按日期写入
+    {archive_dir}/questions/date=YYYY-MM-DD/part-{最小id}-{最大id}.parquet
+写入成功后再从 questions 表删除这一批（全文索引由触发器同步删除），热表只保留保留期内的记录。
+
+- 文件先写入临时文件再改名，读取方不会看到写了一半的文件
+- 写入文件之后、删除之前崩溃时，下次运行会再归档一次这些记录，读取时按 id 去重
+- /qa/history 和 /qa/search 传 include_archive=true 时在热表之后继续读归档（冷数据路径，逐个分区扫描）
+- API 进程和 worker 需要共享 archive_dir（同一台机器或共享存储）
+需要 pandas 和 pyarrow。
+'''
+
+import fcntl
+import os
+import unicodedata
+import uuid
+from datetime import date, datetime, timedelta
+from types import SimpleNamespace
+from typing import Callable, List, Optional, Tuple
+
+from sqlalchemy import delete, select
+
+from app.core.config import settings
+from app.core.db import SessionLocal
+from app.core.logger import get_logger
+from app.models.question import Question, utcnow
+from app.services.bm25 import tokenize
+
+logger = get_logger(__name__)
+
+TABLE_DIR = "questions"
+LOCK_FILE = "archive.lock"
+ARCHIVE_COLUMNS = ("id", "user_id", "question", "answer", "created_at", "latency_ms")
+# 每个文件的列类型固定，某一批 latency_ms 全为空时也不会写出不同的 schema
+COLUMN_DTYPES = {"id": "int64", "latency_ms": "float64", "created_at": "datetime64[us]"}
+
+
+class ArchiveUnavailableError(RuntimeError):
+    pass
+
+
+def _pandas():
+    try:
+        import pandas as pd
+        import pyarrow  # noqa: F401
+    except ImportError as e:
+        raise ArchiveUnavailableError(f"Archive requires pandas and pyarrow: {e}") from e
+    return pd
+
+
+def archive_cutoff(retention_days: int, now: Optional[datetime] = None) -> datetime:
+    return (now or utcnow()) - timedelta(days=retention_days)
+
+
+def partition_dir(archive_dir: str, day: date) -> str:
+    return os.path.join(archive_dir, TABLE_DIR, f"date={day.isoformat()}")
+
+
+def list_partitions(archive_dir: str) -> List[Tuple[date, str]]:
+    """所有日期分区，按日期从新到旧"""
+    root = os.path.join(archive_dir, TABLE_DIR)
+    if not os.path.isdir(root):
+        return []
+    partitions = []
+    for name in os.listdir(root):
+        if not name.startswith("date="):
+            continue
+        try:
+            partitions.append((date.fromisoformat(name[len("date="):]), os.path.join(root, name)))
+        except ValueError:
+            continue
+    return sorted(partitions, reverse=True)
+
+
+class QuestionArchiver:
+    """把保留期之前的问答记录分批写入 Parquet 分区并从热表删除"""
+
+    def __init__(
+        self,
+        session_factory: Callable = SessionLocal,
+        archive_dir: str = "./data/archive",
+        batch_size: int = 5000,
+        compression: str = "zstd",
+    ):
+        self.session_factory = session_factory
+        self.archive_dir = archive_dir
+        self.batch_size = max(1, batch_size)
+        self.compression = compression
+
+    def _write_partition(self, day: date, frame) -> str:
+        directory = partition_dir(self.archive_dir, day)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"part-{frame['id'].min()}-{frame['id'].max()}.parquet")
+        tmp = os.path.join(directory, f".{uuid.uuid4().hex}.tmp")
+        try:
+            frame.to_parquet(tmp, engine="pyarrow", compression=self.compression, index=False)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        return path
+
+    def archive_batch(self, cutoff: datetime) -> Tuple[int, int]:
+        """
+        归档一批记录，返回 (条数, 写入的文件数)
+
+        按主键顺序取 created_at < cutoff 的记录：旧记录的 id 也小，主键扫描很快就能取满一批，不需要 created_at 单列索引。
+        """
+        pd = _pandas()
+        columns = [Question.__table__.c[name] for name in ARCHIVE_COLUMNS]
+        with self.session_factory() as db:
+            rows = db.execute(
+                select(*columns).where(Question.created_at < cutoff).order_by(Question.id).limit(self.batch_size)
+            ).all()
+            if not rows:
+                return 0, 0
+            frame = pd.DataFrame([tuple(row) for row in rows], columns=ARCHIVE_COLUMNS).astype(COLUMN_DTYPES)
+            files = 0
+            for day, part in frame.groupby(frame["created_at"].dt.date, sort=True):
+                self._write_partition(day, part)
+                files += 1
+            # 文件全部写入成功后再删除
+            db.execute(delete(Question).where(Question.id.in_(frame["id"].tolist())))
+            db.commit()
+        return len(rows), files
+
+    def run(self, cutoff: datetime) -> dict:
+        """归档 cutoff 之前的全部记录；同一个归档目录同一时间只允许一个任务运行，已在运行时直接返回"""
+        os.makedirs(self.archive_dir, exist_ok=True)
+        with open(os.path.join(self.archive_dir, LOCK_FILE), "w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                logger.info("Question archive already running, skipping")
+                return {"skipped": True, "archived": 0, "files": 0, "batches": 0}
+            try:
+                archived = files = batches = 0
+                while True:
+                    count, written = self.archive_batch(cutoff)
+                    if not count:
+                        break
+                    archived += count
+                    files += written
+                    batches += 1
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        logger.info(f"Archived {archived} questions older than {cutoff.isoformat()} into {files} files")
+        return {"skipped": False, "cutoff": cutoff.isoformat(), "archived": archived, "files": files, "batches": batches}
+
+
+def get_archiver() -> QuestionArchiver:
+    return QuestionArchiver(
+        archive_dir=settings.archive_dir,
+        batch_size=settings.archive_batch_size,
+        compression=settings.archive_compression,
+    )
+
+
+# ---- 读取 ----
+
+def _read_partition(path: str, user_id: Optional[str] = None):
+    pd = _pandas()
+    filters = [("user_id", "==", user_id)] if user_id is not None else None
+    frame = pd.read_parquet(path, engine="pyarrow", filters=filters)
+    return frame.drop_duplicates("id")
+
+
+def _records(frame) -> List[SimpleNamespace]:
+    """DataFrame -> 与 Question 属性相同的对象（created_at 为 datetime，空值为 None）"""
+    records = []
+    for row in frame.to_dict("records"):
+        row["created_at"] = row["created_at"].to_pydatetime()
+        if row["latency_ms"] != row["latency_ms"]:
+            row["latency_ms"] = None
+        records.append(SimpleNamespace(**row))
+    return records
+
+
+def archive_history(
+    user_id: str, limit: int, before: Optional[Tuple[datetime, int]] = None, archive_dir: Optional[str] = None
+) -> List[SimpleNamespace]:
+    """归档中某个用户 (created_at, id) 小于 before 的记录，按时间倒序最多 limit 条"""
+    rows = []
+    for day, path in list_partitions(archive_dir or settings.archive_dir):
+        if before is not None and day > before[0].date():
+            continue
+        frame = _read_partition(path, user_id)
+        if before is not None:
+            created_at, question_id = before
+            frame = frame[(frame["created_at"] < created_at) | ((frame["created_at"] == created_at) & (frame["id"] < question_id))]
+        frame = frame.sort_values(["created_at", "id"], ascending=False).head(limit - len(rows))
+        rows.extend(_records(frame))
+        if len(rows) >= limit:
+            break
+    return rows
+
+
+def archive_search(
+    query: str, limit: int, user_id: Optional[str] = None, archive_dir: Optional[str] = None
+) -> List[dict]:
+    """
+    在归档中检索：与全文索引相同的切词，所有词都出现在问题或答案中，按时间倒序
+
+    归档没有倒排索引，逐个分区扫描，只用于低频的冷数据查询。
+    """
+    terms = list(dict.fromkeys(tokenize(query)))
+    if not terms:
+        return []
+    results = []
+    for _, path in list_partitions(archive_dir or settings.archive_dir):
+        frame = _read_partition(path, user_id)
+        if frame.empty:
+            continue
+        text = (frame["question"].fillna("") + "\n" + frame["answer"].fillna("")).map(
+            lambda value: unicodedata.normalize("NFKC", value).lower()
+        )
+        mask = text.str.contains(terms[0], regex=False)
+        for term in terms[1:]:
+            mask &= text.str.contains(term, regex=False)
+        frame = frame[mask].sort_values(["created_at", "id"], ascending=False).head(limit - len(results))
+        results.extend(
+            {
+                "id": row.id,
+                "user_id": row.user_id,
+                "question": row.question,
+                "answer": row.answer,
+                "created_at": str(row.created_at),
+                "score": None,
+                "archived": True,
+            }
+            for row in _records(frame)
+        )
+        if len(results) >= limit:
+            break
+    return results
@@ -0,0 +1,302 @@
+# -*- encoding: utf-8 -*-
+'''
+@Time    :   2025/10/18 16:03:17
+@Author  :   47bwy
+@Desc    :   可插拔推理后端：eager / TorchScript / torch.compile / ONNX Runtime / INT8
+'''
+
+import inspect
+import os
+
+from app.core.logger import get_logger
+
+logger = get_logger(__name__)
+
+BACKENDS = ("eager", "torchscript", "compile", "onnx", "int8")
+
+INPUT_NAMES = ["input_ids", "attention_mask", "token_type_ids"]
+OUTPUT_NAMES = ["start_logits", "end_logits"]
+
+# 导出文件与模型权重放在同一目录
+ARTIFACT_NAMES = {
+    "torchscript": "model.torchscript.pt",
+    "onnx": "model.onnx",
+    "int8": "model.int8.pt",
+}
+
+# 判断缓存是否过期时参考的权重文件
+WEIGHT_FILES = ("model.safetensors", "pytorch_model.bin")
+
+
+def artifact_path(model_dir: str, kind: str) -> str:
+    """返回导出图文件的路径（与 settings.local_model 同目录）"""
+    return os.path.join(model_dir, ARTIFACT_NAMES[kind])
+
+
+def _weights_mtime(model_dir: str) -> float:
+    mtimes = [
+        os.path.getmtime(os.path.join(model_dir, name))
+        for name in WEIGHT_FILES
+        if os.path.exists(os.path.join(model_dir, name))
+    ]
+    return max(mtimes) if mtimes else 0.0
+
+
+def artifact_fresh(model_dir: str, kind: str) -> bool:
+    """导出文件存在且不比权重文件旧（权重更新后导出图需要重新生成）"""
+    path = artifact_path(model_dir, kind)
+    return os.path.exists(path) and os.path.getmtime(path) >= _weights_mtime(model_dir)
+
+
+def _example_inputs(batch_size: int = 2, seq_len: int = 16):
+    import torch
+
+    input_ids = torch.ones((batch_size, seq_len), dtype=torch.long)
+    return (input_ids, torch.ones_like(input_ids), torch.zeros_like(input_ids))
+
+
+class QABackend:
+    """推理后端基类：输入三个 [batch, seq] 张量，返回 (start_logits, end_logits)"""
+
+    name = "base"
+    device = "cpu"
+
+    def __call__(self, input_ids, attention_mask, token_type_ids):
+        raise NotImplementedError
+
+
+class EagerBackend(QABackend):
+    """直接调用 PyTorch 模型"""
+
+    name = "eager"
+
+    def __init__(self, model):
+        self.model = model
+        self.device = next(model.parameters()).device.type
+
+    def __call__(self, input_ids, attention_mask, token_type_ids):
+        import torch
+
+        with torch.no_grad():
+            outputs = self.model(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                token_type_ids=token_type_ids,
+            )
+        return outputs.start_logits, outputs.end_logits
+
+
+class TorchScriptBackend(QABackend):
+    """加载 torch.jit 导出的图；找不到导出文件或导出文件比权重旧时现场 trace 一份"""
+
+    name = "torchscript"
+
+    def __init__(self, module):
+        self.module = module
+
+    @classmethod
+    def load(cls, model_dir: str, model=None):
+        import torch
+
+        path = artifact_path(model_dir, "torchscript")
+        if artifact_fresh(model_dir, "torchscript"):
+            logger.info(f"Loading TorchScript graph from {path}")
+            return cls(torch.jit.load(path, map_location="cpu"))
+        if model is None:
+            raise RuntimeError(
+                f"TorchScript graph missing or older than model weights at {path}, "
+                "run `python export_model.py --format torchscript` first"
+            )
+        logger.warning(f"TorchScript graph missing or stale at {path}, tracing in memory (run export_model.py to cache it)")
+        return cls(trace_model(model))
+
+    def __call__(self, input_ids, attention_mask, token_type_ids):
+        import torch
+
+        with torch.no_grad():
+            start_logits, end_logits = self.module(input_ids, attention_mask, token_type_ids)[:2]
+        return start_logits, end_logits
+
+
+class CompiledBackend(EagerBackend):
+    """torch.compile 包装的模型，首次调用时编译，batch/seq 维度按动态形状处理"""
+
+    name = "compile"
+
+    def __init__(self, model):
+        import torch
+
+        super().__init__(torch.compile(model, dynamic=True))
+
+
+class QuantizedBackend(TorchScriptBackend):
+    """
+    动态 INT8 量化：Linear 层权重量化为 int8，激活在运行时动态量化
+
+    量化后的模型以 TorchScript 形式缓存到 model.int8.pt，worker 重启时直接加载；
+    权重文件比缓存新时重新量化。
+    """
+
+    name = "int8"
+
+    @classmethod
+    def load(cls, model_dir: str, load_model=None):
+        import torch
+
+        path = artifact_path(model_dir, "int8")
+        if artifact_fresh(model_dir, "int8"):
+            logger.info(f"Loading INT8 model from {path}")
+            return cls(torch.jit.load(path, map_location="cpu"))
+
+        if load_model is None:
+            raise RuntimeError(f"INT8 model not found at {path}, run `python export_model.py --format int8` first")
+        logger.info(f"INT8 model cache missing or stale at {path}, quantizing")
+        module = trace_model(quantize_model(load_model()))
+        try:
+            torch.jit.save(module, path)
+            logger.info(f"INT8 model cached to {path}")
+        except OSError as e:
+            # 模型目录只读时仍然可以使用内存中的量化模型
+            logger.warning(f"Failed to cache INT8 model to {path}: {e}")
+        return cls(module)
+
+
+class OnnxBackend(QABackend):
+    """ONNX Runtime CPU 推理，开启全部图优化"""
+
+    name = "onnx"
+
+    def __init__(self, session):
+        self.session = session
+
+    @classmethod
+    def load(cls, model_dir: str, num_threads: int = 0):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise RuntimeError("onnxruntime is not installed. Please `pip install onnxruntime` to use the onnx backend.") from e
+
+        path = artifact_path(model_dir, "onnx")
+        if not os.path.exists(path):
+            raise RuntimeError(f"ONNX graph not found at {path}, run `python export_model.py --format onnx` first")
+        if not artifact_fresh(model_dir, "onnx"):
+            raise RuntimeError(f"ONNX graph at {path} is older than model weights, run `python export_model.py --format onnx` again")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads > 0:
+            options.intra_op_num_threads = num_threads
+        logger.info(f"Loading ONNX graph from {path}")
+        return cls(ort.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"]))
+
+    def __call__(self, input_ids, attention_mask, token_type_ids):
+        import torch
+
+        feeds = {
+            "input_ids": input_ids.cpu().numpy(),
+            "attention_mask": attention_mask.cpu().numpy(),
+            "token_type_ids": token_type_ids.cpu().numpy(),
+        }
+        start_logits, end_logits = self.session.run(OUTPUT_NAMES, feeds)
+        return torch.from_numpy(start_logits), torch.from_numpy(end_logits)
+
+
+def trace_model(model):
+    """用 torch.jit.trace 把 BertForQuestionAnswering 转成 TorchScript 图"""
+    import torch
+
+    # trace 需要模型返回 tuple 而不是 ModelOutput，结束后恢复原来的设置
+    return_dict = model.config.return_dict
+    model.config.return_dict = False
+    try:
+        with torch.no_grad():
+            traced = torch.jit.trace(model, _example_inputs(), strict=False)
+    finally:
+        model.config.return_dict = return_dict
+    return torch.jit.freeze(traced.eval())
+
+
+def quantize_model(model):
+    """对 Linear 层做动态 INT8 量化（仅支持 CPU），返回新模型，原模型不变"""
+    import copy
+
+    import torch
+
+    model = copy.deepcopy(model).cpu().eval()
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def export_int8(model, model_dir: str) -> str:
+    """量化并导出 INT8 TorchScript 图，返回文件路径"""
+    import torch
+
+    path = artifact_path(model_dir, "int8")
+    torch.jit.save(trace_model(quantize_model(model)), path)
+    logger.info(f"INT8 model saved to {path}")
+    return path
+
+
+def export_torchscript(model, model_dir: str) -> str:
+    """导出 TorchScript 图，返回文件路径"""
+    import torch
+
+    path = artifact_path(model_dir, "torchscript")
+    torch.jit.save(trace_model(model), path)
+    logger.info(f"TorchScript graph saved to {path}")
+    return path
+
+
+def export_onnx(model, model_dir: str, opset: int = 17) -> str:
+    """导出 ONNX 图（batch 和 seq 维度为动态轴），返回文件路径"""
+    import torch
+
+    path = artifact_path(model_dir, "onnx")
+    dynamic_axes = {name: {0: "batch", 1: "seq"} for name in INPUT_NAMES + OUTPUT_NAMES}
+    kwargs = {}
+    # 新版本 PyTorch 默认使用 dynamo 导出器，这里固定使用稳定的 TorchScript 导出器
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        kwargs["dynamo"] = False
+
+    return_dict = model.config.return_dict
+    model.config.return_dict = False
+    try:
+        with torch.no_grad():
+            torch.onnx.export(
+                model,
+                _example_inputs(),
+                path,
+                input_names=INPUT_NAMES,
+                output_names=OUTPUT_NAMES,
+                dynamic_axes=dynamic_axes,
+                opset_version=opset,
+                **kwargs,
+            )
+    finally:
+        model.config.return_dict = return_dict
+    logger.info(f"ONNX graph saved to {path}")
+    return path
+
+
+def create_backend(kind: str, model_dir: str, load_model=None, num_threads: int = 0) -> QABackend:
+    """
+    按名称创建推理后端
+
+    Args:
+        kind: eager / torchscript / compile / onnx / int8
+        model_dir: 模型目录（导出文件所在目录）
+        load_model: 返回 eager 模型的函数，只有需要 PyTorch 模型的后端才会调用
+        num_threads: ONNX Runtime 的 intra-op 线程数，0 表示默认
+    """
+    if kind not in BACKENDS:
+        raise ValueError(f"Unknown inference backend: {kind}, expected one of {BACKENDS}")
+
+    if kind == "onnx":
+        return OnnxBackend.load(model_dir, num_threads=num_threads)
+    if kind == "torchscript":
+        fresh = artifact_fresh(model_dir, "torchscript")
+        return TorchScriptBackend.load(model_dir, model=None if fresh else load_model())
+    if kind == "int8":
+        return QuantizedBackend.load(model_dir, load_model=load_model)
+    if kind == "compile":
+        return CompiledBackend(load_model())
+    return EagerBackend(load_model())
@@ -0,0 +1,153 @@
+# -*- encoding: utf-8 -*-
+'''
+@Time    :   2025/10/24 10:36:12
+@Author  :   47bwy
+@Desc    :   批量提问：整批问题切块，每块作为一个 Celery 任务做一次批量推理，进度与逐条结果保存在 Redis
+
+一次提交几百个问题时不再逐条提交任务：broker 往返从每个问题一次降为每块一次，
+worker 里同一块的问题合并成一次批量前向推理（见 llm_services.process_questions）。
+
+Redis 中的数据（ask_batch_ttl_seconds 后过期）：
+    qa:batch:<id>          批次元数据：total / done / failed / chunks / user / created_at
+    qa:batch:<id>:results  问题序号 -> {"status": "success", "answer": ...} 或 {"status": "failure", "error": ...}
+    qa:batch:<id>:chunks   已记录的块：块序号 -> "done:<条数>" 或 "failed:<条数>"（acks_late 重投递时不重复计数）
+'''
+
+import json
+import time
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+import redis
+
+from app.core.config import settings
+from app.core.logger import get_logger
+from app.services.result_stream import publish_result, result_message
+
+logger = get_logger(__name__)
+
+BATCH_KEY = "qa:batch:{batch_id}"
+RESULTS_KEY = "qa:batch:{batch_id}:results"
+CHUNKS_KEY = "qa:batch:{batch_id}:chunks"
+
+
+def _client():
+    return redis.Redis.from_url(settings.backend_url, socket_connect_timeout=1, socket_timeout=5)
+
+
+def iter_chunks(items: Sequence, size: int) -> Iterator[Tuple[int, list]]:
+    """按 size 切块，产出 (块内第一个问题在整批中的序号, 块)"""
+    size = max(1, size)
+    for offset in range(0, len(items), size):
+        yield offset, list(items[offset:offset + size])
+
+
+def create_batch(batch_id: str, user_id: str, total: int, chunks: int, client=None):
+    """提交任务之前登记批次，worker 之后按块累加完成数"""
+    client = client or _client()
+    key = BATCH_KEY.format(batch_id=batch_id)
+    pipe = client.pipeline()
+    pipe.hset(key, mapping={
+        "user": user_id,
+        "total": total,
+        "chunks": chunks,
+        "done": 0,
+        "failed": 0,
+        "created_at": time.time(),
+    })
+    pipe.expire(key, settings.ask_batch_ttl_seconds)
+    pipe.execute()
+
+
+def record_chunk(
+    batch_id: str,
+    offset: int,
+    answers: Optional[List[str]] = None,
+    error: Optional[str] = None,
+    count: int = 0,
+    client=None,
+) -> dict:
+    """
+    worker 端保存一块的结果并累加进度，返回更新后的进度（total / done / failed）
+
+    成功时传 answers；整块失败时传 error 和块内问题数 count。
+    幂等：同一块被重复记录（acks_late 重投递）时不重复计数；已成功的块不会被之后的失败覆盖，
+    先失败后重试成功的块从 failed 转入 done。
+    """
+    client = client or _client()
+    key = BATCH_KEY.format(batch_id=batch_id)
+    results_key = RESULTS_KEY.format(batch_id=batch_id)
+    chunks_key = CHUNKS_KEY.format(batch_id=batch_id)
+    if answers is not None:
+        results = {
+            offset + i: json.dumps({"status": "success", "answer": answer}, ensure_ascii=False)
+            for i, answer in enumerate(answers)
+        }
+        field, count = "done", len(answers)
+    else:
+        message = json.dumps({"status": "failure", "error": error}, ensure_ascii=False)
+        results = {offset + i: message for i in range(count)}
+        field = "failed"
+
+    def update(pipe):
+        # WATCH 块记录，并发记录同一块时事务重试，读取到对方的结果后再决定是否计数
+        previous = pipe.hget(chunks_key, offset)
+        previous_field, _, previous_count = _text(previous or "").partition(":")
+        pipe.multi()
+        if previous_field != "done" and previous_field != field:
+            if results:
+                pipe.hset(results_key, mapping=results)
+            if previous_field:
+                pipe.hincrby(key, previous_field, -int(previous_count))
+            pipe.hincrby(key, field, count)
+            pipe.hset(chunks_key, offset, f"{field}:{count}")
+        pipe.expire(results_key, settings.ask_batch_ttl_seconds)
+        pipe.expire(chunks_key, settings.ask_batch_ttl_seconds)
+        pipe.hmget(key, "total", "done", "failed")
+
+    total, done, failed = client.transaction(update, chunks_key)[-1]
+    return {"total": int(total or 0), "done": int(done or 0), "failed": int(failed or 0)}
+
+
+def publish_progress(batch_id: str, progress: dict) -> bool:
+    """通过结果推送通知等待中的连接（消息 task_id 为批次 id）"""
+    return publish_result({**result_message(batch_id, "progress"), **progress})
+
+
+def _text(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def _status(total: int, done: int, failed: int) -> str:
+    if done + failed < total:
+        return "pending"
+    return "success" if failed == 0 else "failure" if done == 0 else "partial"
+
+
+def get_batch(batch_id: str, with_results: bool = True, client=None) -> Optional[dict]:
+    """
+    批次进度与逐条结果，批次不存在（或已过期）返回 None
+
+    status：pending（未全部完成）/ success / partial（部分块失败）/ failure（全部失败）；
+    results 与提交顺序一致，尚未完成的问题为 {"status": "pending"}。
+    """
+    client = client or _client()
+    meta = client.hgetall(BATCH_KEY.format(batch_id=batch_id))
+    if not meta:
+        return None
+    meta = {_text(k): _text(v) for k, v in meta.items()}
+    total, done, failed = int(meta["total"]), int(meta["done"]), int(meta["failed"])
+    batch = {
+        "batch_id": batch_id,
+        "user": meta["user"],
+        "status": _status(total, done, failed),
+        "total": total,
+        "done": done,
+        "failed": failed,
+        "chunks": int(meta["chunks"]),
+        "created_at": float(meta["created_at"]),
+    }
+    if with_results:
+        stored = client.hgetall(RESULTS_KEY.format(batch_id=batch_id))
+        stored = {int(k): json.loads(v) for k, v in stored.items()}
+        batch["results"] = [stored.get(i, {"status": "pending"}) for i in range(total)]
+    return batch
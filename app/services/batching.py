@@ -0,0 +1,187 @@
+# -*- encoding: utf-8 -*-
+'''
+@Time    :   2025/10/18 10:12:05
+@Author  :   47bwy
+@Desc    :   动态微批处理（micro-batching），把并发请求合并成一次前向推理
+'''
+
+import os
+import queue
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+from typing import Any, Callable, List, Optional
+
+from app.core.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+def _percentile(samples: List[float], pct: float) -> float:
+    """计算百分位数（最近邻法），samples 为空时返回 0"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+class BatchStats:
+    """批处理统计：批大小分布、排队等待时间、推理耗时"""
+
+    def __init__(self, window: int = 2048):
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.requests = 0
+        self.errors = 0
+        self.batch_sizes = Counter()
+        self.queue_wait_ms = deque(maxlen=window)
+        self.forward_ms = deque(maxlen=window)
+
+    def record(self, batch_size: int, waits_ms: List[float], forward_ms: float, failed: bool = False):
+        with self._lock:
+            self.batches += 1
+            self.requests += batch_size
+            self.batch_sizes[batch_size] += 1
+            self.queue_wait_ms.extend(waits_ms)
+            self.forward_ms.append(forward_ms)
+            if failed:
+                self.errors += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            waits = list(self.queue_wait_ms)
+            forwards = list(self.forward_ms)
+            return {
+                "batches": self.batches,
+                "requests": self.requests,
+                "errors": self.errors,
+                "avg_batch_size": round(self.requests / self.batches, 2) if self.batches else 0.0,
+                "batch_size_histogram": dict(sorted(self.batch_sizes.items())),
+                "queue_wait_ms": {
+                    "p50": round(_percentile(waits, 50), 3),
+                    "p95": round(_percentile(waits, 95), 3),
+                    "p99": round(_percentile(waits, 99), 3),
+                },
+                "forward_ms": {
+                    "p50": round(_percentile(forwards, 50), 3),
+                    "p95": round(_percentile(forwards, 95), 3),
+                    "p99": round(_percentile(forwards, 99), 3),
+                },
+            }
+
+
+class MicroBatcher:
+    """
+    收集一个时间窗口内的并发请求，合并成一批交给 handler 处理
+
+    - 第一个请求到达后最多再等待 max_wait_ms 毫秒，或凑满 max_batch_size 立即发车
+    - handler 接收请求列表，返回等长的结果列表，结果按顺序回填到各自的 Future
+    - 后台线程在第一次 submit 时才启动；fork 出的子进程会重新启动自己的线程
+
+    注意：Celery prefork 模式下每个子进程同一时间只执行一个任务，
+    需要配合 `-P threads` 或 `-P gevent` 等并发池，批处理才有意义。
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[List[Any]], List[Any]],
+        max_batch_size: int = 16,
+        max_wait_ms: float = 5.0,
+        name: str = "batcher",
+        log_every: int = 100,
+    ):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be >= 1")
+        self.handler = handler
+        self.max_batch_size = max_batch_size
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.name = name
+        self.log_every = log_every
+        self.stats = BatchStats()
+
+        self._queue: "queue.Queue" = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._closed = False
+
+    def _ensure_started(self):
+        """懒启动后台线程；fork 之后线程不会被继承，需要按 pid 重新创建"""
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            if self._pid != os.getpid():
+                # fork 后父进程队列里残留的请求与本进程无关，直接丢弃
+                self._queue = queue.Queue()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name=f"{self.name}-collector", daemon=True)
+            self._thread.start()
+
+    def submit(self, item: Any) -> Future:
+        """提交一个请求，返回 Future，调用方通过 future.result() 获取自己的结果"""
+        if self._closed:
+            raise RuntimeError(f"{self.name} is closed")
+        future: Future = Future()
+        self._ensure_started()
+        self._queue.put((item, future, time.monotonic()))
+        return future
+
+    def close(self, timeout: float = 5.0):
+        """停止后台线程（已入队的请求会先处理完）"""
+        self._closed = True
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout)
+
+    def _collect(self, first) -> list:
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                entry = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is None:
+                # 关闭信号放回去，本批处理完后再退出
+                self._queue.put(None)
+                break
+            batch.append(entry)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = self._collect(first)
+            self._process(batch)
+
+    def _process(self, batch: list):
+        started = time.monotonic()
+        waits_ms = [(started - enqueued) * 1000.0 for _, _, enqueued in batch]
+        items = [item for item, _, _ in batch]
+        failed = False
+        try:
+            results = self.handler(items)
+            if len(results) != len(items):
+                raise RuntimeError(
+                    f"{self.name} handler returned {len(results)} results for {len(items)} requests"
+                )
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
+        except Exception as e:
+            failed = True
+            logger.error(f"{self.name} batch of {len(items)} failed: {e}")
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+        forward_ms = (time.monotonic() - started) * 1000.0
+        self.stats.record(len(items), waits_ms, forward_ms, failed=failed)
+
+        if self.log_every and self.stats.batches % self.log_every == 0:
+            logger.info(f"{self.name} stats: {self.stats.snapshot()}")
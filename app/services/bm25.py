@@ -0,0 +1,330 @@
+# -*- encoding: utf-8 -*-
+'''
+@Time    :   2025/10/21 10:05:26
+@Author  :   47bwy
+@Desc    :   BM25 倒排索引：数组化的倒排表 + numpy 打分，磁盘格式可 mmap 加载
+'''
+
+import json
+import os
+import re
+import threading
+import unicodedata
+import zlib
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.core.logger import get_logger
+
+logger = get_logger(__name__)
+
+META_FILE = "bm25.json"
+SEGMENT_ARRAYS = ("terms", "offsets", "docs", "tfs", "lengths")
+# 加载时段文件被并发的 compact 删除后，重新读取元数据的次数
+LOAD_RETRIES = 3
+
+# 英文单词/数字/编码（如 gpt-4、a1.2、ISO_9001）作为一个词；中日韩文字切成字符二元组
+_LATIN = r"[a-z0-9]+(?:[._\-][a-z0-9]+)*"
+_CJK = r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]+"
+_TOKEN_RE = re.compile(f"{_LATIN}|{_CJK}")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    切词：拉丁字母和数字按单词，中文按字符二元组（单字词保留单字）
+
+    不依赖分词器，中英文混排、专有名词和编号都能精确匹配。
+    """
+    text = unicodedata.normalize("NFKC", text).lower()
+    terms = []
+    for match in _TOKEN_RE.finditer(text):
+        token = match.group()
+        if token[0].isascii():
+            terms.append(token)
+        elif len(token) == 1:
+            terms.append(token)
+        else:
+            terms.extend(token[i:i + 2] for i in range(len(token) - 1))
+    return terms
+
+
+def term_ids(terms: Sequence[str]) -> np.ndarray:
+    """词 -> 32 位哈希 id，不需要保存词表"""
+    return np.fromiter((zlib.crc32(t.encode("utf-8")) for t in terms), dtype="uint32", count=len(terms))
+
+
+def build_segment(token_ids: Sequence[np.ndarray]) -> dict:
+    """
+    把一批文档（每个文档是词 id 数组）构建为 CSR 倒排表
+
+    terms[i] 的倒排表为 docs[offsets[i]:offsets[i+1]]（段内文档下标）与对应的词频 tfs。
+    """
+    lengths = np.array([len(ids) for ids in token_ids], dtype="uint32")
+    if not len(token_ids) or not lengths.sum():
+        empty = np.zeros(0, dtype="uint32")
+        return {"terms": empty, "offsets": np.zeros(1, dtype="int64"), "docs": empty,
+                "tfs": np.zeros(0, dtype="uint16"), "lengths": lengths}
+    doc_of = np.repeat(np.arange(len(token_ids), dtype="uint32"), lengths)
+    all_terms = np.concatenate([np.asarray(ids, dtype="uint32") for ids in token_ids])
+    # 按 (term, doc) 排序后去重计数得到词频
+    pairs = (all_terms.astype("uint64") << np.uint64(32)) | doc_of.astype("uint64")
+    pairs, tfs = np.unique(pairs, return_counts=True)
+    terms_col = (pairs >> np.uint64(32)).astype("uint32")
+    docs = (pairs & np.uint64(0xFFFFFFFF)).astype("uint32")
+    terms, starts = np.unique(terms_col, return_index=True)
+    offsets = np.append(starts, len(terms_col)).astype("int64")
+    return {
+        "terms": terms,
+        "offsets": offsets,
+        "docs": docs,
+        "tfs": np.minimum(tfs, np.iinfo("uint16").max).astype("uint16"),
+        "lengths": lengths,
+    }
+
+
+def merge_segments(segments: Sequence[dict]) -> dict:
+    """把多个相邻段合并为一个（段内文档下标按段的先后顺延）"""
+    terms_parts, docs_parts, tfs_parts, shift = [], [], [], 0
+    for seg in segments:
+        counts = np.diff(seg["offsets"])
+        terms_parts.append(np.repeat(np.asarray(seg["terms"]), counts))
+        docs_parts.append(np.asarray(seg["docs"], dtype="uint32") + np.uint32(shift))
+        tfs_parts.append(np.asarray(seg["tfs"]))
+        shift += len(seg["lengths"])
+    terms_col = np.concatenate(terms_parts)
+    order = np.argsort(terms_col, kind="stable")
+    terms_col = terms_col[order]
+    terms, starts = np.unique(terms_col, return_index=True)
+    return {
+        "terms": terms,
+        "offsets": np.append(starts, len(terms_col)).astype("int64"),
+        "docs": np.concatenate(docs_parts)[order],
+        "tfs": np.concatenate(tfs_parts)[order],
+        "lengths": np.concatenate([np.asarray(seg["lengths"]) for seg in segments]),
+    }
+
+
+class BM25Index:
+    """
+    分段 BM25 索引
+
+    - 每次 flush 把新增文档写成一个只读段（segment），段内为 CSR 倒排表，
+      各数组单独存为 .npy，加载时 np.load(mmap_mode="r")，只有被查询的倒排表才会读入内存
+    - 文档 id 与段落 id 一致，段按 id 连续追加；每 flush_every 个文档落盘一段，段数超过 max_segments 时合并
+    - 查询时全局 df/avgdl 跨段汇总，每个词的倒排表做一次向量化打分
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        k1: float = 1.2,
+        b: float = 0.75,
+        max_segments: int = 8,
+        flush_every: int = 50000,
+        mmap: bool = True,
+    ):
+        self.directory = directory
+        self.k1 = k1
+        self.b = b
+        self.max_segments = max_segments
+        self.flush_every = flush_every
+        self.mmap = mmap
+        self.segments: List[dict] = []
+        self.num_docs = 0
+        self.total_length = 0
+        self._next_segment = 0
+        self._pending_ids: List[int] = []
+        self._pending_terms: List[np.ndarray] = []
+        self._lock = threading.RLock()
+
+    @property
+    def meta_path(self) -> str:
+        return os.path.join(self.directory, META_FILE)
+
+    def exists(self) -> bool:
+        return os.path.exists(self.meta_path)
+
+    def __len__(self) -> int:
+        return self.num_docs + len(self._pending_ids)
+
+    # ---- 写入 ----
+
+    def add(self, ids: Sequence[int], texts: Sequence[str]):
+        """追加文档；ids 必须紧接已有文档连续递增（与段落存储的 id 一致）"""
+        with self._lock:
+            expected = self.num_docs + len(self._pending_ids)
+            if len(ids) and ids[0] != expected:
+                raise ValueError(f"BM25 document ids must be contiguous, expected {expected}, got {ids[0]}")
+            for doc_id, text in zip(ids, texts):
+                self._pending_ids.append(doc_id)
+                self._pending_terms.append(term_ids(tokenize(text)))
+            # 大批量构建时分段落盘，内存中只保留最近一段
+            if len(self._pending_ids) >= self.flush_every:
+                self.flush()
+
+    def flush(self):
+        """把内存中的新增文档写成一个新段"""
+        with self._lock:
+            if not self._pending_ids:
+                return
+            segment = build_segment(self._pending_terms)
+            self._write_segment(segment, base=self._pending_ids[0])
+            self._pending_ids, self._pending_terms = [], []
+            if len(self.segments) > self.max_segments:
+                self.compact()
+
+    def save(self):
+        self.flush()
+        self._write_meta()
+
+    def _segment_path(self, name: str, array: str) -> str:
+        return os.path.join(self.directory, f"{name}.{array}.npy")
+
+    def _write_segment(self, segment: dict, base: int):
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"seg-{self._next_segment:06d}"
+        self._next_segment += 1
+        for array in SEGMENT_ARRAYS:
+            np.save(self._segment_path(name, array), segment[array])
+        count = len(segment["lengths"])
+        self.segments.append(dict(segment, name=name, base=base, count=count))
+        self.num_docs += count
+        self.total_length += int(segment["lengths"].sum())
+        # 段写完后立即更新元数据，中途退出不会留下元数据里引用不到的段
+        self._write_meta()
+
+    def _write_meta(self):
+        os.makedirs(self.directory, exist_ok=True)
+        meta = {
+            "k1": self.k1,
+            "b": self.b,
+            "num_docs": self.num_docs,
+            "total_length": self.total_length,
+            "next_segment": self._next_segment,
+            "segments": [{"name": s["name"], "base": s["base"], "count": s["count"]} for s in self.segments],
+        }
+        tmp = f"{self.meta_path}.tmp.{os.getpid()}"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp, self.meta_path)
+
+    def compact(self):
+        """合并全部段为一个，减少查询时需要访问的段数"""
+        with self._lock:
+            if len(self.segments) <= 1:
+                return
+            old = self.segments
+            merged = merge_segments(old)
+            base = old[0]["base"]
+            self.segments, self.num_docs, self.total_length = [], 0, 0
+            self._write_segment(merged, base=base)
+            for seg in old:
+                for array in SEGMENT_ARRAYS:
+                    try:
+                        os.remove(self._segment_path(seg["name"], array))
+                    except OSError:
+                        pass
+            logger.info(f"BM25 index compacted {len(old)} segments into {self.segments[0]['name']}")
+
+    # ---- 加载 ----
+
+    def load(self, mmap: Optional[bool] = None):
+        """
+        加载元数据和各段
+
+        其他进程 compact 时会在写入新元数据后删除被合并的旧段，读到旧元数据的进程打开段文件时
+        可能已被删除：此时重新读取元数据（指向合并后的新段）再加载，最多重试 LOAD_RETRIES 次。
+        已经 mmap 的段文件被删除后仍可读取，不受影响。
+        """
+        mmap = self.mmap if mmap is None else mmap
+        with self._lock:
+            for attempt in range(LOAD_RETRIES):
+                with open(self.meta_path, encoding="utf-8") as f:
+                    meta = json.load(f)
+                try:
+                    segments = [
+                        dict(self._load_segment(info["name"], mmap), **info) for info in meta["segments"]
+                    ]
+                    break
+                except FileNotFoundError:
+                    if attempt == LOAD_RETRIES - 1:
+                        raise
+                    logger.info("BM25 segment removed by a concurrent compaction, re-reading metadata")
+            self.k1, self.b = meta["k1"], meta["b"]
+            self.segments = segments
+            self.num_docs = meta["num_docs"]
+            self.total_length = meta["total_length"]
+            self._next_segment = meta["next_segment"]
+            self._pending_ids, self._pending_terms = [], []
+        return self
+
+    def _load_segment(self, name: str, mmap: bool) -> dict:
+        return {
+            array: np.load(self._segment_path(name, array), mmap_mode="r" if mmap else None)
+            for array in SEGMENT_ARRAYS
+        }
+
+    def truncate(self, count: int):
+        """丢弃 id >= count 的段（向量索引没有随之保存时回滚用）"""
+        with self._lock:
+            self._pending_ids, self._pending_terms = [], []
+            keep = [s for s in self.segments if s["base"] + s["count"] <= count]
+            if len(keep) == len(self.segments):
+                return
+            logger.warning(f"Dropping {len(self.segments) - len(keep)} BM25 segments beyond document {count}")
+            self.segments = keep
+            self.num_docs = sum(s["count"] for s in keep)
+            self.total_length = int(sum(int(np.asarray(s["lengths"]).sum()) for s in keep))
+            self._write_meta()
+
+    # ---- 查询 ----
+
+    def search(self, query: str, k: int = 10) -> List[Tuple[int, float]]:
+        """返回 [(文档 id, BM25 得分), ...]，按得分降序"""
+        query_terms = np.unique(term_ids(tokenize(query)))
+        with self._lock:
+            segments = list(self.segments)
+            num_docs, total_length = self.num_docs, self.total_length
+        if not len(query_terms) or not num_docs:
+            return []
+        avgdl = total_length / num_docs
+
+        # 每个查询词在每个段中的倒排区间，以及全局 df
+        spans = []
+        df = np.zeros(len(query_terms), dtype="int64")
+        for seg in segments:
+            terms = seg["terms"]
+            pos = np.searchsorted(terms, query_terms)
+            found = (pos < len(terms)) & (terms[np.minimum(pos, len(terms) - 1)] == query_terms)
+            for q in np.nonzero(found)[0]:
+                start, end = int(seg["offsets"][pos[q]]), int(seg["offsets"][pos[q] + 1])
+                spans.append((seg, q, start, end))
+                df[q] += end - start
+        if not spans:
+            return []
+        idf = np.log(1.0 + (num_docs - df + 0.5) / (df + 0.5))
+
+        doc_parts, score_parts = [], []
+        for seg, q, start, end in spans:
+            local = np.asarray(seg["docs"][start:end])
+            tf = np.asarray(seg["tfs"][start:end], dtype="float32")
+            length = np.asarray(seg["lengths"])[local].astype("float32")
+            norm = self.k1 * (1.0 - self.b + self.b * length / avgdl)
+            score_parts.append(idf[q] * tf * (self.k1 + 1.0) / (tf + norm))
+            doc_parts.append(local.astype("int64") + seg["base"])
+        docs = np.concatenate(doc_parts)
+        scores = np.concatenate(score_parts)
+        if len(docs) * 8 > num_docs:
+            # 命中的倒排表很长（常用字）：直接在稠密数组上累加，避免排序
+            totals = np.bincount(docs, weights=scores, minlength=num_docs)
+            unique_docs = np.flatnonzero(totals)
+            totals = totals[unique_docs]
+        else:
+            unique_docs, inverse = np.unique(docs, return_inverse=True)
+            totals = np.bincount(inverse, weights=scores)
+
+        k = min(k, len(unique_docs))
+        top = np.argpartition(-totals, k - 1)[:k]
+        top = top[np.argsort(-totals[top], kind="stable")]
+        return [(int(unique_docs[i]), float(totals[i])) for i in top]
@@ -0,0 +1,210 @@
+# -*- encoding: utf-8 -*-
+'''
+@Time    :   2025/10/23 17:02:45
+@Author  :   47bwy
+@Desc    :   /qa/ask 的进程内快速路径：队列空闲时在 API 进程里直接推理，不经过 Celery
+
+低负载下短问题的耗时主要是 broker 往返和结果轮询；队列深度和本地线程池都有余量时
+直接在有界线程池里调用 process_question 并同步返回答案，否则照常提交 Celery 任务。
+两条路径的端到端耗时都记录到 Redis（每条路径保留最近 LATENCY_SAMPLES 个样本），所有进程共享。
+'''
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+import redis
+import redis.asyncio as aioredis
+
+from app.core.config import settings
+from app.core.logger import get_logger
+from app.core.redis_client import get_redis
+from app.services.batching import _percentile
+
+logger = get_logger(__name__)
+
+LATENCY_KEY = "qa:latency:{path}"
+LATENCY_SAMPLES = 1000
+PATHS = ("inline", "celery")
+
+
+def _metrics_client():
+    """进程内复用的客户端：每个任务都会记录一次耗时，不为每次记录新建连接"""
+    return get_redis(settings.cache_url)
+
+
+def record_latency(path: str, seconds: float, client=None):
+    """记录一次端到端耗时（毫秒），Redis 不可用时忽略"""
+    try:
+        client = client or _metrics_client()
+        key = LATENCY_KEY.format(path=path)
+        pipe = client.pipeline()
+        pipe.lpush(key, round(seconds * 1000, 3))
+        pipe.ltrim(key, 0, LATENCY_SAMPLES - 1)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.debug(f"Failed to record {path} latency: {e}")
+
+
+def latency_stats(client=None) -> dict:
+    """两条路径最近样本的 p50 / p95 / p99（毫秒）"""
+    client = client or _metrics_client()
+    stats = {}
+    for path in PATHS:
+        samples = [float(v) for v in client.lrange(LATENCY_KEY.format(path=path), 0, -1)]
+        stats[path] = {
+            "samples": len(samples),
+            "p50": round(_percentile(samples, 50), 3),
+            "p95": round(_percentile(samples, 95), 3),
+            "p99": round(_percentile(samples, 99), 3),
+        }
+    return stats
+
+
+class FastPath:
+    """
+    进程内快速路径
+
+    同时满足以下条件时走快速路径：
+    - 问题不超过 max_question_chars，上下文不超过 max_context_chars
+    - 本地线程池还有空闲线程（进行中的请求数 < max_workers，不在线程池里排队）
+    - 请求所属级别的 Celery 队列（访客为 qa_guest_queue，登录用户为 qa_queue）深度 <= max_queue_depth
+      （每个队列的深度每 depth_cache_ms 毫秒最多查询一次）
+    """
+
+    def __init__(
+        self,
+        answer_func: Callable[..., str],
+        max_workers: int = 2,
+        max_queue_depth: int = 0,
+        max_question_chars: int = 200,
+        max_context_chars: int = 2000,
+        depth_cache_ms: float = 500,
+        depth_func: Optional[Callable] = None,
+        queue: str = "qa_queue",
+    ):
+        self.answer_func = answer_func
+        self.max_workers = max_workers
+        self.max_queue_depth = max_queue_depth
+        self.max_question_chars = max_question_chars
+        self.max_context_chars = max_context_chars
+        self.depth_cache_ms = depth_cache_ms
+        self.depth_func = depth_func or self._broker_depth
+        self.queue = queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="qa-fast-path")
+        self._broker = None
+        self._depths = {}
+        self.inflight = 0
+
+        self.inline = 0
+        self.errors = 0
+        self.skipped = {"too_long": 0, "busy": 0, "queue_depth": 0}
+
+    async def _broker_depth(self, queue: str) -> Optional[int]:
+        if self._broker is None:
+            self._broker = aioredis.from_url(settings.broker_url, socket_connect_timeout=0.5, socket_timeout=0.5)
+        return await self._broker.llen(queue)
+
+    async def queue_depth(self, queue: Optional[str] = None) -> Optional[int]:
+        """Celery 队列（默认 self.queue）当前积压的任务数（带短暂缓存），查询失败返回 None"""
+        queue = queue or self.queue
+        now = time.monotonic()
+        depth, checked = self._depths.get(queue, (None, 0.0))
+        if depth is not None and (now - checked) * 1000 < self.depth_cache_ms:
+            return depth
+        try:
+            depth = await self.depth_func(queue)
+        except (redis.RedisError, OSError) as e:
+            logger.warning(f"Failed to read depth of {queue}: {e}")
+            depth = None
+        self._depths[queue] = (depth, now)
+        return depth
+
+    async def eligible(self, question: str, context: Optional[str], queue: Optional[str] = None) -> bool:
+        if len(question) > self.max_question_chars or len(context or "") > self.max_context_chars:
+            self.skipped["too_long"] += 1
+            return False
+        if self.inflight >= self.max_workers:
+            self.skipped["busy"] += 1
+            return False
+        depth = await self.queue_depth(queue)
+        # 查不到队列深度时不冒险占用 API 进程
+        if depth is None or depth > self.max_queue_depth:
+            self.skipped["queue_depth"] += 1
+            return False
+        return True
+
+    def _run(self, started: float, *args, **kwargs) -> str:
+        answer = self.answer_func(*args, **kwargs)
+        record_latency("inline", time.time() - started)
+        return answer
+
+    async def try_answer(
+        self,
+        question: str,
+        user_id: str,
+        context: Optional[str] = None,
+        model: Optional[str] = None,
+        queue: Optional[str] = None,
+    ) -> Optional[str]:
+        """
+        满足条件时在本地线程池里回答并返回答案，否则（或推理出错）返回 None，由调用方提交 Celery 任务
+
+        queue 为这个请求本来要进入的队列，按它的积压判断是否空闲。
+        """
+        if not await self.eligible(question, context, queue):
+            return None
+        # inflight 只在事件循环线程里修改，不需要加锁
+        self.inflight += 1
+        started = time.time()
+        try:
+            loop = asyncio.get_running_loop()
+            answer = await loop.run_in_executor(
+                self._executor,
+                lambda: self._run(started, question, user_id, context=context, model=model),
+            )
+            self.inline += 1
+            return answer
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Fast path failed, falling back to celery: {e}")
+            return None
+        finally:
+            self.inflight -= 1
+
+    def stats(self) -> dict:
+        return {
+            "inline": self.inline,
+            "inflight": self.inflight,
+            "errors": self.errors,
+            "skipped": dict(self.skipped),
+            "queue_depth": {queue: depth for queue, (depth, _) in self._depths.items()},
+            "max_workers": self.max_workers,
+            "max_queue_depth": self.max_queue_depth,
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+_fast_path = None
+
+
+def get_fast_path() -> Optional[FastPath]:
+    """进程级单例；fast_path_enabled=false 时返回 None"""
+    global _fast_path
+    if not settings.fast_path_enabled:
+        return None
+    if _fast_path is None:
+        from app.services.llm_services import process_question
+
+        _fast_path = FastPath(
+            process_question,
+            max_workers=settings.fast_path_workers,
+            max_queue_depth=settings.fast_path_max_queue_depth,
+            max_question_chars=settings.fast_path_max_question_chars,
+            max_context_chars=settings.fast_path_max_context_chars,
+            depth_cache_ms=settings.fast_path_depth_cache_ms,
+        )
+    return _fast_path
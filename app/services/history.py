@@ -0,0 +1,103 @@
+# -*- encoding: utf-8 -*-
+'''
+@Time    :   2025/10/25 18:52:09
+@Author  :   47bwy
+@Desc    :   问答历史：按 (created_at, id) 倒序的游标（keyset）分页
+
+不使用 OFFSET：OFFSET 需要扫描并丢弃前面所有的行，越往后翻越慢。游标记录上一页最后一条的 (created_at, id)，
+下一页查询 WHERE user_id = ? AND (created_at, id) < (?, ?) ORDER BY created_at DESC, id DESC LIMIT n，
+在 (user_id, created_at, id) 索引上直接定位，每页耗时与用户的记录总数无关。
+
+include_archive=True 时，热表中的记录读完后用同一个游标继续读取归档（app/services/archive.py）：
+归档的记录都早于热表中的记录，翻页顺序不变。
+'''
+
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select, tuple_
+from sqlalchemy.orm import Session
+
+from app.models.question import Question
+from app.services.archive import archive_history
+
+
+class InvalidCursorError(ValueError):
+    pass
+
+
+def encode_cursor(created_at: datetime, question_id: int) -> str:
+    payload = json.dumps({"t": created_at.isoformat(), "id": question_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return datetime.fromisoformat(payload["t"]), int(payload["id"])
+    except (binascii.Error, ValueError, TypeError, KeyError, AttributeError):
+        raise InvalidCursorError(f"Invalid cursor: {cursor}")
+
+
+def history_query(user_id: str, limit: int, cursor: Optional[str] = None):
+    """一页历史记录的查询，多取一条用于判断是否还有下一页"""
+    stmt = select(Question).where(Question.user_id == user_id)
+    if cursor:
+        created_at, question_id = decode_cursor(cursor)
+        stmt = stmt.where(tuple_(Question.created_at, Question.id) < tuple_(created_at, question_id))
+    return stmt.order_by(Question.created_at.desc(), Question.id.desc()).limit(limit + 1)
+
+
+def history_page(rows, limit: int) -> dict:
+    items = [
+        {
+            "id": row.id,
+            "question": row.question,
+            "answer": row.answer,
+            "created_at": row.created_at.isoformat() if row.created_at else None,
+            "latency_ms": row.latency_ms,
+        }
+        for row in rows[:limit]
+    ]
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = encode_cursor(last.created_at, last.id)
+    return {"items": items, "next_cursor": next_cursor}
+
+
+def _with_archive(rows, user_id: str, limit: int, cursor: Optional[str]) -> list:
+    """热表这一页不满时，从归档中补足（多取一条用于判断是否还有下一页）"""
+    rows = list(rows)
+    if len(rows) > limit:
+        return rows
+    if rows:
+        before = (rows[-1].created_at, rows[-1].id)
+    else:
+        before = decode_cursor(cursor) if cursor else None
+    return rows + archive_history(user_id, limit + 1 - len(rows), before)
+
+
+def get_history(
+    db: Session, user_id: str, limit: int, cursor: Optional[str] = None, include_archive: bool = False
+) -> dict:
+    rows = db.scalars(history_query(user_id, limit, cursor)).all()
+    if include_archive:
+        rows = _with_archive(rows, user_id, limit, cursor)
+    return history_page(rows, limit)
+
+
+async def get_history_async(
+    db, user_id: str, limit: int, cursor: Optional[str] = None, include_archive: bool = False
+) -> dict:
+    """db 可以是 AsyncSession，也可以是同步 Session（在线程池中执行）；读取归档文件在线程池中执行"""
+    if isinstance(db, Session):
+        return await run_in_threadpool(get_history, db, user_id, limit, cursor, include_archive)
+    rows = (await db.scalars(history_query(user_id, limit, cursor))).all()
+    if include_archive:
+        rows = await run_in_threadpool(_with_archive, rows, user_id, limit, cursor)
+    return history_page(rows, limit)
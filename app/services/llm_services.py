@@ -5,13 +5,28 @@
 @Desc    :   LLM 服务，使用 BERT 进行问答
 '''
 
+import gc
 import os
+import threading
+import time
+from typing import List, Optional
+
+import numpy as np
 from sqlalchemy.orm import Session
 
 from app.models.question import Question
+from app.core.cache import LRUCache, content_hash
 from app.core.config import settings
-from app.core.db import SessionLocal
 from app.core.logger import get_logger
+from app.services import model_registry
+from app.services.backends import create_backend
+from app.services.batching import MicroBatcher
+from app.services.model_registry import ModelHandle, ModelRegistry, ModelSpec
+from app.services.model_server import ModelServerClient, ModelServerUnavailable, RemoteBackend
+from app.services.persistence import get_question_writer, question_record, table_rows
+from app.services.reader import best_spans, build_features, extract_answer, select_answers
+from app.services.retrieval import PassageIndex, Retriever
+from app.services.semantic_cache import SemanticCache
 
 logger = get_logger(__name__)
 
@@ -21,7 +36,7 @@ os.environ.setdefault("PYTORCH_CUDA_ALLOC_CONF", "")
 # 延迟导入 torch，避免在导入时立即加载 CUDA
 try:
     import torch
-    from transformers import BertForQuestionAnswering, BertTokenizer
+    from transformers import BertForQuestionAnswering, BertTokenizerFast
     TORCH_AVAILABLE = True
 except ImportError as e:
     logger.error(f"Failed to import PyTorch: {e}")
@@ -33,15 +48,32 @@ except Exception as e:
     os.environ["CUDA_VISIBLE_DEVICES"] = ""
     try:
         import torch
-        from transformers import BertForQuestionAnswering, BertTokenizer
+        from transformers import BertForQuestionAnswering, BertTokenizerFast
         TORCH_AVAILABLE = True
     except Exception:
         TORCH_AVAILABLE = False
 
-# 全局变量，延迟加载模型
-_tokenizer = None
-_model = None
+NO_ANSWER = "无法从给定的上下文中找到答案。"
+
+# 可以在 fork 之前加载、由子进程共享的推理后端；
+# onnxruntime 会话和 torch.compile 的线程/编译进程在 fork 后不可用，仍在子进程内加载
+FORK_SAFE_BACKENDS = ("eager", "torchscript", "int8")
+
+# 全局变量，模型由模型注册表延迟加载
 _device = None
+_context_cache = None
+_batchers = {}
+_batcher_lock = threading.Lock()
+_encoder_lock = threading.Lock()
+_semantic_cache = None
+_semantic_cache_lock = threading.Lock()
+_retriever = None
+_retriever_lock = threading.Lock()
+# 模型服务客户端（配置了 model_server_socket 时使用）
+_model_server = None
+_model_server_down_until = 0.0
+_remote_models = {}
+_remote_lock = threading.Lock()
 
 
 def _get_device():
@@ -76,136 +108,690 @@ def _get_device():
     return _device
 
 
+def _load_eager_model(path: str):
+    """加载 PyTorch 问答模型并移动到设备上"""
+    logger.info(f"Loading model from: {path}")
+    model = BertForQuestionAnswering.from_pretrained(path)
+    device = _get_device()
+    if device:
+        model = model.to(device)
+        logger.info(f"Model loaded successfully on {device}")
+    else:
+        logger.warning("No device available, model may not work correctly")
+    _freeze_module(model)
+    return model
+
+
+def _load_handle(spec: ModelSpec) -> ModelHandle:
+    """模型注册表的加载函数：tokenizer + 推理后端（eager 后端同时保留 PyTorch 模型）"""
+    if not TORCH_AVAILABLE:
+        raise RuntimeError("PyTorch is not available. Please install torch and transformers.")
+
+    if settings.inference_num_threads > 0:
+        torch.set_num_threads(settings.inference_num_threads)
+
+    # Rust 实现的 fast tokenizer：支持整批编码和 offset mapping
+    tokenizer = BertTokenizerFast.from_pretrained(spec.path)
+    loaded = {}
+
+    def load_model():
+        if "model" not in loaded:
+            loaded["model"] = _load_eager_model(spec.path)
+        return loaded["model"]
+
+    logger.info(f"Creating inference backend for {spec.name}: {spec.backend}")
+    backend = create_backend(
+        spec.backend,
+        spec.path,
+        load_model=load_model,
+        num_threads=settings.inference_num_threads,
+    )
+    _freeze_module(getattr(backend, "model", None) or getattr(backend, "module", None))
+    # 只有 eager 后端直接使用 PyTorch 模型；其他后端量化/trace 用过的原始模型不再保留
+    model = loaded.get("model") if spec.backend == "eager" else None
+    return ModelHandle(spec, tokenizer, backend, model=model)
+
+
+def get_registry() -> ModelRegistry:
+    """当前进程的模型注册表"""
+    registry = model_registry.get_registry()
+    if registry.loader is None:
+        registry.loader = _load_handle
+    return registry
+
+
+def _handle_model(handle: ModelHandle):
+    """模型的 PyTorch 版本（文本向量化使用），非 eager 后端第一次使用时加载"""
+    if handle.model is None:
+        with _encoder_lock:
+            if handle.model is None:
+                handle.model = _load_eager_model(handle.spec.path)
+                handle.size_bytes = handle.estimate_size()
+    return handle.model
+
+
+def _load_tokenizer():
+    """默认模型的 tokenizer"""
+    return get_registry().peek().tokenizer
+
+
+def _get_context_cache():
+    """上下文编码缓存：同一篇上下文被反复提问时跳过分词，tokenization_cache_size=0 时关闭"""
+    global _context_cache
+    if _context_cache is None and settings.tokenization_cache_size > 0:
+        _context_cache = LRUCache(maxsize=settings.tokenization_cache_size)
+    return _context_cache
+
+
 def _load_model():
-    """延迟加载模型，避免在模块导入时出错"""
-    global _tokenizer, _model, _device
-    
+    """默认模型的 (tokenizer, PyTorch 模型)"""
     if not TORCH_AVAILABLE:
         raise RuntimeError("PyTorch is not available. Please install torch and transformers.")
-    
-    if _model is not None and _tokenizer is not None:
-        return _tokenizer, _model
-    
+    handle = get_registry().peek()
+    return handle.tokenizer, _handle_model(handle)
+
+
+def _load_backend():
+    """默认模型的 (tokenizer, 推理后端)"""
+    if not TORCH_AVAILABLE:
+        raise RuntimeError("PyTorch is not available. Please install torch and transformers.")
+    handle = get_registry().peek()
+    return handle.tokenizer, handle.backend
+
+
+class _RemoteModel:
+    """模型服务上的一个模型：本进程只加载 tokenizer 和配置，不加载权重"""
+
+    def __init__(self, client: ModelServerClient, spec: ModelSpec):
+        from transformers import BertConfig
+
+        self.spec = spec
+        self.tokenizer = BertTokenizerFast.from_pretrained(spec.path)
+        self.hidden_size = BertConfig.from_pretrained(spec.path).hidden_size
+        self.backend = RemoteBackend(client, spec.name)
+
+
+def _get_model_server() -> Optional[ModelServerClient]:
+    """配置了模型服务且没有处于故障冷却期时返回客户端，否则返回 None（进程内推理）"""
+    global _model_server
+    if not settings.model_server_socket or time.monotonic() < _model_server_down_until:
+        return None
+    if _model_server is None:
+        with _remote_lock:
+            if _model_server is None:
+                _model_server = ModelServerClient(settings.model_server_socket, timeout=settings.model_server_timeout)
+    return _model_server
+
+
+def _model_server_failed(error: Exception):
+    """模型服务不可用：不允许回退时抛出，否则在冷却期内改用进程内推理"""
+    global _model_server_down_until
+    if not settings.model_server_fallback:
+        raise error
+    logger.warning(
+        f"Model server unavailable ({error}), falling back to in-process inference "
+        f"for {settings.model_server_retry_seconds}s"
+    )
+    _model_server_down_until = time.monotonic() + settings.model_server_retry_seconds
+
+
+def _remote_model(client: ModelServerClient, model: Optional[str] = None) -> _RemoteModel:
+    spec = get_registry().spec(model)
+    remote = _remote_models.get(spec)
+    if remote is None:
+        with _remote_lock:
+            remote = _remote_models.get(spec)
+            if remote is None:
+                remote = _remote_models[spec] = _RemoteModel(client, spec)
+    return remote
+
+
+def _run_reader(tokenizer, backend, pairs):
+    """
+    对一批 (question, context) 做一次批量阅读
+
+    长上下文按 reader_max_seq_len / reader_doc_stride 切成重叠窗口，所有样本的所有窗口
+    合并成一批前向推理，再一次性在全部窗口上搜索合法的最佳答案片段。
+
+    Returns:
+        与 pairs 等长的 [(answer, score), ...]，找不到答案时 score 为 None
+    """
+    features = build_features(
+        tokenizer,
+        pairs,
+        max_seq_len=settings.reader_max_seq_len,
+        doc_stride=settings.reader_doc_stride,
+        max_question_len=settings.reader_max_question_len,
+        context_cache=_get_context_cache(),
+    )
+    inputs, context_mask = features.to_tensors(pad_token_id=tokenizer.pad_token_id or 0)
+
+    # 移动输入到正确的设备（只有 PyTorch 模型后端可能在 GPU 上）
+    device = backend.device
+    if device != "cpu":
+        inputs = {k: v.to(device) for k, v in inputs.items()}
+        context_mask = context_mask.to(device)
+
+    # 前向推理；窗口很多时按 reader_max_windows_per_forward 分块以限制注意力矩阵的内存
+    chunk = max(1, settings.reader_max_windows_per_forward)
+    start_logits, end_logits = [], []
+    for i in range(0, features.num_windows, chunk):
+        start, end = backend(**{k: v[i:i + chunk] for k, v in inputs.items()})
+        start_logits.append(start)
+        end_logits.append(end)
+
+    # 所有窗口一次性做片段搜索，再取每个样本的全局最佳
+    scores, starts, ends = best_spans(
+        torch.cat(start_logits),
+        torch.cat(end_logits),
+        context_mask,
+        max_answer_len=settings.reader_max_answer_len,
+    )
+    spans = select_answers(features, scores, starts, ends, len(pairs))
+
+    results = []
+    for example, span in enumerate(spans):
+        answer, score = "", None
+        if span is not None:
+            start_idx, end_idx, score = span
+            answer = extract_answer(tokenizer, features, example, start_idx, end_idx)
+
+        # 如果答案为空，返回提示信息
+        if not answer.strip():
+            answer, score = NO_ANSWER, None
+        results.append((answer, score))
+
+    return results
+
+
+def _read_batch(pairs, model: Optional[str] = None):
+    """
+    使用指定模型回答一批 (question, context)
+
+    配置了模型服务时由模型服务推理（本进程只做分词和答案抽取），不可用时回退到进程内推理。
+    进程内推理期间持有模型引用，模型被热切换时这批请求仍在旧版本上完成。
+
+    Args:
+        pairs: [(question, context), ...]
+        model: 模型名，None 为默认模型
+
+    Returns:
+        与 pairs 等长的 [(answer, score), ...]
+    """
+    client = _get_model_server()
+    if client is not None:
+        try:
+            remote = _remote_model(client, model)
+            return _run_reader(remote.tokenizer, remote.backend, pairs)
+        except ModelServerUnavailable as e:
+            _model_server_failed(e)
+
+    with get_registry().use(model) as handle:
+        return _run_reader(handle.tokenizer, handle.backend, pairs)
+
+
+def _get_batcher(model: Optional[str] = None):
+    """获取当前进程某个模型的批处理器（懒创建，不同模型的请求不会合并到同一批）"""
+    name = get_registry().resolve(model)
+    batcher = _batchers.get(name)
+    if batcher is None:
+        with _batcher_lock:
+            batcher = _batchers.get(name)
+            if batcher is None:
+                batcher = MicroBatcher(
+                    lambda pairs: _read_batch(pairs, model=name),
+                    max_batch_size=settings.batch_max_size,
+                    max_wait_ms=settings.batch_max_wait_ms,
+                    name=f"qa-batcher-{name}",
+                )
+                _batchers[name] = batcher
+    return batcher
+
+
+def get_batch_stats(model: Optional[str] = None) -> dict:
+    """
+    当前进程各模型的批处理统计（批大小分布、排队等待 / 前向耗时 p50/p95/p99），用于调整 batch_max_size / batch_max_wait_ms
+
+    model 为 None 时返回所有已创建的批处理器；还没有请求进入批处理时为空。
+    """
+    with _batcher_lock:
+        batchers = dict(_batchers)
+    if model is not None:
+        batchers = {name: batcher for name, batcher in batchers.items() if name == model}
+    return {name: batcher.stats.snapshot() for name, batcher in batchers.items()}
+
+
+def get_answer_with_score(question: str, context: str, model: Optional[str] = None):
+    """
+    使用 BERT 模型回答问题，同时返回答案片段的得分
+
+    开启 batch_enabled 时，请求会进入微批处理队列，与同一时间窗口内的
+    其他请求合并成一次前向推理。
+
+    Returns:
+        (answer, score)，找不到答案时 score 为 None
+    """
+    if not TORCH_AVAILABLE:
+        raise RuntimeError("PyTorch is not available. Cannot generate answer.")
+
     try:
-        model_name = settings.local_model if settings.local_model else "bert-base-chinese"
-        logger.info(f"Loading model from: {model_name}")
-        
-        # 加载 tokenizer 和模型
-        _tokenizer = BertTokenizer.from_pretrained(model_name)
-        _model = BertForQuestionAnswering.from_pretrained(model_name)
-        
-        # 获取设备并移动模型
-        _device = _get_device()
-        if _device:
-            _model = _model.to(_device)
-            logger.info(f"Model loaded successfully on {_device}")
-        else:
-            logger.warning("No device available, model may not work correctly")
-            
+        if settings.batch_enabled:
+            return _get_batcher(model).submit((question, context)).result()
+        return _read_batch([(question, context)], model=model)[0]
+
     except Exception as e:
-        logger.error(f"Error loading model: {e}")
+        logger.error(f"Error generating answer: {e}")
         raise
-    
-    return _tokenizer, _model
+
+
+def get_best_answer(question: str, passages, model: Optional[str] = None):
+    """
+    在多个段落中找答案：所有段落作为一批同时阅读，返回得分最高的答案
+
+    开启批处理时各段落分别进入批处理队列，会与其他请求合并成同一次前向推理。
+    """
+    if not TORCH_AVAILABLE:
+        raise RuntimeError("PyTorch is not available. Cannot generate answer.")
+
+    pairs = [(question, passage) for passage in passages]
+    if settings.batch_enabled:
+        batcher = _get_batcher(model)
+        futures = [batcher.submit(pair) for pair in pairs]
+        results = [future.result() for future in futures]
+    else:
+        results = _read_batch(pairs, model=model)
+    return _pick_best(results)
+
+
+def _pick_best(results):
+    """(answer, score) 列表中得分最高的答案，全部无答案时返回 NO_ANSWER"""
+    scored = [(score, answer) for answer, score in results if score is not None]
+    if not scored:
+        return NO_ANSWER
+    return max(scored, key=lambda item: item[0])[1]
+
 
 # 问答服务
-def get_answer(question: str, context: str):
+def get_answer(question: str, context: str, model: Optional[str] = None):
     """
     使用 BERT 模型回答问题
     
     Args:
         question: 问题文本
-        context: 上下文文本
+        context: 上下文文本，长度不受 BERT 512 token 限制
+        model: 模型名，None 为默认模型
         
     Returns:
         答案文本
     """
-    if not TORCH_AVAILABLE:
-        raise RuntimeError("PyTorch is not available. Cannot generate answer.")
-    
-    try:
-        # 延迟加载模型
-        tokenizer, model = _load_model()
-        device = _get_device()
-        
-        # 将问题和上下文编码为模型可以接受的格式
-        inputs = tokenizer(question, context, return_tensors="pt")
-        
-        # 移动输入到正确的设备（inputs 是字典，需要转换为 Tensor）
+    answer, _ = get_answer_with_score(question, context, model=model)
+    return answer
+
+def _encode(encoder, inputs) -> np.ndarray:
+    """BERT 编码器最后一层做 mean pooling 后 L2 归一化，inputs 为张量字典"""
+    with torch.no_grad():
+        hidden = encoder(**inputs).last_hidden_state
+    mask = inputs["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+    pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+    return torch.nn.functional.normalize(pooled, dim=1).cpu().numpy()
+
+
+def embed_texts(texts, batch_size: int = 32):
+    """
+    文本向量化：BERT 编码器最后一层做 mean pooling 后 L2 归一化
+
+    使用默认模型的 BERT 编码器，内积即余弦相似度。
+    默认模型切换到新版本后向量随之变化，段落检索索引需要重新构建。
+    配置了模型服务时由模型服务编码。
+
+    Returns:
+        np.ndarray，形状 [len(texts), hidden_size]，float32
+    """
+    client = _get_model_server()
+    if client is not None:
+        try:
+            return _embed_remote(_remote_model(client), texts, batch_size)
+        except ModelServerUnavailable as e:
+            _model_server_failed(e)
+
+    tokenizer, model = _load_model()
+    device = _get_device()
+    encoder = getattr(model, "bert", model)
+
+    vectors = []
+    for i in range(0, len(texts), batch_size):
+        inputs = tokenizer(
+            list(texts[i:i + batch_size]),
+            padding=True,
+            truncation=True,
+            max_length=settings.embedding_max_len,
+            return_tensors="pt",
+        )
         if device:
             inputs = {k: v.to(device) for k, v in inputs.items()}
-        
-        # 使用模型进行推理
-        import torch
-        with torch.no_grad():
-            outputs = model(**inputs)
-        
-        # 获取答案的位置
-        start_scores, end_scores = outputs.start_logits, outputs.end_logits
-        
-        # 找到开始和结束位置（获取第一个 batch 的结果）
-        start_idx = torch.argmax(start_scores[0]).item()  # 转换为 Python int
-        end_idx = torch.argmax(end_scores[0]).item()  # 转换为 Python int
-        
-        # 确保索引有效
-        input_ids = inputs['input_ids'][0]  # 获取 input_ids tensor
-        max_len = input_ids.shape[0]
-        
-        # 确保 end_idx >= start_idx 且都在有效范围内
-        if start_idx > end_idx:
-            start_idx, end_idx = end_idx, start_idx
-        
-        start_idx = max(0, min(start_idx, max_len - 1))
-        end_idx = max(start_idx, min(end_idx, max_len - 1))
-        
-        # 提取答案 token
-        answer_tokens = input_ids[start_idx:end_idx + 1]
-        
-        # 解码答案
-        answer = tokenizer.decode(answer_tokens, skip_special_tokens=True)
-        
-        # 如果答案为空，返回提示信息
-        if not answer.strip():
-            answer = "无法从给定的上下文中找到答案。"
-        
-        return answer
-        
-    except Exception as e:
-        logger.error(f"Error generating answer: {e}")
-        raise
+        vectors.append(_encode(encoder, inputs))
+    if not vectors:
+        return np.zeros((0, encoder.config.hidden_size), dtype="float32")
+    return np.concatenate(vectors).astype("float32")
+
+
+def _embed_remote(remote: "_RemoteModel", texts, batch_size: int):
+    vectors = []
+    for i in range(0, len(texts), batch_size):
+        inputs = remote.tokenizer(
+            list(texts[i:i + batch_size]),
+            padding=True,
+            truncation=True,
+            max_length=settings.embedding_max_len,
+            return_token_type_ids=True,
+            return_tensors="np",
+        )
+        vectors.append(remote.backend.embed(
+            inputs["input_ids"], inputs["attention_mask"], inputs["token_type_ids"], remote.hidden_size
+        ))
+    if not vectors:
+        return np.zeros((0, remote.hidden_size), dtype="float32")
+    return np.concatenate(vectors).astype("float32")
+
+
+def _embedding_dim() -> int:
+    client = _get_model_server()
+    if client is not None:
+        return _remote_model(client).hidden_size
+    _, model = _load_model()
+    return model.config.hidden_size
+
+
+def get_semantic_cache():
+    """当前进程的语义缓存（懒创建并从磁盘恢复），semantic_cache_enabled=false 时返回 None"""
+    global _semantic_cache
+    if not settings.semantic_cache_enabled:
+        return None
+    if _semantic_cache is None:
+        with _semantic_cache_lock:
+            if _semantic_cache is None:
+                cache = SemanticCache(
+                    dim=_embedding_dim(),
+                    threshold=settings.semantic_cache_threshold,
+                    capacity=settings.semantic_cache_capacity,
+                    policy=settings.semantic_cache_policy,
+                    persist_dir=settings.semantic_cache_dir,
+                    persist_interval=settings.semantic_cache_persist_interval,
+                    fingerprint=model_registry.model_version(),
+                )
+                cache.load()
+                _semantic_cache = cache
+    return _semantic_cache
+
+
+def get_retriever():
+    """当前进程的段落检索器（懒创建，索引在第一次检索时加载），retrieval_enabled=false 时返回 None"""
+    global _retriever
+    if not settings.retrieval_enabled:
+        return None
+    if _retriever is None:
+        with _retriever_lock:
+            if _retriever is None:
+                index = PassageIndex(
+                    settings.retrieval_index_dir,
+                    kind=settings.retrieval_index_type,
+                    nlist=settings.retrieval_nlist,
+                    nprobe=settings.retrieval_nprobe,
+                    hnsw_m=settings.retrieval_hnsw_m,
+                    ef_search=settings.retrieval_ef_search,
+                    mmap=settings.retrieval_mmap,
+                    lexical=settings.retrieval_hybrid,
+                )
+                _retriever = Retriever(
+                    index,
+                    embed=embed_texts,
+                    top_k=settings.retrieval_top_k,
+                    hybrid=settings.retrieval_hybrid,
+                    candidates=settings.retrieval_candidates,
+                    rrf_k=settings.retrieval_rrf_k,
+                )
+    return _retriever
+
+
+def persist_caches():
+    """把需要落盘的缓存写到磁盘（worker 退出时调用）"""
+    if _semantic_cache is not None:
+        try:
+            _semantic_cache.save()
+        except Exception as e:
+            logger.warning(f"Failed to save semantic cache: {e}")
+
+
+def _freeze_module(module):
+    """推理模式 + 参数只读：关闭梯度，避免 autograd 在权重张量上记录状态"""
+    if module is None or not hasattr(module, "parameters"):
+        return
+    if isinstance(module, torch.jit.ScriptModule):
+        # trace 出的模块已经是推理模式，且不支持 requires_grad_
+        return
+    module.eval()
+    module.requires_grad_(False)
+
+
+def preload(warmup: bool = True, freeze: bool = True):
+    """
+    在 Celery 父进程（fork 之前）加载并预热模型，prefork 子进程以写时复制方式共享权重
+
+    - 只预加载默认模型，且只在其后端属于 FORK_SAFE_BACKENDS 时加载，其他情况照常在子进程首次请求时加载
+    - 预热时临时把 torch 线程数设为 1，父进程不创建 OpenMP 线程池（fork 后的子进程无法复用）
+    - 最后 gc.freeze()：已加载的对象移出 GC 跟踪，子进程的垃圾回收不再改写这些对象所在的内存页
+
+    Returns:
+        耗时（秒）
+    """
+    started = time.time()
+    # Rust tokenizer 的线程池在 fork 后同样不可用
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+
+    if settings.model_server_socket:
+        logger.info(f"Models are served by the model server at {settings.model_server_socket}, skip preloading")
+        return 0.0
+
+    need_encoder = settings.semantic_cache_enabled or settings.retrieval_enabled
+    registry = get_registry()
+    kind = registry.spec().backend
+    if kind not in FORK_SAFE_BACKENDS:
+        logger.info(f"Backend {kind} is not fork-safe, it will be loaded in each child process")
+        return 0.0
+
+    threads = torch.get_num_threads()
+    try:
+        # 只预加载默认模型，其他模型在子进程中第一次被请求时加载
+        handle = registry.peek()
+        if need_encoder:
+            _handle_model(handle)
+
+        # _load_handle 会按 inference_num_threads 设置线程数，预热前再改回单线程
+        torch.set_num_threads(1)
+        if warmup:
+            with torch.inference_mode():
+                _run_reader(handle.tokenizer, handle.backend, [("预热", "模型预热")])
+                if need_encoder:
+                    embed_texts(["模型预热"])
+    finally:
+        torch.set_num_threads(threads)
+
+    if freeze:
+        gc.collect()
+        gc.freeze()
+    elapsed = time.time() - started
+    logger.info(f"Model preloaded in parent process {os.getpid()} ({kind}) in {elapsed:.1f}s")
+    return elapsed
+
+
+def model_loaded() -> bool:
+    """当前进程是否已加载了任一模型（使用模型服务时，已连接上的远程模型也算）"""
+    if _remote_models:
+        return True
+    return model_registry._registry is not None and model_registry._registry.any_loaded()
+
+
+def after_fork():
+    """prefork 子进程启动时调用：设置推理线程数（子进程不会继承父进程设置的线程池）"""
+    if not TORCH_AVAILABLE:
+        return
+    if settings.inference_num_threads > 0:
+        torch.set_num_threads(settings.inference_num_threads)
+
 
 # 提供问题答案
-def process_question(question: str, user_id: str, db: Session = SessionLocal()):
+def process_question(
+    question: str,
+    user_id: str,
+    db: Optional[Session] = None,
+    context: Optional[str] = None,
+    model: Optional[str] = None,
+):
     """
     处理问题并返回答案，同时保存到数据库
     
     Args:
         question: 问题文本
         user_id: 用户 ID
-        db: 数据库会话
+        db: 数据库会话；提供时用它同步写入，不提供时交给异步批量写库（见 app/services/persistence.py）
+        context: 请求中携带的上下文，不提供时从段落索引中检索
+        model: 模型名，None 为默认模型
         
     Returns:
         答案文本
     """
     try:
-        # 获取上下文信息（可以从数据库或固定文本中获取）
-        context = " "  # 你可以替换为从数据库或文档中提取的上下文
-        
-        # 获取答案
-        answer = get_answer(question, context)
+        started = time.perf_counter()
+        semantic_cache = get_semantic_cache()
+        retriever = get_retriever() if context is None else None
+        if retriever is not None and not retriever.available():
+            retriever = None
+
+        # 问题向量：语义缓存和段落检索共用
+        embedding = None
+        if semantic_cache is not None or retriever is not None:
+            embedding = embed_texts([question])[0]
+
+        # 获取上下文信息：请求未携带上下文时从段落索引中检索
+        passages = [context] if context is not None else []
+        if retriever is not None:
+            passages = [p["text"] for p in retriever.retrieve(question, embedding=embedding)]
+            logger.info(f"Retrieved {len(passages)} passages for question: {question}")
+        if not passages:
+            passages = [" "]  # 没有可用的上下文（索引尚未建立）
+
+        # 获取答案：先查语义缓存（近似问题 + 相同上下文 + 相同模型版本）
+        context_key = content_hash("\0".join([model_registry.model_version(model)] + passages))
+        answer = None
+        if semantic_cache is not None:
+            answer = semantic_cache.lookup(embedding, context_hash=context_key)
+            if answer is not None:
+                logger.info(f"Semantic cache hit for question: {question}")
+
+        if answer is None:
+            answer = get_best_answer(question, passages, model=model)
+            if semantic_cache is not None and answer != NO_ANSWER:
+                semantic_cache.add(question, embedding, answer, context_hash=context_key)
         
-        # 记录问题与回答到数据库（可选）
-        try:
-            question_record = Question(question=question, answer=answer, user_id=user_id)
-            db.add(question_record)
-            db.commit()
-            logger.info(f"Question saved to database for user: {user_id}")
-        except Exception as db_error:
-            logger.warning(f"Failed to save question to database: {db_error}")
-            # 即使数据库保存失败，也返回答案
+        # 记录问题与回答到数据库（即使保存失败也返回答案）
+        latency_ms = round((time.perf_counter() - started) * 1000, 3)
+        save_questions([question_record(question, answer, user_id, latency_ms=latency_ms)], db=db)
         
         return answer
         
     except Exception as e:
         logger.error(f"Error processing question: {e}")
         raise
+
+
+def process_questions(items: List[dict], user_id: str, db: Optional[Session] = None) -> List[str]:
+    """
+    批量处理问题：整批问题一次向量化，同一模型的所有 (问题, 段落) 合并成一次批量阅读，结果一次提交到数据库
+
+    Args:
+        items: 问题列表，每项为 {"question": ..., "context": ..., "model": ...}（context / model 可省略）
+        user_id: 用户 ID
+        db: 数据库会话；提供时用它同步写入，不提供时交给异步批量写库
+
+    Returns:
+        与 items 顺序一致的答案列表
+    """
+    if not items:
+        return []
+    started = time.perf_counter()
+    questions = [item["question"] for item in items]
+    contexts = [item.get("context") for item in items]
+    models = [item.get("model") for item in items]
+
+    semantic_cache = get_semantic_cache()
+    retriever = get_retriever() if any(context is None for context in contexts) else None
+    if retriever is not None and not retriever.available():
+        retriever = None
+
+    # 问题向量：整批一次编码，语义缓存和段落检索共用
+    embeddings = [None] * len(items)
+    need_embedding = [
+        i for i, context in enumerate(contexts)
+        if semantic_cache is not None or (retriever is not None and context is None)
+    ]
+    if need_embedding:
+        vectors = embed_texts([questions[i] for i in need_embedding])
+        for i, vector in zip(need_embedding, vectors):
+            embeddings[i] = vector
+
+    answers = [None] * len(items)
+    context_keys = [None] * len(items)
+    # 按模型分组：{model: [(问题序号, 问题, 段落), ...]}
+    pending = {}
+    for i, (question, context, model) in enumerate(zip(questions, contexts, models)):
+        passages = [context] if context is not None else []
+        if context is None and retriever is not None:
+            passages = [p["text"] for p in retriever.retrieve(question, embedding=embeddings[i])]
+        if not passages:
+            passages = [" "]  # 没有可用的上下文（索引尚未建立）
+
+        context_keys[i] = content_hash("\0".join([model_registry.model_version(model)] + passages))
+        if semantic_cache is not None:
+            answers[i] = semantic_cache.lookup(embeddings[i], context_hash=context_keys[i])
+            if answers[i] is not None:
+                continue
+        pending.setdefault(model, []).extend((i, question, passage) for passage in passages)
+
+    # 每个模型一次批量阅读（_read_batch 内部按 reader_max_windows_per_forward 切分前向推理）
+    for model, entries in pending.items():
+        results = _read_batch([(question, passage) for _, question, passage in entries], model=model)
+        grouped = {}
+        for (i, _, _), result in zip(entries, results):
+            grouped.setdefault(i, []).append(result)
+        for i, item_results in grouped.items():
+            answers[i] = _pick_best(item_results)
+            if semantic_cache is not None and answers[i] != NO_ANSWER:
+                semantic_cache.add(questions[i], embeddings[i], answers[i], context_hash=context_keys[i])
+    logger.info(f"Answered {len(items)} questions in batch for user: {user_id}")
+
+    # 整批问题一次交给数据库写入
+    latency_ms = round((time.perf_counter() - started) * 1000, 3)
+    records = [question_record(q, answer, user_id, latency_ms=latency_ms) for q, answer in zip(questions, answers)]
+    save_questions(records, db=db)
+    return answers
+
+
+def save_questions(records: List[dict], db: Optional[Session] = None) -> bool:
+    """
+    保存问答记录（persistence.question_record 生成），保存失败只记录日志
+
+    提供 db 时用该会话同步写入并提交；否则交给进程内的异步批量写库，不在任务关键路径上 commit。
+    """
+    if not records:
+        return True
+    if db is None:
+        get_question_writer().submit_many(records)
+        return True
+    try:
+        db.add_all([Question(**row) for row in table_rows(records)])
+        db.commit()
+        return True
+    except Exception as db_error:
+        db.rollback()
+        logger.warning(f"Failed to save {len(records)} questions to database: {db_error}")
+        return False
@@ -0,0 +1,476 @@
+# -*- encoding: utf-8 -*-
+'''
+@Time    :   2025/10/22 10:12:36
+@Author  :   47bwy
+@Desc    :   模型注册表：多个命名模型按需加载、内存预算内 LRU 淘汰、原子热切换
+'''
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional
+
+import redis
+
+from app.core.config import settings
+from app.core.logger import get_logger
+
+logger = get_logger(__name__)
+
+# 运行时覆盖的模型配置（Redis hash：模型名 -> {"path": ..., "backend": ...}），所有进程定期读取
+SPEC_KEY = "qa:models"
+
+MB = 1024 * 1024
+
+# 参与模型指纹计算的文件：内容变化（mtime/size）即视为换了模型
+FINGERPRINT_FILES = ("config.json", "model.safetensors", "pytorch_model.bin", "vocab.txt")
+FINGERPRINT_REFRESH_SECONDS = 30
+
+
+class UnknownModelError(ValueError):
+    """请求了未注册的模型"""
+
+
+def model_fingerprint(model_dir: Optional[str] = None, backend: Optional[str] = None) -> str:
+    """
+    模型指纹：模型路径 + 推理后端 + 权重文件的 mtime/size
+
+    替换 settings.local_model 下的模型文件后指纹随之变化，旧缓存自动失效。
+    """
+    model_dir = model_dir or settings.local_model
+    backend = backend or settings.inference_backend
+    parts = [os.path.abspath(model_dir) if os.path.exists(model_dir) else model_dir, backend]
+    for name in FINGERPRINT_FILES:
+        path = os.path.join(model_dir, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        parts.append(f"{name}:{stat.st_mtime_ns}:{stat.st_size}")
+    return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()[:12]
+
+
+@dataclass(frozen=True)
+class ModelSpec:
+    name: str
+    path: str
+    backend: str = "eager"
+
+    def to_dict(self) -> dict:
+        return {"path": self.path, "backend": self.backend}
+
+
+def parse_model_specs(text: str, default_name: str, default_path: str, default_backend: str) -> Dict[str, ModelSpec]:
+    """
+    解析模型配置：逗号分隔的 name=path 或 name=path@backend
+
+    默认模型（default_name）总是存在，取 local_model / inference_backend，也可以在配置里覆盖。
+    """
+    specs = {default_name: ModelSpec(default_name, default_path, default_backend)}
+    for item in (text or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        if "=" not in item:
+            raise ValueError(f"Invalid model spec {item!r}, expected name=path[@backend]")
+        name, path = (part.strip() for part in item.split("=", 1))
+        backend = default_backend
+        if "@" in path:
+            path, backend = (part.strip() for part in path.rsplit("@", 1))
+        specs[name] = ModelSpec(name, path, backend)
+    return specs
+
+
+def _iter_tensors(value):
+    if hasattr(value, "numel") and hasattr(value, "element_size"):
+        yield value
+    elif isinstance(value, (tuple, list)):
+        for item in value:
+            yield from _iter_tensors(item)
+
+
+def module_nbytes(module) -> int:
+    """torch 模块的权重占用的字节数（按 state_dict 统计，包含量化后的权重；非 torch 对象返回 0）"""
+    if module is None or not hasattr(module, "state_dict"):
+        return 0
+    seen, total = set(), 0
+    for value in module.state_dict().values():
+        for tensor in _iter_tensors(value):
+            if tensor.is_quantized:
+                nbytes = tensor.int_repr().numel() * tensor.element_size()
+            else:
+                nbytes = tensor.numel() * tensor.element_size()
+            key = (tensor.data_ptr(), nbytes) if not tensor.is_quantized else id(tensor)
+            if key in seen:
+                continue
+            seen.add(key)
+            total += nbytes
+    if total == 0 and hasattr(module, "_c"):
+        # 量化后 trace 的 ScriptModule 把权重打包在属性里，state_dict 为空，按序列化大小估算
+        import io
+
+        import torch
+
+        buffer = io.BytesIO()
+        torch.jit.save(module, buffer)
+        total = buffer.tell()
+    return total
+
+
+class ModelHandle:
+    """
+    一个已加载的模型版本
+
+    refs 为正在使用它的请求数；被热切换替换（retired）后等最后一个请求释放时才真正卸载。
+    """
+
+    def __init__(self, spec: ModelSpec, tokenizer, backend, model=None, size_bytes: Optional[int] = None):
+        self.spec = spec
+        self.tokenizer = tokenizer
+        self.backend = backend
+        self.model = model
+        self.version = model_fingerprint(spec.path, spec.backend)
+        self.size_bytes = size_bytes if size_bytes is not None else self.estimate_size()
+        self.refs = 0
+        self.retired = False
+        self.loaded_at = time.time()
+        self.last_used = time.monotonic()
+
+    @property
+    def name(self) -> str:
+        return self.spec.name
+
+    def estimate_size(self) -> int:
+        backend_module = getattr(self.backend, "model", None) or getattr(self.backend, "module", None)
+        size = module_nbytes(self.model)
+        if backend_module is not self.model:
+            size += module_nbytes(backend_module)
+        return size
+
+    def describe(self) -> dict:
+        return {
+            "path": self.spec.path,
+            "backend": self.spec.backend,
+            "version": self.version,
+            "size_mb": round(self.size_bytes / MB, 1),
+            "refs": self.refs,
+            "retired": self.retired,
+        }
+
+
+class ModelRegistry:
+    """
+    进程内模型注册表
+
+    - 模型第一次被请求时加载（同一模型并发请求只加载一次）
+    - 已加载模型的总大小超过 budget_mb 时，按最久未使用淘汰没有请求在用的模型
+    - swap() 在锁外加载新版本，加载完成后在锁内替换，之后的请求使用新版本，
+      正在进行的请求继续使用旧版本直到结束
+    - spec_source 返回运行时覆盖的模型配置，每 refresh_seconds 秒检查一次，
+      已加载模型的配置变化时自动热切换（用于让所有 worker 进程切到新版本）
+    """
+
+    def __init__(
+        self,
+        specs: Dict[str, ModelSpec],
+        default: str,
+        loader: Optional[Callable[[ModelSpec], ModelHandle]] = None,
+        budget_mb: float = 0,
+        spec_source: Optional[Callable[[], Optional[Dict[str, ModelSpec]]]] = None,
+        refresh_seconds: float = FINGERPRINT_REFRESH_SECONDS,
+    ):
+        if default not in specs:
+            raise ValueError(f"Default model {default!r} is not in the model specs")
+        self.loader = loader
+        self.default = default
+        self.budget_mb = budget_mb
+        self.spec_source = spec_source
+        self.refresh_seconds = refresh_seconds
+        self._base_specs = dict(specs)
+        self._specs = dict(specs)
+        self._loaded: "OrderedDict[str, ModelHandle]" = OrderedDict()
+        self._retired = []
+        self._versions = {}
+        self._lock = threading.RLock()
+        self._load_locks: Dict[str, threading.Lock] = {}
+        self._last_refresh = 0.0
+
+        self.loads = 0
+        self.evictions = 0
+        self.swaps = 0
+
+    # ---- 配置 ----
+
+    def names(self):
+        self.maybe_refresh()
+        return list(self._specs)
+
+    def resolve(self, name: Optional[str] = None) -> str:
+        name = name or self.default
+        if name not in self._specs:
+            self.maybe_refresh()
+            if name not in self._specs:
+                raise UnknownModelError(f"Unknown model: {name}")
+        return name
+
+    def spec(self, name: Optional[str] = None) -> ModelSpec:
+        return self._specs[self.resolve(name)]
+
+    def version(self, name: Optional[str] = None) -> str:
+        """模型当前配置的版本指纹（路径 + 后端 + 权重文件 mtime/size），不需要加载模型"""
+        self.maybe_refresh()
+        spec = self.spec(name)
+        now = time.monotonic()
+        cached = self._versions.get(spec)
+        if cached is None or now - cached[1] >= self.refresh_seconds:
+            cached = (model_fingerprint(spec.path, spec.backend), now)
+            self._versions[spec] = cached
+        return cached[0]
+
+    def maybe_refresh(self, force: bool = False):
+        """读取运行时覆盖的配置；已加载模型的配置变化时热切换"""
+        if self.spec_source is None:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_refresh < self.refresh_seconds:
+            return
+        self._last_refresh = now
+        overrides = self.spec_source()
+        if overrides is None:
+            return
+        specs = dict(self._base_specs)
+        specs.update(overrides)
+        changed = []
+        with self._lock:
+            for name, spec in specs.items():
+                if self._specs.get(name) != spec and name in self._loaded:
+                    changed.append(spec)
+            # 被删除的覆盖配置回到启动时的配置；不在任何配置里的已加载模型保留到被淘汰
+            self._specs = specs
+        for spec in changed:
+            logger.info(f"Model {spec.name} changed to {spec.path}@{spec.backend}, hot-swapping")
+            try:
+                self.swap(spec.name, spec)
+            except Exception as e:
+                logger.error(f"Failed to hot-swap model {spec.name}: {e}")
+
+    # ---- 加载与使用 ----
+
+    def _load_lock(self, name: str) -> threading.Lock:
+        with self._lock:
+            return self._load_locks.setdefault(name, threading.Lock())
+
+    def _load(self, spec: ModelSpec) -> ModelHandle:
+        if self.loader is None:
+            raise RuntimeError("Model registry has no loader configured")
+        started = time.time()
+        handle = self.loader(spec)
+        self.loads += 1
+        logger.info(
+            f"Model {spec.name} loaded from {spec.path} ({spec.backend}, "
+            f"{handle.size_bytes / MB:.0f} MB) in {time.time() - started:.1f}s"
+        )
+        return handle
+
+    def acquire(self, name: Optional[str] = None) -> ModelHandle:
+        """取得模型并增加引用计数，用完必须 release（推荐用 use()）"""
+        self.maybe_refresh()
+        name = self.resolve(name)
+        with self._lock:
+            handle = self._loaded.get(name)
+            if handle is not None:
+                return self._checkout(handle)
+
+        with self._load_lock(name):
+            with self._lock:
+                handle = self._loaded.get(name)
+                if handle is not None:
+                    return self._checkout(handle)
+                spec = self._specs[name]
+            handle = self._load(spec)
+            with self._lock:
+                self._loaded[name] = handle
+                self._checkout(handle)
+                self._enforce_budget()
+            return handle
+
+    def _checkout(self, handle: ModelHandle) -> ModelHandle:
+        handle.refs += 1
+        handle.last_used = time.monotonic()
+        self._loaded.move_to_end(handle.name)
+        return handle
+
+    def release(self, handle: ModelHandle):
+        with self._lock:
+            handle.refs -= 1
+            if handle.refs > 0:
+                return
+            if handle.retired and handle in self._retired:
+                self._retired.remove(handle)
+                logger.info(f"Retired model {handle.name} version {handle.version} unloaded")
+            # 之前因为都在使用而没能淘汰的模型，现在可能可以淘汰了
+            self._enforce_budget(keep=handle.name)
+
+    @contextmanager
+    def use(self, name: Optional[str] = None):
+        handle = self.acquire(name)
+        try:
+            yield handle
+        finally:
+            self.release(handle)
+
+    def peek(self, name: Optional[str] = None) -> ModelHandle:
+        """取得模型但不持有引用（进程内只读使用，如预热、导出工具）"""
+        handle = self.acquire(name)
+        self.release(handle)
+        return handle
+
+    def is_loaded(self, name: Optional[str] = None) -> bool:
+        return (name or self.default) in self._loaded
+
+    def any_loaded(self) -> bool:
+        return bool(self._loaded)
+
+    # ---- 热切换与淘汰 ----
+
+    def swap(self, name: str, spec: Optional[ModelSpec] = None) -> ModelHandle:
+        """
+        原子热切换到新版本
+
+        新版本在锁外加载（期间旧版本照常服务），加载完成后一次替换；
+        旧版本标记为 retired，正在使用它的请求结束后卸载。
+        """
+        with self._load_lock(name):
+            spec = spec or self._specs.get(name)
+            if spec is None:
+                raise UnknownModelError(f"Unknown model: {name}")
+            handle = self._load(spec)
+            with self._lock:
+                self._specs[name] = spec
+                old = self._loaded.pop(name, None)
+                self._loaded[name] = handle
+                if old is not None:
+                    self._retire(old)
+                self.swaps += 1
+                self._enforce_budget(keep=name)
+        logger.info(f"Model {name} hot-swapped to version {handle.version}")
+        return handle
+
+    def _retire(self, handle: ModelHandle):
+        handle.retired = True
+        if handle.refs > 0:
+            self._retired.append(handle)
+
+    def unload(self, name: str) -> bool:
+        with self._lock:
+            handle = self._loaded.pop(name, None)
+            if handle is None:
+                return False
+            self._retire(handle)
+        logger.info(f"Model {name} unloaded")
+        return True
+
+    def loaded_bytes(self) -> int:
+        with self._lock:
+            return sum(h.size_bytes for h in self._loaded.values()) + sum(h.size_bytes for h in self._retired)
+
+    def _enforce_budget(self, keep: Optional[str] = None):
+        """超出内存预算时按 LRU 淘汰没有请求在用的模型，默认模型常驻不淘汰（调用方持有 _lock）"""
+        if self.budget_mb <= 0:
+            return
+        budget = self.budget_mb * MB
+        while self.loaded_bytes() > budget:
+            victim = next(
+                (h for n, h in self._loaded.items() if h.refs == 0 and n != keep and n != self.default),
+                None,
+            )
+            if victim is None:
+                logger.warning(
+                    f"Model memory {self.loaded_bytes() / MB:.0f} MB exceeds budget {self.budget_mb} MB, "
+                    f"but every evictable model is in use"
+                )
+                return
+            del self._loaded[victim.name]
+            victim.retired = True
+            self.evictions += 1
+            logger.info(f"Evicted model {victim.name} ({victim.size_bytes / MB:.0f} MB) to stay within memory budget")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "default": self.default,
+                "budget_mb": self.budget_mb,
+                "loaded_mb": round(self.loaded_bytes() / MB, 1),
+                "models": {name: spec.to_dict() for name, spec in self._specs.items()},
+                "loaded": {name: handle.describe() for name, handle in self._loaded.items()},
+                "retired": [handle.describe() for handle in self._retired],
+                "loads": self.loads,
+                "evictions": self.evictions,
+                "swaps": self.swaps,
+            }
+
+
+# ---- 运行时模型配置（Redis） ----
+
+def _spec_client():
+    return redis.Redis.from_url(
+        settings.cache_url, decode_responses=True, socket_connect_timeout=0.5, socket_timeout=0.5
+    )
+
+
+def load_spec_overrides(client=None) -> Optional[Dict[str, ModelSpec]]:
+    """读取 Redis 中覆盖的模型配置；Redis 不可用时返回 None（保持当前配置）"""
+    try:
+        data = (client or _spec_client()).hgetall(SPEC_KEY)
+    except redis.RedisError as e:
+        logger.debug(f"Failed to read model specs from redis: {e}")
+        return None
+    specs = {}
+    for name, raw in data.items():
+        try:
+            item = json.loads(raw)
+            specs[name] = ModelSpec(name, item["path"], item.get("backend", settings.inference_backend))
+        except (ValueError, KeyError) as e:
+            logger.warning(f"Ignoring invalid model spec {name}: {e}")
+    return specs
+
+
+def publish_spec(spec: ModelSpec, client=None):
+    """发布模型配置，所有进程在 model_registry_refresh_seconds 内切换到新版本"""
+    (client or _spec_client()).hset(SPEC_KEY, spec.name, json.dumps(spec.to_dict()))
+
+
+def remove_spec(name: str, client=None):
+    (client or _spec_client()).hdel(SPEC_KEY, name)
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> ModelRegistry:
+    """进程级单例；加载函数由推理模块设置（见 llm_services.get_registry）"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = ModelRegistry(
+                    parse_model_specs(
+                        settings.qa_models, settings.default_model, settings.local_model, settings.inference_backend
+                    ),
+                    default=settings.default_model,
+                    budget_mb=settings.model_memory_budget_mb,
+                    spec_source=load_spec_overrides,
+                    refresh_seconds=settings.model_registry_refresh_seconds,
+                )
+    return _registry
+
+
+def model_version(name: Optional[str] = None) -> str:
+    """模型当前版本指纹（答案缓存 key 的一部分）"""
+    return get_registry().version(name)
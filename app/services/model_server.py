@@ -0,0 +1,457 @@
+# -*- encoding: utf-8 -*-
+'''
+@Time    :   2025/10/22 16:40:17
+@Author  :   47bwy
+@Desc    :   独立模型服务进程：持有模型并合并批处理，worker / API 进程通过 Unix socket 调用
+
+协议：每条消息是 4 字节大端长度 + JSON。token id 数组和输出的 logits / 向量不经过 socket，
+而是放在客户端创建的共享内存段里（multiprocessing.shared_memory），消息只携带段名和形状：
+
+    客户端 -> {"op": "forward", "model": "default", "shm": "psm_xx", "batch": 4, "seq": 384}
+    服务端 <- {"ok": true}                        # logits 已写入共享内存
+    服务端 <- {"ok": false, "error": "..."}       # 推理出错
+
+共享内存布局：[0, 3*B*L*8) 为 int64 的 input_ids / attention_mask / token_type_ids，
+其后（按 64 字节对齐）为输出：forward 是 float32 [2, B, L] 的 start/end logits，
+embed 是 float32 [B, hidden] 的归一化向量。
+
+启动：python serve_models.py --socket /tmp/qa-model.sock
+'''
+
+import json
+import os
+import socket
+import socketserver
+import struct
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.core.config import settings
+from app.core.logger import get_logger
+from app.services.backends import QABackend
+from app.services.batching import MicroBatcher
+
+logger = get_logger(__name__)
+
+_HEADER = struct.Struct(">I")
+MAX_MESSAGE_BYTES = 16 * 1024 * 1024
+ALIGN = 64
+MIN_SEGMENT_BYTES = 1024 * 1024
+
+
+class ModelServerError(RuntimeError):
+    """模型服务返回的错误（推理失败、未知模型等）"""
+
+
+class ModelServerUnavailable(ConnectionError):
+    """连接不上模型服务或连接中断"""
+
+
+def send_message(sock: socket.socket, message: dict):
+    data = json.dumps(message).encode("utf-8")
+    sock.sendall(_HEADER.pack(len(data)) + data)
+
+
+def _recv_exact(sock: socket.socket, size: int) -> Optional[bytes]:
+    chunks, remaining = [], size
+    while remaining:
+        chunk = sock.recv(remaining)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(chunks)
+
+
+def recv_message(sock: socket.socket) -> Optional[dict]:
+    """读取一条消息，对端关闭连接时返回 None"""
+    header = _recv_exact(sock, _HEADER.size)
+    if header is None:
+        return None
+    (size,) = _HEADER.unpack(header)
+    if size > MAX_MESSAGE_BYTES:
+        raise ValueError(f"Message too large: {size} bytes")
+    data = _recv_exact(sock, size)
+    if data is None:
+        return None
+    return json.loads(data)
+
+
+def _aligned(size: int) -> int:
+    return (size + ALIGN - 1) // ALIGN * ALIGN
+
+
+def attach_segment(name: str) -> shared_memory.SharedMemory:
+    """
+    打开客户端创建的共享内存段
+
+    段由客户端负责删除；Python 3.13 之前打开已有段也会登记到 resource_tracker，
+    服务进程退出时会把客户端仍在使用的段删掉，这里取消登记。
+    """
+    segment = shared_memory.SharedMemory(name=name)
+    try:
+        resource_tracker.unregister(segment._name, "shared_memory")
+    except Exception:
+        pass
+    return segment
+
+
+# ---- 客户端 ----
+
+class _Channel:
+    """一个线程独占的连接 + 共享内存段"""
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.segment: Optional[shared_memory.SharedMemory] = None
+
+    def ensure_capacity(self, nbytes: int) -> shared_memory.SharedMemory:
+        if self.segment is None or self.segment.size < nbytes:
+            size = max(nbytes, MIN_SEGMENT_BYTES)
+            if self.segment is not None:
+                size = max(size, self.segment.size * 2)
+                self.release_segment()
+            self.segment = shared_memory.SharedMemory(create=True, size=size)
+        return self.segment
+
+    def release_segment(self):
+        if self.segment is not None:
+            self.segment.close()
+            try:
+                self.segment.unlink()
+            except FileNotFoundError:
+                pass
+            self.segment = None
+
+    def close(self):
+        self.release_segment()
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class ModelServerClient:
+    """
+    模型服务客户端
+
+    每个线程一条连接和一个共享内存段（按需扩容），请求在同一连接上串行；
+    进程 fork 后子进程会重新建立自己的连接。
+    """
+
+    def __init__(self, socket_path: str, timeout: float = 30.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._channels: List[_Channel] = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def _channel(self) -> _Channel:
+        if self._pid != os.getpid():
+            # fork 之后父进程的连接和共享内存段不能复用
+            self._local = threading.local()
+            self._channels = []
+            self._pid = os.getpid()
+        channel = getattr(self._local, "channel", None)
+        if channel is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.socket_path)
+            except OSError as e:
+                sock.close()
+                raise ModelServerUnavailable(f"Cannot connect to model server at {self.socket_path}: {e}") from e
+            channel = _Channel(sock)
+            self._local.channel = channel
+            with self._lock:
+                self._channels.append(channel)
+        return channel
+
+    def _drop_channel(self, channel: _Channel):
+        channel.close()
+        self._local.channel = None
+        with self._lock:
+            if channel in self._channels:
+                self._channels.remove(channel)
+
+    def _call(self, channel: _Channel, message: dict) -> dict:
+        try:
+            send_message(channel.sock, message)
+            reply = recv_message(channel.sock)
+        except OSError as e:
+            self._drop_channel(channel)
+            raise ModelServerUnavailable(f"Model server connection failed: {e}") from e
+        if reply is None:
+            self._drop_channel(channel)
+            raise ModelServerUnavailable("Model server closed the connection")
+        if not reply.get("ok"):
+            raise ModelServerError(reply.get("error", "unknown model server error"))
+        return reply
+
+    def request(self, op: str, model: str, inputs: np.ndarray, out_shape: Tuple[int, ...]) -> np.ndarray:
+        """
+        发送一次推理请求
+
+        Args:
+            inputs: int64 [3, B, L]（input_ids / attention_mask / token_type_ids）
+            out_shape: float32 输出的形状
+
+        Returns:
+            输出数组（从共享内存复制出来，之后可以复用共享内存段）
+        """
+        inputs = np.ascontiguousarray(inputs, dtype=np.int64)
+        out_offset = _aligned(inputs.nbytes)
+        out_nbytes = int(np.prod(out_shape)) * 4
+        channel = self._channel()
+        segment = channel.ensure_capacity(out_offset + out_nbytes)
+        np.ndarray(inputs.shape, dtype=np.int64, buffer=segment.buf)[:] = inputs
+        self._call(channel, {
+            "op": op,
+            "model": model,
+            "shm": segment.name,
+            "batch": inputs.shape[1],
+            "seq": inputs.shape[2],
+        })
+        return np.ndarray(out_shape, dtype=np.float32, buffer=segment.buf, offset=out_offset).copy()
+
+    def ping(self) -> dict:
+        return self._call(self._channel(), {"op": "ping"})
+
+    def stats(self) -> dict:
+        return self._call(self._channel(), {"op": "stats"})
+
+    def close(self):
+        with self._lock:
+            channels, self._channels = self._channels, []
+        for channel in channels:
+            channel.close()
+        self._local = threading.local()
+
+
+def _stack_inputs(input_ids, attention_mask, token_type_ids) -> np.ndarray:
+    return np.stack([
+        np.asarray(t.cpu().numpy() if hasattr(t, "cpu") else t, dtype=np.int64)
+        for t in (input_ids, attention_mask, token_type_ids)
+    ])
+
+
+class RemoteBackend(QABackend):
+    """把前向推理交给模型服务的后端，输入输出都是 CPU 上的 torch 张量"""
+
+    name = "remote"
+    device = "cpu"
+
+    def __init__(self, client: ModelServerClient, model: str):
+        self.client = client
+        self.model = model
+
+    def __call__(self, input_ids, attention_mask, token_type_ids):
+        import torch
+
+        inputs = _stack_inputs(input_ids, attention_mask, token_type_ids)
+        batch, seq = inputs.shape[1:]
+        logits = self.client.request("forward", self.model, inputs, (2, batch, seq))
+        return torch.from_numpy(logits[0]), torch.from_numpy(logits[1])
+
+    def embed(self, input_ids, attention_mask, token_type_ids, hidden_size: int) -> np.ndarray:
+        inputs = _stack_inputs(input_ids, attention_mask, token_type_ids)
+        return self.client.request("embed", self.model, inputs, (inputs.shape[1], hidden_size))
+
+
+# ---- 服务端 ----
+
+def pad_and_concat(items: List[np.ndarray]) -> np.ndarray:
+    """把多个 [3, b_i, L_i] 右侧补零到同一长度后拼成 [3, sum(b_i), max(L_i)]"""
+    seq = max(item.shape[2] for item in items)
+    total = sum(item.shape[1] for item in items)
+    out = np.zeros((3, total, seq), dtype=np.int64)
+    row = 0
+    for item in items:
+        out[:, row:row + item.shape[1], :item.shape[2]] = item
+        row += item.shape[1]
+    return out
+
+
+class ModelServer:
+    """
+    模型服务
+
+    模型由本进程的模型注册表加载（同样支持多模型、热切换和内存预算）；
+    来自所有客户端的 forward 请求按模型进入各自的 MicroBatcher，补齐长度后合并成一次前向推理。
+    """
+
+    def __init__(self, socket_path: str, max_batch_size: int = 32, max_wait_ms: float = 5.0):
+        self.socket_path = socket_path
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._batchers: Dict[str, MicroBatcher] = {}
+        self._lock = threading.Lock()
+        self._server = None
+        self.requests = 0
+        self.errors = 0
+        self.started_at = time.time()
+
+    # ---- 推理 ----
+
+    def _batcher(self, model: str) -> MicroBatcher:
+        with self._lock:
+            batcher = self._batchers.get(model)
+            if batcher is None:
+                batcher = MicroBatcher(
+                    lambda items: self._forward_batch(model, items),
+                    max_batch_size=self.max_batch_size,
+                    max_wait_ms=self.max_wait_ms,
+                    name=f"model-server-{model}",
+                )
+                self._batchers[model] = batcher
+            return batcher
+
+    def _forward_batch(self, model: str, items: List[np.ndarray]) -> List[np.ndarray]:
+        import torch
+
+        from app.services.llm_services import get_registry
+
+        merged = pad_and_concat(items)
+        with get_registry().use(model) as handle:
+            backend = handle.backend
+            tensors = [torch.from_numpy(merged[i]) for i in range(3)]
+            if backend.device != "cpu":
+                tensors = [t.to(backend.device) for t in tensors]
+            chunk = max(1, settings.reader_max_windows_per_forward)
+            starts, ends = [], []
+            for i in range(0, merged.shape[1], chunk):
+                start, end = backend(*(t[i:i + chunk] for t in tensors))
+                starts.append(start.float().cpu())
+                ends.append(end.float().cpu())
+        start_logits = torch.cat(starts).numpy()
+        end_logits = torch.cat(ends).numpy()
+
+        results, row = [], 0
+        for item in items:
+            batch, seq = item.shape[1], item.shape[2]
+            results.append(np.stack([start_logits[row:row + batch, :seq], end_logits[row:row + batch, :seq]]))
+            row += batch
+        return results
+
+    def forward(self, model: str, inputs: np.ndarray) -> np.ndarray:
+        return self._batcher(model).submit(inputs).result()
+
+    def embed(self, model: str, inputs: np.ndarray) -> np.ndarray:
+        import torch
+
+        from app.services.llm_services import _encode, _handle_model, get_registry
+
+        with get_registry().use(model) as handle:
+            qa_model = _handle_model(handle)
+            encoder = getattr(qa_model, "bert", qa_model)
+            tensors = {
+                name: torch.from_numpy(inputs[i])
+                for i, name in enumerate(("input_ids", "attention_mask", "token_type_ids"))
+            }
+            return _encode(encoder, tensors)
+
+    # ---- 请求处理 ----
+
+    def handle(self, message: dict, segments: Dict[str, shared_memory.SharedMemory]) -> dict:
+        op = message.get("op")
+        if op == "ping":
+            from app.services.llm_services import get_registry
+
+            return {"ok": True, "pid": os.getpid(), "models": get_registry().names()}
+        if op == "stats":
+            return {"ok": True, **self.stats()}
+        if op not in ("forward", "embed"):
+            return {"ok": False, "error": f"Unknown op: {op}"}
+
+        from app.services.llm_services import get_registry
+
+        model = get_registry().resolve(message.get("model"))
+        name = message["shm"]
+        segment = segments.get(name)
+        if segment is None:
+            # 客户端扩容后会换一个新的段，旧段在这里关闭
+            for old in segments.values():
+                old.close()
+            segments.clear()
+            segment = segments[name] = attach_segment(name)
+        batch, seq = int(message["batch"]), int(message["seq"])
+        inputs = np.ndarray((3, batch, seq), dtype=np.int64, buffer=segment.buf).copy()
+        out_offset = _aligned(inputs.nbytes)
+
+        output = self.forward(model, inputs) if op == "forward" else self.embed(model, inputs)
+        output = np.ascontiguousarray(output, dtype=np.float32)
+        if out_offset + output.nbytes > segment.size:
+            return {"ok": False, "error": "Shared memory segment too small for output"}
+        np.ndarray(output.shape, dtype=np.float32, buffer=segment.buf, offset=out_offset)[:] = output
+        self.requests += 1
+        return {"ok": True, "shape": list(output.shape)}
+
+    def stats(self) -> dict:
+        from app.services.llm_services import get_registry
+
+        return {
+            "pid": os.getpid(),
+            "uptime": round(time.time() - self.started_at, 1),
+            "requests": self.requests,
+            "errors": self.errors,
+            "batching": {name: batcher.stats.snapshot() for name, batcher in self._batchers.items()},
+            "registry": get_registry().stats(),
+        }
+
+    # ---- 服务循环 ----
+
+    def serve_forever(self):
+        model_server = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                segments = {}
+                try:
+                    while True:
+                        message = recv_message(self.request)
+                        if message is None:
+                            break
+                        try:
+                            reply = model_server.handle(message, segments)
+                        except Exception as e:
+                            model_server.errors += 1
+                            logger.error(f"Model server request failed: {e}")
+                            reply = {"ok": False, "error": str(e)}
+                        send_message(self.request, reply)
+                except OSError as e:
+                    logger.debug(f"Model server client disconnected: {e}")
+                finally:
+                    for segment in segments.values():
+                        segment.close()
+
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self._server = socketserver.ThreadingUnixStreamServer(self.socket_path, Handler)
+        self._server.daemon_threads = True
+        os.chmod(self.socket_path, 0o660)
+        logger.info(f"Model server {os.getpid()} listening on {self.socket_path}")
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+    def shutdown(self):
+        if self._server is not None:
+            self._server.shutdown()
+        for batcher in self._batchers.values():
+            batcher.close()
+
+
+def create_server(socket_path: Optional[str] = None) -> ModelServer:
+    return ModelServer(
+        socket_path or settings.model_server_socket,
+        max_batch_size=settings.model_server_max_batch_size,
+        max_wait_ms=settings.model_server_max_wait_ms,
+    )
@@ -0,0 +1,334 @@
+# -*- encoding: utf-8 -*-
+'''
+@Time    :   2025/10/25 10:14:36
+@Author  :   47bwy
+@Desc    :   问答记录异步批量写库（write-behind）
+
+任务把 (question, answer, user_id, 耗时) 记录交给进程内有界缓冲区后立即返回，不再在关键路径上逐条 commit；
+后台线程在攒够 question_flush_batch_size 条或距上次写入超过 question_flush_interval_ms 时
+用一个会话一次 executemany 批量插入。写库失败的批次追加到溢出文件（JSON Lines），
+下次启动写入线程时补写；进程退出（worker 子进程退出 / API 关闭）时写完缓冲区中剩余的记录。
+'''
+
+import atexit
+import json
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import insert
+
+from app.core.config import settings
+from app.core.db import SessionLocal
+from app.core.logger import get_logger
+from app.models.question import Question
+
+logger = get_logger(__name__)
+
+
+def question_record(
+    question: str, answer: str, user_id: str, created_at: Optional[float] = None, latency_ms: Optional[float] = None
+) -> dict:
+    """一条待写入的问答记录；created_at 为回答完成的时间戳，latency_ms 为处理耗时"""
+    return {
+        "question": question,
+        "answer": answer,
+        "user_id": user_id,
+        "created_at": created_at if created_at is not None else time.time(),
+        "latency_ms": latency_ms,
+    }
+
+
+def table_rows(records: List[dict]) -> List[dict]:
+    """只保留 questions 表中存在的列，created_at 时间戳转换为 UTC 时间"""
+    columns = set(Question.__table__.columns.keys())
+    rows = []
+    for record in records:
+        row = {key: value for key, value in record.items() if key in columns}
+        if isinstance(row.get("created_at"), (int, float)):
+            row["created_at"] = datetime.fromtimestamp(row["created_at"], timezone.utc).replace(tzinfo=None)
+        rows.append(row)
+    return rows
+
+
+class QuestionWriter:
+    """
+    问答记录的进程内写缓冲
+
+    - submit() 只把记录放入缓冲区；缓冲区满（max_buffer）时这条记录直接写入溢出文件，任务不会被阻塞
+    - 后台线程按条数（batch_size）或时间（flush_interval 秒）触发，每批使用独立的会话并一次提交
+    - write_behind=False 时在调用线程里同步写入（每次调用一个会话）
+    - fork 之后子进程不会继承父进程的写入线程，第一次 submit 时重新启动并丢弃继承来的缓冲区
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable = SessionLocal,
+        batch_size: int = 200,
+        flush_interval: float = 1.0,
+        max_buffer: int = 10000,
+        spill_file: Optional[str] = None,
+        write_behind: bool = True,
+    ):
+        self.session_factory = session_factory
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.spill_file = spill_file
+        self.write_behind = write_behind
+        self._reset()
+
+        self.submitted = 0
+        self.written = 0
+        self.batches = 0
+        self.spilled = 0
+        self.errors = 0
+        self.last_flush_ms = 0.0
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._buffer = deque()
+        self._cond = threading.Condition()
+        self._spill_lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        self._flush_requested = False
+        self._inflight = 0
+
+    # ---- 写入 ----
+
+    def submit(self, record: dict) -> bool:
+        """放入一条记录；返回 False 表示没有进入缓冲区（已同步写入或写入溢出文件）"""
+        return self.submit_many([record]) == 1
+
+    def submit_many(self, records: List[dict]) -> int:
+        """放入多条记录，返回进入缓冲区的条数"""
+        if not records:
+            return 0
+        self.submitted += len(records)
+        if not self.write_behind:
+            self._write(list(records))
+            return 0
+        if self._pid != os.getpid():
+            self._reset()
+        overflow = []
+        with self._cond:
+            if self._closed:
+                overflow = list(records)
+            else:
+                room = max(0, self.max_buffer - len(self._buffer))
+                self._buffer.extend(records[:room])
+                overflow = list(records[room:])
+                if len(self._buffer) >= self.batch_size:
+                    self._cond.notify()
+            self._ensure_thread()
+        if overflow:
+            logger.warning(f"Question buffer full or closed, spilling {len(overflow)} records")
+            self._spill(overflow)
+        return len(records) - len(overflow)
+
+    def _ensure_thread(self):
+        if self._closed or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._thread = threading.Thread(target=self._run, name="question-writer", daemon=True)
+        self._thread.start()
+
+    def _take(self) -> List[dict]:
+        count = min(self.batch_size, len(self._buffer))
+        return [self._buffer.popleft() for _ in range(count)]
+
+    def _run(self):
+        try:
+            self.replay_spill()
+        except Exception as e:
+            logger.error(f"Failed to replay spilled question records: {e}")
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + self.flush_interval
+                while not (self._closed or self._flush_requested) and len(self._buffer) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._take()
+                self._inflight = len(batch)
+                if not self._buffer:
+                    self._flush_requested = False
+                if not batch and self._closed:
+                    return
+            try:
+                if batch:
+                    self._write(batch)
+            finally:
+                with self._cond:
+                    self._inflight = 0
+                    self._cond.notify_all()
+
+    def _write(self, batch: List[dict]) -> bool:
+        """一个会话、一次 executemany 插入整批；失败时整批写入溢出文件"""
+        started = time.perf_counter()
+        try:
+            with self.session_factory() as db:
+                try:
+                    db.execute(insert(Question), table_rows(batch))
+                    db.commit()
+                except Exception:
+                    db.rollback()
+                    raise
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Failed to write {len(batch)} questions to database: {e}")
+            self._spill(batch)
+            return False
+        self.written += len(batch)
+        self.batches += 1
+        self.last_flush_ms = round((time.perf_counter() - started) * 1000, 3)
+        return True
+
+    # ---- 溢出文件 ----
+
+    def _spill(self, records: List[dict]):
+        self._append_spill([json.dumps(record, ensure_ascii=False) for record in records])
+
+    def _append_spill(self, lines: List[str]):
+        if not self.spill_file:
+            logger.error(f"No spill file configured, dropping {len(lines)} question records")
+            return
+        with self._spill_lock:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(self.spill_file)), exist_ok=True)
+                # surrogateescape：无法解码的行原样写回
+                with open(self.spill_file, "a", encoding="utf-8", errors="surrogateescape") as f:
+                    for line in lines:
+                        f.write(line + "\n")
+                self.spilled += len(lines)
+            except OSError as e:
+                logger.error(f"Failed to spill {len(lines)} question records: {e}")
+
+    def replay_spill(self) -> int:
+        """
+        补写溢出文件中的记录，返回成功写入的条数
+
+        先把溢出文件改名认领，多个进程同时启动时只有一个进程补写；补写失败的记录重新追加到溢出文件。
+        无法解析的行（写了一半的行、非 JSON）跳过并记录日志，原样写回溢出文件留待人工处理，不会阻塞其他记录。
+        """
+        if not self.spill_file or not os.path.exists(self.spill_file):
+            return 0
+        claimed = f"{self.spill_file}.{os.getpid()}.replay"
+        try:
+            os.replace(self.spill_file, claimed)
+        except FileNotFoundError:
+            return 0
+        records, unreadable = [], []
+        with open(claimed, encoding="utf-8", errors="surrogateescape") as f:
+            for number, line in enumerate(f, 1):
+                line = line.rstrip("\n")
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError as e:
+                    record = e
+                if not isinstance(record, dict):
+                    logger.warning(f"Skipping unreadable line {number} in spill file {self.spill_file}: {record}")
+                    unreadable.append(line)
+                    continue
+                records.append(record)
+        written = 0
+        for start in range(0, len(records), self.batch_size):
+            batch = records[start:start + self.batch_size]
+            if self._write(batch):
+                written += len(batch)
+        if unreadable:
+            self._append_spill(unreadable)
+        os.remove(claimed)
+        if records or unreadable:
+            logger.info(f"Replayed {written}/{len(records)} spilled question records, {len(unreadable)} unreadable lines kept")
+        return written
+
+    # ---- 关闭 ----
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """等待缓冲区中已有的记录全部写入（或写入溢出文件），超时返回 False"""
+        if self._pid != os.getpid():
+            return True
+        with self._cond:
+            self._flush_requested = True
+            self._cond.notify_all()
+            deadline = time.monotonic() + timeout
+            while self._buffer or self._inflight:
+                if self._thread is None or not self._thread.is_alive():
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            leftover = list(self._buffer)
+            self._buffer.clear()
+        # 写入线程没有运行（已退出），在当前线程里写完
+        if leftover:
+            self._write(leftover)
+        return True
+
+    def close(self, timeout: float = 10.0):
+        """停止接收新记录并写完缓冲区（进程退出前调用）"""
+        if self._pid != os.getpid():
+            return
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        with self._cond:
+            leftover = list(self._buffer)
+            self._buffer.clear()
+        if leftover:
+            self._write(leftover)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "write_behind": self.write_behind,
+            "buffered": len(self._buffer),
+            "submitted": self.submitted,
+            "written": self.written,
+            "batches": self.batches,
+            "spilled": self.spilled,
+            "errors": self.errors,
+            "last_flush_ms": self.last_flush_ms,
+        }
+
+
+_writer = None
+_writer_lock = threading.Lock()
+_atexit_registered = False
+
+
+def get_question_writer() -> QuestionWriter:
+    """进程级单例，进程正常退出时写完缓冲区"""
+    global _writer, _atexit_registered
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = QuestionWriter(
+                    batch_size=settings.question_flush_batch_size,
+                    flush_interval=settings.question_flush_interval_ms / 1000.0,
+                    max_buffer=settings.question_buffer_size,
+                    spill_file=settings.question_spill_file,
+                    write_behind=settings.question_write_behind,
+                )
+                if not _atexit_registered:
+                    atexit.register(close_question_writer)
+                    _atexit_registered = True
+    return _writer
+
+
+def close_question_writer():
+    """写完缓冲区并释放单例，之后再提交记录时重新创建"""
+    global _writer
+    with _writer_lock:
+        writer, _writer = _writer, None
+    if writer is not None:
+        writer.close()
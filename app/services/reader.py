@@ -0,0 +1,240 @@
+# -*- encoding: utf-8 -*-
+'''
+@Time    :   2025/10/18 14:26:41
+@Author  :   47bwy
+@Desc    :   滑动窗口阅读器：长文本切分为重叠窗口，向量化搜索最佳答案片段
+'''
+
+from dataclasses import dataclass, field
+from typing import List, Optional, Sequence, Tuple
+
+from app.core.cache import content_hash
+
+
+@dataclass
+class ReaderFeatures:
+    """
+    一批 (question, context) 切分后的窗口特征
+
+    每个窗口的结构为 [CLS] question [SEP] context[offset:offset+length] [SEP]，
+    example_index 记录窗口属于第几个样本，context_ids 保存每个样本完整的上下文 token。
+    """
+    input_ids: List[List[int]] = field(default_factory=list)
+    token_type_ids: List[List[int]] = field(default_factory=list)
+    example_index: List[int] = field(default_factory=list)
+    # 窗口内第一个上下文 token 的位置（即 len(question) + 2）
+    context_start: List[int] = field(default_factory=list)
+    # 窗口在完整上下文 token 序列中的起始下标和长度
+    context_offset: List[int] = field(default_factory=list)
+    context_length: List[int] = field(default_factory=list)
+    context_ids: List[List[int]] = field(default_factory=list)
+    # 每个上下文 token 在原文中的字符区间（fast tokenizer 才有），用于精确截取答案原文
+    context_offsets: List[Optional[Sequence[Tuple[int, int]]]] = field(default_factory=list)
+    contexts: List[str] = field(default_factory=list)
+
+    @property
+    def num_windows(self) -> int:
+        return len(self.input_ids)
+
+    def to_tensors(self, pad_token_id: int = 0):
+        """补齐为张量，返回 (inputs, context_mask)；context_mask 标记可作为答案的位置"""
+        import torch
+
+        max_len = max(len(ids) for ids in self.input_ids)
+        num = self.num_windows
+        input_ids = torch.full((num, max_len), pad_token_id, dtype=torch.long)
+        token_type_ids = torch.zeros((num, max_len), dtype=torch.long)
+        attention_mask = torch.zeros((num, max_len), dtype=torch.long)
+        context_mask = torch.zeros((num, max_len), dtype=torch.bool)
+        for i, ids in enumerate(self.input_ids):
+            input_ids[i, :len(ids)] = torch.tensor(ids, dtype=torch.long)
+            token_type_ids[i, :len(ids)] = torch.tensor(self.token_type_ids[i], dtype=torch.long)
+            attention_mask[i, :len(ids)] = 1
+            start = self.context_start[i]
+            context_mask[i, start:start + self.context_length[i]] = True
+        inputs = {
+            "input_ids": input_ids,
+            "token_type_ids": token_type_ids,
+            "attention_mask": attention_mask,
+        }
+        return inputs, context_mask
+
+
+def encode_texts(tokenizer, texts: Sequence[str]):
+    """
+    批量编码文本（不加特殊 token）
+
+    fast tokenizer 一次调用完成整批编码并返回 offset mapping；
+    其他 tokenizer 逐条编码，offsets 为 None。
+
+    Returns:
+        [(ids, offsets), ...]
+    """
+    if not texts:
+        return []
+    if getattr(tokenizer, "is_fast", False):
+        encoded = tokenizer(list(texts), add_special_tokens=False, return_offsets_mapping=True)
+        return [
+            (tuple(ids), tuple(map(tuple, offsets)))
+            for ids, offsets in zip(encoded["input_ids"], encoded["offset_mapping"])
+        ]
+    return [(tuple(tokenizer.encode(text, add_special_tokens=False)), None) for text in texts]
+
+
+def encode_contexts(tokenizer, contexts: Sequence[str], cache=None):
+    """
+    编码上下文，重复出现的上下文直接从缓存读取
+
+    Args:
+        cache: LRUCache，key 为 (tokenizer 名称, 内容哈希)；None 表示不缓存
+
+    Returns:
+        与 contexts 等长的 [(ids, offsets), ...]
+    """
+    if cache is None:
+        return encode_texts(tokenizer, contexts)
+
+    name = getattr(tokenizer, "name_or_path", "")
+    keys = [(name, content_hash(context)) for context in contexts]
+    results = [cache.get(key) for key in keys]
+
+    # 未命中的上下文去重后合并成一次批量编码
+    missing = {}
+    for i, result in enumerate(results):
+        if result is None:
+            missing.setdefault(keys[i], contexts[i])
+    if missing:
+        encoded = dict(zip(missing, encode_texts(tokenizer, list(missing.values()))))
+        for key, value in encoded.items():
+            cache.set(key, value)
+        results = [encoded.get(key) if result is None else result for key, result in zip(keys, results)]
+    return results
+
+
+def build_features(
+    tokenizer,
+    pairs: Sequence[Tuple[str, str]],
+    max_seq_len: int = 384,
+    doc_stride: int = 128,
+    max_question_len: int = 64,
+    context_cache=None,
+) -> ReaderFeatures:
+    """
+    把一批 (question, context) 切分为重叠窗口
+
+    Args:
+        tokenizer: BERT tokenizer
+        pairs: [(question, context), ...]
+        max_seq_len: 单个窗口的最大 token 数（含特殊 token），BERT 上限 512
+        doc_stride: 相邻窗口起点之间的步长（token 数），小于窗口可容纳的上下文长度时窗口之间重叠
+        max_question_len: 问题最多保留的 token 数
+        context_cache: 上下文编码缓存（见 encode_contexts）
+
+    Returns:
+        ReaderFeatures
+    """
+    cls_id, sep_id = tokenizer.cls_token_id, tokenizer.sep_token_id
+    features = ReaderFeatures()
+
+    questions = encode_texts(tokenizer, [question for question, _ in pairs])
+    contexts = encode_contexts(tokenizer, [context for _, context in pairs], cache=context_cache)
+
+    for example, ((question_ids, _), (context_ids, offsets)) in enumerate(zip(questions, contexts)):
+        question_ids = list(question_ids[:max_question_len])
+        features.context_ids.append(context_ids)
+        features.context_offsets.append(offsets)
+        features.contexts.append(pairs[example][1])
+
+        # 每个窗口可放入的上下文 token 数：扣掉问题和 [CLS] [SEP] [SEP]
+        span_len = max_seq_len - len(question_ids) - 3
+        if span_len <= 0:
+            raise ValueError(f"max_seq_len={max_seq_len} is too small for a question of {len(question_ids)} tokens")
+        stride = max(1, min(doc_stride, span_len))
+
+        offset = 0
+        while True:
+            length = min(span_len, len(context_ids) - offset)
+            prefix = [cls_id] + question_ids + [sep_id]
+            window_ids = prefix + list(context_ids[offset:offset + length]) + [sep_id]
+
+            features.input_ids.append(window_ids)
+            features.token_type_ids.append([0] * len(prefix) + [1] * (length + 1))
+            features.example_index.append(example)
+            features.context_start.append(len(prefix))
+            features.context_offset.append(offset)
+            features.context_length.append(length)
+
+            if offset + length >= len(context_ids):
+                break
+            offset += stride
+
+    return features
+
+
+def extract_answer(tokenizer, features: ReaderFeatures, example: int, start: int, end: int) -> str:
+    """
+    取出答案文本：有 offset mapping 时直接截取原文（保留原始空格和大小写），否则解码 token
+    """
+    offsets = features.context_offsets[example]
+    if offsets:
+        return features.contexts[example][offsets[start][0]:offsets[end][1]]
+    answer_tokens = features.context_ids[example][start:end + 1]
+    return tokenizer.decode(answer_tokens, skip_special_tokens=True)
+
+
+def best_spans(start_logits, end_logits, context_mask, max_answer_len: int = 30):
+    """
+    一次张量运算为所有窗口找出最佳答案片段
+
+    对每个窗口的所有 (start, end) 组合打分 score = start_logit + end_logit，
+    只保留 start、end 都落在上下文内、end >= start 且长度 <= max_answer_len 的组合。
+    只对带状区域打分（张量为 [W, L, max_answer_len]，不是 [W, L, L]），内存随窗口数和序列长度线性增长。
+
+    Args:
+        start_logits, end_logits: [num_windows, seq_len]
+        context_mask: [num_windows, seq_len]，True 表示该位置属于上下文
+        max_answer_len: 答案最多包含的 token 数
+
+    Returns:
+        (scores, starts, ends)，形状均为 [num_windows]；窗口内没有合法片段时 score 为 -inf
+    """
+    import torch
+
+    neg_inf = float("-inf")
+    num_windows, seq_len = start_logits.shape
+    width = max(1, min(max_answer_len, seq_len))
+
+    start_logits = start_logits.float().masked_fill(~context_mask, neg_inf)
+    end_logits = end_logits.float().masked_fill(~context_mask, neg_inf)
+
+    # [W, L, width]：第 i 行第 k 列为以 i 开始、以 i + k 结束的片段得分；右侧补 -inf，越过序列末尾的片段不合法
+    padded_end = torch.nn.functional.pad(end_logits, (0, width - 1), value=neg_inf)
+    scores = start_logits.unsqueeze(2) + padded_end.unfold(1, width, 1)
+
+    best_scores, best_index = scores.reshape(num_windows, -1).max(dim=1)
+    starts = torch.div(best_index, width, rounding_mode="floor")
+    ends = starts + best_index % width
+    return best_scores, starts, ends
+
+
+def select_answers(features: ReaderFeatures, scores, starts, ends, num_examples: int):
+    """
+    在每个样本的所有窗口里取全局得分最高的片段
+
+    Returns:
+        [(context_token_start, context_token_end, score), ...]，长度为 num_examples；
+        没有合法片段的样本返回 None
+    """
+    best = [None] * num_examples
+    scores, starts, ends = scores.tolist(), starts.tolist(), ends.tolist()
+    for window in range(features.num_windows):
+        score = scores[window]
+        if score == float("-inf"):
+            continue
+        example = features.example_index[window]
+        if best[example] is not None and best[example][2] >= score:
+            continue
+        # 把窗口内位置换算回完整上下文中的 token 下标
+        shift = features.context_offset[window] - features.context_start[window]
+        best[example] = (starts[window] + shift, ends[window] + shift, score)
+    return best
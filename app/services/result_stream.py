@@ -0,0 +1,200 @@
+# -*- encoding: utf-8 -*-
+'''
+@Time    :   2025/10/23 10:05:26
+@Author  :   47bwy
+@Desc    :   任务结果推送：worker 通过 Redis pub/sub 发布结果，API 进程内一个共享订阅者分发给所有等待的连接
+
+客户端不再反复轮询 /qa/ask/result：每个 API 进程只有一条订阅连接，
+任务完成时结果随消息直接送达，等待中的 SSE / WebSocket 连接立即返回。
+'''
+
+import asyncio
+import json
+from typing import Callable, Dict, Optional, Set
+
+import redis
+import redis.asyncio as aioredis
+
+from app.core.config import settings
+from app.core.logger import get_logger
+from app.core.redis_client import get_redis
+
+logger = get_logger(__name__)
+
+RESULT_CHANNEL = "qa:results"
+
+
+def result_message(task_id: str, status: str, answer: Optional[str] = None, error: Optional[str] = None) -> dict:
+    """与 /qa/ask/result 返回格式一致的结果消息"""
+    message = {"task_id": task_id, "status": status}
+    if answer is not None:
+        message["answer"] = answer
+    if error is not None:
+        message["error"] = error
+    return message
+
+
+def publish_result(message: dict, client=None) -> bool:
+    """worker 端发布任务结果；Redis 不可用时只记录日志（客户端仍可轮询结果）"""
+    try:
+        # 进程内复用同一个客户端，不为每个完成的任务新建连接
+        client = client or get_redis(settings.backend_url)
+        client.publish(RESULT_CHANNEL, json.dumps(message, ensure_ascii=False))
+        return True
+    except redis.RedisError as e:
+        logger.warning(f"Failed to publish result of task {message.get('task_id')}: {e}")
+        return False
+
+
+class ResultHub:
+    """
+    API 进程内的结果分发器
+
+    - 第一次有连接等待结果时启动后台订阅协程，之后一直复用同一条订阅连接
+    - subscribe(task_id) 返回一个 Future，收到该任务的结果消息时完成
+    - 订阅连接断开后按 retry_seconds 重连；断开期间发布的消息会丢失，
+      调用方在订阅之后应再查一次结果后端，避免错过订阅之前或断线期间完成的任务
+    """
+
+    def __init__(
+        self,
+        client_factory: Optional[Callable[[], "aioredis.Redis"]] = None,
+        channel: str = RESULT_CHANNEL,
+        retry_seconds: float = 1.0,
+    ):
+        self.client_factory = client_factory or (lambda: aioredis.from_url(settings.backend_url))
+        self.channel = channel
+        self.retry_seconds = retry_seconds
+        self._waiters: Dict[str, Set[asyncio.Future]] = {}
+        self._listener: Optional[asyncio.Task] = None
+        self._ready: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+        self.messages = 0
+        self.deliveries = 0
+        self.reconnects = 0
+
+    @property
+    def subscribed(self) -> bool:
+        return self._ready is not None and self._ready.is_set()
+
+    def subscribe(self, task_id: str) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._waiters.setdefault(task_id, set()).add(future)
+        self._ensure_listener()
+        return future
+
+    def unsubscribe(self, task_id: str, future: asyncio.Future):
+        waiters = self._waiters.get(task_id)
+        if waiters is None:
+            return
+        waiters.discard(future)
+        if not waiters:
+            del self._waiters[task_id]
+
+    async def wait_ready(self, timeout: float = 1.0) -> bool:
+        """等待订阅生效（用于测试和启动阶段），超时返回 False"""
+        self._ensure_listener()
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def _ensure_listener(self):
+        loop = asyncio.get_running_loop()
+        # 订阅协程绑定在启动它的事件循环上，事件循环换了（如测试中多次启动应用）需要重新订阅
+        if self._listener is None or self._listener.done() or self._loop is not loop:
+            self._loop = loop
+            self._ready = asyncio.Event()
+            self._listener = loop.create_task(self._listen())
+
+    def dispatch(self, raw) -> int:
+        """把一条结果消息交给等待该任务的所有连接，返回送达的连接数"""
+        self.messages += 1
+        try:
+            message = json.loads(raw)
+            task_id = message["task_id"]
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Ignoring invalid result message: {e}")
+            return 0
+        delivered = 0
+        for future in self._waiters.pop(task_id, ()):
+            if not future.done():
+                future.set_result(message)
+                delivered += 1
+        self.deliveries += delivered
+        return delivered
+
+    async def _listen(self):
+        while True:
+            client = pubsub = None
+            try:
+                client = self.client_factory()
+                pubsub = client.pubsub(ignore_subscribe_messages=True)
+                await pubsub.subscribe(self.channel)
+                self._ready.set()
+                logger.info(f"Result hub subscribed to {self.channel}")
+                async for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        self.dispatch(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.reconnects += 1
+                self._ready.clear()
+                logger.warning(f"Result hub subscription lost: {e}, retrying in {self.retry_seconds}s")
+                await asyncio.sleep(self.retry_seconds)
+            finally:
+                if pubsub is not None:
+                    try:
+                        await pubsub.aclose()
+                    except Exception:
+                        pass
+                if client is not None:
+                    try:
+                        await client.aclose()
+                    except Exception:
+                        pass
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._listener = None
+        for waiters in self._waiters.values():
+            for future in waiters:
+                future.cancel()
+        self._waiters.clear()
+
+    def stats(self) -> dict:
+        return {
+            "subscribed": self.subscribed,
+            "waiting_tasks": len(self._waiters),
+            "waiting_connections": sum(len(w) for w in self._waiters.values()),
+            "messages": self.messages,
+            "deliveries": self.deliveries,
+            "reconnects": self.reconnects,
+        }
+
+
+_hub = None
+
+
+def get_result_hub() -> ResultHub:
+    """进程级单例（只在事件循环里使用，不需要加锁）"""
+    global _hub
+    if _hub is None:
+        _hub = ResultHub()
+    return _hub
+
+
+async def close_result_hub():
+    global _hub
+    if _hub is not None:
+        await _hub.close()
+        _hub = None
@@ -0,0 +1,462 @@
+# -*- encoding: utf-8 -*-
+'''
+@Time    :   2025/10/20 09:36:15
+@Author  :   47bwy
+@Desc    :   段落检索：FAISS 向量索引（flat / ivf / hnsw）+ BM25 倒排索引 + 磁盘段落存储
+'''
+
+import json
+import os
+import shutil
+import threading
+import time
+from typing import Callable, List, Optional, Sequence
+
+import faiss
+import numpy as np
+
+from app.core.logger import get_logger
+from app.services.bm25 import BM25Index
+
+logger = get_logger(__name__)
+
+INDEX_TYPES = ("flat", "ivf", "hnsw")
+
+INDEX_FILE = "passages.faiss"
+PASSAGES_FILE = "passages.jsonl"
+OFFSETS_FILE = "passages.offsets"
+META_FILE = "index.json"
+LEXICAL_DIR = "bm25"
+# 索引目录中属于段落索引的文件和目录（重建索引时只删除这些）
+INDEX_ENTRIES = (META_FILE, INDEX_FILE, PASSAGES_FILE, OFFSETS_FILE, LEXICAL_DIR)
+
+# 检查磁盘索引是否被更新（例如增量导入）的最小间隔
+RELOAD_CHECK_SECONDS = 5
+
+# IVF 训练所需的最少向量数（每个聚类中心约 39 个点，FAISS 少于此数时会告警，聚类质量差）
+TRAIN_POINTS_PER_LIST = 39
+
+
+def index_version(directory: str) -> str:
+    """
+    磁盘索引的版本：index.json 的 mtime/size（每次 save 都会重写），索引不存在时为 "none"
+
+    导入新文档后版本变化，依赖检索上下文的答案缓存随之失效（见 app/services/answer_cache.py）。
+    """
+    try:
+        stat = os.stat(os.path.join(directory, META_FILE))
+    except OSError:
+        return "none"
+    return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+
+class PassageStore:
+    """
+    追加写入的段落存储
+
+    - passages.jsonl：每行一个段落 {"text": ..., "source": ...}
+    - passages.offsets：int64 数组，第 i 个元素是第 i 个段落在 jsonl 中的字节偏移，
+      读取时用 np.memmap 映射，百万级段落也不需要全部载入内存
+    段落 id 即写入顺序，与 FAISS 索引中的向量 id 一一对应。
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.passages_path = os.path.join(directory, PASSAGES_FILE)
+        self.offsets_path = os.path.join(directory, OFFSETS_FILE)
+        self._offsets = None
+        self._lock = threading.Lock()
+
+    def _load_offsets(self):
+        if not os.path.exists(self.offsets_path) or os.path.getsize(self.offsets_path) == 0:
+            return np.zeros(0, dtype="int64")
+        return np.memmap(self.offsets_path, dtype="int64", mode="r")
+
+    def __len__(self) -> int:
+        if self._offsets is None:
+            self._offsets = self._load_offsets()
+        return len(self._offsets)
+
+    def refresh(self):
+        """重新映射偏移文件（其他进程追加写入后调用）"""
+        with self._lock:
+            self._offsets = self._load_offsets()
+
+    def get(self, ids: Sequence[int]) -> List[dict]:
+        if self._offsets is None:
+            self.refresh()
+        offsets = self._offsets
+        results = []
+        with open(self.passages_path, "rb") as f:
+            for passage_id in ids:
+                if passage_id < 0 or passage_id >= len(offsets):
+                    results.append(None)
+                    continue
+                f.seek(int(offsets[passage_id]))
+                item = json.loads(f.readline().decode("utf-8"))
+                item["id"] = int(passage_id)
+                results.append(item)
+        return results
+
+    def add(self, texts: Sequence[str], sources: Optional[Sequence[str]] = None) -> List[int]:
+        """追加段落，返回分配的 id"""
+        os.makedirs(self.directory, exist_ok=True)
+        sources = sources or [""] * len(texts)
+        with self._lock:
+            start_id = len(self._load_offsets())
+            offsets = []
+            with open(self.passages_path, "ab") as f:
+                for text, source in zip(texts, sources):
+                    offsets.append(f.tell())
+                    line = json.dumps({"text": text, "source": source}, ensure_ascii=False) + "\n"
+                    f.write(line.encode("utf-8"))
+            with open(self.offsets_path, "ab") as f:
+                f.write(np.asarray(offsets, dtype="int64").tobytes())
+            self._offsets = self._load_offsets()
+        return list(range(start_id, start_id + len(texts)))
+
+    def truncate(self, count: int):
+        """回滚到只保留前 count 个段落（向量索引写入失败时使用）"""
+        with self._lock:
+            offsets = self._load_offsets()
+            if count >= len(offsets):
+                return
+            end = int(offsets[count])
+            del offsets
+            self._offsets = None
+            with open(self.passages_path, "ab") as f:
+                f.truncate(end)
+            with open(self.offsets_path, "ab") as f:
+                f.truncate(count * 8)
+            self._offsets = self._load_offsets()
+
+
+def remove_index_files(directory: str, extra: Sequence[str] = ()):
+    """删除目录中的段落索引文件（INDEX_ENTRIES 和 extra），目录中的其他文件不动"""
+    for name in tuple(INDEX_ENTRIES) + tuple(extra):
+        path = os.path.join(directory, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+
+
+def create_index(kind: str, dim: int, nlist: int = 1024, hnsw_m: int = 32):
+    """创建空的 FAISS 索引，向量需 L2 归一化，使用内积（余弦相似度）"""
+    if kind == "flat":
+        return faiss.IndexFlatIP(dim)
+    if kind == "ivf":
+        quantizer = faiss.IndexFlatIP(dim)
+        return faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+    if kind == "hnsw":
+        return faiss.IndexHNSWFlat(dim, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+    raise ValueError(f"Unknown index type: {kind}, expected one of {INDEX_TYPES}")
+
+
+class PassageIndex:
+    """
+    段落向量索引 + 段落存储
+
+    目录结构：
+        index.json        索引类型、维度
+        passages.faiss    FAISS 索引（IVF 攒够训练数据之前为 flat 暂存索引）
+        passages.jsonl    段落原文
+        passages.offsets  段落偏移
+        bm25/             BM25 倒排索引（lexical=True 时与向量索引同步写入）
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        kind: str = "flat",
+        dim: Optional[int] = None,
+        nlist: int = 1024,
+        nprobe: int = 16,
+        hnsw_m: int = 32,
+        ef_search: int = 64,
+        mmap: bool = True,
+        lexical: bool = True,
+    ):
+        self.directory = directory
+        self.kind = kind
+        self.dim = dim
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.hnsw_m = hnsw_m
+        self.ef_search = ef_search
+        self.mmap = mmap
+        self.store = PassageStore(directory)
+        self.lexical = self._new_lexical() if lexical else None
+        self.index = None
+        self._loaded_mtime = None
+        self._last_check = 0.0
+        self._lock = threading.RLock()
+
+    @property
+    def index_path(self) -> str:
+        return os.path.join(self.directory, INDEX_FILE)
+
+    @property
+    def meta_path(self) -> str:
+        return os.path.join(self.directory, META_FILE)
+
+    def exists(self) -> bool:
+        return os.path.exists(self.index_path) and os.path.exists(self.meta_path)
+
+    def __len__(self) -> int:
+        return 0 if self.index is None else self.index.ntotal
+
+    def _new_lexical(self) -> BM25Index:
+        return BM25Index(os.path.join(self.directory, LEXICAL_DIR), mmap=self.mmap)
+
+    def _disk_mtime(self):
+        mtimes = [os.path.getmtime(self.index_path)]
+        if self.lexical is not None and os.path.exists(self.lexical.meta_path):
+            mtimes.append(os.path.getmtime(self.lexical.meta_path))
+        return tuple(mtimes)
+
+    def _apply_search_params(self, index):
+        if isinstance(index, faiss.IndexIVF):
+            index.nprobe = self.nprobe
+        elif isinstance(index, faiss.IndexHNSW):
+            index.hnsw.efSearch = self.ef_search
+
+    def load(self, mmap: Optional[bool] = None):
+        """从磁盘加载；mmap=True 时索引数据按需从磁盘映射（只读）"""
+        mmap = self.mmap if mmap is None else mmap
+        with self._lock:
+            with open(self.meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            self.kind, self.dim = meta["kind"], meta["dim"]
+            mtime = self._disk_mtime()
+            flags = faiss.IO_FLAG_MMAP if mmap else 0
+            index = faiss.read_index(self.index_path, flags)
+            self._apply_search_params(index)
+            self.index = index
+            self.store.refresh()
+            if self.lexical is not None:
+                self.lexical = self._new_lexical()
+                if self.lexical.exists():
+                    self.lexical.load(mmap)
+            self._loaded_mtime = mtime
+            self._last_check = time.monotonic()
+        logger.info(f"Passage index loaded: {self.kind}, {index.ntotal} vectors, mmap={mmap}")
+        return self
+
+    def reload_if_changed(self):
+        """磁盘索引被其他进程更新后重新加载（最多每 RELOAD_CHECK_SECONDS 秒检查一次）"""
+        now = time.monotonic()
+        if now - self._last_check < RELOAD_CHECK_SECONDS:
+            return
+        self._last_check = now
+        try:
+            mtime = self._disk_mtime()
+        except OSError:
+            return
+        if mtime != self._loaded_mtime:
+            logger.info("Passage index changed on disk, reloading")
+            self.load()
+
+    def save(self):
+        """原子写入索引文件；向量索引先落盘，BM25 随后（BM25 落后时由 sync_lexical 补齐）"""
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock:
+            tmp = f"{self.index_path}.tmp.{os.getpid()}"
+            faiss.write_index(self.index, tmp)
+            os.replace(tmp, self.index_path)
+            with open(self.meta_path, "w", encoding="utf-8") as f:
+                json.dump({"kind": self.kind, "dim": self.dim, "count": self.index.ntotal}, f)
+            if self.lexical is not None:
+                self.lexical.save()
+            self._loaded_mtime = self._disk_mtime()
+
+    def reset(self):
+        """清空索引（包括磁盘上的段落存储和 BM25 段），用于在空目录上重新写入"""
+        with self._lock:
+            self.index = None
+            if len(self.store):
+                self.store.truncate(0)
+            if self.lexical is not None:
+                self.lexical = self._new_lexical()
+                if self.lexical.exists():
+                    self.lexical.load()
+                    self.lexical.truncate(0)
+
+    def sync_lexical(self, batch_size: int = 10000):
+        """
+        让 BM25 与向量索引对齐（写入端在追加前调用）
+
+        丢弃超出向量索引的段（写入中途退出），再从段落存储补齐缺失的文档
+        （旧版本建立的索引没有 BM25，或 BM25 落盘前退出）。
+        """
+        if self.lexical is None:
+            return
+        with self._lock:
+            total = len(self)
+            self.lexical.truncate(total)
+            missing = total - len(self.lexical)
+            if missing <= 0:
+                return
+            logger.info(f"Building BM25 index for {missing} passages")
+            for start in range(len(self.lexical), total, batch_size):
+                ids = list(range(start, min(start + batch_size, total)))
+                self.lexical.add(ids, [p["text"] for p in self.store.get(ids)])
+            self.lexical.save()
+            self._loaded_mtime = self._disk_mtime()
+
+    @property
+    def train_size(self) -> int:
+        return TRAIN_POINTS_PER_LIST * self.nlist
+
+    def _maybe_train(self):
+        """
+        IVF 索引先把向量写入 flat 暂存索引（精确检索），累计到 train_size 条后一次训练聚类中心，
+        再把暂存的向量迁移到 IVF 索引；不会用很小的第一批数据训练出质量很差的聚类中心
+        """
+        if self.kind != "ivf" or isinstance(self.index, faiss.IndexIVF) or self.index.ntotal < self.train_size:
+            return
+        vectors = self.index.reconstruct_n(0, self.index.ntotal)
+        logger.info(f"Training ivf index on {len(vectors)} vectors")
+        index = create_index("ivf", self.dim, nlist=self.nlist)
+        index.train(vectors)
+        index.add(vectors)
+        self._apply_search_params(index)
+        self.index = index
+
+    def add(self, texts: Sequence[str], vectors: np.ndarray, sources: Optional[Sequence[str]] = None) -> List[int]:
+        """
+        追加段落和对应向量（增量写入，不重建索引）
+
+        IVF 索引累计到 train_size（39 * nlist）条向量后才训练，在此之前使用 flat 暂存索引（见 _maybe_train）。
+        """
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        if len(texts) != len(vectors):
+            raise ValueError("texts and vectors must have the same length")
+        if not len(texts):
+            return []
+        with self._lock:
+            if self.index is None:
+                self.dim = self.dim or vectors.shape[1]
+                kind = "flat" if self.kind == "ivf" else self.kind
+                self.index = create_index(kind, self.dim, nlist=self.nlist, hnsw_m=self.hnsw_m)
+                self._apply_search_params(self.index)
+
+            before = len(self.store)
+            if before != self.index.ntotal:
+                raise RuntimeError(f"Passage store ({before}) and vector index ({self.index.ntotal}) are out of sync")
+            ids = self.store.add(texts, sources)
+            try:
+                self.index.add(vectors)
+            except Exception:
+                self.store.truncate(before)
+                raise
+            if self.lexical is not None:
+                self.lexical.add(ids, texts)
+            self._maybe_train()
+        return ids
+
+    def search(self, vectors: np.ndarray, k: int = 5):
+        """返回 [[passage, ...], ...]，每个 passage 带 score 字段"""
+        vectors = np.ascontiguousarray(np.atleast_2d(vectors), dtype="float32")
+        with self._lock:
+            if self.index is None or self.index.ntotal == 0:
+                return [[] for _ in range(len(vectors))]
+            scores, ids = self.index.search(vectors, min(k, self.index.ntotal))
+        results = []
+        for row_scores, row_ids in zip(scores, ids):
+            passages = self.store.get([int(i) for i in row_ids if i >= 0])
+            hits = []
+            for passage, score in zip(passages, row_scores):
+                if passage is not None:
+                    passage["score"] = float(score)
+                    hits.append(passage)
+            results.append(hits)
+        return results
+
+    def search_lexical(self, query: str, k: int = 5) -> List[dict]:
+        """BM25 检索，返回带 score 字段的段落"""
+        if self.lexical is None:
+            return []
+        hits = self.lexical.search(query, k)
+        passages = self.store.get([doc_id for doc_id, _ in hits])
+        results = []
+        for passage, (_, score) in zip(passages, hits):
+            if passage is not None:
+                passage["score"] = score
+                results.append(passage)
+        return results
+
+
+def reciprocal_rank_fusion(rankings: Sequence[List[dict]], k: int = 60) -> List[dict]:
+    """
+    RRF 融合多路检索结果：score = Σ 1 / (k + rank)
+
+    各路得分量纲不同（余弦相似度 vs BM25），只用名次融合。段落按 id 去重，
+    返回的段落 score 为融合得分。
+    """
+    fused, passages = {}, {}
+    for ranking in rankings:
+        for rank, passage in enumerate(ranking):
+            pid = passage["id"]
+            fused[pid] = fused.get(pid, 0.0) + 1.0 / (k + rank + 1)
+            passages.setdefault(pid, passage)
+    order = sorted(fused, key=lambda pid: fused[pid], reverse=True)
+    return [dict(passages[pid], score=fused[pid]) for pid in order]
+
+
+class Retriever:
+    """
+    问题 -> top-k 段落
+
+    每个进程一个实例：索引第一次查询时才加载（懒加载），之后在进程内共享；
+    磁盘索引更新后自动重新加载。
+    hybrid=True 时向量检索和 BM25 各取 candidates 个候选，RRF 融合后取前 top_k 个。
+    """
+
+    def __init__(
+        self,
+        index: PassageIndex,
+        embed: Callable[[List[str]], np.ndarray],
+        top_k: int = 3,
+        hybrid: bool = True,
+        candidates: int = 20,
+        rrf_k: int = 60,
+    ):
+        self.index = index
+        self.embed = embed
+        self.top_k = top_k
+        self.hybrid = hybrid
+        self.candidates = candidates
+        self.rrf_k = rrf_k
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _ensure_loaded(self) -> bool:
+        if self._loaded:
+            self.index.reload_if_changed()
+            return True
+        with self._lock:
+            if not self._loaded:
+                if not self.index.exists():
+                    return False
+                self.index.load()
+                self._loaded = True
+        return True
+
+    def available(self) -> bool:
+        """索引是否已建立（必要时触发懒加载）"""
+        return self._ensure_loaded()
+
+    def retrieve(self, question: str, k: Optional[int] = None, embedding: Optional[np.ndarray] = None) -> List[dict]:
+        """检索与问题最相关的段落；索引不存在时返回空列表"""
+        if not self._ensure_loaded():
+            return []
+        k = k or self.top_k
+        if embedding is None:
+            embedding = self.embed([question])[0]
+        if not self.hybrid or self.index.lexical is None:
+            return self.index.search(embedding, k)[0]
+        candidates = max(k, self.candidates)
+        dense = self.index.search(embedding, candidates)[0]
+        lexical = self.index.search_lexical(question, candidates)
+        return reciprocal_rank_fusion([dense, lexical], k=self.rrf_k)[:k]
@@ -0,0 +1,144 @@
+# -*- encoding: utf-8 -*-
+'''
+@Time    :   2025/10/25 21:04:33
+@Author  :   47bwy
+@Desc    :   问答记录全文检索：SQLite 使用 FTS5，PostgreSQL 使用 tsvector + GIN 索引
+
+数据库自带的分词器不切分中文（整段中文是一个词），因此写入时用 bm25.tokenize 把问题和答案切成
+中文二元组 / 英文单词，以空格分隔存入 questions.search_text（列默认值，在插入时计算），全文索引建在这一列上：
+- SQLite：外部内容 FTS5 表 questions_fts，questions 上的 INSERT / UPDATE / DELETE 触发器增量同步
+- PostgreSQL：生成列 search_vector = to_tsvector('simple', search_text)，GIN 索引，随行写入自动更新
+查询用同样的切词，所有词都要出现（AND），按 bm25 / ts_rank 排序。建表和触发器见 app/core/migrations.py。
+include_archive=True 时热表结果不足 limit 条再扫描归档（app/services/archive.py），归档结果排在后面、没有得分。
+'''
+
+from typing import List, Optional
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+
+from app.services.archive import archive_search
+from app.services.bm25 import tokenize
+
+FTS_TABLE = "questions_fts"
+
+
+class SearchUnavailableError(RuntimeError):
+    pass
+
+
+def search_document(question: Optional[str], answer: Optional[str]) -> str:
+    """写入 search_text 的内容：问题和答案切词后以空格连接"""
+    return " ".join(tokenize(question or "") + tokenize(answer or ""))
+
+
+def _is_single_cjk(term: str) -> bool:
+    return len(term) == 1 and not term.isascii()
+
+
+def match_query(query: str) -> Optional[str]:
+    """
+    FTS5 查询串：每个词加引号（英文编号如 gpt-4 按短语匹配），词之间 AND；没有可检索的词时返回 None
+
+    索引中的中文是二元组，单个汉字的查询用前缀匹配（匹配以该字开头的二元组，位于一段中文末尾的字匹配不到）。
+    """
+    terms = list(dict.fromkeys(tokenize(query)))
+    if not terms:
+        return None
+    return " AND ".join(f'"{term}"*' if _is_single_cjk(term) else f'"{term}"' for term in terms)
+
+
+def ts_query(query: str) -> Optional[str]:
+    """PostgreSQL to_tsquery 查询串，规则与 match_query 相同"""
+    terms = list(dict.fromkeys(tokenize(query)))
+    if not terms:
+        return None
+    return " & ".join(f"'{term}':*" if _is_single_cjk(term) else f"'{term}'" for term in terms)
+
+
+def _search_sql(dialect: str, user_filter: bool) -> str:
+    where_user = " AND q.user_id = :user_id" if user_filter else ""
+    if dialect == "sqlite":
+        # bm25() 越小越相关，取负数作为得分
+        return (
+            f"SELECT q.id, q.user_id, q.question, q.answer, q.created_at, -bm25({FTS_TABLE}) AS score "
+            f"FROM {FTS_TABLE} JOIN questions q ON q.id = {FTS_TABLE}.rowid "
+            f"WHERE {FTS_TABLE} MATCH :query{where_user} ORDER BY bm25({FTS_TABLE}) LIMIT :limit"
+        )
+    if dialect == "postgresql":
+        return (
+            "SELECT q.id, q.user_id, q.question, q.answer, q.created_at, ts_rank(q.search_vector, query) AS score "
+            "FROM questions q, to_tsquery('simple', :query) query "
+            f"WHERE q.search_vector @@ query{where_user} ORDER BY score DESC LIMIT :limit"
+        )
+    raise SearchUnavailableError(f"Full-text search is not supported on {dialect}")
+
+
+def _search_params(dialect: str, query: str, limit: int, user_id: Optional[str]) -> Optional[dict]:
+    query = match_query(query) if dialect == "sqlite" else ts_query(query)
+    if not query:
+        return None
+    params = {"query": query, "limit": limit}
+    if user_id is not None:
+        params["user_id"] = user_id
+    return params
+
+
+def _results(rows) -> List[dict]:
+    return [
+        {
+            "id": row.id,
+            "user_id": row.user_id,
+            "question": row.question,
+            "answer": row.answer,
+            "created_at": str(row.created_at) if row.created_at is not None else None,
+            "score": round(float(row.score), 6),
+        }
+        for row in rows
+    ]
+
+
+def _with_archive(results: List[dict], query: str, limit: int, user_id: Optional[str]) -> List[dict]:
+    if len(results) >= limit:
+        return results
+    seen = {result["id"] for result in results}
+    archived = archive_search(query, limit - len(results) + len(seen), user_id)
+    return (results + [result for result in archived if result["id"] not in seen])[:limit]
+
+
+def search_questions(
+    db: Session, query: str, limit: int = 20, user_id: Optional[str] = None, include_archive: bool = False
+) -> List[dict]:
+    """全文检索问答记录；user_id 为 None 时检索所有用户的记录"""
+    dialect = db.get_bind().dialect.name
+    params = _search_params(dialect, query, limit, user_id)
+    if params is None:
+        return []
+    try:
+        rows = db.execute(text(_search_sql(dialect, user_id is not None)), params).all()
+    except DBAPIError as e:
+        raise SearchUnavailableError(f"Full-text search failed: {e}") from e
+    results = _results(rows)
+    return _with_archive(results, query, limit, user_id) if include_archive else results
+
+
+async def search_questions_async(
+    db, query: str, limit: int = 20, user_id: Optional[str] = None, include_archive: bool = False
+) -> List[dict]:
+    """db 可以是 AsyncSession，也可以是同步 Session（在线程池中执行）；扫描归档在线程池中执行"""
+    if isinstance(db, Session):
+        return await run_in_threadpool(search_questions, db, query, limit, user_id, include_archive)
+    dialect = db.get_bind().dialect.name
+    params = _search_params(dialect, query, limit, user_id)
+    if params is None:
+        return []
+    try:
+        rows = (await db.execute(text(_search_sql(dialect, user_id is not None)), params)).all()
+    except DBAPIError as e:
+        raise SearchUnavailableError(f"Full-text search failed: {e}") from e
+    results = _results(rows)
+    if include_archive:
+        results = await run_in_threadpool(_with_archive, results, query, limit, user_id)
+    return results
@@ -0,0 +1,196 @@
+# -*- encoding: utf-8 -*-
+'''
+@Time    :   2025/10/19 16:47:12
+@Author  :   47bwy
+@Desc    :   语义缓存：问题向量化后在 FAISS 内存索引中查找近似问题，复用已有答案
+'''
+
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+import faiss
+import numpy as np
+
+from app.core.logger import get_logger
+
+logger = get_logger(__name__)
+
+# 索引和元数据写在同一个文件里（npz：序列化的 FAISS 索引 + JSON 元数据），一次 rename 原子替换，
+# prefork 的多个子进程同时保存时也不会出现索引和元数据来自不同进程的情况
+SNAPSHOT_FILE = "semantic_cache.npz"
+
+
+class SemanticCache:
+    """
+    近似问题缓存
+
+    - 向量需要先做 L2 归一化，内积即余弦相似度
+    - 相似度 >= threshold 且上下文哈希相同才算命中
+    - 容量有限，超出时按 LRU（最久未使用）或 LFU（命中次数最少）淘汰
+    - 每写入 persist_every 条或距离上次保存超过 persist_interval 秒时持久化到 persist_dir，
+      重启后从磁盘恢复；模型指纹不一致的磁盘缓存会被丢弃
+    """
+
+    def __init__(
+        self,
+        dim: int,
+        threshold: float = 0.95,
+        capacity: int = 10000,
+        policy: str = "lru",
+        persist_dir: Optional[str] = None,
+        persist_every: int = 100,
+        persist_interval: float = 300,
+        fingerprint: str = "",
+    ):
+        if policy not in ("lru", "lfu"):
+            raise ValueError(f"Unknown eviction policy: {policy}")
+        self.dim = dim
+        self.threshold = threshold
+        self.capacity = capacity
+        self.policy = policy
+        self.persist_dir = persist_dir
+        self.persist_every = persist_every
+        self.persist_interval = persist_interval
+        self.fingerprint = fingerprint
+
+        self._index = faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+        self._entries = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._dirty = 0
+        self._last_saved = time.monotonic()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    # ---- 查找与写入 ----
+
+    def lookup(self, embedding: np.ndarray, context_hash: str = "") -> Optional[str]:
+        """返回相似问题的答案，未命中返回 None"""
+        query = np.asarray(embedding, dtype="float32").reshape(1, self.dim)
+        with self._lock:
+            if not self._entries:
+                self.misses += 1
+                return None
+            scores, ids = self._index.search(query, min(8, len(self._entries)))
+            for score, entry_id in zip(scores[0], ids[0]):
+                if entry_id < 0 or score < self.threshold:
+                    break
+                entry = self._entries.get(int(entry_id))
+                if entry is None or entry["context_hash"] != context_hash:
+                    continue
+                entry["hits"] += 1
+                entry["last_used"] = time.time()
+                self.hits += 1
+                return entry["answer"]
+            self.misses += 1
+            return None
+
+    def add(self, question: str, embedding: np.ndarray, answer: str, context_hash: str = ""):
+        vector = np.asarray(embedding, dtype="float32").reshape(1, self.dim)
+        with self._lock:
+            while len(self._entries) >= self.capacity:
+                self._evict_one()
+            entry_id = self._next_id
+            self._next_id += 1
+            self._index.add_with_ids(vector, np.array([entry_id], dtype="int64"))
+            self._entries[entry_id] = {
+                "question": question,
+                "answer": answer,
+                "context_hash": context_hash,
+                "hits": 0,
+                "last_used": time.time(),
+            }
+            self._dirty += 1
+        self.maybe_persist()
+
+    def _evict_one(self):
+        if self.policy == "lfu":
+            victim = min(self._entries, key=lambda i: (self._entries[i]["hits"], self._entries[i]["last_used"]))
+        else:
+            victim = min(self._entries, key=lambda i: self._entries[i]["last_used"])
+        self._index.remove_ids(np.array([victim], dtype="int64"))
+        del self._entries[victim]
+        self.evictions += 1
+
+    # ---- 持久化 ----
+
+    def maybe_persist(self):
+        """满足条数或时间条件时保存到磁盘"""
+        if not self.persist_dir or not self._dirty:
+            return
+        if self._dirty >= self.persist_every or time.monotonic() - self._last_saved >= self.persist_interval:
+            self.save()
+
+    def save(self):
+        """原子写入：索引和元数据先写入同一个临时文件再 rename，避免进程中途退出或并发保存留下不一致的文件"""
+        if not self.persist_dir:
+            return
+        os.makedirs(self.persist_dir, exist_ok=True)
+        path = os.path.join(self.persist_dir, SNAPSHOT_FILE)
+        tmp = f"{path}.tmp.{os.getpid()}"
+        with self._lock:
+            meta = {
+                "dim": self.dim,
+                "fingerprint": self.fingerprint,
+                "next_id": self._next_id,
+                "entries": {str(k): v for k, v in self._entries.items()},
+            }
+            with open(tmp, "wb") as f:
+                np.savez(f, index=faiss.serialize_index(self._index), meta=np.array(json.dumps(meta, ensure_ascii=False)))
+            os.replace(tmp, path)
+            self._dirty = 0
+            self._last_saved = time.monotonic()
+        logger.info(f"Semantic cache saved: {len(self._entries)} entries -> {self.persist_dir}")
+
+    def load(self) -> bool:
+        """从 persist_dir 恢复；文件不存在、维度或模型指纹不一致、索引与元数据条数不一致时返回 False"""
+        if not self.persist_dir:
+            return False
+        path = os.path.join(self.persist_dir, SNAPSHOT_FILE)
+        if not os.path.exists(path):
+            return False
+        try:
+            with np.load(path, allow_pickle=False) as snapshot:
+                meta = json.loads(str(snapshot["meta"]))
+                if meta.get("dim") != self.dim or meta.get("fingerprint") != self.fingerprint:
+                    logger.info("Semantic cache on disk belongs to another model, ignoring it")
+                    return False
+                index = faiss.deserialize_index(snapshot["index"])
+        except Exception as e:
+            logger.warning(f"Failed to load semantic cache from {self.persist_dir}: {e}")
+            return False
+        if index.ntotal != len(meta["entries"]):
+            logger.warning(
+                f"Semantic cache on disk is inconsistent ({index.ntotal} vectors, {len(meta['entries'])} entries), ignoring it"
+            )
+            return False
+        with self._lock:
+            self._index = index
+            self._entries = {int(k): v for k, v in meta["entries"].items()}
+            self._next_id = meta["next_id"]
+            self._dirty = 0
+            while len(self._entries) > self.capacity:
+                self._evict_one()
+        logger.info(f"Semantic cache loaded: {len(self._entries)} entries from {self.persist_dir}")
+        return True
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "capacity": self.capacity,
+            "policy": self.policy,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,136 @@
+# -*- encoding: utf-8 -*-
+'''
+@Time    :   2025/10/24 19:12:40
+@Author  :   47bwy
+@Desc    :   相同问题合并：同一个问题正在推理时，后来的提交挂到同一个 task_id 上，不再重复入队
+
+热门问题会在同一时刻被提交几十次，每次都是一次完整的前向推理。提交 answer_question_task 之前
+先用 Redis SET NX 抢占归一化的 (问题, 上下文, 模型, 队列) key：
+- 抢到的请求正常提交任务，key 的值为它的 task_id
+- 没抢到的请求直接返回 key 中的 task_id，并登记为跟随者，任务完成时 worker 为跟随者补记问答记录
+key 带 TTL（single_flight_ttl），worker 崩溃没有释放时到期自动失效。
+'''
+
+import hashlib
+import threading
+from typing import List, Optional
+
+import redis
+
+from app.core.cache import content_hash
+from app.core.config import settings
+from app.core.logger import get_logger
+from app.services.answer_cache import normalize_question
+
+logger = get_logger(__name__)
+
+KEY_PREFIX = "qa:inflight"
+# 抢占与登记跟随者之间 key 被释放或过期时重试的次数
+CLAIM_ATTEMPTS = 3
+
+
+class SingleFlight:
+    """基于 Redis 的进行中任务登记（API 进程抢占 / 跟随，worker 进程释放）"""
+
+    def __init__(self, client: "redis.Redis", ttl: int = 120):
+        self.client = client
+        self.ttl = ttl
+
+        self.leaders = 0
+        self.followers = 0
+        self.releases = 0
+
+    def key(
+        self, question: str, context: Optional[str] = None, model: Optional[str] = None, queue: str = ""
+    ) -> str:
+        """归一化的合并 key；包含队列名，登录用户不会挂到访客队列里排队的任务上"""
+        digest = hashlib.sha1(
+            "\0".join([normalize_question(question), content_hash(context or "")]).encode("utf-8")
+        ).hexdigest()
+        return f"{KEY_PREFIX}:{queue}:{model or 'default'}:{digest}"
+
+    def _followers_key(self, task_id: str) -> str:
+        return f"{KEY_PREFIX}:followers:{task_id}"
+
+    def claim(self, key: str, task_id: str, user_id: str) -> Optional[str]:
+        """
+        抢占 key：抢到返回 None，调用方以 task_id 提交任务；
+        已有进行中的任务时登记为跟随者并返回该任务的 task_id
+        """
+        for _ in range(CLAIM_ATTEMPTS):
+            if self.client.set(key, task_id, nx=True, ex=self.ttl):
+                self.leaders += 1
+                return None
+            with self.client.pipeline() as pipe:
+                try:
+                    # 只有 key 在登记期间没有被 worker 释放时才登记成功，保证 worker 释放后不会漏掉跟随者
+                    pipe.watch(key)
+                    owner = pipe.get(key)
+                    if owner is None:
+                        continue
+                    followers_key = self._followers_key(owner)
+                    pipe.multi()
+                    pipe.rpush(followers_key, user_id)
+                    pipe.expire(followers_key, self.ttl)
+                    pipe.execute()
+                except redis.WatchError:
+                    continue
+            self.followers += 1
+            return owner
+        logger.warning(f"Failed to claim {key} after {CLAIM_ATTEMPTS} attempts, submitting without coalescing")
+        return None
+
+    def _delete_if_owner(self, key: str, task_id: str):
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                if pipe.get(key) != task_id:
+                    return
+                pipe.multi()
+                pipe.delete(key)
+                pipe.execute()
+            except redis.WatchError:
+                # key 在此期间过期或被新任务抢占，不属于这个任务了
+                pass
+
+    def release(self, key: str, task_id: str) -> List[str]:
+        """worker 端任务结束时释放 key（只释放自己持有的），返回登记过的跟随者用户 id"""
+        self._delete_if_owner(key, task_id)
+        followers_key = self._followers_key(task_id)
+        pipe = self.client.pipeline()
+        pipe.lrange(followers_key, 0, -1)
+        pipe.delete(followers_key)
+        followers = pipe.execute()[0]
+        self.releases += 1
+        return followers
+
+    def abandon(self, key: str, task_id: str):
+        """任务提交失败时释放抢到的 key"""
+        self._delete_if_owner(key, task_id)
+
+    def stats(self) -> dict:
+        return {"leaders": self.leaders, "followers": self.followers, "releases": self.releases, "ttl": self.ttl}
+
+
+_single_flight = None
+_single_flight_lock = threading.Lock()
+
+
+def get_single_flight() -> Optional[SingleFlight]:
+    """进程级单例；single_flight_enabled=false 时返回 None"""
+    global _single_flight
+    if not settings.single_flight_enabled:
+        return None
+    if _single_flight is None:
+        with _single_flight_lock:
+            if _single_flight is None:
+                _single_flight = SingleFlight(
+                    redis.Redis.from_url(
+                        settings.cache_url,
+                        decode_responses=True,
+                        socket_connect_timeout=0.5,
+                        socket_timeout=0.5,
+                    ),
+                    ttl=settings.single_flight_ttl,
+                )
+    return _single_flight
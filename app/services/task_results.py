@@ -0,0 +1,112 @@
+# -*- encoding: utf-8 -*-
+'''
+@Time    :   2025/10/23 14:20:51
+@Author  :   47bwy
+@Desc    :   异步任务结果查询：共享连接池的异步 Redis 客户端直接读取 Celery 结果键
+
+celery_app.AsyncResult(...).state 是同步的 Redis 往返，在 async 路由里调用会阻塞事件循环；
+这里按 Celery Redis 结果后端的键格式（celery-task-meta-<id>）异步读取，多个任务一次 MGET。
+'''
+
+import json
+from typing import Dict, List, Optional, Sequence
+
+import redis.asyncio as aioredis
+
+from app.core.config import settings
+from app.core.logger import get_logger
+
+logger = get_logger(__name__)
+
+FINAL_STATUSES = ("success", "failure")
+
+
+def _error_message(result) -> str:
+    """Celery 以 JSON 序列化保存的异常：{"exc_type": ..., "exc_message": [...]}，与 str(exception) 对齐"""
+    if not isinstance(result, dict):
+        return str(result)
+    message = result.get("exc_message")
+    if isinstance(message, (list, tuple)):
+        return str(message[0]) if len(message) == 1 else str(tuple(message))
+    return str(message if message is not None else result.get("exc_type", "unknown error"))
+
+
+def decode_meta(raw) -> dict:
+    """Celery 结果元数据 -> 与 /qa/ask/result 相同的结果字典，键不存在视为 pending"""
+    if raw is None:
+        return {"status": "pending"}
+    meta = json.loads(raw)
+    state = meta.get("status", "PENDING")
+    if state == "SUCCESS":
+        return {"status": "success", "answer": meta.get("result")}
+    if state == "FAILURE":
+        return {"status": "failure", "error": _error_message(meta.get("result"))}
+    return {"status": state.lower()}
+
+
+class TaskResultStore:
+    """异步读取任务结果（使用进程共享的连接池）"""
+
+    def __init__(self, client: "aioredis.Redis", key_func):
+        self.client = client
+        self.key_func = key_func
+        self.lookups = 0
+        self.round_trips = 0
+
+    async def get(self, task_id: str) -> dict:
+        return (await self.get_many([task_id]))[task_id]
+
+    async def get_many(self, task_ids: Sequence[str]) -> Dict[str, dict]:
+        """一次 MGET 查询多个任务"""
+        task_ids = list(dict.fromkeys(task_ids))
+        if not task_ids:
+            return {}
+        values = await self.client.mget([self.key_func(task_id) for task_id in task_ids])
+        self.lookups += len(task_ids)
+        self.round_trips += 1
+        return {task_id: decode_meta(value) for task_id, value in zip(task_ids, values)}
+
+    async def close(self):
+        await self.client.aclose()
+        await self.client.connection_pool.disconnect()
+
+    def stats(self) -> dict:
+        return {"lookups": self.lookups, "round_trips": self.round_trips}
+
+
+def _celery_key_func():
+    from worker.celery_app import celery_app
+
+    backend = celery_app.backend
+    return lambda task_id: backend.get_key_for_task(task_id)
+
+
+_store = None
+
+
+def get_task_result_store() -> Optional[TaskResultStore]:
+    """进程级单例；结果后端不是 Redis 时返回 None，调用方改用同步的 AsyncResult"""
+    global _store
+    if _store is None:
+        if not settings.backend_url.startswith(("redis://", "rediss://", "unix://")):
+            return None
+        pool = aioredis.ConnectionPool.from_url(
+            settings.backend_url,
+            max_connections=settings.result_redis_pool_size,
+            socket_connect_timeout=1,
+            socket_timeout=5,
+        )
+        _store = TaskResultStore(aioredis.Redis(connection_pool=pool), _celery_key_func())
+    return _store
+
+
+async def close_task_result_store():
+    global _store
+    if _store is not None:
+        await _store.close()
+        _store = None
+
+
+def pending_ids(results: Dict[str, dict]) -> List[str]:
+    """还没有完成（成功或失败）的任务 id"""
+    return [task_id for task_id, result in results.items() if result["status"] not in FINAL_STATUSES]
@@ -0,0 +1,114 @@
+# -*- encoding: utf-8 -*-
+'''
+@Time    :   2025/10/24 15:48:03
+@Author  :   47bwy
+@Desc    :   分级队列：访客 / 登录用户 / 批量提问分别进入不同的 Celery 队列
+
+访客问题激增时不再拖慢登录用户：每个级别有自己的队列，可以各自部署专用 worker，
+同时消费多个队列的 worker 按 queue_weights 加权轮流取任务（见 worker/priority.py），高级别不会被饿死。
+每个任务从提交到开始执行的排队耗时按级别记录到 Redis（每个级别保留最近 WAIT_SAMPLES 个样本）。
+'''
+
+from typing import Dict, Optional
+
+import redis
+
+from app.core.config import settings
+from app.core.logger import get_logger
+from app.core.redis_client import get_redis
+from app.services.batching import _percentile
+
+logger = get_logger(__name__)
+
+# 级别从高到低；user 沿用原来的 qa_queue，已部署的 worker 不需要改动即可继续处理登录用户的问题
+TIERS = ("user", "batch", "guest")
+TIER_QUEUES = {
+    "user": "qa_queue",
+    "batch": "qa_batch_queue",
+    "guest": "qa_guest_queue",
+}
+QUEUE_TIERS = {queue: tier for tier, queue in TIER_QUEUES.items()}
+
+WAIT_KEY = "qa:queue_wait:{tier}"
+WAIT_SAMPLES = 1000
+
+
+def tier_for_user(user_id: str) -> str:
+    """get_current_user 的结果 -> 级别（未登录为 guest）"""
+    return "guest" if user_id == "guest" else "user"
+
+
+def tier_queue(tier: str) -> str:
+    return TIER_QUEUES[tier]
+
+
+def parse_weights(text: str) -> Dict[str, int]:
+    """
+    解析 "user=6,batch=3,guest=1" -> {"user": 6, "batch": 3, "guest": 1}
+
+    未列出的级别权重为 1，权重至少为 1（任何级别都不会完全停止消费）。
+    """
+    weights = {tier: 1 for tier in TIERS}
+    for part in filter(None, (p.strip() for p in (text or "").split(","))):
+        tier, _, value = part.partition("=")
+        tier = tier.strip()
+        if tier not in weights:
+            raise ValueError(f"Unknown queue tier: {tier}")
+        weights[tier] = max(1, int(value))
+    return weights
+
+
+def queue_weights() -> Dict[str, int]:
+    """队列名 -> 权重"""
+    return {TIER_QUEUES[tier]: weight for tier, weight in parse_weights(settings.queue_weights).items()}
+
+
+def _metrics_client():
+    """进程内复用的客户端：task_prerun 每个任务都会记录一次排队耗时，不为每次记录新建连接"""
+    return get_redis(settings.cache_url)
+
+
+def record_queue_wait(queue: str, seconds: float, client=None):
+    """worker 开始执行任务时记录排队耗时（毫秒）；不是分级队列或 Redis 不可用时忽略"""
+    tier = QUEUE_TIERS.get(queue)
+    if tier is None:
+        return
+    try:
+        client = client or _metrics_client()
+        key = WAIT_KEY.format(tier=tier)
+        pipe = client.pipeline()
+        pipe.lpush(key, round(max(seconds, 0.0) * 1000, 3))
+        pipe.ltrim(key, 0, WAIT_SAMPLES - 1)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.debug(f"Failed to record {tier} queue wait: {e}")
+
+
+def queue_stats(client=None, broker=None) -> dict:
+    """每个级别的队列积压任务数，以及最近样本的排队耗时 p50 / p95 / p99（毫秒）"""
+    client = client or _metrics_client()
+    broker = broker or get_redis(settings.broker_url)
+    weights = parse_weights(settings.queue_weights)
+    stats = {}
+    for tier in TIERS:
+        samples = [float(v) for v in client.lrange(WAIT_KEY.format(tier=tier), 0, -1)]
+        stats[tier] = {
+            "queue": TIER_QUEUES[tier],
+            "weight": weights[tier],
+            "depth": _queue_depth(broker, TIER_QUEUES[tier]),
+            "wait_ms": {
+                "samples": len(samples),
+                "p50": round(_percentile(samples, 50), 3),
+                "p95": round(_percentile(samples, 95), 3),
+                "p99": round(_percentile(samples, 99), 3),
+            },
+        }
+    return stats
+
+
+def _queue_depth(broker, queue: str) -> Optional[int]:
+    try:
+        return broker.llen(queue)
+    except redis.RedisError as e:
+        logger.warning(f"Failed to read depth of {queue}: {e}")
+        return None
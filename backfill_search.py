@@ -0,0 +1,36 @@
+# -*- encoding: utf-8 -*-
+'''
+@Time    :   2025/10/27 15:12:36
+@Author  :   47bwy
+@Desc    :   为已有问答记录一次性回填全文检索的切词文本（questions.search_text）
+
+应用启动时只建列和全文索引，不再回填已有记录（百万级的表切词耗时很长，会阻塞启动）。
+升级后执行一次即可；按批提交，回填时触发器 / 生成列同步更新全文索引，可以在服务运行时执行，中断后重新执行会接着回填。
+
+使用方式：
+    python backfill_search.py                   # 默认每批 10000 条
+    python backfill_search.py --batch-size 2000
+'''
+
+import argparse
+import sys
+
+from app.core.db import engine
+from app.core.migrations import BACKFILL_BATCH_SIZE, backfill_search_text, run_migrations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="回填 questions.search_text")
+    parser.add_argument("--batch-size", type=int, default=BACKFILL_BATCH_SIZE, help="每批回填的记录数")
+    args = parser.parse_args()
+    if args.batch_size <= 0:
+        print("❌ --batch-size 必须大于 0")
+        sys.exit(1)
+
+    run_migrations(engine)
+    total = backfill_search_text(engine, batch_size=args.batch_size)
+    print(f"✅ 已回填 {total} 条记录的检索文本")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+# -*- encoding: utf-8 -*-
+'''
+@Time    :   2025/10/21 11:48:03
+@Author  :   47bwy
+@Desc    :   BM25 检索延迟：不同语料规模下的单条查询耗时
+
+使用方式（在项目根目录）：
+    python -m benchmarks.bench_bm25
+    python -m benchmarks.bench_bm25 --sizes 100000 1000000 --doc-len 200
+
+用常用汉字随机拼出段落（长度 doc-len 个字），查询从语料中随机截取片段并混入一个编号。
+'''
+
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+from app.services.bm25 import BM25Index
+
+# 常用汉字区间内取前 3000 个字，近似真实语料的字分布（按 Zipf 分布抽样）
+CHARS = [chr(c) for c in range(0x4E00, 0x4E00 + 3000)]
+
+
+def make_corpus(size, doc_len, seed=0):
+    rng = np.random.default_rng(seed)
+    ranks = np.minimum(rng.zipf(1.2, size=(size, doc_len)) - 1, len(CHARS) - 1)
+    for i, row in enumerate(ranks):
+        yield "".join(CHARS[r] for r in row) + f" CODE-{i}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="BM25 检索延迟基准测试")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 500000])
+    parser.add_argument("--doc-len", type=int, default=150)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--batch", type=int, default=10000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(1)
+    print(f"{'段落数':>10}{'构建 s':>10}{'段数':>6}{'p50 ms':>10}{'p99 ms':>10}{'编号命中率':>12}")
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            index = BM25Index(tmp)
+            started = time.perf_counter()
+            ids, texts, samples = [], [], []
+            sample_ids = set(rng.choice(size, size=min(args.queries, size), replace=False).tolist())
+            for doc_id, text in enumerate(make_corpus(size, args.doc_len)):
+                ids.append(doc_id)
+                texts.append(text)
+                if doc_id in sample_ids:
+                    start = int(rng.integers(0, args.doc_len - 12))
+                    samples.append((doc_id, f"{text[start:start + 12]} CODE-{doc_id}"))
+                if len(ids) >= args.batch:
+                    index.add(ids, texts)
+                    ids, texts = [], []
+            index.add(ids, texts)
+            index.save()
+            build_s = time.perf_counter() - started
+
+            loaded = BM25Index(tmp).load(mmap=True)
+            for _, query in samples[:10]:
+                loaded.search(query, args.k)
+            latencies, hits = [], 0
+            for doc_id, query in samples:
+                t = time.perf_counter()
+                result = loaded.search(query, args.k)
+                latencies.append((time.perf_counter() - t) * 1000)
+                hits += bool(result) and result[0][0] == doc_id
+            latencies.sort()
+            p50 = latencies[len(latencies) // 2]
+            p99 = latencies[max(0, int(len(latencies) * 0.99) - 1)]
+            print(
+                f"{size:>10}{build_s:>10.1f}{len(loaded.segments):>6}"
+                f"{p50:>10.2f}{p99:>10.2f}{hits / len(samples):>12.2%}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+# -*- encoding: utf-8 -*-
+'''
+@Time    :   2025/10/22 18:10:44
+@Author  :   47bwy
+@Desc    :   独立模型服务 vs 每个子进程各自加载模型：吞吐量与内存
+
+使用方式（在项目根目录）：
+    python -m benchmarks.bench_model_server
+    python -m benchmarks.bench_model_server --workers 8 --requests 50 --context-chars 800
+
+每种模式启动 --workers 个客户端进程（模拟 prefork 子进程），各自串行发送 --requests 个请求：
+- local：每个进程自己加载模型（当前的默认方式）
+- server：一个模型服务进程持有模型并合并批处理，客户端只加载 tokenizer
+内存取所有相关进程的 USS / PSS 合计（PSS 把共享页按进程数分摊，更接近真实占用）。
+'''
+
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+
+import psutil
+
+from app.core.config import settings
+from worker_memory_report import memory_row
+
+QUESTION = "北京是哪个国家的首都？"
+CONTEXT = "北京是中华人民共和国的首都，也是全国的政治、文化和国际交往中心。"
+
+
+def _serve(socket_path, ready):
+    from app.services.llm_services import get_registry
+    from app.services.model_server import create_server
+
+    get_registry().peek()
+    server = create_server(socket_path)
+    ready.put(os.getpid())
+    server.serve_forever()
+
+
+def _client(socket_path, requests, context, ready, start, done, results):
+    settings.model_server_socket = socket_path or ""
+    settings.model_server_fallback = False
+    settings.batch_enabled = False
+    from app.services import llm_services
+
+    llm_services.get_answer(QUESTION, context)
+    ready.put(os.getpid())
+    start.wait()
+    started = time.perf_counter()
+    for _ in range(requests):
+        llm_services.get_answer(QUESTION, context)
+    results.put(time.perf_counter() - started)
+    done.wait()
+
+
+def run(mode, workers, requests, context):
+    ctx = multiprocessing.get_context("spawn")
+    ready, results = ctx.Queue(), ctx.Queue()
+    start, done = ctx.Event(), ctx.Event()
+    socket_path = None
+    pids = []
+
+    server = None
+    if mode == "server":
+        socket_path = os.path.join(tempfile.mkdtemp(prefix="qa-bench-"), "model.sock")
+        server = ctx.Process(target=_serve, args=(socket_path, ready))
+        server.start()
+        pids.append(ready.get(timeout=600))
+
+    clients = [
+        ctx.Process(target=_client, args=(socket_path, requests, context, ready, start, done, results))
+        for _ in range(workers)
+    ]
+    for proc in clients:
+        proc.start()
+    for _ in clients:
+        pids.append(ready.get(timeout=600))
+
+    started = time.perf_counter()
+    start.set()
+    elapsed = [results.get(timeout=3600) for _ in clients]
+    wall = time.perf_counter() - started
+
+    rows = [memory_row(psutil.Process(pid)) for pid in pids]
+    done.set()
+    for proc in clients:
+        proc.join()
+    if server is not None:
+        server.terminate()
+        server.join()
+
+    total = workers * requests
+    return {
+        "mode": mode,
+        "throughput": total / wall,
+        "latency_ms": sum(elapsed) / total * 1000,
+        "uss_mb": sum(row["uss"] for row in rows),
+        "pss_mb": sum(row["pss"] for row in rows),
+        "rss_mb": sum(row["rss"] for row in rows),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="独立模型服务吞吐量与内存基准")
+    parser.add_argument("--workers", type=int, default=4, help="客户端进程数")
+    parser.add_argument("--requests", type=int, default=30, help="每个客户端的请求数")
+    parser.add_argument("--context-chars", type=int, default=0, help="上下文长度（0 使用默认短上下文）")
+    parser.add_argument("--modes", nargs="+", choices=["local", "server"], default=["local", "server"])
+    args = parser.parse_args()
+
+    context = (CONTEXT * (args.context_chars // len(CONTEXT) + 1))[:args.context_chars] if args.context_chars else CONTEXT
+    print(f"模型: {settings.local_model}, 后端: {settings.inference_backend}")
+    print(f"客户端进程: {args.workers}, 每个 {args.requests} 个请求, 上下文 {len(context)} 字\n")
+    print(f"{'模式':<8}{'吞吐 req/s':>12}{'平均延迟 ms':>14}{'USS 合计 MB':>14}{'PSS 合计 MB':>14}{'RSS 合计 MB':>14}")
+    for mode in args.modes:
+        r = run(mode, args.workers, args.requests, context)
+        print(
+            f"{r['mode']:<8}{r['throughput']:>12.1f}{r['latency_ms']:>14.1f}"
+            f"{r['uss_mb']:>14.1f}{r['pss_mb']:>14.1f}{r['rss_mb']:>14.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# -*- encoding: utf-8 -*-
+'''
+@Time    :   2025/10/20 14:02:31
+@Author  :   47bwy
+@Desc    :   向量检索延迟：flat / ivf / hnsw 在不同段落规模下的单条查询耗时
+
+使用方式（在项目根目录）：
+    python -m benchmarks.bench_retrieval
+    python -m benchmarks.bench_retrieval --sizes 100000 1000000 --types ivf hnsw
+
+使用随机单位向量模拟段落向量（768 维与 bert-base 一致），不需要加载模型。
+'''
+
+import argparse
+import tempfile
+import time
+
+import faiss
+import numpy as np
+
+from app.services.retrieval import PassageIndex, create_index
+
+
+def _unit_vectors(n, dim, seed):
+    rng = np.random.default_rng(seed)
+    out = np.empty((n, dim), dtype="float32")
+    step = 100000
+    for i in range(0, n, step):
+        block = rng.standard_normal((min(step, n - i), dim), dtype="float32")
+        out[i:i + len(block)] = block / np.linalg.norm(block, axis=1, keepdims=True)
+    return out
+
+
+def bench(kind, vectors, queries, k, nlist, nprobe, ef_search, mmap):
+    dim = vectors.shape[1]
+    index = create_index(kind, dim, nlist=nlist)
+    started = time.perf_counter()
+    if not index.is_trained:
+        index.train(vectors[: min(len(vectors), 64 * nlist)])
+    index.add(vectors)
+    build_s = time.perf_counter() - started
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # 通过 PassageIndex 的加载路径（含 mmap）测量查询延迟
+        path = f"{tmp}/passages.faiss"
+        faiss.write_index(index, path)
+        del index
+        loaded = PassageIndex(tmp, kind=kind, nprobe=nprobe, ef_search=ef_search)
+        loaded.index = faiss.read_index(path, faiss.IO_FLAG_MMAP if mmap else 0)
+        loaded._apply_search_params(loaded.index)
+
+        for q in queries[:10]:
+            loaded.index.search(q[None, :], k)
+        latencies = []
+        for q in queries:
+            t = time.perf_counter()
+            loaded.index.search(q[None, :], k)
+            latencies.append((time.perf_counter() - t) * 1000)
+    latencies.sort()
+    return build_s, latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="向量检索延迟基准测试")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--types", nargs="+", default=["flat", "ivf", "hnsw"])
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--nlist", type=int, default=1024)
+    parser.add_argument("--nprobe", type=int, default=16)
+    parser.add_argument("--ef-search", type=int, default=64)
+    parser.add_argument("--no-mmap", action="store_true")
+    args = parser.parse_args()
+
+    queries = _unit_vectors(args.queries, args.dim, seed=1)
+    print(f"{'类型':<8}{'段落数':>10}{'构建 s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for size in args.sizes:
+        vectors = _unit_vectors(size, args.dim, seed=0)
+        for kind in args.types:
+            nlist = min(args.nlist, max(1, size // 39))
+            build_s, p50, p99 = bench(kind, vectors, queries, args.k, nlist, args.nprobe, args.ef_search, not args.no_mmap)
+            print(f"{kind:<8}{size:>10}{build_s:>10.1f}{p50:>10.2f}{p99:>10.2f}")
+        del vectors
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# -*- encoding: utf-8 -*-
+'''
+@Time    :   2025/10/19 11:02:44
+@Author  :   47bwy
+@Desc    :   分词耗时占端到端推理耗时的比例：慢速 tokenizer vs fast tokenizer + 上下文缓存
+
+使用方式（在项目根目录）：
+    python -m benchmarks.bench_tokenization
+    python -m benchmarks.bench_tokenization --requests 200 --contexts 10 --context-chars 3000
+'''
+
+import argparse
+import random
+import time
+
+from transformers import BertTokenizer, BertTokenizerFast
+
+from app.core.cache import LRUCache
+from app.core.config import settings
+from app.services import llm_services
+
+
+def _make_workload(num_requests: int, num_contexts: int, context_chars: int, seed: int = 0):
+    """构造 num_contexts 篇上下文，num_requests 个问题随机落在这些上下文上（模拟同一文档被反复提问）"""
+    rng = random.Random(seed)
+    alphabet = "北京上海中国首都长城历史文化经济人口面积城市发展位于东部是的在有和"
+    contexts = ["".join(rng.choice(alphabet) for _ in range(context_chars)) for _ in range(num_contexts)]
+    questions = ["".join(rng.choice(alphabet) for _ in range(rng.randint(6, 20))) for _ in range(num_requests)]
+    return [(q, rng.choice(contexts)) for q in questions]
+
+
+def run(tokenizer, backend, workload, cache):
+    """
+    逐个请求执行完整的阅读流程，返回 (分词总耗时, 端到端总耗时)
+
+    通过包装 llm_services.build_features 单独统计分词（含窗口切分）耗时。
+    """
+    timings = {"tokenize": 0.0}
+    original = llm_services.build_features
+
+    def timed_build_features(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return original(*args, **kwargs)
+        finally:
+            timings["tokenize"] += time.perf_counter() - started
+
+    llm_services.build_features = timed_build_features
+    llm_services._context_cache = cache
+    try:
+        total_s = 0.0
+        for pair in workload:
+            started = time.perf_counter()
+            llm_services._run_reader(tokenizer, backend, [pair])
+            total_s += time.perf_counter() - started
+    finally:
+        llm_services.build_features = original
+    return timings["tokenize"], total_s
+
+
+def main():
+    parser = argparse.ArgumentParser(description="分词耗时占比基准测试")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--contexts", type=int, default=10, help="不同上下文的数量")
+    parser.add_argument("--context-chars", type=int, default=2000)
+    args = parser.parse_args()
+
+    workload = _make_workload(args.requests, args.contexts, args.context_chars)
+    _, backend = llm_services._load_backend()
+    print(f"模型: {settings.local_model}, 后端: {backend.name}")
+    print(f"请求数: {args.requests}, 上下文数: {args.contexts}, 每篇 {args.context_chars} 字\n")
+
+    variants = [
+        ("BertTokenizer（慢速，无缓存）", BertTokenizer.from_pretrained(settings.local_model), None),
+        ("BertTokenizerFast（无缓存）", BertTokenizerFast.from_pretrained(settings.local_model), None),
+        ("BertTokenizerFast + LRU 缓存", BertTokenizerFast.from_pretrained(settings.local_model), LRUCache(maxsize=1024)),
+    ]
+    print(f"{'方案':<32}{'分词 ms/请求':>14}{'端到端 ms/请求':>16}{'分词占比':>10}")
+    for name, tokenizer, cache in variants:
+        tokenize_s, total_s = run(tokenizer, backend, workload, cache)
+        per_request_tok = tokenize_s / args.requests * 1000
+        per_request_total = total_s / args.requests * 1000
+        share = per_request_tok / per_request_total if per_request_total else 0.0
+        print(f"{name:<32}{per_request_tok:>14.2f}{per_request_total:>16.2f}{share:>10.1%}")
+        if cache is not None:
+            print(f"{'':<4}缓存统计: {cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# -*- encoding: utf-8 -*-
+'''
+@Time    :   2025/10/20 11:20:08
+@Author  :   47bwy
+@Desc    :   从文本文件构建段落检索索引
+
+使用方式：
+    python build_index.py corpus.txt                 # 每行一个段落
+    python build_index.py corpus.jsonl --type hnsw   # 每行 {"text": ..., "source": ...}
+    python build_index.py more.txt --append          # 追加到已有索引
+
+不加 --append 时只删除输出目录中的索引文件后重建；目录中还有其他文件（例如 --output 指向了 ./data）时
+拒绝执行，确认无误后加 --force（仍然只删除索引文件）。
+
+IVF 索引累计到 39 * nlist 条向量后训练聚类中心，之前的数据暂存在 flat 索引中（精确检索）。
+'''
+
+import argparse
+import json
+import os
+import sys
+import time
+
+from app.core.config import settings
+from app.services.llm_services import embed_texts
+from app.services.retrieval import INDEX_ENTRIES, INDEX_TYPES, PassageIndex, remove_index_files
+from worker.ingest import MANIFEST_FILE
+
+
+def read_passages(path: str):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if path.endswith(".jsonl"):
+                item = json.loads(line)
+                yield item["text"], item.get("source", path)
+            else:
+                yield line, path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="构建段落检索索引")
+    parser.add_argument("corpus", help="段落文件（.txt 每行一段，.jsonl 每行一个对象）")
+    parser.add_argument("--type", choices=INDEX_TYPES, default=settings.retrieval_index_type)
+    parser.add_argument("--output", default=settings.retrieval_index_dir, help="索引目录")
+    parser.add_argument("--batch-size", type=int, default=4096, help="每批向量化的段落数")
+    parser.add_argument("--append", action="store_true", help="追加到已有索引，不清空目录")
+    parser.add_argument("--force", action="store_true", help="输出目录中有索引以外的文件时仍然重建（只删除索引文件）")
+    args = parser.parse_args()
+
+    index = PassageIndex(
+        args.output,
+        kind=args.type,
+        nlist=settings.retrieval_nlist,
+        nprobe=settings.retrieval_nprobe,
+        hnsw_m=settings.retrieval_hnsw_m,
+        ef_search=settings.retrieval_ef_search,
+    )
+    if args.append and index.exists():
+        index.load(mmap=False)
+        index.sync_lexical()
+    elif os.path.exists(args.output):
+        unknown = sorted(set(os.listdir(args.output)) - set(INDEX_ENTRIES) - {MANIFEST_FILE})
+        if unknown and not args.force:
+            print(f"❌ {args.output} 中有不属于段落索引的文件：{', '.join(unknown[:5])}，确认在这个目录重建索引请加 --force")
+            return 1
+        remove_index_files(args.output, extra=(MANIFEST_FILE,))
+
+    started = time.time()
+    batch_texts, batch_sources, total = [], [], 0
+
+    def flush():
+        nonlocal total
+        if batch_texts:
+            index.add(batch_texts, embed_texts(batch_texts), batch_sources)
+            total += len(batch_texts)
+            print(f"已写入 {total} 个段落（{time.time() - started:.1f}s）")
+            batch_texts.clear()
+            batch_sources.clear()
+
+    for text, source in read_passages(args.corpus):
+        batch_texts.append(text)
+        batch_sources.append(source)
+        if len(batch_texts) >= args.batch_size:
+            flush()
+    flush()
+
+    if len(index) == 0:
+        print("❌ 没有读到任何段落")
+        return 1
+    index.save()
+    print(f"✅ 索引已保存到 {args.output}: {index.kind}, {len(index)} 个段落")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -40,7 +40,7 @@ if [ -n "$WORKER_PROCESSES" ]; then
     fi
 else
     echo "   ❌ Worker 进程未运行"
-    echo "   启动命令: celery -A worker.celery_app worker --loglevel=info -Q qa_queue"
+    echo "   启动命令: celery -A worker.celery_app worker --loglevel=info -Q qa_queue,qa_batch_queue,qa_guest_queue"
 fi
 echo ""
 
@@ -0,0 +1,180 @@
+# -*- encoding: utf-8 -*-
+'''
+@Time    :   2025/10/18 19:05:26
+@Author  :   47bwy
+@Desc    :   对比 fp32 与 int8 模型：EM/F1、延迟分位数、常驻内存
+
+使用方式：
+    python compare_quantized.py data/qa_dev.jsonl
+    python compare_quantized.py data/qa_dev.jsonl --limit 200 --output report.json
+
+JSONL 每行格式：
+    {"question": "...", "context": "...", "answers": ["...", "..."]}
+    （也可以用单个 "answer" 字段）
+
+每个模型在独立的子进程中加载和评测，保证内存统计互不干扰。
+'''
+
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import resource
+import string
+import sys
+import time
+from collections import Counter
+
+PUNCTUATION = set(string.punctuation) | set("，。！？、；：“”‘’（）《》【】…—·")
+
+
+def load_dataset(path: str, limit: int = 0):
+    samples = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            answers = item.get("answers") or [item.get("answer", "")]
+            samples.append((item["question"], item["context"], [a for a in answers if a is not None]))
+            if limit and len(samples) >= limit:
+                break
+    return samples
+
+
+def normalize_answer(text: str) -> str:
+    """去掉空白和标点；中文 tokenizer 解码出的答案字之间带空格，这里统一去掉"""
+    text = re.sub(r"\s+", "", text.lower())
+    return "".join(c for c in text if c not in PUNCTUATION)
+
+
+def exact_match(prediction: str, answers) -> float:
+    prediction = normalize_answer(prediction)
+    return float(any(prediction == normalize_answer(a) for a in answers))
+
+
+def f1_score(prediction: str, answers) -> float:
+    """按字符计算 F1（中文没有空格分词，按字比较更稳定）"""
+    best = 0.0
+    pred_chars = list(normalize_answer(prediction))
+    for answer in answers:
+        gold_chars = list(normalize_answer(answer))
+        common = sum((Counter(pred_chars) & Counter(gold_chars)).values())
+        if common == 0:
+            continue
+        precision = common / len(pred_chars)
+        recall = common / len(gold_chars)
+        best = max(best, 2 * precision * recall / (precision + recall))
+    return best
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def _rss_mb() -> float:
+    """当前常驻内存（Linux 读 /proc，其他平台退化为峰值内存）"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def evaluate(kind: str, dataset_path: str, limit: int, warmup: int):
+    """在子进程里加载指定后端并评测，返回指标字典"""
+    # 子进程内设置后端，再导入服务模块
+    os.environ["inference_backend"] = kind
+    from app.services import llm_services
+
+    samples = load_dataset(dataset_path, limit)
+    rss_before = _rss_mb()
+    tokenizer, backend = llm_services._load_backend()
+    rss_loaded = _rss_mb()
+
+    for question, context, _ in samples[:warmup]:
+        llm_services._run_reader(tokenizer, backend, [(question, context)])
+
+    latencies, em, f1 = [], [], []
+    predictions = []
+    for question, context, answers in samples:
+        started = time.perf_counter()
+        answer, _ = llm_services._run_reader(tokenizer, backend, [(question, context)])[0]
+        latencies.append((time.perf_counter() - started) * 1000)
+        predictions.append(answer)
+        if answers:
+            em.append(exact_match(answer, answers))
+            f1.append(f1_score(answer, answers))
+
+    return {
+        "backend": kind,
+        "samples": len(samples),
+        "exact_match": round(100 * sum(em) / len(em), 2) if em else None,
+        "f1": round(100 * sum(f1) / len(f1), 2) if f1 else None,
+        "latency_ms": {
+            "p50": round(_percentile(latencies, 50), 2),
+            "p95": round(_percentile(latencies, 95), 2),
+            "p99": round(_percentile(latencies, 99), 2),
+            "mean": round(sum(latencies) / len(latencies), 2) if latencies else 0.0,
+        },
+        "model_rss_mb": round(rss_loaded - rss_before, 1),
+        "process_rss_mb": round(_rss_mb(), 1),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "predictions": predictions,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比 fp32 与 int8 量化模型")
+    parser.add_argument("dataset", help="JSONL 格式的问答评测集")
+    parser.add_argument("--baseline", default="eager", help="基线后端（默认 eager fp32）")
+    parser.add_argument("--candidate", default="int8", help="对比后端（默认 int8）")
+    parser.add_argument("--limit", type=int, default=0, help="只评测前 N 条，0 表示全部")
+    parser.add_argument("--warmup", type=int, default=3, help="预热样本数（不计入延迟）")
+    parser.add_argument("--output", help="把完整报告写入 JSON 文件")
+    args = parser.parse_args()
+
+    # spawn 保证每个后端在全新进程中加载，内存统计不受前一个模型影响
+    ctx = multiprocessing.get_context("spawn")
+    reports = []
+    for kind in (args.baseline, args.candidate):
+        with ctx.Pool(1) as pool:
+            reports.append(pool.apply(evaluate, (kind, args.dataset, args.limit, args.warmup)))
+    baseline, candidate = reports
+
+    agreement = sum(
+        normalize_answer(a) == normalize_answer(b)
+        for a, b in zip(baseline["predictions"], candidate["predictions"])
+    ) / max(1, baseline["samples"])
+
+    print(f"{'指标':<16}{baseline['backend']:>14}{candidate['backend']:>14}{'变化':>14}")
+    rows = [
+        ("EM", baseline["exact_match"], candidate["exact_match"]),
+        ("F1", baseline["f1"], candidate["f1"]),
+        ("p50 (ms)", baseline["latency_ms"]["p50"], candidate["latency_ms"]["p50"]),
+        ("p95 (ms)", baseline["latency_ms"]["p95"], candidate["latency_ms"]["p95"]),
+        ("p99 (ms)", baseline["latency_ms"]["p99"], candidate["latency_ms"]["p99"]),
+        ("model RSS (MB)", baseline["model_rss_mb"], candidate["model_rss_mb"]),
+        ("peak RSS (MB)", baseline["peak_rss_mb"], candidate["peak_rss_mb"]),
+    ]
+    for name, base, cand in rows:
+        delta = "" if base is None or cand is None else f"{cand - base:+.2f}"
+        print(f"{name:<16}{str(base):>14}{str(cand):>14}{delta:>14}")
+    print(f"答案一致率: {agreement:.2%}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"baseline": baseline, "candidate": candidate, "agreement": agreement}, f, ensure_ascii=False, indent=2)
+        print(f"报告已写入: {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
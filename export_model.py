@@ -0,0 +1,82 @@
+# -*- encoding: utf-8 -*-
+'''
+@Time    :   2025/10/18 16:40:52
+@Author  :   47bwy
+@Desc    :   导出优化后的推理图（TorchScript / ONNX / INT8），并校验各后端答案一致
+
+使用方式：
+    python export_model.py                      # 导出 torchscript、onnx 和 int8
+    python export_model.py --format onnx        # 只导出 onnx
+    python export_model.py --check              # 导出后做一致性校验
+    python export_model.py --check-only         # 不导出，只校验已有文件
+'''
+
+import argparse
+import sys
+
+from app.core.config import settings
+from app.services import llm_services
+from app.services.backends import create_backend, export_int8, export_onnx, export_torchscript
+
+# 一致性校验用的样例：包含短上下文、超过 512 token 的长上下文和空上下文
+PARITY_SAMPLES = [
+    ("中国的首都是哪里？", "北京是中华人民共和国的首都，也是全国的政治和文化中心。"),
+    ("长城有多长？", "长城是中国古代的军事防御工程，" * 40 + "总长度超过两万千米。"),
+    ("今天天气怎么样？", " "),
+]
+
+
+def check_parity(backends, samples=PARITY_SAMPLES, atol: float = 1e-3) -> bool:
+    """用各个后端回答同一批问题，答案必须一致，得分差异不超过 atol"""
+    tokenizer = llm_services._load_tokenizer()
+    baseline = None
+    ok = True
+    for kind in backends:
+        backend = create_backend(kind, settings.local_model, load_model=lambda: llm_services._load_model()[1])
+        results = llm_services._run_reader(tokenizer, backend, samples)
+        print(f"[{kind}]")
+        for (question, _), (answer, score) in zip(samples, results):
+            print(f"  {question} -> {answer} ({score})")
+        if baseline is None:
+            baseline = (kind, results)
+            continue
+        for (answer, score), (base_answer, base_score) in zip(results, baseline[1]):
+            same_score = (score is None and base_score is None) or (
+                score is not None and base_score is not None and abs(score - base_score) <= atol
+            )
+            if answer != base_answer or not same_score:
+                print(f"  ❌ {kind} differs from {baseline[0]}: {answer!r} ({score}) vs {base_answer!r} ({base_score})")
+                ok = False
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="导出 QA 模型的优化推理图")
+    parser.add_argument("--format", choices=["torchscript", "onnx", "int8", "all"], default="all")
+    parser.add_argument("--opset", type=int, default=17, help="ONNX opset 版本")
+    parser.add_argument("--check", action="store_true", help="导出后校验 eager / torchscript / onnx 答案一致")
+    parser.add_argument("--check-only", action="store_true", help="只校验，不导出")
+    args = parser.parse_args()
+
+    print(f"模型目录: {settings.local_model}")
+    if not args.check_only:
+        _, model = llm_services._load_model()
+        model = model.cpu().eval()
+        if args.format in ("torchscript", "all"):
+            print(f"✅ TorchScript: {export_torchscript(model, settings.local_model)}")
+        if args.format in ("onnx", "all"):
+            print(f"✅ ONNX: {export_onnx(model, settings.local_model, opset=args.opset)}")
+        if args.format in ("int8", "all"):
+            print(f"✅ INT8: {export_int8(model, settings.local_model)}")
+
+    if args.check or args.check_only:
+        if check_parity(["eager", "torchscript", "onnx"]):
+            print("✅ 三个后端答案一致")
+        else:
+            print("❌ 后端答案不一致")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
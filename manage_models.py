@@ -0,0 +1,81 @@
+# -*- encoding: utf-8 -*-
+'''
+@Time    :   2025/10/22 14:36:10
+@Author  :   47bwy
+@Desc    :   管理运行时模型配置（Redis qa:models），所有 API/worker 进程自动热切换
+
+使用方式：
+    python manage_models.py list
+    python manage_models.py set default ./models/bert-qa-v2          # 默认模型切到新版本
+    python manage_models.py set small ./models/bert-small --backend int8
+    python manage_models.py remove small                            # 回到配置文件中的设置
+
+各进程最多在 model_registry_refresh_seconds 秒后读到新配置；
+已加载的模型在后台加载新版本后原子替换，进行中的请求在旧版本上完成。
+'''
+
+import argparse
+import json
+import os
+import sys
+
+import redis
+
+from app.core.config import settings
+from app.services.backends import BACKENDS
+from app.services.model_registry import (
+    ModelSpec,
+    load_spec_overrides,
+    parse_model_specs,
+    publish_spec,
+    remove_spec,
+)
+
+
+def _client():
+    return redis.Redis.from_url(settings.cache_url, decode_responses=True)
+
+
+def list_models(client):
+    configured = parse_model_specs(
+        settings.qa_models, settings.default_model, settings.local_model, settings.inference_backend
+    )
+    overrides = load_spec_overrides(client) or {}
+    print(f"{'模型':<16}{'后端':<14}{'来源':<8}路径")
+    for name in sorted(set(configured) | set(overrides)):
+        spec = overrides.get(name) or configured[name]
+        source = "redis" if name in overrides else "config"
+        marker = " (默认)" if name == settings.default_model else ""
+        print(f"{name:<16}{spec.backend:<14}{source:<8}{spec.path}{marker}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="管理运行时模型配置")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="列出模型配置")
+    set_parser = sub.add_parser("set", help="新增或替换模型")
+    set_parser.add_argument("name")
+    set_parser.add_argument("path")
+    set_parser.add_argument("--backend", choices=BACKENDS, default=settings.inference_backend)
+    remove_parser = sub.add_parser("remove", help="删除运行时配置")
+    remove_parser.add_argument("name")
+    args = parser.parse_args()
+
+    client = _client()
+    if args.command == "list":
+        list_models(client)
+    elif args.command == "set":
+        if not os.path.isdir(args.path):
+            print(f"❌ 模型目录不存在: {args.path}")
+            return 1
+        spec = ModelSpec(args.name, os.path.abspath(args.path), args.backend)
+        publish_spec(spec, client)
+        print(f"✅ 已发布 {args.name}: {json.dumps(spec.to_dict(), ensure_ascii=False)}")
+    else:
+        remove_spec(args.name, client)
+        print(f"✅ 已删除 {args.name} 的运行时配置")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
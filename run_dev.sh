@@ -54,17 +54,17 @@ case $choice in
         ;;
     2)
         echo "启动 Celery Worker..."
-        celery -A worker.celery_app worker --loglevel=info -Q qa_queue
+        celery -A worker.celery_app worker --loglevel=info -Q qa_queue,qa_batch_queue,qa_guest_queue
         ;;
     3)
         echo "请在两个终端中分别运行:"
         echo "终端1: uvicorn app.main:app --reload --host 0.0.0.0 --port 8000"
-        echo "终端2: celery -A worker.celery_app worker --loglevel=info -Q qa_queue"
+        echo "终端2: celery -A worker.celery_app worker --loglevel=info -Q qa_queue,qa_batch_queue,qa_guest_queue"
         ;;
     4)
         echo "启动所有服务..."
         # 在后台启动 Celery
-        celery -A worker.celery_app worker --loglevel=info -Q qa_queue &
+        celery -A worker.celery_app worker --loglevel=info -Q qa_queue,qa_batch_queue,qa_guest_queue &
         CELERY_PID=$!
         # 启动 Flower
         celery -A worker.celery_app flower --port=5555 &
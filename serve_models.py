@@ -0,0 +1,50 @@
+# -*- encoding: utf-8 -*-
+'''
+@Time    :   2025/10/22 17:25:03
+@Author  :   47bwy
+@Desc    :   启动独立模型服务进程
+
+使用方式：
+    python serve_models.py                                 # socket 路径取 model_server_socket
+    python serve_models.py --socket /tmp/qa-model.sock --preload default,small
+
+然后在 worker / API 的环境变量中设置 model_server_socket=/tmp/qa-model.sock。
+'''
+
+import argparse
+import signal
+import sys
+import threading
+
+from app.core.config import settings
+from app.core.logger import get_logger
+from app.services.llm_services import get_registry
+from app.services.model_server import create_server
+
+logger = get_logger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="独立模型服务进程")
+    parser.add_argument("--socket", default=settings.model_server_socket or "/tmp/qa-model.sock")
+    parser.add_argument("--preload", default=settings.default_model, help="启动时加载的模型，逗号分隔，为空不预加载")
+    args = parser.parse_args()
+
+    registry = get_registry()
+    for name in filter(None, (item.strip() for item in args.preload.split(","))):
+        registry.peek(name)
+
+    server = create_server(args.socket)
+
+    def stop(signum, frame):
+        logger.info(f"Model server received signal {signum}, shutting down")
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    server.serve_forever()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
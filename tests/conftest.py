@@ -0,0 +1,35 @@
+# -*- encoding: utf-8 -*-
+"""
+测试公共 fixture
+"""
+
+import pytest
+
+# 最小中文词表，足够覆盖测试里用到的问题和上下文
+TINY_VOCAB = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + list(
+    "的是在北京上海中国首都什么哪里谁张三李四天气很好今我你他问题答案长城有多"
+) + list("abcdefghijklmnopqrstuvwxyz0123456789")
+
+
+@pytest.fixture(scope="session")
+def tiny_model_dir(tmp_path_factory):
+    """随机初始化的小号 BertForQuestionAnswering，保存为本地模型目录"""
+    torch = pytest.importorskip("torch")
+    transformers = pytest.importorskip("transformers")
+
+    model_dir = tmp_path_factory.mktemp("tiny-bert")
+    vocab_file = model_dir / "vocab.txt"
+    vocab_file.write_text("\n".join(TINY_VOCAB), encoding="utf-8")
+    transformers.BertTokenizer(str(vocab_file)).save_pretrained(str(model_dir))
+
+    torch.manual_seed(0)
+    config = transformers.BertConfig(
+        vocab_size=len(TINY_VOCAB),
+        hidden_size=32,
+        num_hidden_layers=2,
+        num_attention_heads=2,
+        intermediate_size=64,
+        max_position_embeddings=128,
+    )
+    transformers.BertForQuestionAnswering(config).save_pretrained(str(model_dir))
+    return str(model_dir)
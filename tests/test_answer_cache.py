@@ -0,0 +1,108 @@
+# -*- encoding: utf-8 -*-
+"""
+测试答案缓存
+"""
+
+from app.services.answer_cache import AnswerCache, normalize_question
+from app.services.model_registry import model_fingerprint
+
+
+def test_normalize_question():
+    """测试问题归一化：大小写、全角、空白和结尾标点不影响 key"""
+    assert normalize_question("  What IS  BERT？ ") == normalize_question("what is bert?")
+    assert normalize_question("ＢＥＲＴ是什么？") == normalize_question("bert是什么")
+
+
+def test_local_hit_and_miss():
+    """测试进程内缓存命中与统计"""
+    cache = AnswerCache(redis_client=None, fingerprint_func=lambda: "v1")
+    assert cache.get("北京是哪里？") is None
+    cache.set("北京是哪里？", "中国首都")
+    assert cache.get("北京是哪里") == "中国首都"
+
+    stats = cache.stats()
+    assert (stats["local_hits"], stats["misses"], stats["writes"]) == (1, 1, 1)
+
+
+def test_context_is_part_of_key():
+    """测试不同上下文的同一问题不会互相命中"""
+    cache = AnswerCache(redis_client=None, fingerprint_func=lambda: "v1")
+    cache.set("谁", "张三", context="张三在北京")
+    assert cache.get("谁", context="李四在上海") is None
+    assert cache.get("谁", context="张三在北京") == "张三"
+
+
+def test_model_change_invalidates(monkeypatch):
+    """测试模型指纹变化后旧答案失效"""
+    import app.services.answer_cache as answer_cache
+
+    monkeypatch.setattr(answer_cache, "FINGERPRINT_REFRESH_SECONDS", 0)
+    version = {"value": "v1"}
+    cache = AnswerCache(redis_client=None, fingerprint_func=lambda: version["value"])
+    cache.set("问题", "旧答案")
+    assert cache.get("问题") == "旧答案"
+
+    version["value"] = "v2"
+    assert cache.get("问题") is None
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_model_fingerprint_tracks_weights(tmp_path):
+    """测试权重文件变化后模型指纹改变"""
+    weights = tmp_path / "model.safetensors"
+    weights.write_bytes(b"a")
+    before = model_fingerprint(str(tmp_path), backend="eager")
+    weights.write_bytes(b"bb")
+    assert model_fingerprint(str(tmp_path), backend="eager") != before
+    assert model_fingerprint(str(tmp_path), backend="onnx") != model_fingerprint(str(tmp_path), backend="eager")
+
+
+def test_no_answer_is_not_cached(monkeypatch):
+    """测试 worker 不缓存"无答案"，段落索引导入后同一问题可以重新推理"""
+    from app.services.llm_services import NO_ANSWER
+    from worker import tasks
+
+    cache = AnswerCache(redis_client=None, fingerprint_func=lambda: "v1")
+    monkeypatch.setattr(tasks, "get_answer_cache", lambda: cache)
+    monkeypatch.setattr(tasks, "process_question", lambda question, user_id, context=None, model=None: NO_ANSWER)
+    assert tasks.answer_question_task.apply(("长城在哪", "alice")).get() == NO_ANSWER
+    assert cache.get("长城在哪") is None
+
+
+def test_passage_index_change_invalidates_retrieval_answers(monkeypatch):
+    """测试段落索引更新（导入新文档）后，依赖检索的答案不再命中，自带上下文的答案不受影响"""
+    import app.services.answer_cache as answer_cache
+
+    monkeypatch.setattr(answer_cache, "FINGERPRINT_REFRESH_SECONDS", 0)
+    version = {"value": "1"}
+    cache = AnswerCache(redis_client=None, fingerprint_func=lambda: "v1", index_version_func=lambda: version["value"])
+    cache.set("长城在哪", "北方")
+    cache.set("谁", "张三", context="张三在北京")
+
+    version["value"] = "2"
+    assert cache.get("长城在哪") is None
+    assert cache.get("谁", context="张三在北京") == "张三"
+
+
+def test_cache_hit_records_question(monkeypatch):
+    """测试 /qa/ask 命中答案缓存时仍然保存问答记录"""
+    from fastapi.testclient import TestClient
+
+    from app.auth.auth import get_current_user
+    from app.main import app
+    from app.routers import qa
+
+    cache = AnswerCache(redis_client=None, fingerprint_func=lambda: "v1", index_version_func=lambda: "")
+    cache.set("长城在哪", "北方")
+    saved = []
+    monkeypatch.setattr(qa, "get_answer_cache", lambda: cache)
+    monkeypatch.setattr(qa, "save_questions", lambda records: saved.extend(records))
+    app.dependency_overrides[get_current_user] = lambda: "alice"
+    try:
+        with TestClient(app) as client:
+            response = client.post("/qa/ask", json={"question": "长城在哪？"}).json()
+    finally:
+        app.dependency_overrides.pop(get_current_user, None)
+
+    assert response == {"status": "success", "answer": "北方", "cached": True}
+    assert [(r["question"], r["answer"], r["user_id"]) for r in saved] == [("长城在哪？", "北方", "alice")]
@@ -0,0 +1,89 @@
+# -*- encoding: utf-8 -*-
+"""
+测试问答记录冷数据归档：按日期分区写入 Parquet 并从热表删除，历史 / 检索接口读取归档
+"""
+
+import os
+import shutil
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, func, insert, select
+from sqlalchemy.orm import sessionmaker
+
+pytest.importorskip("pandas")
+pytest.importorskip("pyarrow")
+
+from app.core.config import settings  # noqa: E402
+from app.core.db import Base  # noqa: E402
+from app.core.migrations import run_migrations  # noqa: E402
+from app.models.question import Question  # noqa: E402
+from app.services.archive import QuestionArchiver, list_partitions  # noqa: E402
+from app.services.history import get_history  # noqa: E402
+from app.services.search import search_questions  # noqa: E402
+from worker import archive as archive_tasks  # noqa: E402
+
+NOW = datetime(2025, 10, 1, 12, 0)
+CUTOFF = NOW - timedelta(days=90)
+
+
+@pytest.fixture
+def session_factory(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "archive_dir", str(tmp_path / "archive"))
+    engine = create_engine(f"sqlite:///{tmp_path / 'hot.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+    factory = sessionmaker(bind=engine)
+    # 5 条归档期之前（分布在两天）、2 条保留期内
+    created = [CUTOFF - timedelta(days=2, hours=i) for i in range(3)] + [CUTOFF - timedelta(days=1, hours=i) for i in range(2)]
+    created += [NOW - timedelta(hours=i) for i in range(2)]
+    with factory() as db:
+        db.execute(insert(Question), [
+            {"question": f"长城问题{i}", "answer": "答案", "user_id": "alice", "created_at": created_at}
+            for i, created_at in enumerate(created)
+        ])
+        db.commit()
+    yield factory
+    engine.dispose()
+
+
+def test_archive_moves_old_rows_to_partitions(session_factory):
+    """测试保留期之前的记录分批写入日期分区并从热表和全文索引中删除，重复运行不会再归档"""
+    result = QuestionArchiver(session_factory, settings.archive_dir, batch_size=2).run(CUTOFF)
+
+    assert result["archived"] == 5 and result["batches"] == 3
+    assert [day.isoformat() for day, _ in list_partitions(settings.archive_dir)] == ["2025-07-02", "2025-07-01"]
+    with session_factory() as db:
+        assert db.scalar(select(func.count()).select_from(Question)) == 2
+        assert {r["question"] for r in search_questions(db, "长城")} == {"长城问题5", "长城问题6"}
+    assert QuestionArchiver(session_factory, settings.archive_dir).run(CUTOFF)["archived"] == 0
+
+
+def test_history_and_search_continue_into_archive(session_factory):
+    """测试历史记录翻页从热表延续到归档、顺序不变且不重复，检索可以包含归档记录"""
+    QuestionArchiver(session_factory, settings.archive_dir, batch_size=2).run(CUTOFF)
+    # 模拟写入文件后、删除前崩溃：同一批记录在归档中出现两次
+    _, path = list_partitions(settings.archive_dir)[0]
+    first = sorted(os.listdir(path))[0]
+    shutil.copy(os.path.join(path, first), os.path.join(path, "part-copy.parquet"))
+
+    with session_factory() as db:
+        seen, cursor = [], None
+        while True:
+            page = get_history(db, "alice", 2, cursor, include_archive=True)
+            seen += [item["question"] for item in page["items"]]
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+        hot_only = get_history(db, "alice", 10)
+        results = search_questions(db, "长城问题0", 10, "alice", include_archive=True)
+
+    assert seen == [f"长城问题{i}" for i in (5, 6, 3, 4, 0, 1, 2)]
+    assert [item["question"] for item in hot_only["items"]] == ["长城问题5", "长城问题6"]
+    assert [(r["question"], r["archived"]) for r in results] == [("长城问题0", True)]
+
+
+def test_archive_task_disabled(monkeypatch):
+    """测试保留天数为 0 时归档任务不执行"""
+    monkeypatch.setattr(settings, "archive_retention_days", 0)
+    assert archive_tasks.archive_questions_task.apply().get()["skipped"] is True
@@ -0,0 +1,71 @@
+# -*- encoding: utf-8 -*-
+"""
+测试异步数据库路径：异步会话下的注册 / 登录、SQLite 生产模式、连接池参数
+"""
+
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+
+from app.core import db
+from app.core.db import Base, apply_sqlite_pragmas, async_database_url, engine_options
+from app.main import app
+
+pytest.importorskip("greenlet")
+pytest.importorskip("aiosqlite")
+
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine  # noqa: E402
+
+
+def test_async_url_and_pool_options():
+    """测试同步连接串转换为异步驱动，内存库不使用连接池参数"""
+    assert async_database_url("sqlite:///./test.db") == "sqlite+aiosqlite:///./test.db"
+    assert async_database_url("postgresql://u:p@h/qa") == "postgresql+asyncpg://u:p@h/qa"
+    assert "pool_size" not in engine_options("sqlite://")
+    options = engine_options("postgresql+asyncpg://u:p@h/qa")
+    assert options["pool_pre_ping"] is True and "connect_args" not in options
+
+
+def test_sqlite_production_pragmas(tmp_path):
+    """测试 SQLite 生产模式下新连接开启 WAL 和 synchronous=NORMAL"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'wal.db'}")
+    apply_sqlite_pragmas(engine)
+    with engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert conn.execute(text("PRAGMA synchronous")).scalar() == 1
+    engine.dispose()
+
+
+def test_register_and_login_with_async_session(tmp_path):
+    """测试路由使用 AsyncSession 时注册、重复注册、登录"""
+    url = f"sqlite:///{tmp_path / 'auth.db'}"
+    sync_engine = create_engine(url)
+    Base.metadata.create_all(bind=sync_engine)
+    async_engine = create_async_engine(async_database_url(url))
+    factory = async_sessionmaker(async_engine, expire_on_commit=False)
+
+    async def override():
+        async with factory() as session:
+            yield session
+
+    app.dependency_overrides[db.get_db_session] = override
+    user = {
+        "username": "asyncuser",
+        "email": "a@example.com",
+        "password": "password123",
+        "confirm_password": "password123",
+    }
+    try:
+        with TestClient(app) as client:
+            assert client.post("/auth/register", json=user).status_code == 200
+            assert client.post("/auth/register", json=user).status_code == 400
+            response = client.post("/auth/login", json={"username": "asyncuser", "password": "password123"})
+            bad = client.post("/auth/login", json={"username": "asyncuser", "password": "wrong-password1"})
+    finally:
+        app.dependency_overrides.pop(db.get_db_session, None)
+        sync_engine.dispose()
+        asyncio.run(async_engine.dispose())
+    assert response.status_code == 200 and response.json()["token_type"] == "bearer"
+    assert bad.status_code == 400
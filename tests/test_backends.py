@@ -0,0 +1,118 @@
+# -*- encoding: utf-8 -*-
+"""
+测试推理后端一致性
+"""
+
+import os
+
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+
+from app.services.backends import create_backend, export_onnx, export_torchscript
+
+
+@pytest.fixture
+def model(tiny_model_dir):
+    return transformers.BertForQuestionAnswering.from_pretrained(tiny_model_dir).eval()
+
+
+def _inputs(batch_size, seq_len):
+    torch.manual_seed(1)
+    input_ids = torch.randint(5, 40, (batch_size, seq_len))
+    attention_mask = torch.ones_like(input_ids)
+    attention_mask[0, seq_len // 2:] = 0
+    token_type_ids = torch.zeros_like(input_ids)
+    token_type_ids[:, seq_len // 3:] = 1
+    return input_ids, attention_mask, token_type_ids
+
+
+def test_unknown_backend(tiny_model_dir):
+    """测试未知后端名称"""
+    with pytest.raises(ValueError):
+        create_backend("tensorrt", tiny_model_dir)
+
+
+def test_torchscript_matches_eager(model, tiny_model_dir, tmp_path):
+    """测试 TorchScript 导出图与 eager 输出一致，且支持与 trace 时不同的形状"""
+    export_torchscript(model, str(tmp_path))
+    eager = create_backend("eager", tiny_model_dir, load_model=lambda: model)
+    scripted = create_backend("torchscript", str(tmp_path))
+
+    inputs = _inputs(3, 40)
+    for expected, actual in zip(eager(*inputs), scripted(*inputs)):
+        assert torch.allclose(expected, actual, atol=1e-5)
+
+
+def test_onnx_matches_eager(model, tiny_model_dir, tmp_path):
+    """测试 ONNX Runtime 输出与 eager 一致"""
+    pytest.importorskip("onnxruntime")
+    pytest.importorskip("onnx")
+    export_onnx(model, str(tmp_path))
+    eager = create_backend("eager", tiny_model_dir, load_model=lambda: model)
+    onnx = create_backend("onnx", str(tmp_path))
+
+    inputs = _inputs(2, 24)
+    for expected, actual in zip(eager(*inputs), onnx(*inputs)):
+        assert torch.allclose(expected, actual, atol=1e-4)
+
+
+def test_onnx_requires_export(tmp_path):
+    """测试没有导出文件时给出明确提示"""
+    pytest.importorskip("onnxruntime")
+    with pytest.raises(RuntimeError, match="export_model.py"):
+        create_backend("onnx", str(tmp_path))
+
+
+def test_int8_backend_caches_quantized_model(model, tmp_path):
+    """测试 INT8 后端首次量化后写入缓存，之后直接加载缓存"""
+    calls = []
+
+    def load_model():
+        calls.append(1)
+        return model
+
+    first = create_backend("int8", str(tmp_path), load_model=load_model)
+    assert (tmp_path / "model.int8.pt").exists()
+    second = create_backend("int8", str(tmp_path), load_model=load_model)
+    assert len(calls) == 1
+
+    inputs = _inputs(2, 24)
+    eager_start, _ = create_backend("eager", str(tmp_path), load_model=lambda: model)(*inputs)
+    cached_start, _ = second(*inputs)
+    assert torch.allclose(first(*inputs)[0], cached_start)
+    # 量化误差应当很小
+    assert torch.allclose(eager_start, cached_start, atol=0.1)
+
+
+def test_stale_export_is_not_loaded(model, tmp_path):
+    """测试权重文件比导出图新时，TorchScript 重新 trace、ONNX 要求重新导出"""
+    export_torchscript(model, str(tmp_path))
+    weights = tmp_path / "model.safetensors"
+    weights.write_bytes(b"")
+    newer = os.path.getmtime(tmp_path / "model.torchscript.pt") + 10
+    os.utime(weights, (newer, newer))
+
+    calls = []
+
+    def load_model():
+        calls.append(1)
+        return model
+
+    create_backend("torchscript", str(tmp_path), load_model=load_model)
+    assert calls == [1]
+
+    pytest.importorskip("onnxruntime")
+    (tmp_path / "model.onnx").write_bytes(b"")
+    os.utime(tmp_path / "model.onnx", (newer - 20, newer - 20))
+    with pytest.raises(RuntimeError, match="older than model weights"):
+        create_backend("onnx", str(tmp_path))
+
+
+def test_export_restores_return_dict(model, tmp_path):
+    """测试导出后恢复模型原来的 return_dict 设置"""
+    for value in (False, True):
+        model.config.return_dict = value
+        export_torchscript(model, str(tmp_path))
+        assert model.config.return_dict is value
@@ -0,0 +1,166 @@
+# -*- encoding: utf-8 -*-
+"""
+测试批量提问：切块提交、批量推理、批次进度与逐条结果
+"""
+
+import json
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from app.auth.auth import get_current_user
+from app.core.config import settings
+from app.main import app
+from app.routers import qa
+from app.services import batch_jobs, llm_services
+from app.services.batch_jobs import create_batch, get_batch, iter_chunks, record_chunk
+from worker import tasks
+
+
+@pytest.fixture
+def redis_client(monkeypatch):
+    client = fakeredis.FakeRedis()
+    monkeypatch.setattr(batch_jobs, "_client", lambda: client)
+    return client
+
+
+class _Session:
+    def __init__(self):
+        self.added = []
+        self.commits = 0
+
+    def add_all(self, records):
+        self.added.extend(records)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_batch_progress_and_ordered_results(redis_client):
+    """测试各块乱序完成时结果仍按提交顺序返回，部分块失败时状态为 partial"""
+    assert [offset for offset, _ in iter_chunks(list(range(5)), 2)] == [0, 2, 4]
+
+    create_batch("b1", "alice", total=5, chunks=3)
+    assert get_batch("b1")["status"] == "pending"
+    record_chunk("b1", 2, answers=["c", "d"])
+    record_chunk("b1", 4, error="boom", count=1)
+    progress = record_chunk("b1", 0, answers=["a", "b"])
+    assert progress == {"total": 5, "done": 4, "failed": 1}
+
+    batch = get_batch("b1")
+    assert batch["status"] == "partial"
+    assert [r.get("answer") for r in batch["results"]] == ["a", "b", "c", "d", None]
+    assert batch["results"][4] == {"status": "failure", "error": "boom"}
+    assert get_batch("missing") is None
+
+
+def test_redelivered_chunk_is_counted_once(redis_client):
+    """测试同一块被重复记录（acks_late 重投递）时不重复计数，失败后重试成功的块转为成功"""
+    create_batch("b2", "alice", total=4, chunks=2)
+    record_chunk("b2", 0, answers=["a", "b"])
+    assert record_chunk("b2", 0, answers=["a", "b"]) == {"total": 4, "done": 2, "failed": 0}
+    assert record_chunk("b2", 0, error="worker lost", count=2) == {"total": 4, "done": 2, "failed": 0}
+
+    record_chunk("b2", 2, error="boom", count=2)
+    assert record_chunk("b2", 2, error="boom", count=2) == {"total": 4, "done": 2, "failed": 2}
+    assert record_chunk("b2", 2, answers=["c", "d"]) == {"total": 4, "done": 4, "failed": 0}
+
+    batch = get_batch("b2")
+    assert batch["status"] == "success"
+    assert [r["answer"] for r in batch["results"]] == ["a", "b", "c", "d"]
+
+
+def test_process_questions_one_forward_per_model(monkeypatch):
+    """测试同一模型的所有问题合并成一次批量阅读，整批一次提交到数据库"""
+    calls = []
+
+    def read_batch(pairs, model=None):
+        calls.append((model, list(pairs)))
+        return [(f"{question}@{context}", 1.0) for question, context in pairs]
+
+    monkeypatch.setattr(llm_services, "_read_batch", read_batch)
+    monkeypatch.setattr(llm_services, "get_semantic_cache", lambda: None)
+    monkeypatch.setattr(llm_services, "get_retriever", lambda: None)
+    monkeypatch.setattr(llm_services.model_registry, "model_version", lambda model=None: "v1")
+    session = _Session()
+
+    answers = llm_services.process_questions(
+        [
+            {"question": "q1", "context": "c1"},
+            {"question": "q2", "context": "c2", "model": "m"},
+            {"question": "q3", "context": "c3"},
+        ],
+        "alice",
+        db=session,
+    )
+    assert answers == ["q1@c1", "q2@c2", "q3@c3"]
+    assert sorted(len(pairs) for _, pairs in calls) == [1, 2]
+    assert [r.user_id for r in session.added] == ["alice"] * 3 and session.commits == 1
+
+
+def test_batch_endpoint_runs_chunks(redis_client, monkeypatch):
+    """测试 /qa/ask/batch 按块提交任务，完成后可查询逐条结果并通过 SSE 收到 done 事件"""
+    monkeypatch.setattr(settings, "ask_batch_chunk_size", 2)
+    monkeypatch.setattr(settings, "answer_cache_enabled", False)
+    monkeypatch.setattr(tasks, "publish_progress", lambda batch_id, progress: True)
+    monkeypatch.setattr(
+        tasks, "process_questions", lambda items, user_id: [f"答案:{item['question']}" for item in items]
+    )
+    chunk_sizes = []
+
+    def run_group(signatures):
+        signatures = list(signatures)
+        chunk_sizes.extend(len(sig.args[0]) for sig in signatures)
+        return SimpleNamespace(apply_async=lambda: [tasks.answer_batch_task.run(*sig.args) for sig in signatures])
+
+    monkeypatch.setattr(qa, "group", run_group)
+    questions = [{"question": f"问题{i}"} for i in range(5)]
+    with TestClient(app) as client:
+        assert client.post("/qa/ask/batch", json={"questions": questions}).status_code == 403
+
+        app.dependency_overrides[get_current_user] = lambda: "alice"
+        try:
+            submitted = client.post("/qa/ask/batch", json={"questions": questions}).json()
+            batch = client.get(f"/qa/ask/batch/{submitted['batch_id']}").json()
+            with client.stream("GET", f"/qa/ask/batch/{submitted['batch_id']}/stream") as response:
+                body = response.read().decode("utf-8")
+        finally:
+            app.dependency_overrides.pop(get_current_user, None)
+
+    assert submitted["total"] == 5 and submitted["chunks"] == 3 and chunk_sizes == [2, 2, 1]
+    assert batch["status"] == "success" and batch["done"] == 5
+    assert [r["answer"] for r in batch["results"]] == [f"答案:问题{i}" for i in range(5)]
+    done = json.loads(body.split("event: done\ndata: ", 1)[1].split("\n", 1)[0])
+    assert done["results"] == batch["results"]
+
+
+def test_batch_cache_hits_are_recorded(redis_client, monkeypatch):
+    """测试批量提问中命中答案缓存的问题也保存问答记录，其余问题交给 process_questions"""
+    from app.services.answer_cache import AnswerCache
+
+    cache = AnswerCache(redis_client=None, fingerprint_func=lambda: "v1", index_version_func=lambda: "")
+    cache.set("问题0", "缓存答案")
+    saved, computed = [], []
+    monkeypatch.setattr(tasks, "get_answer_cache", lambda: cache)
+    monkeypatch.setattr(tasks, "publish_progress", lambda batch_id, progress: True)
+    monkeypatch.setattr(tasks, "save_questions", lambda records: saved.extend(records))
+
+    def process_questions(items, user_id):
+        computed.extend(item["question"] for item in items)
+        return ["新答案"] * len(items)
+
+    monkeypatch.setattr(tasks, "process_questions", process_questions)
+    create_batch("b3", "alice", total=2, chunks=1)
+    assert tasks.answer_batch_task.run([{"question": "问题0"}, {"question": "问题1"}], "alice", "b3", 0) == 2
+
+    assert computed == ["问题1"]
+    assert [(r["question"], r["answer"], r["user_id"]) for r in saved] == [("问题0", "缓存答案", "alice")]
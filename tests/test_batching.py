@@ -0,0 +1,101 @@
+# -*- encoding: utf-8 -*-
+"""
+测试动态微批处理
+"""
+
+import threading
+
+import pytest
+
+from app.services.batching import MicroBatcher
+
+
+def test_concurrent_requests_are_batched():
+    """测试并发请求被合并，且每个调用方拿到自己的结果"""
+    seen_batches = []
+
+    def handler(items):
+        seen_batches.append(len(items))
+        return [item * 2 for item in items]
+
+    batcher = MicroBatcher(handler, max_batch_size=8, max_wait_ms=50)
+    barrier = threading.Barrier(8)
+    results = {}
+
+    def worker(i):
+        barrier.wait()
+        results[i] = batcher.submit(i).result(timeout=5)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    batcher.close()
+
+    assert results == {i: i * 2 for i in range(8)}
+    assert max(seen_batches) > 1
+    assert sum(seen_batches) == 8
+
+
+def test_batch_size_is_capped():
+    """测试批大小不超过 max_batch_size"""
+    seen_batches = []
+
+    def handler(items):
+        seen_batches.append(len(items))
+        return items
+
+    batcher = MicroBatcher(handler, max_batch_size=3, max_wait_ms=20)
+    futures = [batcher.submit(i) for i in range(10)]
+    assert [f.result(timeout=5) for f in futures] == list(range(10))
+    batcher.close()
+
+    assert max(seen_batches) <= 3
+
+
+def test_handler_error_is_propagated():
+    """测试 handler 出错时异常传给所有调用方"""
+    def handler(items):
+        raise ValueError("boom")
+
+    batcher = MicroBatcher(handler, max_batch_size=4, max_wait_ms=1)
+    future = batcher.submit("q")
+    with pytest.raises(ValueError):
+        future.result(timeout=5)
+    batcher.close()
+
+    assert batcher.stats.snapshot()["errors"] == 1
+
+
+def test_stats_snapshot():
+    """测试统计信息包含批大小分布和排队等待百分位"""
+    batcher = MicroBatcher(lambda items: items, max_batch_size=4, max_wait_ms=1)
+    for i in range(5):
+        batcher.submit(i).result(timeout=5)
+    batcher.close()
+
+    stats = batcher.stats.snapshot()
+    assert stats["requests"] == 5
+    assert sum(stats["batch_size_histogram"].values()) == stats["batches"]
+    assert set(stats["queue_wait_ms"]) == {"p50", "p95", "p99"}
+
+
+def test_batch_stats_endpoint(monkeypatch):
+    """测试 /qa/batch/stats 返回当前进程各模型批处理器的统计"""
+    from fastapi.testclient import TestClient
+
+    from app.main import app
+    from app.services import llm_services
+
+    batcher = MicroBatcher(lambda items: items, max_batch_size=4, max_wait_ms=1)
+    for i in range(3):
+        batcher.submit(i).result(timeout=5)
+    batcher.close()
+    monkeypatch.setattr(llm_services, "_batchers", {"default": batcher})
+
+    with TestClient(app) as client:
+        stats = client.get("/qa/batch/stats").json()
+        missing = client.get("/qa/batch/stats", params={"model": "other"}).json()
+    assert stats["models"]["default"]["requests"] == 3
+    assert missing["models"] == {}
@@ -0,0 +1,111 @@
+# -*- encoding: utf-8 -*-
+"""
+测试 BM25 倒排索引与混合检索
+"""
+
+import numpy as np
+import pytest
+
+from app.services.bm25 import BM25Index, tokenize
+
+DOCS = [
+    "北京是中国的首都，故宫位于北京。",
+    "上海是中国最大的城市之一。",
+    "型号 XJ-2049 的设备需要定期维护。",
+    "The Great Wall of China is very long.",
+]
+
+
+def test_tokenize_mixed_text():
+    """测试中文二元组与英文单词、编号切分"""
+    assert tokenize("北京XJ-2049型") == ["北京", "xj-2049", "型"]
+    assert tokenize("Hello, World!") == ["hello", "world"]
+
+
+def test_search_exact_code_and_chinese(tmp_path):
+    """测试编号、中文、英文检索"""
+    index = BM25Index(str(tmp_path))
+    index.add(list(range(len(DOCS))), DOCS)
+    index.save()
+    assert index.search("XJ-2049 怎么维护", k=1)[0][0] == 2
+    assert index.search("中国的首都在哪里", k=1)[0][0] == 0
+    assert index.search("great wall", k=1)[0][0] == 3
+    assert index.search("完全无关", k=3) == []
+
+
+def test_segments_compaction_and_mmap(tmp_path):
+    """测试分段写入、合并后与单段结果一致，并以 mmap 方式加载"""
+    single = BM25Index(str(tmp_path / "single"))
+    single.add(list(range(len(DOCS))), DOCS)
+    single.save()
+
+    segmented = BM25Index(str(tmp_path / "segmented"), flush_every=1, max_segments=2)
+    for i, doc in enumerate(DOCS):
+        segmented.add([i], [doc])
+    segmented.save()
+    assert len(segmented.segments) <= 2
+
+    loaded = BM25Index(str(tmp_path / "segmented")).load(mmap=True)
+    assert isinstance(loaded.segments[0]["docs"], np.memmap)
+    for query in ["中国", "北京 故宫", "维护 设备"]:
+        expected = single.search(query, k=4)
+        actual = loaded.search(query, k=4)
+        assert [d for d, _ in actual] == [d for d, _ in expected]
+        assert [s for _, s in actual] == pytest.approx([s for _, s in expected], rel=1e-5)
+
+
+def test_load_retries_when_segments_compacted(tmp_path):
+    """测试读到旧元数据后段文件被其他进程合并删除时，重新读取元数据加载合并后的段"""
+    writer = BM25Index(str(tmp_path), flush_every=1, max_segments=10)
+    for i, doc in enumerate(DOCS):
+        writer.add([i], [doc])
+    writer.save()
+    expected = writer.search("中国", k=4)
+
+    reader = BM25Index(str(tmp_path))
+    load_segment = reader._load_segment
+
+    def compact_then_load(name, mmap):
+        # 模拟读取元数据之后、打开段文件之前，写入端完成了一次合并
+        if len(writer.segments) > 1:
+            writer.compact()
+        return load_segment(name, mmap)
+
+    reader._load_segment = compact_then_load
+    reader.load()
+    assert len(reader.segments) == 1
+    assert reader.search("中国", k=4) == expected
+
+
+def test_truncate_and_contiguous_ids(tmp_path):
+    """测试回滚超出的段，以及文档 id 必须连续"""
+    index = BM25Index(str(tmp_path), flush_every=2, max_segments=10)
+    index.add([0, 1], DOCS[:2])
+    index.add([2, 3], DOCS[2:])
+    assert len(index.segments) == 2
+    index.truncate(2)
+    assert len(index) == 2
+    with pytest.raises(ValueError):
+        index.add([5], ["x"])
+    assert index.search("维护") == []
+
+
+def test_hybrid_retriever_fuses_lexical_hits(tmp_path):
+    """测试向量检索不到的编号由 BM25 补上"""
+    pytest.importorskip("faiss")
+    from app.services.retrieval import PassageIndex, Retriever
+
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(len(DOCS), 8)).astype("float32")
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    index = PassageIndex(str(tmp_path))
+    index.add(DOCS, vectors)
+    index.save()
+
+    # 问题向量与第 0 个段落完全相同，但问题里的编号只出现在第 2 个段落
+    retriever = Retriever(PassageIndex(str(tmp_path)), embed=lambda texts: vectors[[0]], top_k=2, candidates=1)
+    texts = [p["text"] for p in retriever.retrieve("XJ-2049")]
+    assert sorted(texts) == sorted([DOCS[0], DOCS[2]])
+
+    dense_only = Retriever(PassageIndex(str(tmp_path)), embed=lambda texts: vectors[[0]], top_k=2, hybrid=False)
+    assert DOCS[2] not in [p["text"] for p in dense_only.retrieve("XJ-2049")][:1]
@@ -0,0 +1,61 @@
+# -*- encoding: utf-8 -*-
+"""
+测试进程内 LRU 缓存与进程级复用的 Redis 客户端
+"""
+
+import time
+
+from app.core import redis_client
+from app.core.cache import LRUCache, content_hash
+
+
+def test_lru_eviction_order():
+    """测试超出容量时淘汰最久未使用的条目"""
+    cache = LRUCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # a 变为最近使用
+    cache.set("c", 3)
+
+    assert "b" not in cache
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_ttl_expiry():
+    """测试条目过期后视为未命中"""
+    cache = LRUCache(maxsize=10, ttl=0.05)
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    time.sleep(0.06)
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_hit_miss_counters():
+    """测试命中/未命中计数"""
+    cache = LRUCache(maxsize=10)
+    cache.get("missing")
+    cache.set("a", 1)
+    cache.get("a")
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 1)
+    assert stats["hit_rate"] == 0.5
+
+
+def test_content_hash_is_stable():
+    """测试内容哈希只取决于文本内容"""
+    assert content_hash("北京") == content_hash("北京")
+    assert content_hash("北京") != content_hash("上海")
+
+
+def test_redis_client_reused_per_process(monkeypatch):
+    """测试同一进程内复用 Redis 客户端，fork 出的子进程（pid 变化）重新创建"""
+    url = "redis://localhost:6379/15"
+    first = redis_client.get_redis(url)
+    assert redis_client.get_redis(url) is first
+    assert redis_client.get_redis(url, socket_timeout=5) is not first
+
+    monkeypatch.setattr(redis_client.os, "getpid", lambda: -1)
+    assert redis_client.get_redis(url) is not first
@@ -0,0 +1,105 @@
+# -*- encoding: utf-8 -*-
+"""
+测试 /qa/ask 的进程内快速路径
+"""
+
+import asyncio
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.auth.auth import get_current_user
+from app.core.config import settings
+from app.main import app
+from app.routers import qa
+from app.services import fast_path
+from app.services.fast_path import FastPath
+
+
+def _depth(value):
+    async def depth(queue):
+        return value
+    return depth
+
+
+def test_eligibility_thresholds():
+    """测试问题过长、队列积压、查不到队列深度时都不走快速路径"""
+    async def scenario():
+        path = FastPath(lambda *a, **k: "答案", max_queue_depth=2, max_question_chars=5, depth_func=_depth(1))
+        assert await path.eligible("短问题", None)
+        assert not await path.eligible("这是一个很长的问题", None)
+
+        busy = FastPath(lambda *a, **k: "答案", max_queue_depth=2, depth_func=_depth(3))
+        assert not await busy.eligible("问题", None)
+
+        async def broken(queue):
+            raise OSError("broker down")
+        unknown = FastPath(lambda *a, **k: "答案", depth_func=broken)
+        assert not await unknown.eligible("问题", None)
+        return path, busy, unknown
+
+    path, busy, unknown = asyncio.run(scenario())
+    assert path.skipped["too_long"] == 1
+    assert path.stats()["queue_depth"] == {"qa_queue": 1}
+    assert busy.skipped["queue_depth"] == 1
+    assert unknown.skipped["queue_depth"] == 1
+
+
+def test_depth_checked_per_tier_queue():
+    """测试按请求所属队列判断积压：访客队列积压时访客不走快速路径，登录用户不受影响"""
+    depths = {"qa_queue": 0, "qa_guest_queue": 5}
+
+    async def depth(queue):
+        return depths[queue]
+
+    async def scenario():
+        path = FastPath(lambda *a, **k: "答案", depth_func=depth)
+        return await path.eligible("问题", None, "qa_queue"), await path.eligible("问题", None, "qa_guest_queue")
+
+    assert asyncio.run(scenario()) == (True, False)
+
+
+def test_bounded_inflight_requests(monkeypatch):
+    """测试线程池满时新请求不排队，交给 Celery"""
+    monkeypatch.setattr(fast_path, "record_latency", lambda path, seconds: None)
+    release = threading.Event()
+
+    def slow_answer(question, user_id, context=None, model=None):
+        release.wait(5)
+        return f"答案:{question}"
+
+    async def scenario():
+        path = FastPath(slow_answer, max_workers=1, depth_func=_depth(0))
+        first = asyncio.ensure_future(path.try_answer("问题1", "u"))
+        await asyncio.sleep(0.05)
+        second = await path.try_answer("问题2", "u")
+        release.set()
+        return await first, second, path
+
+    first, second, path = asyncio.run(scenario())
+    assert first == "答案:问题1"
+    assert second is None
+    assert path.skipped["busy"] == 1 and path.inline == 1
+
+
+def test_ask_returns_inline_answer(monkeypatch):
+    """测试快速路径可用时 /qa/ask 直接返回答案，不提交 Celery 任务"""
+    monkeypatch.setattr(settings, "answer_cache_enabled", False)
+    monkeypatch.setattr(settings, "fast_path_enabled", True)
+    monkeypatch.setattr(fast_path, "record_latency", lambda path, seconds: None)
+    monkeypatch.setattr(
+        fast_path, "_fast_path", FastPath(lambda q, u, context=None, model=None: "快速答案", depth_func=_depth(0))
+    )
+
+    def fail_delay(*args, **kwargs):
+        raise AssertionError("should not submit a celery task")
+
+    monkeypatch.setattr(qa.answer_question_task, "apply_async", fail_delay)
+    app.dependency_overrides[get_current_user] = lambda: "alice"
+    try:
+        with TestClient(app) as client:
+            response = client.post("/qa/ask", json={"question": "北京是哪里"})
+    finally:
+        app.dependency_overrides.pop(get_current_user, None)
+    assert response.json() == {"status": "success", "answer": "快速答案", "inline": True}
@@ -0,0 +1,95 @@
+# -*- encoding: utf-8 -*-
+"""
+测试问答历史：已有数据库的迁移、游标分页、分页查询使用复合索引
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, insert, inspect, text
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.auth.auth import get_current_user
+from app.core.db import Base, get_db_session
+from app.core.migrations import migrate_questions
+from app.main import app
+from app.models.question import Question
+from app.services.history import encode_cursor, history_query
+from app.services.persistence import question_record, table_rows
+
+
+@pytest.fixture
+def session_factory():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(bind=engine)
+
+
+def test_migrate_existing_questions_table(tmp_path):
+    """测试旧表补上 created_at / latency_ms 列和复合索引，已有记录回填时间，重复执行无影响"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE questions (id INTEGER PRIMARY KEY, question VARCHAR, answer VARCHAR, user_id VARCHAR)"))
+        conn.execute(text("INSERT INTO questions (question, answer, user_id) VALUES ('问题', '答案', 'alice')"))
+
+    migrate_questions(engine)
+    migrate_questions(engine)
+
+    columns = {column["name"] for column in inspect(engine).get_columns("questions")}
+    assert {"created_at", "latency_ms"} <= columns
+    assert "ix_questions_user_created_id" in {index["name"] for index in inspect(engine).get_indexes("questions")}
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM questions WHERE created_at IS NULL")).scalar() == 0
+    engine.dispose()
+
+
+def test_history_keyset_pages(session_factory):
+    """测试按时间倒序逐页读取，时间相同时按 id 排序，不重复不遗漏，只返回当前用户的记录"""
+    start = datetime(2025, 1, 1)
+    rows = [
+        {"question": f"问题{i}", "answer": "答案", "user_id": "alice", "created_at": start + timedelta(seconds=i // 2)}
+        for i in range(7)
+    ]
+    rows += table_rows([question_record("别人的问题", "答案", "bob", created_at=start.timestamp())])
+    with session_factory() as db:
+        db.execute(insert(Question), rows)
+        db.commit()
+
+    def override():
+        with session_factory() as db:
+            yield db
+
+    app.dependency_overrides[get_db_session] = override
+    app.dependency_overrides[get_current_user] = lambda: "alice"
+    try:
+        with TestClient(app) as client:
+            seen, cursor = [], None
+            while True:
+                params = {"limit": 3, **({"cursor": cursor} if cursor else {})}
+                page = client.get("/qa/history", params=params).json()
+                seen += [item["question"] for item in page["items"]]
+                cursor = page["next_cursor"]
+                if cursor is None:
+                    break
+            invalid = client.get("/qa/history", params={"cursor": "not-a-cursor"})
+            app.dependency_overrides[get_current_user] = lambda: "guest"
+            guest = client.get("/qa/history")
+    finally:
+        app.dependency_overrides.pop(get_db_session, None)
+        app.dependency_overrides.pop(get_current_user, None)
+
+    assert seen == [f"问题{i}" for i in reversed(range(7))]
+    assert invalid.status_code == 400
+    assert guest.status_code == 403
+
+
+def test_history_query_uses_composite_index(session_factory):
+    """测试带游标的分页查询在 (user_id, created_at, id) 索引上定位，不扫描全部记录"""
+    stmt = history_query("alice", 20, encode_cursor(datetime(2025, 1, 1), 100))
+    with session_factory() as db:
+        compiled = stmt.compile(db.bind, compile_kwargs={"literal_binds": True})
+        plan = " ".join(str(row) for row in db.execute(text(f"EXPLAIN QUERY PLAN {compiled}")))
+    assert "ix_questions_user_created_id" in plan
+    assert "TEMP B-TREE" not in plan
@@ -0,0 +1,100 @@
+# -*- encoding: utf-8 -*-
+"""
+测试文档导入流水线
+"""
+
+import numpy as np
+import pytest
+
+pytest.importorskip("faiss")
+
+from app.services.retrieval import PassageIndex
+from worker.ingest import Ingestor, chunk_passages, split_text
+
+DIM = 8
+
+
+def _embed(texts):
+    """按文本哈希生成确定的单位向量，代替真实模型"""
+    vectors = np.stack([np.random.default_rng(abs(hash(t)) % 2**32).normal(size=DIM) for t in texts])
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype("float32")
+
+
+def test_split_text_prefers_sentence_end():
+    """测试长文本按句末切分且片段不超过 chunk_size"""
+    text = "北京是中国的首都。" * 40
+    chunks = split_text(text, chunk_size=50, overlap=10)
+    assert all(len(chunk) <= 50 for chunk in chunks)
+    assert all(chunk.endswith("。") for chunk in chunks)
+    assert "".join(chunks).count("北京") >= 40
+
+
+def test_chunk_passages_merges_short_paragraphs():
+    """测试短段落合并、长段落切分"""
+    passages = list(chunk_passages(["甲" * 10, "乙" * 10, "丙" * 100], chunk_size=30, overlap=5))
+    assert passages[0] == "甲" * 10 + "\n" + "乙" * 10
+    assert all(len(p) <= 30 for p in passages)
+
+
+def test_ingest_directory_and_skip_unchanged(tmp_path):
+    """测试目录导入、增量追加以及未变化文件跳过"""
+    corpus = tmp_path / "corpus"
+    corpus.mkdir()
+    (corpus / "a.txt").write_text("长城位于北京。\n\n故宫也在北京。\n", encoding="utf-8")
+    (corpus / "b.jsonl").write_text('{"text": "上海是直辖市。"}\n', encoding="utf-8")
+    (corpus / "ignore.bin").write_bytes(b"\x00")
+    index_dir = str(tmp_path / "index")
+
+    def ingestor():
+        return Ingestor(PassageIndex(index_dir), embed=_embed, chunk_size=8, batch_size=2)
+
+    first = ingestor().run([str(corpus)])
+    assert first["files"] == 2 and first["passages"] == 3
+
+    again = ingestor().run([str(corpus)])
+    assert again["skipped"] == 2 and again["passages"] == 0
+
+    (corpus / "c.txt").write_text("广州在南方。", encoding="utf-8")
+    third = ingestor().run([str(corpus)])
+    assert third["files"] == 1 and third["total_passages"] == 4
+
+    index = PassageIndex(index_dir).load(mmap=False)
+    hit = index.search(_embed(["广州在南方。"]), k=1)[0][0]
+    assert hit["text"] == "广州在南方。"
+    assert hit["source"].endswith("c.txt")
+
+
+def test_ingest_rolls_back_failed_file(tmp_path):
+    """测试某个文件向量化失败时回滚，其他文件照常导入"""
+    (tmp_path / "a.txt").write_text("好的段落。", encoding="utf-8")
+    (tmp_path / "b.txt").write_text("坏的段落。", encoding="utf-8")
+
+    def embed(texts):
+        if "坏的段落。" in texts:
+            raise RuntimeError("boom")
+        return _embed(texts)
+
+    index_dir = str(tmp_path / "index")
+    summary = Ingestor(PassageIndex(index_dir), embed=embed, save_every=1).run(
+        [str(tmp_path / "a.txt"), str(tmp_path / "b.txt")]
+    )
+    assert summary["files"] == 1 and summary["failed"] == 1
+    index = PassageIndex(index_dir).load(mmap=False)
+    assert len(index) == len(index.store) == 1
+
+
+def test_ingest_summary_excludes_rolled_back_files(tmp_path):
+    """测试失败回滚时，上次保存之后已导入的文件不计入导入结果"""
+    for name, text in (("a.txt", "第一段。"), ("b.txt", "第二段。"), ("c.txt", "坏的段落。")):
+        (tmp_path / name).write_text(text, encoding="utf-8")
+
+    def embed(texts):
+        if "坏的段落。" in texts:
+            raise RuntimeError("boom")
+        return _embed(texts)
+
+    index_dir = str(tmp_path / "index")
+    paths = [str(tmp_path / name) for name in ("a.txt", "b.txt", "c.txt")]
+    summary = Ingestor(PassageIndex(index_dir), embed=embed, save_every=100).run(paths)
+    assert (summary["files"], summary["passages"], summary["rolled_back"], summary["failed"]) == (0, 0, 2, 1)
+    assert summary["total_passages"] == 0
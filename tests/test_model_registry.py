@@ -0,0 +1,161 @@
+# -*- encoding: utf-8 -*-
+"""
+测试模型注册表：按需加载、LRU 淘汰、热切换
+"""
+
+import threading
+import time
+
+import pytest
+
+from app.services import model_registry
+from app.services.model_registry import (
+    ModelHandle,
+    ModelRegistry,
+    ModelSpec,
+    UnknownModelError,
+    parse_model_specs,
+)
+
+MB = 1024 * 1024
+
+
+class FakeLoader:
+    """不加载真实模型，按路径名记录加载次数，每个模型占 size_mb"""
+
+    def __init__(self, size_mb=100, delay=0.0):
+        self.size_mb = size_mb
+        self.delay = delay
+        self.calls = []
+
+    def __call__(self, spec):
+        self.calls.append(spec.path)
+        time.sleep(self.delay)
+        return ModelHandle(spec, tokenizer=None, backend=spec.path, size_bytes=self.size_mb * MB)
+
+
+def _registry(loader, budget_mb=0, names=("default", "a", "b")):
+    specs = {name: ModelSpec(name, f"/models/{name}") for name in names}
+    return ModelRegistry(specs, default="default", loader=loader, budget_mb=budget_mb)
+
+
+def test_parse_model_specs():
+    """测试解析 name=path[@backend]，默认模型总是存在"""
+    specs = parse_model_specs("small=/m/small, fast=/m/fast@int8", "default", "/m/base", "eager")
+    assert specs["default"] == ModelSpec("default", "/m/base", "eager")
+    assert specs["small"].backend == "eager"
+    assert specs["fast"] == ModelSpec("fast", "/m/fast", "int8")
+    with pytest.raises(ValueError):
+        parse_model_specs("broken", "default", "/m/base", "eager")
+
+
+def test_unknown_model():
+    """测试请求未注册的模型"""
+    registry = _registry(FakeLoader())
+    with pytest.raises(UnknownModelError):
+        registry.acquire("missing")
+    assert registry.resolve(None) == "default"
+
+
+def test_lru_eviction_within_budget():
+    """测试超出内存预算时淘汰最久未使用的非默认模型"""
+    loader = FakeLoader(size_mb=100)
+    registry = _registry(loader, budget_mb=250)
+    registry.peek("default")
+    registry.peek("a")
+    registry.peek("b")
+
+    assert registry.is_loaded("default")
+    assert not registry.is_loaded("a")
+    assert registry.is_loaded("b")
+    assert registry.evictions == 1
+    assert registry.loaded_bytes() <= 250 * MB
+
+    # 再次请求被淘汰的模型时重新加载
+    registry.peek("a")
+    assert loader.calls.count("/models/a") == 2
+
+
+def test_model_in_use_is_not_evicted():
+    """测试正在使用的模型不会被淘汰"""
+    registry = _registry(FakeLoader(size_mb=100), budget_mb=150)
+    with registry.use("a"):
+        with registry.use("b"):
+            assert registry.is_loaded("a")
+    assert registry.loaded_bytes() <= 150 * MB
+
+
+def test_default_model_is_never_evicted():
+    """测试其他模型都在使用中时也不会淘汰默认模型（暂时超出预算）"""
+    registry = _registry(FakeLoader(size_mb=100), budget_mb=150)
+    registry.peek("default")
+    with registry.use("a"):
+        assert registry.is_loaded("default") and registry.is_loaded("a")
+    assert registry.evictions == 0
+
+
+def test_concurrent_requests_load_once():
+    """测试同一模型被并发请求时只加载一次"""
+    loader = FakeLoader(delay=0.05)
+    registry = _registry(loader)
+    threads = [threading.Thread(target=registry.peek, args=("a",)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert loader.calls == ["/models/a"]
+
+
+def test_swap_keeps_in_flight_requests_on_old_version():
+    """测试热切换：进行中的请求继续用旧版本，之后的请求用新版本，旧版本在最后一个请求结束后卸载"""
+    registry = _registry(FakeLoader())
+    old = registry.acquire("a")
+
+    new = registry.swap("a", ModelSpec("a", "/models/a-v2"))
+    assert old.retired and not new.retired
+    assert registry.peek("a") is new
+    assert old.backend == "/models/a"
+    assert registry.stats()["retired"][0]["path"] == "/models/a"
+
+    registry.release(old)
+    assert registry.stats()["retired"] == []
+    assert registry.swaps == 1
+
+
+def test_spec_overrides_trigger_hot_swap():
+    """测试运行时覆盖的模型配置变化时，已加载的模型自动热切换"""
+    overrides = {}
+    registry = _registry(FakeLoader())
+    registry.spec_source = lambda: dict(overrides)
+    registry.refresh_seconds = 0
+    registry.peek("a")
+
+    overrides["a"] = ModelSpec("a", "/models/a-v2")
+    overrides["c"] = ModelSpec("c", "/models/c")
+    assert registry.peek("a").backend == "/models/a-v2"
+    assert "c" in registry.names()
+    assert not registry.is_loaded("c")
+
+
+def test_answer_cache_keys_differ_per_model(monkeypatch):
+    """测试不同模型的答案缓存互不命中"""
+    from app.services.answer_cache import AnswerCache
+
+    versions = {None: "v-default", "a": "v-a"}
+    cache = AnswerCache(redis_client=None, fingerprint_func=lambda model=None: versions[model])
+    cache.set("问题", "默认模型答案")
+    assert cache.get("问题", model="a") is None
+    cache.set("问题", "a 模型答案", model="a")
+    assert cache.get("问题") == "默认模型答案"
+    assert cache.get("问题", model="a") == "a 模型答案"
+
+
+def test_registry_singleton_uses_settings(monkeypatch):
+    """测试进程级注册表从配置构建"""
+    from app.core.config import settings
+
+    monkeypatch.setattr(model_registry, "_registry", None)
+    monkeypatch.setattr(settings, "qa_models", "small=/m/small@int8")
+    registry = model_registry.get_registry()
+    assert set(registry._specs) == {settings.default_model, "small"}
+    assert registry.spec("small").backend == "int8"
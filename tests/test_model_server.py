@@ -0,0 +1,123 @@
+# -*- encoding: utf-8 -*-
+"""
+测试独立模型服务：Unix socket + 共享内存协议、合并批处理、客户端回退
+"""
+
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from app.core.config import settings
+from app.services import llm_services, model_registry
+from app.services.model_server import (
+    ModelServer,
+    ModelServerClient,
+    ModelServerUnavailable,
+    pad_and_concat,
+)
+
+
+@pytest.fixture
+def tiny_services(monkeypatch, tiny_model_dir):
+    monkeypatch.setattr(settings, "local_model", tiny_model_dir)
+    monkeypatch.setattr(settings, "inference_backend", "eager")
+    monkeypatch.setattr(settings, "batch_enabled", False)
+    # 小模型只有 128 个位置，长上下文切成多个短窗口
+    monkeypatch.setattr(settings, "reader_max_seq_len", 64)
+    monkeypatch.setattr(settings, "reader_doc_stride", 16)
+    monkeypatch.setattr(settings, "model_server_socket", "")
+    monkeypatch.setattr(model_registry, "_registry", None)
+    monkeypatch.setattr(llm_services, "_context_cache", None)
+    monkeypatch.setattr(llm_services, "_batchers", {})
+    monkeypatch.setattr(llm_services, "_model_server", None)
+    monkeypatch.setattr(llm_services, "_model_server_down_until", 0.0)
+    monkeypatch.setattr(llm_services, "_remote_models", {})
+    return llm_services
+
+
+@pytest.fixture
+def server(tiny_services):
+    # AF_UNIX 路径长度有限，不用 pytest 的 tmp_path
+    directory = tempfile.mkdtemp(prefix="qa-ms-")
+    path = os.path.join(directory, "model.sock")
+    model_server = ModelServer(path, max_batch_size=8, max_wait_ms=20)
+    thread = threading.Thread(target=model_server.serve_forever, daemon=True)
+    thread.start()
+    for _ in range(100):
+        if os.path.exists(path):
+            break
+        time.sleep(0.02)
+    yield model_server
+    model_server.shutdown()
+    thread.join(timeout=5)
+    os.rmdir(directory)
+
+
+def test_pad_and_concat():
+    """测试不同长度的请求补齐后合并"""
+    a = np.ones((3, 2, 4), dtype=np.int64)
+    b = np.full((3, 1, 6), 2, dtype=np.int64)
+    merged = pad_and_concat([a, b])
+    assert merged.shape == (3, 3, 6)
+    assert (merged[:, :2, 4:] == 0).all()
+    assert (merged[:, 2] == 2).all()
+
+
+def test_remote_answers_match_in_process(server, monkeypatch):
+    """测试通过模型服务得到的答案与进程内推理一致，向量也一致"""
+    pairs = [("北京是什么", "北京是中国的首都"), ("谁在上海", "张三在北京，李四在上海。" * 30)]
+    local = llm_services._read_batch(pairs)
+    local_vectors = llm_services.embed_texts(["北京是中国的首都"])
+
+    monkeypatch.setattr(settings, "model_server_socket", server.socket_path)
+    monkeypatch.setattr(settings, "model_server_fallback", False)
+    remote = llm_services._read_batch(pairs)
+    remote_vectors = llm_services.embed_texts(["北京是中国的首都"])
+
+    assert [answer for answer, _ in remote] == [answer for answer, _ in local]
+    for (_, s1), (_, s2) in zip(remote, local):
+        assert (s1 is None and s2 is None) or abs(s1 - s2) < 1e-4
+    assert np.allclose(remote_vectors, local_vectors, atol=1e-5)
+    assert server.requests >= 2
+
+
+def test_concurrent_clients_are_batched(server):
+    """测试多个连接的并发请求在服务端合并成批"""
+    client = ModelServerClient(server.socket_path)
+    results = {}
+
+    def call(i):
+        inputs = np.ones((3, 1, 8 + i), dtype=np.int64)
+        results[i] = client.request("forward", "default", inputs, (2, 1, 8 + i))
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    client.close()
+
+    assert sorted(results) == list(range(6))
+    assert all(results[i].shape == (2, 1, 8 + i) for i in range(6))
+    stats = server.stats()["batching"]["default"]
+    assert stats["requests"] == 6
+    assert stats["batches"] < 6
+
+
+def test_fallback_when_server_missing(tiny_services, monkeypatch):
+    """测试模型服务不可用时回退到进程内推理"""
+    monkeypatch.setattr(settings, "model_server_socket", "/nonexistent/qa-model.sock")
+    answer = llm_services.get_answer("北京是什么", "北京是中国的首都")
+    assert isinstance(answer, str) and answer
+    assert llm_services._model_server_down_until > time.monotonic()
+
+    monkeypatch.setattr(llm_services, "_model_server_down_until", 0.0)
+    monkeypatch.setattr(settings, "model_server_fallback", False)
+    with pytest.raises(ModelServerUnavailable):
+        llm_services._read_batch([("北京是什么", "北京是中国的首都")])
@@ -0,0 +1,94 @@
+# -*- encoding: utf-8 -*-
+"""
+测试问答记录异步批量写库：按条数 / 时间触发、关闭时写完、失败写入溢出文件后补写
+"""
+
+import inspect
+import json
+import time
+
+import pytest
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.core.db import Base
+from app.models.question import Question
+from app.services import llm_services
+from app.services.persistence import QuestionWriter, question_record
+
+
+@pytest.fixture
+def session_factory():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(bind=engine)
+
+
+def _count(session_factory) -> int:
+    with session_factory() as db:
+        return db.scalar(select(func.count()).select_from(Question))
+
+
+def _wait_for(predicate, timeout=2.0):
+    deadline = time.time() + timeout
+    while not predicate() and time.time() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+def test_flush_by_size_and_time(session_factory):
+    """测试攒够一批立即写入、不足一批时按时间写入，每批一次提交"""
+    writer = QuestionWriter(session_factory, batch_size=3, flush_interval=0.2)
+    writer.submit_many([question_record(f"问题{i}", "答案", "alice") for i in range(3)])
+    assert _wait_for(lambda: _count(session_factory) == 3, timeout=0.15)
+
+    writer.submit(question_record("问题3", "答案", "alice"))
+    assert _wait_for(lambda: _count(session_factory) == 4)
+    assert writer.batches == 2
+    writer.close()
+
+
+def test_close_writes_remaining_records(session_factory):
+    """测试关闭时写完缓冲区中剩余的记录，关闭后提交的记录进入溢出文件"""
+    writer = QuestionWriter(session_factory, batch_size=100, flush_interval=60)
+    writer.submit_many([question_record(f"问题{i}", "答案", "bob") for i in range(5)])
+    writer.close()
+    assert _count(session_factory) == 5
+    assert writer.submit(question_record("迟到的问题", "答案", "bob")) is False
+
+
+def test_failed_batch_spills_and_replays(session_factory, tmp_path):
+    """测试写库失败的批次写入溢出文件，之后补写进数据库"""
+    spill_file = str(tmp_path / "spill.jsonl")
+
+    def broken_session():
+        raise RuntimeError("database is locked")
+
+    broken = QuestionWriter(broken_session, batch_size=2, flush_interval=60, spill_file=spill_file)
+    broken.submit_many([question_record("问题1", "答案", "alice"), question_record("问题2", "答案", "alice")])
+    broken.close()
+    assert broken.spilled == 2 and _count(session_factory) == 0
+
+    writer = QuestionWriter(session_factory, spill_file=spill_file)
+    assert writer.replay_spill() == 2
+    assert _count(session_factory) == 2
+    assert writer.replay_spill() == 0
+
+
+def test_replay_skips_unreadable_lines(session_factory, tmp_path):
+    """测试溢出文件中有写了一半的行时，其他记录照常补写，坏行写回溢出文件，认领文件不残留"""
+    spill_file = tmp_path / "spill.jsonl"
+    good = json.dumps(question_record("问题1", "答案", "alice"), ensure_ascii=False)
+    spill_file.write_text(f'{good}\n{{"question": "问题2", "ans\n{good}\n', encoding="utf-8")
+
+    writer = QuestionWriter(session_factory, spill_file=str(spill_file))
+    assert writer.replay_spill() == 2
+    assert _count(session_factory) == 2
+    assert spill_file.read_text(encoding="utf-8") == '{"question": "问题2", "ans\n'
+    assert [p.name for p in tmp_path.iterdir()] == ["spill.jsonl"]
+
+
+def test_process_question_has_no_shared_session():
+    """测试 process_question 不再在导入时创建共享的数据库会话"""
+    assert inspect.signature(llm_services.process_question).parameters["db"].default is None
@@ -0,0 +1,62 @@
+# -*- encoding: utf-8 -*-
+"""
+测试 worker 父进程预加载模型
+"""
+
+import multiprocessing
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from app.core.config import settings
+from app.services import llm_services, model_registry
+
+
+@pytest.fixture
+def fresh_services(monkeypatch, tiny_model_dir):
+    """使用小模型，并在测试前后清空 llm_services 的全局模型状态"""
+    monkeypatch.setattr(settings, "local_model", tiny_model_dir)
+    monkeypatch.setattr(settings, "inference_backend", "eager")
+    monkeypatch.setattr(settings, "retrieval_enabled", False)
+    monkeypatch.setattr(settings, "semantic_cache_enabled", False)
+    monkeypatch.setattr(settings, "batch_enabled", False)
+    monkeypatch.setattr(model_registry, "_registry", None)
+    monkeypatch.setattr(llm_services, "_context_cache", None)
+    monkeypatch.setattr(llm_services, "_batchers", {})
+    threads = torch.get_num_threads()
+    yield llm_services
+    torch.set_num_threads(threads)
+
+
+def _answer_in_child(queue):
+    # fork 出来的子进程里模型已经就绪，不需要再加载
+    preloaded = llm_services.model_loaded()
+    llm_services.after_fork()
+    queue.put((preloaded, llm_services.get_answer("北京是什么", "北京是中国的首都")))
+
+
+def test_preload_freezes_weights_and_restores_threads(fresh_services):
+    """测试预加载后参数只读、处于推理模式，且恢复原线程数"""
+    threads = torch.get_num_threads()
+    fresh_services.preload(freeze=False)
+    model = fresh_services.get_registry().peek().backend.model
+    assert not model.training
+    assert all(not p.requires_grad for p in model.parameters())
+    assert torch.get_num_threads() == threads
+
+
+def test_forked_child_reuses_preloaded_model(fresh_services, monkeypatch):
+    """测试 fork 后的子进程直接使用父进程预加载的模型"""
+    fresh_services.preload(freeze=False)
+    monkeypatch.setattr(settings, "inference_num_threads", 1)
+
+    ctx = multiprocessing.get_context("fork")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_answer_in_child, args=(queue,))
+    proc.start()
+    preloaded, answer = queue.get(timeout=60)
+    proc.join(timeout=10)
+    assert proc.exitcode == 0
+    assert preloaded
+    assert isinstance(answer, str) and answer
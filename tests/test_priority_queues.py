@@ -0,0 +1,94 @@
+# -*- encoding: utf-8 -*-
+"""
+测试分级队列：按用户级别路由、加权消费、排队耗时统计
+"""
+
+from collections import Counter
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.auth.auth import get_current_user
+from app.core.config import settings
+from app.main import app
+from app.routers import qa
+from app.services import tiers
+from app.services.tiers import parse_weights, queue_stats, record_queue_wait
+from worker.priority import WeightedCycle
+
+WEIGHTS = {"qa_queue": 6, "qa_batch_queue": 3, "qa_guest_queue": 1}
+
+
+def _consume(cycle, backlog, rounds):
+    """模拟 BRPOP：按 consume 的顺序取第一个有积压的队列"""
+    taken = Counter()
+    for _ in range(rounds):
+        queue = next((q for q in cycle.consume(len(cycle.items)) if backlog[q] > 0), None)
+        if queue is None:
+            break
+        backlog[queue] -= 1
+        taken[queue] += 1
+        cycle.rotate(queue)
+    return taken
+
+
+def test_weighted_cycle_shares_by_weight():
+    """测试所有队列都有积压时按权重比例取任务，低级别不会被饿死"""
+    cycle = WeightedCycle(weights=WEIGHTS)
+    cycle.update(["qa_guest_queue", "qa_batch_queue", "qa_queue"])
+    taken = _consume(cycle, Counter({q: 1000 for q in WEIGHTS}), 100)
+    assert taken == Counter({"qa_queue": 60, "qa_batch_queue": 30, "qa_guest_queue": 10})
+
+
+def test_weighted_cycle_idle_queue_does_not_monopolize():
+    """测试长时间空闲的高权重队列恢复后不会连续独占"""
+    cycle = WeightedCycle(weights={"qa_queue": 1, "qa_guest_queue": 1})
+    cycle.update(["qa_queue", "qa_guest_queue"])
+    _consume(cycle, Counter({"qa_queue": 0, "qa_guest_queue": 1000}), 200)
+    taken = _consume(cycle, Counter({"qa_queue": 1000, "qa_guest_queue": 1000}), 10)
+    assert taken["qa_guest_queue"] >= 4
+
+
+def test_parse_weights():
+    assert parse_weights("user=4, guest=0") == {"user": 4, "batch": 1, "guest": 1}
+    with pytest.raises(ValueError):
+        parse_weights("vip=3")
+
+
+def test_ask_routes_by_user_tier(monkeypatch):
+    """测试访客和登录用户的问题进入不同队列"""
+    monkeypatch.setattr(settings, "answer_cache_enabled", False)
+    monkeypatch.setattr(settings, "fast_path_enabled", False)
+    monkeypatch.setattr(qa, "check_visitor_limit", lambda user: True)
+    queues = []
+
+    def apply_async(args, kwargs=None, queue=None, **options):
+        queues.append(queue)
+        return SimpleNamespace(id=f"task-{len(queues)}")
+
+    monkeypatch.setattr(qa.answer_question_task, "apply_async", apply_async)
+    with TestClient(app) as client:
+        client.post("/qa/ask", json={"question": "访客的问题"})
+        app.dependency_overrides[get_current_user] = lambda: "alice"
+        try:
+            client.post("/qa/ask", json={"question": "用户的问题"})
+        finally:
+            app.dependency_overrides.pop(get_current_user, None)
+    assert queues == ["qa_guest_queue", "qa_queue"]
+
+
+def test_queue_wait_stats():
+    """测试排队耗时按级别记录，非分级队列忽略"""
+    fakeredis = pytest.importorskip("fakeredis")
+    client = fakeredis.FakeRedis()
+    broker = fakeredis.FakeRedis()
+    broker.lpush("qa_guest_queue", "t1", "t2")
+    for seconds in (0.1, 0.2, 0.3):
+        record_queue_wait("qa_guest_queue", seconds, client=client)
+    record_queue_wait("ingest_queue", 1.0, client=client)
+
+    stats = queue_stats(client=client, broker=broker)
+    assert stats["guest"]["depth"] == 2 and stats["guest"]["wait_ms"]["samples"] == 3
+    assert stats["guest"]["wait_ms"]["p50"] == 200.0
+    assert stats["user"]["wait_ms"]["samples"] == 0 and tiers.TIER_QUEUES["user"] == "qa_queue"
@@ -0,0 +1,132 @@
+# -*- encoding: utf-8 -*-
+"""
+测试滑动窗口阅读器
+"""
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from app.services.reader import best_spans, build_features, select_answers
+
+
+class CharTokenizer:
+    """按字符切分的最小 tokenizer，id 从 10 开始，避开特殊 token"""
+    cls_token_id = 1
+    sep_token_id = 2
+    pad_token_id = 0
+
+    def encode(self, text, add_special_tokens=False):
+        return [10 + ord(c) % 1000 for c in text]
+
+
+def test_short_context_single_window():
+    """测试短上下文只生成一个窗口"""
+    features = build_features(CharTokenizer(), [("问题", "北京是首都")], max_seq_len=32, doc_stride=8)
+    assert features.num_windows == 1
+    assert features.input_ids[0][0] == 1
+    assert features.context_start == [4]
+    assert features.context_length == [5]
+    assert features.token_type_ids[0] == [0] * 4 + [1] * 6
+
+
+def test_long_context_overlapping_windows():
+    """测试长上下文被切成重叠窗口，且完整覆盖上下文"""
+    context = "天" * 100
+    features = build_features(CharTokenizer(), [("问", context)], max_seq_len=24, doc_stride=10)
+    assert features.num_windows > 1
+    assert all(len(ids) <= 24 for ids in features.input_ids)
+    covered = set()
+    for offset, length in zip(features.context_offset, features.context_length):
+        covered.update(range(offset, offset + length))
+    assert covered == set(range(100))
+    # 相邻窗口有重叠
+    assert features.context_offset[1] < features.context_offset[0] + features.context_length[0]
+
+
+def test_best_spans_respects_order_and_length():
+    """测试片段搜索只返回 end >= start 且长度合法的片段"""
+    start_logits = torch.tensor([[0.0, 0.0, 1.0, 0.0, 9.0, 0.0]])
+    end_logits = torch.tensor([[0.0, 0.0, 8.0, 2.0, 0.0, 0.0]])
+    mask = torch.tensor([[False, True, True, True, True, True]])
+
+    # 独立 argmax 会得到 start=4, end=2 的非法片段
+    scores, starts, ends = best_spans(start_logits, end_logits, mask, max_answer_len=3)
+    assert (starts.item(), ends.item()) == (2, 2)
+    assert scores.item() == pytest.approx(9.0)
+
+    # 长度限制为 1 时不能跨越多个 token
+    scores, starts, ends = best_spans(start_logits, end_logits, mask, max_answer_len=1)
+    assert starts.item() == ends.item()
+
+
+def test_best_spans_ignores_non_context_positions():
+    """测试问题和特殊 token 位置不会被选为答案"""
+    start_logits = torch.tensor([[10.0, 0.0, 1.0]])
+    end_logits = torch.tensor([[10.0, 0.0, 1.0]])
+    mask = torch.tensor([[False, True, True]])
+    _, starts, ends = best_spans(start_logits, end_logits, mask)
+    assert (starts.item(), ends.item()) == (2, 2)
+
+
+def test_best_spans_matches_exhaustive_search():
+    """测试带状片段搜索与逐个枚举 (start, end) 的结果一致，包括答案长度超过序列长度的情况"""
+    generator = torch.Generator().manual_seed(0)
+    start_logits = torch.randn(4, 12, generator=generator)
+    end_logits = torch.randn(4, 12, generator=generator)
+    mask = torch.rand(4, 12, generator=generator) > 0.3
+    for max_answer_len in (1, 4, 30):
+        scores, starts, ends = best_spans(start_logits, end_logits, mask, max_answer_len=max_answer_len)
+        for w in range(4):
+            valid = [
+                (start_logits[w, i] + end_logits[w, j]).item()
+                for i in range(12) for j in range(i, min(12, i + max_answer_len))
+                if mask[w, i] and mask[w, j]
+            ]
+            assert scores[w].item() == pytest.approx(max(valid))
+            assert 0 <= ends[w] - starts[w] < max_answer_len
+            assert (start_logits[w, starts[w]] + end_logits[w, ends[w]]).item() == pytest.approx(max(valid))
+
+
+def test_select_answers_picks_global_best_window():
+    """测试在多个窗口中选取全局最佳，并换算回上下文下标"""
+    features = build_features(CharTokenizer(), [("问", "天" * 40), ("问", "")], max_seq_len=20, doc_stride=8)
+    inputs, mask = features.to_tensors()
+    num, seq_len = inputs["input_ids"].shape
+    start_logits = torch.zeros(num, seq_len)
+    end_logits = torch.zeros(num, seq_len)
+    # 在第二个窗口的第一个上下文 token 放最高分
+    start_logits[1, features.context_start[1]] = 5.0
+    end_logits[1, features.context_start[1] + 1] = 5.0
+
+    scores, starts, ends = best_spans(start_logits, end_logits, mask, max_answer_len=5)
+    spans = select_answers(features, scores, starts, ends, num_examples=2)
+
+    offset = features.context_offset[1]
+    assert spans[0][:2] == (offset, offset + 1)
+    assert spans[0][2] == pytest.approx(10.0)
+    # 空上下文没有合法片段
+    assert spans[1] is None
+
+
+def test_fast_tokenizer_offsets_and_context_cache(tiny_model_dir):
+    """测试 fast tokenizer 通过 offset 截取原文，重复上下文命中缓存"""
+    from transformers import BertTokenizerFast
+
+    from app.core.cache import LRUCache
+    from app.services.reader import extract_answer
+
+    tokenizer = BertTokenizerFast.from_pretrained(tiny_model_dir)
+    cache = LRUCache(maxsize=4)
+    context = "北京是中国首都"
+    pairs = [("首都是哪里", context), ("中国首都", context)]
+
+    features = build_features(tokenizer, pairs, max_seq_len=32, context_cache=cache)
+    assert cache.stats()["misses"] == 2
+    assert len(cache) == 1
+
+    build_features(tokenizer, pairs, max_seq_len=32, context_cache=cache)
+    assert cache.stats()["hits"] == 2
+
+    # 上下文 token 0..1 对应原文 “北京”
+    assert extract_answer(tokenizer, features, 0, 0, 1) == "北京"
@@ -0,0 +1,96 @@
+# -*- encoding: utf-8 -*-
+"""
+测试任务结果推送：Redis pub/sub -> 进程内订阅者 -> SSE / WebSocket
+"""
+
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from app.main import app
+from app.routers import qa
+from app.services import result_stream
+from app.services.result_stream import ResultHub, publish_result, result_message
+
+
+@pytest.fixture
+def fake_server():
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def hub(fake_server, monkeypatch):
+    hub = ResultHub(client_factory=lambda: fakeredis.aioredis.FakeRedis(server=fake_server))
+    monkeypatch.setattr(result_stream, "_hub", hub)
+    return hub
+
+
+def _fixed_results(result):
+    async def lookup(task_ids):
+        return {task_id: dict(result) for task_id in task_ids}
+    return lookup
+
+
+def _publish_until_delivered(hub, fake_server, message, timeout=5.0):
+    """订阅生效之前发布的消息会丢失，在后台线程里反复发布直到送达"""
+    def run():
+        client = fakeredis.FakeRedis(server=fake_server)
+        deadline = time.time() + timeout
+        while hub.deliveries == 0 and time.time() < deadline:
+            publish_result(message, client=client)
+            time.sleep(0.05)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_hub_fans_out_to_all_waiters(hub, fake_server):
+    """测试一条结果消息送达等待同一任务的所有连接，其他任务不受影响"""
+    async def scenario():
+        first, second = hub.subscribe("t1"), hub.subscribe("t1")
+        other = hub.subscribe("t2")
+        assert await hub.wait_ready()
+        fakeredis.FakeRedis(server=fake_server).publish(
+            result_stream.RESULT_CHANNEL, json.dumps(result_message("t1", "success", answer="北京"))
+        )
+        results = await asyncio.wait_for(asyncio.gather(first, second), 2)
+        assert not other.done()
+        await hub.close()
+        return results
+
+    results = asyncio.run(scenario())
+    assert [r["answer"] for r in results] == ["北京", "北京"]
+    assert hub.deliveries == 2
+
+
+def test_sse_stream_pushes_result(hub, fake_server, monkeypatch):
+    """测试 SSE 连接在任务完成后立即收到 result 事件"""
+    monkeypatch.setattr(qa, "_lookup_results", _fixed_results({"status": "pending"}))
+    thread = _publish_until_delivered(hub, fake_server, result_message("t-sse", "success", answer="答案"))
+
+    started = time.time()
+    with TestClient(app) as client:
+        with client.stream("GET", "/qa/ask/stream/t-sse") as response:
+            assert response.headers["content-type"].startswith("text/event-stream")
+            body = response.read().decode("utf-8")
+    thread.join()
+
+    assert "event: result" in body
+    data = json.loads(body.split("data: ", 1)[1].split("\n", 1)[0])
+    assert data == {"status": "success", "answer": "答案"}
+    assert time.time() - started < 5
+
+
+def test_stream_returns_finished_task_without_waiting(hub, monkeypatch):
+    """测试任务在订阅之前已完成时直接返回结果后端中的结果"""
+    monkeypatch.setattr(qa, "_lookup_results", _fixed_results({"status": "failure", "error": "boom"}))
+    with TestClient(app) as client:
+        with client.websocket_connect("/qa/ask/ws/t-done") as ws:
+            assert ws.receive_json() == {"status": "failure", "error": "boom"}
@@ -0,0 +1,125 @@
+# -*- encoding: utf-8 -*-
+"""
+测试段落检索
+"""
+
+import numpy as np
+import pytest
+
+faiss = pytest.importorskip("faiss")
+
+from app.services.retrieval import PassageIndex, PassageStore, Retriever
+
+DIM = 16
+
+
+def _vectors(n, seed=0):
+    v = np.random.default_rng(seed).normal(size=(n, DIM)).astype("float32")
+    return v / np.linalg.norm(v, axis=1, keepdims=True)
+
+
+def test_passage_store_append_and_read(tmp_path):
+    """测试段落追加写入和按 id 读取"""
+    store = PassageStore(str(tmp_path))
+    assert store.add(["北京", "上海"], ["a.txt", "a.txt"]) == [0, 1]
+    assert store.add(["长城"]) == [2]
+    passages = store.get([2, 0, 5])
+    assert passages[0]["text"] == "长城"
+    assert passages[1] == {"text": "北京", "source": "a.txt", "id": 0}
+    assert passages[2] is None
+
+    store.truncate(1)
+    assert len(store) == 1
+    assert store.add(["广州"]) == [1]
+
+
+@pytest.mark.parametrize("kind", ["flat", "ivf", "hnsw"])
+def test_index_search_and_mmap_reload(tmp_path, kind):
+    """测试各类索引检索，并以 mmap 方式重新加载"""
+    vectors = _vectors(200)
+    texts = [f"passage-{i}" for i in range(200)]
+    index = PassageIndex(str(tmp_path), kind=kind, nlist=4, nprobe=4)
+    index.add(texts, vectors)
+    index.save()
+
+    loaded = PassageIndex(str(tmp_path), nprobe=4).load(mmap=True)
+    assert loaded.kind == kind
+    hits = loaded.search(vectors[42], k=3)[0]
+    assert hits[0]["text"] == "passage-42"
+    assert hits[0]["score"] == pytest.approx(1.0, abs=1e-4)
+
+
+def test_ivf_trains_once_enough_vectors(tmp_path):
+    """测试 IVF 小批量写入时先暂存在 flat 索引中，累计到 39 * nlist 条后才训练，之后重新加载仍可追加"""
+    vectors = _vectors(200)
+    index = PassageIndex(str(tmp_path), kind="ivf", nlist=4, nprobe=4)
+    index.add([f"passage-{i}" for i in range(20)], vectors[:20])
+    assert not isinstance(index.index, faiss.IndexIVF)
+    assert index.search(vectors[7], k=1)[0][0]["text"] == "passage-7"
+    index.save()
+
+    writer = PassageIndex(str(tmp_path), nlist=4, nprobe=4).load(mmap=False)
+    writer.add([f"passage-{i}" for i in range(20, 200)], vectors[20:])
+    assert isinstance(writer.index, faiss.IndexIVF) and writer.index.nlist == 4
+    assert len(writer) == 200
+    assert writer.search(vectors[150], k=1)[0][0]["text"] == "passage-150"
+
+
+def test_incremental_add(tmp_path):
+    """测试增量追加后段落 id 与向量 id 保持一致"""
+    index = PassageIndex(str(tmp_path), kind="flat")
+    index.add(["a", "b"], _vectors(2, seed=1))
+    index.save()
+
+    writer = PassageIndex(str(tmp_path)).load(mmap=False)
+    new_vectors = _vectors(3, seed=2)
+    assert writer.add(["c", "d", "e"], new_vectors) == [2, 3, 4]
+    writer.save()
+
+    reader = PassageIndex(str(tmp_path)).load()
+    assert len(reader) == 5
+    assert reader.search(new_vectors[1], k=1)[0][0]["text"] == "d"
+
+
+def test_retriever_without_index(tmp_path):
+    """测试索引尚未建立时返回空列表"""
+    retriever = Retriever(PassageIndex(str(tmp_path / "missing")), embed=lambda texts: _vectors(len(texts)))
+    assert not retriever.available()
+    assert retriever.retrieve("问题") == []
+
+
+def test_retriever_lazy_load(tmp_path):
+    """测试检索器第一次查询时加载索引"""
+    vectors = _vectors(10)
+    index = PassageIndex(str(tmp_path), kind="flat")
+    index.add([f"p{i}" for i in range(10)], vectors)
+    index.save()
+
+    retriever = Retriever(PassageIndex(str(tmp_path)), embed=lambda texts: vectors[[7]], top_k=2)
+    hits = retriever.retrieve("问题")
+    assert [h["text"] for h in hits][0] == "p7"
+    assert len(hits) == 2
+
+
+def test_build_index_keeps_unrelated_files(tmp_path, monkeypatch):
+    """测试重建索引只删除索引文件；输出目录中有其他文件时不加 --force 拒绝执行"""
+    import build_index
+
+    output = tmp_path / "data"
+    index = PassageIndex(str(output), kind="flat")
+    index.add(["旧段落"], _vectors(1))
+    index.save()
+    (output / "notes.txt").write_text("不是索引", encoding="utf-8")
+    corpus = tmp_path / "corpus.txt"
+    corpus.write_text("新段落一\n新段落二\n", encoding="utf-8")
+    monkeypatch.setattr(build_index, "embed_texts", lambda texts: _vectors(len(texts), seed=3))
+
+    monkeypatch.setattr("sys.argv", ["build_index.py", str(corpus), "--output", str(output)])
+    assert build_index.main() == 1
+    assert PassageIndex(str(output)).load().store.get([0])[0]["text"] == "旧段落"
+
+    monkeypatch.setattr("sys.argv", ["build_index.py", str(corpus), "--output", str(output), "--force"])
+    assert build_index.main() == 0
+    rebuilt = PassageIndex(str(output)).load()
+    assert len(rebuilt) == 2 and rebuilt.store.get([0])[0]["text"] == "新段落一"
+    assert (output / "notes.txt").read_text(encoding="utf-8") == "不是索引"
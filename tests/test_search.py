@@ -0,0 +1,107 @@
+# -*- encoding: utf-8 -*-
+"""
+测试问答记录全文检索：切词、FTS5 触发器增量同步、已有记录迁移、/qa/search 接口
+"""
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, delete, insert, text
+from sqlalchemy.orm import sessionmaker
+
+from app.auth.auth import get_current_user
+from app.core.config import settings
+from app.core.db import Base, get_db_session
+from app.core.migrations import backfill_search_text, run_migrations
+from app.main import app
+from app.models.question import Question
+from app.services.persistence import question_record, table_rows
+from app.services.search import match_query, search_document, search_questions
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'search.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+
+def test_search_document_and_query():
+    """测试中文按二元组、英文编号按单词切分，查询词之间 AND"""
+    assert search_document("长城在哪", "GPT-4") == "长城 城在 在哪 gpt-4"
+    assert match_query("长城 gpt-4") == '"长城" AND "gpt-4"'
+    assert match_query("水") == '"水"*'
+    assert match_query("？！") is None
+
+
+def test_fts_index_follows_inserts_and_deletes(session_factory):
+    """测试 ORM 插入、批量插入和删除都由触发器同步到全文索引，按用户过滤"""
+    with session_factory() as db:
+        db.add(Question(question="长城有多长", answer="两万多公里", user_id="alice"))
+        db.execute(insert(Question), table_rows([
+            question_record("北京是中国的首都吗", "是的", "alice"),
+            question_record("GPT-4 是什么", "一个语言模型", "bob"),
+        ]))
+        db.commit()
+
+        assert [r["question"] for r in search_questions(db, "长城")] == ["长城有多长"]
+        assert [r["question"] for r in search_questions(db, "京")] == ["北京是中国的首都吗"]
+        assert [r["question"] for r in search_questions(db, "中国首都")] == []
+        assert [r["question"] for r in search_questions(db, "中国的首都")] == ["北京是中国的首都吗"]
+        assert [r["user_id"] for r in search_questions(db, "gpt-4")] == ["bob"]
+        assert search_questions(db, "gpt-4", user_id="alice") == []
+
+        db.execute(delete(Question).where(Question.user_id == "bob"))
+        db.commit()
+        assert search_questions(db, "gpt-4") == []
+
+
+def test_migration_indexes_existing_rows(tmp_path):
+    """测试已有数据库加列并建立全文索引，已有记录由 backfill_search_text 回填后可检索"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE questions (id INTEGER PRIMARY KEY, question VARCHAR, answer VARCHAR, user_id VARCHAR)"))
+        conn.execute(text("INSERT INTO questions (question, answer, user_id) VALUES ('上海天气', '很好', 'alice')"))
+    run_migrations(engine)
+    run_migrations(engine)
+
+    # 启动时只建索引，不回填已有记录
+    with sessionmaker(bind=engine)() as db:
+        assert search_questions(db, "天气") == []
+    assert backfill_search_text(engine, batch_size=1) == 1
+    assert backfill_search_text(engine) == 0
+
+    with sessionmaker(bind=engine)() as db:
+        assert [r["answer"] for r in search_questions(db, "天气")] == ["很好"]
+    engine.dispose()
+
+
+def test_search_endpoint(session_factory, monkeypatch):
+    """测试接口只检索当前用户的记录，检索所有用户需要在 search_admin_users 中"""
+    with session_factory() as db:
+        db.execute(insert(Question), table_rows([
+            question_record("长城有多长", "两万多公里", "alice"),
+            question_record("长城在哪里", "中国北方", "bob"),
+        ]))
+        db.commit()
+
+    def override():
+        with session_factory() as db:
+            yield db
+
+    app.dependency_overrides[get_db_session] = override
+    app.dependency_overrides[get_current_user] = lambda: "alice"
+    try:
+        with TestClient(app) as client:
+            own = client.get("/qa/search", params={"q": "长城"}).json()
+            denied = client.get("/qa/search", params={"q": "长城", "all_users": True})
+            monkeypatch.setattr(settings, "search_admin_users", "alice")
+            everyone = client.get("/qa/search", params={"q": "长城", "all_users": True}).json()
+    finally:
+        app.dependency_overrides.pop(get_db_session, None)
+        app.dependency_overrides.pop(get_current_user, None)
+
+    assert [r["user_id"] for r in own["results"]] == ["alice"]
+    assert denied.status_code == 403
+    assert sorted(r["user_id"] for r in everyone["results"]) == ["alice", "bob"]
@@ -0,0 +1,89 @@
+# -*- encoding: utf-8 -*-
+"""
+测试语义缓存
+"""
+
+import json
+
+import numpy as np
+import pytest
+
+pytest.importorskip("faiss")
+
+from app.services.semantic_cache import SNAPSHOT_FILE, SemanticCache
+
+DIM = 8
+
+
+def _vec(seed, noise=0.0):
+    rng = np.random.default_rng(seed)
+    v = rng.normal(size=DIM).astype("float32")
+    if noise:
+        v += np.random.default_rng(seed + 1000).normal(scale=noise, size=DIM).astype("float32")
+    return v / np.linalg.norm(v)
+
+
+def test_similar_question_hits():
+    """测试相似度超过阈值时命中，低于阈值时未命中"""
+    cache = SemanticCache(dim=DIM, threshold=0.9)
+    cache.add("北京是哪里", _vec(1), "中国首都")
+    assert cache.lookup(_vec(1, noise=0.05)) == "中国首都"
+    assert cache.lookup(_vec(2)) is None
+    assert cache.stats()["hits"] == 1
+
+
+def test_context_hash_must_match():
+    """测试上下文不同的近似问题不会命中"""
+    cache = SemanticCache(dim=DIM, threshold=0.9)
+    cache.add("谁", _vec(1), "张三", context_hash="ctx-a")
+    assert cache.lookup(_vec(1), context_hash="ctx-b") is None
+    assert cache.lookup(_vec(1), context_hash="ctx-a") == "张三"
+
+
+@pytest.mark.parametrize("policy, survivor, victim", [("lru", 1, 2), ("lfu", 1, 2)])
+def test_capacity_eviction(policy, survivor, victim):
+    """测试容量满时按策略淘汰"""
+    cache = SemanticCache(dim=DIM, threshold=0.99, capacity=2, policy=policy)
+    cache.add("q1", _vec(1), "a1")
+    cache.add("q2", _vec(2), "a2")
+    # q1 被访问过：LRU 下更近、LFU 下命中更多
+    assert cache.lookup(_vec(1)) == "a1"
+    cache.add("q3", _vec(3), "a3")
+
+    assert len(cache) == 2
+    assert cache.lookup(_vec(survivor)) == f"a{survivor}"
+    assert cache.lookup(_vec(victim)) is None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_persist_and_reload(tmp_path):
+    """测试持久化后重启恢复，模型指纹不一致时丢弃"""
+    cache = SemanticCache(dim=DIM, threshold=0.9, persist_dir=str(tmp_path), persist_every=1, fingerprint="v1")
+    cache.add("q1", _vec(1), "a1")  # persist_every=1，写入后立即落盘
+
+    restored = SemanticCache(dim=DIM, threshold=0.9, persist_dir=str(tmp_path), fingerprint="v1")
+    assert restored.load()
+    assert restored.lookup(_vec(1)) == "a1"
+
+    other_model = SemanticCache(dim=DIM, threshold=0.9, persist_dir=str(tmp_path), fingerprint="v2")
+    assert not other_model.load()
+    assert len(other_model) == 0
+
+
+def test_load_rejects_inconsistent_snapshot(tmp_path):
+    """测试索引向量数与元数据条数不一致的磁盘缓存被丢弃"""
+    cache = SemanticCache(dim=DIM, threshold=0.9, persist_dir=str(tmp_path), fingerprint="v1")
+    cache.add("q1", _vec(1), "a1")
+    cache.add("q2", _vec(2), "a2")
+    cache.save()
+    path = tmp_path / SNAPSHOT_FILE
+    with np.load(path) as snapshot:
+        index, meta = snapshot["index"], str(snapshot["meta"])
+    meta = json.loads(meta)
+    meta["entries"].pop("1")
+    with open(path, "wb") as f:
+        np.savez(f, index=index, meta=np.array(json.dumps(meta)))
+
+    restored = SemanticCache(dim=DIM, threshold=0.9, persist_dir=str(tmp_path), fingerprint="v1")
+    assert not restored.load()
+    assert len(restored) == 0
@@ -0,0 +1,86 @@
+# -*- encoding: utf-8 -*-
+"""
+测试相同问题合并：进行中的相同问题复用同一个任务
+"""
+
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from app.auth.auth import get_current_user
+from app.core.config import settings
+from app.main import app
+from app.routers import qa
+from app.services import single_flight
+from app.services.single_flight import SingleFlight
+from worker import tasks
+
+
+@pytest.fixture
+def flight(monkeypatch):
+    flight = SingleFlight(fakeredis.FakeRedis(decode_responses=True), ttl=60)
+    monkeypatch.setattr(single_flight, "_single_flight", flight)
+    return flight
+
+
+def test_claim_follow_release(flight):
+    """测试抢占、跟随、只有持有者才能释放，释放后重新抢占"""
+    key = flight.key("北京在哪里？", None, None, "qa_queue")
+    assert key == flight.key("北京在哪里", None, None, "qa_queue")
+    assert key != flight.key("北京在哪里", None, None, "qa_guest_queue")
+
+    assert flight.claim(key, "t1", "alice") is None
+    assert 0 < flight.client.ttl(key) <= 60
+    assert flight.claim(key, "t2", "bob") == "t1"
+    assert flight.claim(key, "t3", "carol") == "t1"
+
+    assert flight.release(key, "t-other") == []
+    assert flight.client.get(key) == "t1"
+    assert flight.release(key, "t1") == ["bob", "carol"]
+    assert flight.claim(key, "t4", "dave") is None
+    assert flight.stats()["followers"] == 2
+
+
+def test_ask_attaches_to_inflight_task(flight, monkeypatch):
+    """测试相同问题的后续提交返回进行中任务的 task_id，不重复入队"""
+    monkeypatch.setattr(settings, "answer_cache_enabled", False)
+    monkeypatch.setattr(settings, "fast_path_enabled", False)
+    submitted = []
+
+    def apply_async(args, kwargs=None, queue=None, task_id=None, **options):
+        submitted.append((task_id, kwargs["flight_key"]))
+        return SimpleNamespace(id=task_id)
+
+    monkeypatch.setattr(qa.answer_question_task, "apply_async", apply_async)
+    app.dependency_overrides[get_current_user] = lambda: "alice"
+    try:
+        with TestClient(app) as client:
+            first = client.post("/qa/ask", json={"question": "热门问题？"}).json()
+            second = client.post("/qa/ask", json={"question": "热门问题"}).json()
+            other = client.post("/qa/ask", json={"question": "另一个问题"}).json()
+    finally:
+        app.dependency_overrides.pop(get_current_user, None)
+
+    assert second == {"task_id": first["task_id"], "coalesced": True}
+    assert other["task_id"] != first["task_id"]
+    assert [task_id for task_id, _ in submitted] == [first["task_id"], other["task_id"]]
+
+
+def test_worker_releases_and_records_followers(flight, monkeypatch):
+    """测试任务完成后释放进行中标记，并为跟随者补记问答记录"""
+    monkeypatch.setattr(settings, "answer_cache_enabled", False)
+    monkeypatch.setattr(tasks, "process_question", lambda question, user_id, context=None, model=None: "答案")
+    saved = []
+    monkeypatch.setattr(tasks, "save_questions", lambda records: saved.extend(records))
+
+    key = flight.key("问题", None, None, "qa_queue")
+    flight.claim(key, "task-1", "alice")
+    flight.claim(key, "task-2", "bob")
+    result = tasks.answer_question_task.apply(("问题", "alice"), {"flight_key": key}, task_id="task-1")
+
+    assert result.get() == "答案"
+    assert flight.client.get(key) is None
+    assert [(r["question"], r["answer"], r["user_id"]) for r in saved] == [("问题", "答案", "bob")]
@@ -0,0 +1,97 @@
+# -*- encoding: utf-8 -*-
+"""
+测试异步任务结果查询：批量 MGET、长轮询
+"""
+
+import json
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from app.main import app
+from app.services import result_stream, task_results
+from app.services.result_stream import ResultHub, publish_result, result_message
+from app.services.task_results import TaskResultStore, decode_meta
+
+
+def _key(task_id):
+    return f"celery-task-meta-{task_id}"
+
+
+@pytest.fixture
+def fake_server():
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def store(fake_server, monkeypatch):
+    store = TaskResultStore(fakeredis.aioredis.FakeRedis(server=fake_server), _key)
+    monkeypatch.setattr(task_results, "_store", store)
+    hub = ResultHub(client_factory=lambda: fakeredis.aioredis.FakeRedis(server=fake_server))
+    monkeypatch.setattr(result_stream, "_hub", hub)
+    return store
+
+
+def _save(fake_server, task_id, status, result):
+    client = fakeredis.FakeRedis(server=fake_server)
+    client.set(_key(task_id), json.dumps({"status": status, "result": result, "task_id": task_id}))
+
+
+def test_decode_meta():
+    """测试 Celery 结果元数据转换为接口返回格式"""
+    assert decode_meta(None) == {"status": "pending"}
+    assert decode_meta(json.dumps({"status": "STARTED"})) == {"status": "started"}
+    assert decode_meta(json.dumps({"status": "SUCCESS", "result": "北京"})) == {"status": "success", "answer": "北京"}
+    failure = {"status": "FAILURE", "result": {"exc_type": "ValueError", "exc_message": ["boom"]}}
+    assert decode_meta(json.dumps(failure)) == {"status": "failure", "error": "boom"}
+
+
+def test_bulk_results_in_one_round_trip(store, fake_server):
+    """测试批量查询一次 MGET 返回所有任务的状态"""
+    _save(fake_server, "a", "SUCCESS", "答案")
+    _save(fake_server, "b", "FAILURE", {"exc_type": "RuntimeError", "exc_message": ["失败"]})
+    with TestClient(app) as client:
+        response = client.post("/qa/ask/results", json={"task_ids": ["a", "b", "c", "a"]})
+    assert response.status_code == 200
+    assert response.json()["results"] == {
+        "a": {"status": "success", "answer": "答案"},
+        "b": {"status": "failure", "error": "失败"},
+        "c": {"status": "pending"},
+    }
+    assert store.round_trips == 1
+
+
+def test_long_poll_returns_when_task_finishes(store, fake_server):
+    """测试长轮询在任务完成时立即返回，而不是等到超时"""
+    hub = result_stream._hub
+    # 结果可能在长轮询查询结果后端时就已写入（不经过推送），响应返回后停止发布
+    responded = threading.Event()
+
+    def finish():
+        client = fakeredis.FakeRedis(server=fake_server)
+        deadline = time.time() + 5
+        while hub.deliveries == 0 and not responded.is_set() and time.time() < deadline:
+            time.sleep(0.1)
+            _save(fake_server, "slow", "SUCCESS", "完成")
+            publish_result(result_message("slow", "success", answer="完成"), client=client)
+
+    thread = threading.Thread(target=finish, daemon=True)
+    started = time.time()
+    with TestClient(app) as client:
+        thread.start()
+        response = client.get("/qa/ask/result/slow", params={"timeout": 10})
+    responded.set()
+    thread.join()
+    assert response.json() == {"status": "success", "answer": "完成"}
+    assert time.time() - started < 5
+
+
+def test_long_poll_times_out_as_pending(store):
+    """测试长轮询超时后返回 pending"""
+    with TestClient(app) as client:
+        response = client.get("/qa/ask/result/never", params={"timeout": 0.3})
+    assert response.json() == {"status": "pending"}
@@ -0,0 +1,106 @@
+# -*- encoding: utf-8 -*-
+"""
+测试 worker 子进程按内存增长回收
+"""
+
+import os
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from billiard.pool import EX_RECYCLE
+
+from app.core.config import settings
+from app.services import llm_services, model_registry
+from worker import pool as worker_pool
+from worker.pool import MemoryRecyclePolicy, RecycleOnGrowthMixin, RecyclingBlockingPool
+
+MB = 1024 * 1024
+
+
+def test_policy_baseline_after_model_load():
+    """测试模型加载前不设基线，加载并预热后只按增长回收"""
+    rss = {"value": 200 * MB}
+    ready = {"value": False}
+    policy = MemoryRecyclePolicy(
+        growth_limit_mb=100, warmup_tasks=2,
+        rss_func=lambda: rss["value"], ready_func=lambda: ready["value"],
+    )
+    assert policy.after_task() is None
+
+    # 加载模型使 RSS 上涨 800MB，不触发回收
+    ready["value"] = True
+    rss["value"] = 1000 * MB
+    assert policy.after_task() is None
+    assert policy.after_task() is None
+    assert policy.baseline_mb == pytest.approx(1000)
+
+    rss["value"] = 1090 * MB
+    assert policy.after_task() is None
+    rss["value"] = 1101 * MB
+    assert policy.after_task() == "memory_growth"
+
+
+def test_policy_absolute_limit():
+    """测试 RSS 绝对上限"""
+    policy = MemoryRecyclePolicy(max_rss_mb=500, rss_func=lambda: 600 * MB, ready_func=lambda: False)
+    assert policy.after_task() == "rss_limit"
+
+
+def _answer(_):
+    llm_services.get_answer("北京是什么", "北京是中国的首都")
+    return os.getpid()
+
+
+@pytest.fixture
+def tiny_services(monkeypatch, tiny_model_dir):
+    monkeypatch.setattr(settings, "local_model", tiny_model_dir)
+    monkeypatch.setattr(settings, "inference_backend", "eager")
+    monkeypatch.setattr(settings, "batch_enabled", False)
+    monkeypatch.setattr(model_registry, "_registry", None)
+    monkeypatch.setattr(llm_services, "_context_cache", None)
+    monkeypatch.setattr(llm_services, "_batchers", {})
+    # 回收时不连接 Redis
+    monkeypatch.setattr(worker_pool, "record_recycle", lambda cause, details: None)
+    return llm_services
+
+
+def test_steady_task_stream_does_not_reload_model(tiny_services, monkeypatch):
+    """稳态任务流不应回收子进程（回收即意味着重新加载模型）"""
+    monkeypatch.setattr(settings, "worker_recycle_growth_mb", 256)
+    monkeypatch.setattr(settings, "worker_recycle_warmup_tasks", 3)
+    monkeypatch.setattr(settings, "worker_recycle_max_rss_mb", 0)
+
+    p = RecyclingBlockingPool(processes=1)
+    try:
+        pids = p.map(_answer, range(40), chunksize=1)
+    finally:
+        p.terminate()
+    assert len(set(pids)) == 1
+
+
+def test_worker_exits_for_recycle_before_next_job(monkeypatch):
+    """测试上一个任务完成后、取下一个任务前以 EX_RECYCLE 退出，并记录原因"""
+    rss = {"value": 1000 * MB}
+    recorded = []
+    monkeypatch.setattr(worker_pool, "record_recycle", lambda cause, details: recorded.append(cause))
+
+    class _Receiver:
+        def _make_child_methods(self):
+            self.wait_for_job = lambda: ("TASK", None)
+
+    class _Worker(RecycleOnGrowthMixin, _Receiver):
+        policy_factory = staticmethod(lambda: MemoryRecyclePolicy(
+            growth_limit_mb=10, warmup_tasks=1, rss_func=lambda: rss["value"], ready_func=lambda: True,
+        ))
+
+    worker = _Worker()
+    worker._make_child_methods()
+    assert worker.wait_for_job()  # 第 1 个任务
+    assert worker.wait_for_job()  # 第 1 个任务完成后记录基线，取第 2 个任务
+    rss["value"] = 1020 * MB
+    with pytest.raises(SystemExit) as exc:
+        worker.wait_for_job()
+    assert exc.value.code == EX_RECYCLE
+    assert recorded == ["memory_growth"]
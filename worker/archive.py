@@ -0,0 +1,31 @@
+# -*- encoding: utf-8 -*-
+'''
+@Time    :   2025/10/26 10:48:05
+@Author  :   47bwy
+@Desc    :   问答记录冷数据归档任务（Celery beat 每天执行一次，见 celery_config.beat_schedule）
+
+归档任务走 maintenance_queue，与问答队列分开：
+    celery -A worker.celery_app beat
+    celery -A worker.celery_app worker -Q maintenance_queue -c 1 -n maintenance@%h
+手动执行一次：
+    celery -A worker.celery_app call worker.archive.archive_questions_task
+'''
+
+from typing import Optional
+
+from app.core.config import settings
+from app.core.logger import get_logger
+from app.services.archive import archive_cutoff, get_archiver
+from worker.celery_app import celery_app
+
+logger = get_logger(__name__)
+
+
+@celery_app.task
+def archive_questions_task(retention_days: Optional[int] = None) -> dict:
+    """把 created_at 早于 retention_days 天（默认 archive_retention_days）的记录归档并从热表删除"""
+    days = settings.archive_retention_days if retention_days is None else retention_days
+    if days <= 0:
+        logger.info("Question archive disabled (archive_retention_days <= 0)")
+        return {"skipped": True, "archived": 0, "files": 0, "batches": 0}
+    return get_archiver().run(archive_cutoff(days))
@@ -14,3 +14,6 @@ celery_app = Celery("worker")
 celery_app.config_from_object("worker.celery_config")
 celery_app.autodiscover_tasks(["worker"])
 
+# 注册 worker 信号处理
+import worker.signals  # noqa: E402,F401
+
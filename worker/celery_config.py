@@ -5,6 +5,8 @@
 @Desc    :   None
 '''
 
+from celery.schedules import crontab
+
 from app.core.config import settings
 
 broker_url = settings.broker_url
@@ -21,11 +23,32 @@ worker_prefetch_multiplier = 1
 task_reject_on_worker_lost = True
 
 # 任务路由配置：将任务发送到指定队列
+# 问答任务按用户级别分队列（登录用户 qa_queue / 访客 qa_guest_queue），由 /qa/ask 提交时指定，见 app/services/tiers.py
 task_default_queue = 'qa_queue'
 task_routes = {
-    'worker.tasks.answer_question_task': {'queue': 'qa_queue'}
+    'worker.tasks.answer_question_task': {'queue': 'qa_queue'},
+    'worker.tasks.answer_batch_task': {'queue': 'qa_batch_queue'},
+    # 文档导入耗时长，走独立队列，避免阻塞问答 worker
+    'worker.ingest.ingest_documents_task': {'queue': 'ingest_queue'},
+    # 冷数据归档等维护任务
+    'worker.archive.archive_questions_task': {'queue': 'maintenance_queue'},
+}
+
+# 定时任务（需要运行 celery -A worker.celery_app beat）：每天把保留期之前的问答记录归档为 Parquet，见 worker/archive.py
+beat_schedule = {
+    'archive-questions': {
+        'task': 'worker.archive.archive_questions_task',
+        'schedule': crontab(hour=settings.archive_schedule_hour, minute=settings.archive_schedule_minute),
+    },
 }
 
-# 可选：生产环境建议开启
-worker_max_tasks_per_child = 100
-worker_max_memory_per_child = 120000  # 单位KB
\ No newline at end of file
+# 同时消费多个分级队列时按 queue_weights 加权轮流取任务，见 worker/priority.py
+broker_transport_options = {'queue_order_strategy': 'worker.priority:WeightedCycle'}
+
+# autodiscover 只会加载 worker.tasks，其他任务模块在这里显式注册
+imports = ('worker.ingest', 'worker.archive')
+
+# 子进程回收：不使用 worker_max_memory_per_child（比较峰值 RSS，加载模型后每个任务都会触发回收、重新加载模型），
+# 改由 RecyclingTaskPool 按模型加载后的基线内存增长回收，见 worker/pool.py
+worker_pool = 'worker.pool:RecyclingTaskPool'
+worker_max_tasks_per_child = settings.worker_max_tasks_per_child or None
@@ -0,0 +1,307 @@
+# -*- encoding: utf-8 -*-
+'''
+@Time    :   2025/10/20 16:12:48
+@Author  :   47bwy
+@Desc    :   文档导入：流式读取文件 -> 切分段落 -> 分批向量化 -> 增量写入检索索引
+
+导入任务走独立的 ingest_queue，不占用 qa_queue 的 worker：
+    celery -A worker.celery_app worker -Q ingest_queue -c 1 -n ingest@%h
+'''
+
+import fcntl
+import hashlib
+import json
+import os
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator, List, Optional, Sequence
+
+from app.core.config import settings
+from app.core.logger import get_logger
+from app.services.retrieval import PassageIndex
+from worker.celery_app import celery_app
+
+logger = get_logger(__name__)
+
+MANIFEST_FILE = "ingest_manifest.json"
+LOCK_FILE = "ingest.lock"
+SUPPORTED_EXTENSIONS = (".txt", ".md", ".jsonl")
+
+# 切分时优先在这些字符之后断开
+SENTENCE_ENDINGS = "。！？!?；;\n"
+# 单个段落在内存中最多累积的字符数，超过即切分输出（防止没有空行的超大文件撑爆内存）
+MAX_PARAGRAPH_CHARS = 64 * 1024
+READ_BLOCK_SIZE = 1024 * 1024
+
+
+def iter_files(paths: Sequence[str]) -> Iterator[str]:
+    """展开文件和目录（递归），只保留支持的文件类型，按路径排序保证导入顺序稳定"""
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.endswith(SUPPORTED_EXTENSIONS):
+                        yield os.path.join(root, name)
+        elif os.path.isfile(path):
+            yield path
+        else:
+            logger.warning(f"Ingest path not found: {path}")
+
+
+def file_hash(path: str) -> str:
+    """按块计算文件内容哈希，不把整个文件读入内存"""
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(READ_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def iter_paragraphs(path: str) -> Iterator[str]:
+    """
+    逐行流式读取
+
+    - .jsonl：每行一个对象，取 text 字段
+    - 其他文本：空行分隔段落
+    """
+    with open(path, encoding="utf-8", errors="replace") as f:
+        if path.endswith(".jsonl"):
+            for line in f:
+                line = line.strip()
+                if line:
+                    text = json.loads(line).get("text", "").strip()
+                    if text:
+                        yield text
+            return
+
+        buffer, size = [], 0
+        for line in f:
+            line = line.strip()
+            if line:
+                buffer.append(line)
+                size += len(line)
+                if size < MAX_PARAGRAPH_CHARS:
+                    continue
+            if buffer:
+                yield "\n".join(buffer)
+                buffer, size = [], 0
+        if buffer:
+            yield "\n".join(buffer)
+
+
+def split_text(text: str, chunk_size: int, overlap: int) -> List[str]:
+    """把超长文本切成不超过 chunk_size 个字符的片段，相邻片段重叠 overlap 个字符，尽量在句末断开"""
+    if len(text) <= chunk_size:
+        return [text]
+    overlap = min(overlap, chunk_size // 2)
+    chunks, start = [], 0
+    while start < len(text):
+        end = min(start + chunk_size, len(text))
+        if end < len(text):
+            # 在后半段里找最后一个句末标点
+            cut = max(text.rfind(ch, start + chunk_size // 2, end) for ch in SENTENCE_ENDINGS)
+            if cut > start:
+                end = cut + 1
+        chunks.append(text[start:end].strip())
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+    return [chunk for chunk in chunks if chunk]
+
+
+def chunk_passages(paragraphs: Iterable[str], chunk_size: int = 300, overlap: int = 50) -> Iterator[str]:
+    """把段落流合并/切分为长度接近 chunk_size 的检索段落：短段落合并，长段落按句切分"""
+    pending = ""
+    for paragraph in paragraphs:
+        if pending and len(pending) + len(paragraph) + 1 > chunk_size:
+            yield pending
+            pending = ""
+        pending = f"{pending}\n{paragraph}" if pending else paragraph
+        if len(pending) > chunk_size:
+            pieces = split_text(pending, chunk_size, overlap)
+            yield from pieces[:-1]
+            pending = pieces[-1]
+    if pending:
+        yield pending
+
+
+def iter_batches(items: Iterable, size: int) -> Iterator[list]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+@contextmanager
+def ingest_lock(directory: str):
+    """同一个索引目录同一时间只允许一个导入任务写入（跨进程文件锁）"""
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, LOCK_FILE), "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class Ingestor:
+    """
+    增量导入器
+
+    - 文件逐行读取、段落按 batch_size 分批向量化并追加到索引，内存占用与语料总量无关
+    - 已导入文件的内容哈希记录在索引目录的 ingest_manifest.json，内容不变的文件直接跳过
+    - 每导入满 save_every 个段落（在文件边界上）保存一次索引并更新清单；
+      中途崩溃时，段落存储中多出的、未随索引保存的段落会在下次导入前回滚
+    段落存储是只追加的，文件内容变化后重新导入会追加新段落，旧段落不会删除。
+    IVF 索引累计到 39 * nlist 条向量后才训练（之前暂存在 flat 索引中），空目录上也可以直接用本任务逐步导入。
+    """
+
+    def __init__(
+        self,
+        index: PassageIndex,
+        embed: Callable[[List[str]], "object"],
+        chunk_size: int = 300,
+        chunk_overlap: int = 50,
+        batch_size: int = 64,
+        save_every: int = 20000,
+        progress: Optional[Callable[[dict], None]] = None,
+    ):
+        self.index = index
+        self.embed = embed
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.batch_size = batch_size
+        self.save_every = save_every
+        self.progress = progress
+        self.manifest_path = os.path.join(index.directory, MANIFEST_FILE)
+        self.manifest = {}
+
+    def _load_manifest(self):
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, encoding="utf-8") as f:
+                self.manifest = json.load(f)
+
+    def _save_manifest(self):
+        tmp = f"{self.manifest_path}.tmp.{os.getpid()}"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, self.manifest_path)
+
+    def _open_index(self):
+        if self.index.exists():
+            self.index.load(mmap=False)
+            # 上次导入在保存索引之前退出：段落存储比向量索引多出的部分回滚掉
+            if len(self.index.store) > len(self.index):
+                logger.warning(
+                    f"Rolling back {len(self.index.store) - len(self.index)} unsaved passages in {self.index.directory}"
+                )
+                self.index.store.truncate(len(self.index))
+            self.index.sync_lexical()
+        else:
+            self.index.reset()
+
+    def _checkpoint(self, pending: dict, summary: dict):
+        """保存索引和清单；只有保存成功的文件和段落计入导入结果"""
+        # 空目录上只导入了空文件时还没有向量索引，只记录清单
+        if self.index.index is not None:
+            self.index.save()
+        self.manifest.update(pending)
+        self._save_manifest()
+        summary["files"] += len(pending)
+        summary["passages"] += sum(entry["passages"] for entry in pending.values())
+        pending.clear()
+
+    def ingest_file(self, path: str, source: Optional[str] = None) -> int:
+        """导入单个文件，返回写入的段落数"""
+        source = source or path
+        passages = chunk_passages(iter_paragraphs(path), self.chunk_size, self.chunk_overlap)
+        count = 0
+        for batch in iter_batches(passages, self.batch_size):
+            self.index.add(batch, self.embed(batch), [source] * len(batch))
+            count += len(batch)
+        return count
+
+    def run(self, paths: Sequence[str]) -> dict:
+        started = time.time()
+        summary = {"files": 0, "skipped": 0, "failed": 0, "rolled_back": 0, "passages": 0}
+        with ingest_lock(self.index.directory):
+            self._load_manifest()
+            self._open_index()
+            known_hashes = {entry["hash"] for entry in self.manifest.values()}
+            pending, unsaved = {}, 0
+
+            for path in iter_files(paths):
+                key = os.path.abspath(path)
+                digest = file_hash(path)
+                if digest in known_hashes:
+                    summary["skipped"] += 1
+                    continue
+                try:
+                    count = self.ingest_file(path, source=key)
+                except Exception as e:
+                    # 已追加的部分段落留在索引中会与清单不一致，回滚到上次保存的状态
+                    logger.error(f"Failed to ingest {path}: {e}")
+                    summary["failed"] += 1
+                    # 上次保存之后导入的文件随之回滚，不计入导入结果
+                    summary["rolled_back"] += len(pending)
+                    self._open_index()
+                    unsaved = 0
+                    pending.clear()
+                    known_hashes = {entry["hash"] for entry in self.manifest.values()}
+                    continue
+                known_hashes.add(digest)
+                pending[key] = {"hash": digest, "passages": count, "ingested_at": time.time()}
+                unsaved += count
+                if unsaved >= self.save_every:
+                    self._checkpoint(pending, summary)
+                    unsaved = 0
+                if self.progress:
+                    self.progress(dict(summary, current=key, unsaved_files=len(pending)))
+
+            if pending:
+                self._checkpoint(pending, summary)
+
+        summary["total_passages"] = len(self.index)
+        summary["seconds"] = round(time.time() - started, 2)
+        logger.info(f"Ingestion finished: {summary}")
+        return summary
+
+
+def create_ingestor(index_dir: Optional[str] = None, progress=None) -> Ingestor:
+    from app.services.llm_services import embed_texts
+
+    index = PassageIndex(
+        index_dir or settings.retrieval_index_dir,
+        kind=settings.retrieval_index_type,
+        nlist=settings.retrieval_nlist,
+        nprobe=settings.retrieval_nprobe,
+        hnsw_m=settings.retrieval_hnsw_m,
+        ef_search=settings.retrieval_ef_search,
+    )
+    return Ingestor(
+        index,
+        embed=embed_texts,
+        chunk_size=settings.ingest_chunk_size,
+        chunk_overlap=settings.ingest_chunk_overlap,
+        batch_size=settings.ingest_batch_size,
+        save_every=settings.ingest_save_every,
+        progress=progress,
+    )
+
+
+@celery_app.task(bind=True)
+def ingest_documents_task(self, paths: List[str], index_dir: Optional[str] = None) -> dict:
+    """导入文件或目录到段落检索索引，进度通过任务状态 PROGRESS 上报"""
+    if isinstance(paths, str):
+        paths = [paths]
+    logger.info(f"celery app Received ingest task for {len(paths)} path(s)")
+
+    def progress(meta):
+        self.update_state(state="PROGRESS", meta=meta)
+
+    return create_ingestor(index_dir, progress=progress).run(paths)
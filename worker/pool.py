@@ -0,0 +1,190 @@
+# -*- encoding: utf-8 -*-
+'''
+@Time    :   2025/10/21 17:05:52
+@Author  :   47bwy
+@Desc    :   按内存增长回收子进程的 prefork 进程池
+
+Celery 自带的 worker_max_memory_per_child 比较的是子进程的峰值 RSS（ru_maxrss），
+加载 BERT 后任何子进程都会超过固定阈值，导致每个任务之后都回收子进程、重新加载模型。
+这里改为：模型加载完并预热若干个任务后记录子进程的基线 RSS，
+之后只有 RSS 比基线增长超过 worker_recycle_growth_mb（真正的内存泄漏）才回收。
+
+在 celery_config 中通过 worker_pool = 'worker.pool:RecyclingTaskPool' 启用。
+'''
+
+import os
+import sys
+import time
+from typing import Callable, Optional
+
+import psutil
+import redis
+from billiard.pool import EX_RECYCLE
+from billiard.pool import Pool as BlockingPool
+from billiard.pool import Worker as BlockingWorker
+from celery.concurrency.asynpool import AsynPool
+from celery.concurrency.asynpool import Worker as AsynWorker
+from celery.concurrency.prefork import TaskPool
+
+from app.core.config import settings
+from app.core.logger import get_logger
+
+logger = get_logger(__name__)
+
+RECYCLE_METRIC_KEY = "qa:worker:recycles"
+
+MB = 1024 * 1024
+
+
+def current_rss() -> int:
+    """当前（而不是峰值）常驻内存，字节"""
+    return psutil.Process(os.getpid()).memory_info().rss
+
+
+def model_loaded() -> bool:
+    """当前进程是否已经加载了问答模型（未导入推理模块时视为未加载）"""
+    module = sys.modules.get("app.services.llm_services")
+    return module is not None and module.model_loaded()
+
+
+class MemoryRecyclePolicy:
+    """
+    子进程回收策略
+
+    - 模型加载后再执行 warmup_tasks 个任务（分配器、各类缓存趋于稳定），记录基线 RSS
+    - 之后每个任务结束时：RSS - 基线 > growth_limit_mb 回收（cause=memory_growth）
+    - max_rss_mb > 0 时 RSS 绝对值超过上限也回收（cause=rss_limit）
+    模型未加载前不设基线，也不会因为加载模型本身占用的内存回收。
+    """
+
+    def __init__(
+        self,
+        growth_limit_mb: float = 512,
+        max_rss_mb: float = 0,
+        warmup_tasks: int = 5,
+        rss_func: Optional[Callable[[], int]] = None,
+        ready_func: Optional[Callable[[], bool]] = None,
+    ):
+        self.growth_limit_mb = growth_limit_mb
+        self.max_rss_mb = max_rss_mb
+        self.warmup_tasks = warmup_tasks
+        self.rss_func = rss_func or current_rss
+        self.ready_func = ready_func or model_loaded
+        self.baseline_mb: Optional[float] = None
+        self.tasks = 0
+        self._tasks_since_ready = 0
+
+    def after_task(self) -> Optional[str]:
+        """每个任务结束后调用，需要回收时返回原因，否则返回 None"""
+        self.tasks += 1
+        rss_mb = self.rss_func() / MB
+        if self.max_rss_mb > 0 and rss_mb > self.max_rss_mb:
+            return "rss_limit"
+
+        if self.baseline_mb is None:
+            if not self.ready_func():
+                return None
+            self._tasks_since_ready += 1
+            if self._tasks_since_ready >= self.warmup_tasks:
+                self.baseline_mb = rss_mb
+                logger.info(f"Worker process {os.getpid()} memory baseline {rss_mb:.1f} MB after {self.tasks} tasks")
+            return None
+
+        if self.growth_limit_mb > 0 and rss_mb - self.baseline_mb > self.growth_limit_mb:
+            return "memory_growth"
+        return None
+
+    def describe(self) -> dict:
+        return {
+            "tasks": self.tasks,
+            "rss_mb": round(self.rss_func() / MB, 1),
+            "baseline_mb": None if self.baseline_mb is None else round(self.baseline_mb, 1),
+            "growth_limit_mb": self.growth_limit_mb,
+            "max_rss_mb": self.max_rss_mb,
+        }
+
+
+def create_policy() -> MemoryRecyclePolicy:
+    return MemoryRecyclePolicy(
+        growth_limit_mb=settings.worker_recycle_growth_mb,
+        max_rss_mb=settings.worker_recycle_max_rss_mb,
+        warmup_tasks=settings.worker_recycle_warmup_tasks,
+    )
+
+
+def record_recycle(cause: str, details: dict):
+    """记录一次回收：日志 + Redis 计数（按原因累加，Redis 不可用时只写日志）"""
+    logger.warning(f"Recycling worker process {os.getpid()}: cause={cause} {details}")
+    try:
+        client = redis.Redis.from_url(settings.cache_url, socket_connect_timeout=0.5, socket_timeout=0.5)
+        pipe = client.pipeline()
+        pipe.hincrby(RECYCLE_METRIC_KEY, cause, 1)
+        pipe.hset(RECYCLE_METRIC_KEY, "last_recycle_at", int(time.time()))
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Failed to record worker recycle metric: {e}")
+
+
+def get_recycle_stats(client) -> dict:
+    """读取各原因的回收次数"""
+    data = client.hgetall(RECYCLE_METRIC_KEY)
+    return {
+        (k.decode() if isinstance(k, bytes) else k): int(v)
+        for k, v in data.items()
+    }
+
+
+class RecycleOnGrowthMixin:
+    """
+    在子进程取下一个任务之前检查回收策略
+
+    上一个任务的结果已经发回主进程，此时以 EX_RECYCLE 退出与 max_tasks_per_child 的回收路径相同，
+    主进程会补一个新的子进程，不会丢任务。
+    """
+
+    policy_factory = staticmethod(create_policy)
+
+    def _make_child_methods(self, *args, **kwargs):
+        super()._make_child_methods(*args, **kwargs)
+        policy = self.policy_factory()
+        receive = self.wait_for_job
+        running = False
+
+        def wait_for_job():
+            nonlocal running
+            if running:
+                running = False
+                cause = policy.after_task()
+                if cause is not None:
+                    record_recycle(cause, policy.describe())
+                    sys.exit(EX_RECYCLE)
+            req = receive()
+            if req:
+                running = True
+            return req
+
+        self.recycle_policy = policy
+        self.wait_for_job = wait_for_job
+
+
+class RecyclingAsynWorker(RecycleOnGrowthMixin, AsynWorker):
+    pass
+
+
+class RecyclingBlockingWorker(RecycleOnGrowthMixin, BlockingWorker):
+    pass
+
+
+class RecyclingAsynPool(AsynPool):
+    Worker = RecyclingAsynWorker
+
+
+class RecyclingBlockingPool(BlockingPool):
+    Worker = RecyclingBlockingWorker
+
+
+class RecyclingTaskPool(TaskPool):
+    """prefork 进程池，子进程按 MemoryRecyclePolicy 回收"""
+
+    Pool = RecyclingAsynPool
+    BlockingPool = RecyclingBlockingPool
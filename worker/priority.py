@@ -0,0 +1,63 @@
+# -*- encoding: utf-8 -*-
+'''
+@Time    :   2025/10/24 16:20:37
+@Author  :   47bwy
+@Desc    :   同时消费多个分级队列的 worker 按权重轮流取任务
+
+Redis 传输每次用 BRPOP 按队列列表的顺序取任务（排在前面且非空的队列先被取到），
+默认的 round_robin 策略把刚取过的队列移到末尾，各队列机会均等；priority 策略固定顺序，低级别可能一直取不到。
+这里用平滑加权轮询决定每次的队列顺序：所有队列都有积压时，各队列被取到的次数之比等于权重，
+某个队列空闲时其他队列照常消费。通过 broker_transport_options 的 queue_order_strategy 启用（见 celery_config）。
+
+专用 worker 只消费一个队列，不受影响：
+    celery -A worker.celery_app worker -Q qa_queue -n user@%h
+    celery -A worker.celery_app worker -Q qa_guest_queue -c 1 -n guest@%h
+共享 worker 同时消费所有级别，按权重分配：
+    celery -A worker.celery_app worker -Q qa_queue,qa_batch_queue,qa_guest_queue -n shared@%h
+'''
+
+from typing import Dict, Iterable, List, Optional
+
+from kombu.utils.scheduling import round_robin_cycle
+
+
+class WeightedCycle(round_robin_cycle):
+    """
+    kombu 队列轮询策略：平滑加权轮询（smooth weighted round-robin）
+
+    每取到一个任务，所有队列的积分加上各自权重，被取到的队列减去权重总和；
+    consume 按积分从高到低排列队列。积分限制在 [-总权重, 总权重]，
+    长时间空闲的队列不会攒下过多积分，恢复后也不会连续独占。
+    """
+
+    def __init__(self, it: Optional[Iterable[str]] = None, weights: Optional[Dict[str, int]] = None):
+        super().__init__(it)
+        if weights is None:
+            from app.services.tiers import queue_weights
+
+            weights = queue_weights()
+        self.weights = weights
+        self.credits = {queue: 0 for queue in self.items}
+
+    def _weight(self, queue: str) -> int:
+        return self.weights.get(queue, 1)
+
+    def update(self, it):
+        super().update(it)
+        self.credits = {queue: self.credits.get(queue, 0) for queue in self.items}
+
+    def consume(self, n: int) -> List[str]:
+        # 积分相同时权重高的在前；sorted 是稳定排序，权重也相同时保持原顺序
+        ordered = sorted(self.items, key=lambda q: (self.credits.get(q, 0), self._weight(q)), reverse=True)
+        return ordered[:n]
+
+    def rotate(self, last_used: str):
+        if last_used not in self.credits:
+            return last_used
+        total = sum(self._weight(queue) for queue in self.credits)
+        for queue in self.credits:
+            self.credits[queue] += self._weight(queue)
+        self.credits[last_used] -= total
+        for queue, credit in self.credits.items():
+            self.credits[queue] = max(-total, min(total, credit))
+        return last_used
@@ -0,0 +1,95 @@
+# -*- encoding: utf-8 -*-
+'''
+@Time    :   2025/10/19 17:32:50
+@Author  :   47bwy
+@Desc    :   Celery worker 信号处理
+'''
+
+import time
+
+from celery.signals import (
+    task_failure,
+    task_prerun,
+    task_success,
+    worker_init,
+    worker_process_init,
+    worker_process_shutdown,
+)
+
+from app.core.config import settings
+from app.core.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+@worker_init.connect
+def on_worker_init(sender=None, **kwargs):
+    """
+    worker 主进程启动（prefork 子进程创建之前）
+
+    开启 worker_preload_model 时在这里加载并预热模型，子进程 fork 后直接复用父进程的权重内存，
+    不再各自加载一份，也没有首个请求的冷启动。
+    """
+    if not settings.worker_preload_model:
+        return
+    from app.services.llm_services import preload
+
+    try:
+        preload()
+    except Exception as e:
+        # 预加载失败不影响 worker 启动，子进程会在第一次请求时各自加载
+        logger.error(f"Failed to preload model in worker parent: {e}")
+
+
+@worker_process_init.connect
+def on_worker_process_init(**kwargs):
+    """prefork 子进程启动"""
+    from app.services.llm_services import after_fork
+
+    after_fork()
+
+
+@worker_process_shutdown.connect
+def on_worker_process_shutdown(pid=None, exitcode=None, **kwargs):
+    """子进程退出前把缓存落盘、写完缓冲区中的问答记录，重启后可以直接恢复"""
+    from app.services.llm_services import persist_caches
+    from app.services.persistence import close_question_writer
+
+    logger.info(f"Worker process {pid} shutting down, persisting caches")
+    persist_caches()
+    close_question_writer()
+
+
+# 需要推送结果的任务（客户端通过 /qa/ask/stream 等待）
+STREAMED_TASKS = ("worker.tasks.answer_question_task",)
+
+
+@task_success.connect
+def on_task_success(sender=None, result=None, **kwargs):
+    """任务成功：结果已写入结果后端，再通过 Redis pub/sub 推送给等待的连接"""
+    if sender is None or sender.name not in STREAMED_TASKS:
+        return
+    from app.services.result_stream import publish_result, result_message
+
+    publish_result(result_message(sender.request.id, "success", answer=result))
+
+
+@task_failure.connect
+def on_task_failure(sender=None, task_id=None, exception=None, **kwargs):
+    if sender is None or sender.name not in STREAMED_TASKS:
+        return
+    from app.services.result_stream import publish_result, result_message
+
+    publish_result(result_message(task_id, "failure", error=str(exception)))
+
+
+@task_prerun.connect
+def on_task_prerun(sender=None, kwargs=None, **extra):
+    """任务开始执行：带 submitted_at 的任务按所在队列（用户级别）记录排队耗时"""
+    submitted_at = (kwargs or {}).get("submitted_at")
+    if sender is None or submitted_at is None:
+        return
+    from app.services.tiers import record_queue_wait
+
+    queue = (sender.request.delivery_info or {}).get("routing_key")
+    record_queue_wait(queue, time.time() - submitted_at)
@@ -6,17 +6,104 @@
 '''
 
 import time
+from typing import List
 
 from app.core.logger import get_logger
-from app.services.llm_services import process_question
+from app.services.answer_cache import get_answer_cache
+from app.services.batch_jobs import publish_progress, record_chunk
+from app.services.fast_path import record_latency
+from app.services.llm_services import NO_ANSWER, process_question, process_questions, save_questions
+from app.services.persistence import question_record
+from app.services.single_flight import get_single_flight
 from worker.celery_app import celery_app
 
 logger = get_logger(__name__)
 
 
 @celery_app.task
-def answer_question_task(question: str, user_id: str) -> str:
+def answer_question_task(
+    question: str,
+    user_id: str,
+    context: str = None,
+    model: str = None,
+    submitted_at: float = None,
+    flight_key: str = None,
+) -> str:
     logger.info(f"celery app Received task for question: {question}")
-    time.sleep(1)
-    # 这里可以加载本地模型并推理
-    return process_question(question, user_id)
\ No newline at end of file
+    answer = None
+    try:
+        # 这里可以加载本地模型并推理
+        answer = process_question(question, user_id, context=context, model=model)
+
+        # 写入答案缓存，之后相同的问题在 /qa/ask 直接返回；"无答案" 不缓存（段落索引导入后可能就有答案了）
+        cache = get_answer_cache()
+        if cache is not None and answer != NO_ANSWER:
+            try:
+                cache.set(question, answer, context=context, model=model)
+            except Exception as e:
+                logger.warning(f"Failed to cache answer: {e}")
+    finally:
+        # 相同问题合并：先写缓存再释放进行中标记，之后的提交直接命中缓存；为挂在这个任务上的用户补记问答记录
+        if flight_key is not None:
+            _release_flight(flight_key, question, answer)
+
+    # 从 /qa/ask 提交到答案生成的耗时（含排队），与进程内快速路径对比
+    if submitted_at is not None:
+        record_latency("celery", time.time() - submitted_at)
+    return answer
+
+
+def _release_flight(flight_key: str, question: str, answer: str = None):
+    flight = get_single_flight()
+    if flight is None:
+        return
+    try:
+        followers = flight.release(flight_key, answer_question_task.request.id)
+    except Exception as e:
+        logger.warning(f"Failed to release in-flight key {flight_key}: {e}")
+        return
+    if followers and answer is not None:
+        logger.info(f"Saving answer for {len(followers)} coalesced submissions")
+        save_questions([question_record(question, answer, follower) for follower in followers])
+
+
+@celery_app.task
+def answer_batch_task(
+    items: List[dict], user_id: str, batch_id: str, offset: int, submitted_at: float = None
+) -> int:
+    """
+    批量提问的一块：命中答案缓存的问题直接取缓存（同样保存问答记录），其余问题一次批量推理
+
+    结果按问题序号写入批次（见 app/services/batch_jobs.py），并推送一次进度；返回本块的问题数。
+    submitted_at 为 API 提交时间，用于统计排队耗时（见 worker/signals.py）。
+    """
+    logger.info(f"celery app Received batch {batch_id} chunk at {offset} with {len(items)} questions")
+    try:
+        cache = get_answer_cache()
+        answers = [None] * len(items)
+        if cache is not None:
+            for i, item in enumerate(items):
+                answers[i] = cache.get(item["question"], context=item.get("context"), model=item.get("model"))
+        missing = [i for i, answer in enumerate(answers) if answer is None]
+        # 命中缓存的问题不经过 process_questions，在这里补记问答记录
+        save_questions([
+            question_record(items[i]["question"], answer, user_id)
+            for i, answer in enumerate(answers) if answer is not None
+        ])
+        if missing:
+            computed = process_questions([items[i] for i in missing], user_id)
+            for i, answer in zip(missing, computed):
+                answers[i] = answer
+                if cache is not None and answer != NO_ANSWER:
+                    try:
+                        item = items[i]
+                        cache.set(item["question"], answer, context=item.get("context"), model=item.get("model"))
+                    except Exception as e:
+                        logger.warning(f"Failed to cache answer: {e}")
+    except Exception as e:
+        logger.error(f"Batch {batch_id} chunk at {offset} failed: {e}")
+        publish_progress(batch_id, record_chunk(batch_id, offset, error=str(e), count=len(items)))
+        raise
+
+    publish_progress(batch_id, record_chunk(batch_id, offset, answers=answers))
+    return len(items)
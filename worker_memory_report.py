@@ -0,0 +1,135 @@
+# -*- encoding: utf-8 -*-
+'''
+@Time    :   2025/10/21 15:20:44
+@Author  :   47bwy
+@Desc    :   prefork worker 内存报告：每个子进程的 RSS / PSS / USS（独占内存）
+
+使用方式：
+    # 查看正在运行的 Celery worker（自动查找主进程，也可以用 --pid 指定）
+    python worker_memory_report.py
+
+    # 不启动 Celery，模拟 prefork：对比父进程预加载与子进程各自加载两种方式
+    python worker_memory_report.py --simulate 4
+
+USS 是进程独占、进程退出后能回收的内存；预加载生效时子进程的 USS 应远小于模型大小。
+'''
+
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+import psutil
+
+MB = 1024 * 1024
+
+
+def find_worker_parents():
+    """查找 Celery worker 主进程（子进程的父进程也是 celery 时跳过）"""
+    parents = []
+    for proc in psutil.process_iter(["pid", "cmdline"]):
+        cmdline = " ".join(proc.info["cmdline"] or [])
+        if "celery" in cmdline and " worker" in cmdline:
+            try:
+                parent = proc.parent()
+            except psutil.Error:
+                parent = None
+            parent_cmd = " ".join(parent.cmdline()) if parent else ""
+            if not ("celery" in parent_cmd and " worker" in parent_cmd):
+                parents.append(proc)
+    return parents
+
+
+def memory_row(proc):
+    info = proc.memory_full_info()
+    return {
+        "pid": proc.pid,
+        "rss": info.rss / MB,
+        "pss": getattr(info, "pss", 0) / MB,
+        "uss": info.uss / MB,
+        "shared": getattr(info, "shared", 0) / MB,
+    }
+
+
+def print_report(parent, children):
+    print(f"{'角色':<8}{'pid':>8}{'RSS MB':>10}{'PSS MB':>10}{'USS MB':>10}{'共享 MB':>10}")
+    rows = [("parent", memory_row(parent))] + [("child", memory_row(child)) for child in children]
+    for role, row in rows:
+        print(f"{role:<8}{row['pid']:>8}{row['rss']:>10.1f}{row['pss']:>10.1f}{row['uss']:>10.1f}{row['shared']:>10.1f}")
+    child_rows = [row for role, row in rows if role == "child"]
+    if child_rows:
+        total_uss = sum(row["uss"] for row in child_rows)
+        total_pss = sum(row["pss"] for _, row in rows)
+        print(
+            f"子进程 {len(child_rows)} 个，平均 USS {total_uss / len(child_rows):.1f} MB，"
+            f"全部进程 PSS 合计 {total_pss:.1f} MB"
+        )
+
+
+def report_running(pid=None):
+    parents = [psutil.Process(pid)] if pid else find_worker_parents()
+    if not parents:
+        print("❌ 没有找到正在运行的 Celery worker，可以用 --pid 指定主进程")
+        return 1
+    for parent in parents:
+        print(f"\nworker 主进程 {parent.pid}: {' '.join(parent.cmdline())[:100]}")
+        print_report(parent, parent.children())
+    return 0
+
+
+def _child(ready, done):
+    """模拟 prefork 子进程：跑几次推理后等待测量"""
+    from app.services.llm_services import after_fork, get_answer
+
+    after_fork()
+    for _ in range(3):
+        get_answer("北京是哪个国家的首都？", "北京是中国的首都。")
+    ready.put(os.getpid())
+    done.wait()
+
+
+def simulate(children: int, preload: bool):
+    from app.services import llm_services
+
+    if preload:
+        llm_services.preload()
+    ctx = multiprocessing.get_context("fork")
+    ready, done = ctx.Queue(), ctx.Event()
+    procs = [ctx.Process(target=_child, args=(ready, done)) for _ in range(children)]
+    started = time.time()
+    for proc in procs:
+        proc.start()
+    for _ in procs:
+        ready.get(timeout=600)
+    first_request = time.time() - started
+
+    mode = "父进程预加载" if preload else "子进程各自加载"
+    print(f"\n[{mode}] {children} 个子进程就绪（含首次推理）耗时 {first_request:.1f}s")
+    print_report(psutil.Process(), [psutil.Process(proc.pid) for proc in procs])
+    done.set()
+    for proc in procs:
+        proc.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="prefork worker 每个子进程的独占内存报告")
+    parser.add_argument("--pid", type=int, help="Celery worker 主进程 pid，默认自动查找")
+    parser.add_argument("--simulate", type=int, metavar="N", help="不连接 Celery，fork N 个子进程模拟")
+    parser.add_argument("--mode", choices=["preload", "lazy", "both"], default="both", help="模拟模式")
+    args = parser.parse_args()
+
+    if not args.simulate:
+        return report_running(args.pid)
+
+    modes = ["lazy", "preload"] if args.mode == "both" else [args.mode]
+    for mode in modes:
+        # 每种模式在独立的子进程中运行，互不影响已加载的模型
+        proc = multiprocessing.get_context("spawn").Process(target=simulate, args=(args.simulate, mode == "preload"))
+        proc.start()
+        proc.join()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())